@@ -0,0 +1,1060 @@
+import tkinter as tk
+from tkinter import ttk, filedialog, messagebox
+import base64
+import os
+from datetime import datetime
+import json
+import threading
+import time
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.core.encryption import ENCRYPTION_FORMATS, open_encrypted
+from src.core.jobs import PRIORITY_HIGH, PRIORITY_LOW, Job, JobScheduler
+from src.core.preview import PreviewGenerator
+from src.core.raid import RAID_LEVELS, STRIPE_SIZES, RaidLayout, RaidVolume, detect_layout
+from src.core.scanner import Scanner, CancelToken
+from src.core.trash import TRASH_KINDS
+from src.core.results import ResultStore
+from src.database.operations import RecoveryHistory, ScanIndex
+from src.ui.pump import UiPump
+from src.ui.result_list import VirtualList
+
+class FileRecoveryApp:
+    def __init__(self, root):
+        self.root = root
+        self.root.title("File Recovery Tool")
+        self.root.geometry("1000x700")
+        
+        # Hide console window
+        self.hide_console()
+        
+        # System tray setup
+        self.setup_system_tray()
+        
+        # Minimize to tray when clicking close button
+        self.root.protocol('WM_DELETE_WINDOW', self.minimize_to_tray)
+        
+        # Colors
+        self.dark_bg = "#1a1a1a"
+        self.emerald = "#50C878"
+        self.button_bg = "#2E8B57"
+        self.button_text = "#FFFFFF"
+        
+        self.root.configure(bg=self.dark_bg)
+        # Every file found; the list view shows row ids from it
+        self.results = ResultStore()
+        self.current_filter = "all"
+        self.scanner = Scanner()
+        self.scanning = False
+        self.scan_token = CancelToken()
+        # Bumped by every new scan; the classify job of an older one must not touch its rows
+        self.scan_generation = 0
+        self.classify_job = None
+        self.restoring = False
+        self.restore_token = CancelToken()
+        # Scans and restores run as jobs: restores first, one job per disk at a time
+        self.jobs = JobScheduler(max_jobs=2)
+        # Optional I/O ceilings for deep scans, so they leave a busy disk usable
+        self.deep_scan_iops = None
+        self.deep_scan_bytes_per_second = None
+        try:
+            self.index = ScanIndex()
+        except Exception:
+            # Scans still work without the index, they just start from scratch
+            self.index = None
+        try:
+            self.history = RecoveryHistory()
+        except Exception:
+            self.history = None
+        # Previews are built on worker threads and cached by content
+        self.previews = PreviewGenerator(hasher=self.scanner.hasher)
+        self.preview_window = None
+        self.setup_gui()
+        # Scan threads hand their UI updates to the Tk thread through this
+        self.pump = UiPump(self.root)
+        self.pump.start()
+
+    def hide_console(self):
+        """Hide the console window"""
+        try:
+            import win32gui
+            import win32con
+        except ImportError:
+            # Not on Windows (or pywin32 is missing): no console to hide
+            return
+        console_window = win32gui.GetForegroundWindow()
+        win32gui.ShowWindow(console_window, win32con.SW_HIDE)
+
+    def setup_system_tray(self):
+        """Setup system tray icon and menu"""
+        try:
+            import pystray
+            from PIL import Image
+        except ImportError:
+            # Without a tray icon, closing the window quits instead of hiding it
+            self.icon = None
+            return
+
+        # Create system tray icon
+        image = Image.new('RGB', (64, 64), color = (50, 200, 120))
+        menu = (
+            pystray.MenuItem('Show', self.show_window),
+            pystray.MenuItem('Exit', self.quit_window)
+        )
+        self.icon = pystray.Icon(
+            "name",
+            image,
+            "File Recovery Tool",
+            menu
+        )
+        
+        # Run system tray icon in separate thread
+        threading.Thread(target=self.icon.run, daemon=True).start()
+
+    def show_window(self, icon=None, item=None):
+        """Show the main window"""
+        self.root.deiconify()
+        self.root.state('normal')
+        self.root.focus_force()
+
+    def minimize_to_tray(self):
+        """Minimize to system tray"""
+        if self.icon is None:
+            self.quit_window()
+            return
+        self.root.withdraw()
+
+    def quit_window(self, icon=None, item=None):
+        """Exit the application"""
+        if self.icon is not None:
+            self.icon.stop()
+        self.previews.close()
+        self.jobs.close(timeout=2)
+        self.root.destroy()
+        sys.exit()
+
+    def setup_gui(self):
+        # Title
+        title = tk.Label(
+            self.root,
+            text="File Recovery Tool",
+            font=("Helvetica", 24, "bold"),
+            bg=self.dark_bg,
+            fg=self.emerald
+        )
+        title.pack(pady=20)
+
+        # File type buttons
+        types_frame = tk.Frame(self.root, bg=self.dark_bg)
+        types_frame.pack(fill=tk.X, padx=20)
+
+        file_types = ["Documents", "Videos", "Images", "Emails", "Audio", "Other"]
+        for ftype in file_types:
+            btn = tk.Button(
+                types_frame,
+                text=ftype,
+                bg=self.button_bg,
+                fg=self.button_text,
+                command=lambda t=ftype: self.filter_files(t.lower()),
+                width=15
+            )
+            btn.pack(side=tk.LEFT, padx=5)
+
+        # Search bar
+        search_frame = tk.Frame(self.root, bg=self.dark_bg)
+        search_frame.pack(fill=tk.X, padx=20, pady=10)
+        
+        self.search_entry = tk.Entry(search_frame, bg="#2D2D2D", fg="white", width=100)
+        self.search_entry.pack(side=tk.LEFT, padx=5)
+        
+        search_btn = tk.Button(
+            search_frame,
+            text="Search",
+            bg=self.button_bg,
+            fg=self.button_text,
+            command=self.search_files
+        )
+        search_btn.pack(side=tk.LEFT)
+
+        # Main content area
+        content_frame = tk.Frame(self.root, bg=self.dark_bg)
+        content_frame.pack(fill=tk.BOTH, expand=True, padx=20)
+
+        # Files list; only the rows on screen are drawn
+        self.files_listbox = VirtualList(
+            content_frame,
+            text_for=self.row_text,
+            bg="#2D2D2D",
+            fg="white",
+            select_bg=self.button_bg,
+            width=70,
+            height=20,
+            on_select=self.on_row_selected
+        )
+        self.files_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        # Control buttons frame
+        buttons_frame = tk.Frame(content_frame, bg=self.dark_bg)
+        buttons_frame.pack(side=tk.LEFT, padx=20)
+
+        # Control buttons
+        buttons = [
+            ("Quick Scan", self.quick_scan),
+            ("Deep Scan", self.deep_scan),
+            ("Restore Selected", self.restore_files),
+            ("Put Back", self.put_back_files),
+            ("Choose Location", self.choose_restore_location),
+            ("Preview File", self.preview_file),
+            ("Recovery History", self.show_history)
+        ]
+
+        for text, command in buttons:
+            btn = tk.Button(
+                buttons_frame,
+                text=text,
+                bg=self.button_bg,
+                fg=self.button_text,
+                command=command,
+                width=15
+            )
+            btn.pack(pady=5)
+
+        # Duplicates found by a deep scan or carve are stored once and linked
+        self.dedup_restore = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            buttons_frame,
+            text="Deduplicate",
+            variable=self.dedup_restore,
+            bg=self.dark_bg,
+            fg=self.emerald,
+            selectcolor=self.dark_bg,
+            activebackground=self.dark_bg
+        ).pack(pady=5)
+
+        # Add README button
+        tk.Button(
+            buttons_frame,
+            text="README",
+            bg=self.button_bg,
+            fg=self.button_text,
+            command=self.show_readme,
+            width=15
+        ).pack(pady=5)
+
+        # Add Scan Info button
+        tk.Button(
+            buttons_frame,
+            text="Scan Info",
+            bg=self.button_bg,
+            fg=self.button_text,
+            command=self.show_scan_info,
+            width=15
+        ).pack(pady=5)
+
+        # Status bar
+        self.status_var = tk.StringVar()
+        self.status_var.set("Ready")
+        status_bar = tk.Label(
+            self.root,
+            textvariable=self.status_var,
+            bg=self.dark_bg,
+            fg="white"
+        )
+        status_bar.pack(side=tk.BOTTOM, fill=tk.X, pady=5)
+
+        # No default: the usual candidates sit on the volume being recovered
+        self.restore_location = None
+
+    def quick_scan(self):
+        if self.scanning:
+            return
+        self.status_var.set("Performing quick scan...")
+        generation = self.stop_classify()
+        self.results.clear()
+        self.files_listbox.set_rows([])
+        self.scanning = True
+        self.scan_token.cancel()
+
+        def run_scan(scan_token):
+            started, clock = time.time(), time.monotonic()
+            file_count = total_bytes = 0
+            status = 'failed'
+            try:
+                batch = []
+                # Trashed files, with where they were deleted from, straight from the trash metadata
+                for result in self.scanner.quick_scan(cancel_token=scan_token):
+                    scan_token.checkpoint()
+                    batch.append(self.results.add(result))
+                    file_count += 1
+                    total_bytes += result.size
+                    if len(batch) >= 1000:
+                        self.pump.post(self.files_listbox.append_rows, batch)
+                        batch = []
+                self.pump.post(self.files_listbox.append_rows, batch)
+                if not scan_token.cancelled:
+                    self.pump.post(self.status_var.set, f"Quick scan complete. Found {file_count} files.")
+                else:
+                    self.pump.post(self.status_var.set, "Quick scan cancelled.")
+                status = 'cancelled' if scan_token.cancelled else 'done'
+            except Exception as e:
+                self.pump.post(self.status_var.set, f"Scan error: {str(e)}")
+            finally:
+                self.scanning = False
+                self.record_history('scan', 'quick', started, time.monotonic() - clock,
+                                    file_count, total_bytes, 0, status)
+                if status == 'done':
+                    self.classify_results(generation)
+
+        job = Job('scan', run_scan, name="quick scan", priority=PRIORITY_HIGH)
+        self.scan_token = job.control
+        self.jobs.submit(job)
+
+    def deep_scan(self):
+        if self.scanning:
+            return
+        try:
+            # Disable buttons during scan
+            for widget in self.root.winfo_children():
+                if isinstance(widget, tk.Button):
+                    widget.configure(state='disabled')
+
+            self.status_var.set("Starting deep scan...")
+            generation = self.stop_classify()
+            self.files_listbox.set_rows([])
+            self.results.clear()
+
+            # Create progress window
+            progress_window = tk.Toplevel(self.root)
+            progress_window.title("Deep Scan Progress")
+            progress_window.geometry("400x200")
+            progress_window.configure(bg=self.dark_bg)
+            
+            # Labels
+            tk.Label(
+                progress_window,
+                text="Deep Scan in Progress...",
+                bg=self.dark_bg,
+                fg=self.emerald,
+                font=("Helvetica", 12, "bold")
+            ).pack(pady=10)
+
+            self.progress_label = tk.Label(
+                progress_window,
+                text="Scanning...",
+                bg=self.dark_bg,
+                fg=self.emerald
+            )
+            self.progress_label.pack(pady=5)
+
+            self.files_count_label = tk.Label(
+                progress_window,
+                text="Files found: 0",
+                bg=self.dark_bg,
+                fg=self.emerald
+            )
+            self.files_count_label.pack(pady=5)
+
+            # Progress bar
+            self.progress_bar = ttk.Progressbar(
+                progress_window,
+                mode='indeterminate',
+                length=300
+            )
+            self.progress_bar.pack(pady=10)
+            self.progress_bar.start(10)
+
+            self.scan_token.cancel()
+            locations = self.scanner.default_locations('deep')
+            job = Job('scan', lambda control: safe_scan(), name="deep scan",
+                      devices=[location for location in locations if os.path.isdir(location)],
+                      priority=PRIORITY_LOW, bytes_per_second=self.deep_scan_bytes_per_second,
+                      iops=self.deep_scan_iops)
+            scan_token = self.scan_token = job.control
+
+            # Pause and cancel buttons
+            self.scanning = True
+            controls = tk.Frame(progress_window, bg=self.dark_bg)
+            controls.pack(pady=10)
+
+            def toggle_pause():
+                if job.state == 'paused':
+                    job.resume()
+                    pause_button.config(text="Pause")
+                else:
+                    job.pause()
+                    pause_button.config(text="Resume")
+
+            pause_button = tk.Button(
+                controls,
+                text="Pause",
+                bg=self.button_bg,
+                fg=self.button_text,
+                command=toggle_pause
+            )
+            pause_button.pack(side=tk.LEFT, padx=5)
+            tk.Button(
+                controls,
+                text="Cancel Scan",
+                bg=self.button_bg,
+                fg=self.button_text,
+                command=self.cancel_scan
+            ).pack(side=tk.LEFT, padx=5)
+
+            def add_batch(rows, file_count):
+                if scan_token.cancelled:
+                    return
+                try:
+                    self.files_listbox.append_rows(rows)
+                    self.files_count_label.config(text=f"Files found: {file_count}")
+                except tk.TclError:
+                    self.cancel_scan()
+
+            last_progress = []
+
+            def show_path(path):
+                try:
+                    self.progress_label.config(text=f"Scanning: {path}")
+                except tk.TclError:
+                    pass
+
+            def show_progress(event):
+                # Called from the scan thread; only the newest path is drawn each frame
+                last_progress[:] = [event]
+                if event.current_path:
+                    self.pump.post_latest('progress', show_path, event.current_path)
+
+            def safe_scan():
+                started, clock = time.time(), time.monotonic()
+                file_count = total_bytes = 0
+                status = 'failed'
+                try:
+                    batch = []  # Batch for updating listbox
+                    batch_size = 1000  # Hand rows to the UI 1000 at a time
+
+                    for result in self.scanner.scan(locations, mode='deep', cancel_token=scan_token,
+                                                    on_progress=show_progress, index=self.index):
+                        # Throttles and pauses the walk; one lstat per file found
+                        scan_token.charge(0, 1)
+                        batch.append(self.results.add(result))
+                        file_count += 1
+                        total_bytes += result.size
+
+                        if len(batch) >= batch_size:
+                            self.pump.post(add_batch, batch, file_count)
+                            batch = []
+
+                    # Final update for remaining files
+                    if batch:
+                        self.pump.post(add_batch, batch, file_count)
+
+                    # Cleanup
+                    if not scan_token.cancelled:
+                        rate = last_progress[0].files_per_second if last_progress else 0.0
+                        self.pump.post(self.status_var.set,
+                                       f"Scan complete. Found {file_count} files ({rate:,.0f} files/sec).")
+                    else:
+                        self.pump.post(self.status_var.set, "Scan cancelled.")
+                    status = 'cancelled' if scan_token.cancelled else 'done'
+
+                except Exception as e:
+                    self.pump.post(self.status_var.set, f"Scan error: {str(e)}")
+                finally:
+                    self.scanning = False
+                    self.record_history('scan', 'deep', started, time.monotonic() - clock,
+                                        file_count, total_bytes, 0, status)
+                    if status == 'done':
+                        self.classify_results(generation)
+                    # Re-enable buttons
+                    self.pump.post(self.enable_buttons)
+                    self.pump.post(self.close_window, progress_window)
+
+            # Queued behind any restore still using the same disks
+            self.jobs.submit(job)
+
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to start scan: {str(e)}")
+            self.enable_buttons()
+
+    def stop_classify(self):
+        """Cancel any classify job still running and start a new scan generation; returns it"""
+        self.scan_generation += 1
+        if self.classify_job is not None:
+            self.classify_job.cancel()
+            self.classify_job = None
+        return self.scan_generation
+
+    def classify_results(self, generation):
+        """Re-sort scanned files by their contents as a low-priority job
+
+        Rows start in the category their extension suggests; carved and
+        renamed files are moved once their first bytes have been read, and
+        the current filter is re-applied at the end. Files the index has
+        already classified cost nothing here. The next scan cancels the
+        job, and categories are written on the UI thread only while the
+        rows still belong to the scan generation they were read from.
+        """
+        def apply(rows, categories):
+            if generation == self.scan_generation:
+                self.results.set_categories(rows, categories)
+
+        def refilter():
+            if generation == self.scan_generation and self.current_filter != "all":
+                self.filter_files(self.current_filter)
+
+        def run(control):
+            changed = False
+            try:
+                total = len(self.results)
+                batch_size = self.scanner.classifier.batch_size
+                for start in range(0, total, batch_size):
+                    if not control.checkpoint():
+                        return
+                    rows = range(start, min(start + batch_size, total))
+                    records = [self.results.get(row) for row in rows]
+                    before = [self.results.category(row) for row in rows]
+                    self.scanner.classify(records, index=self.index)
+                    categories = [record.category for record in records]
+                    if categories != before:
+                        self.pump.post(apply, rows, categories)
+                        changed = True
+            except IndexError:
+                # A new scan cleared the results under us
+                return
+            except Exception as e:
+                self.pump.post(self.status_var.set, f"Could not classify files: {str(e)}")
+                return
+            if changed and not control.cancelled:
+                self.pump.post(refilter)
+
+        job = Job('scan', run, name="classify files", priority=PRIORITY_LOW)
+        if generation == self.scan_generation:
+            self.classify_job = job
+            self.jobs.submit(job)
+
+    def cancel_scan(self):
+        """Cancel the scanning process"""
+        self.scanning = False
+        self.scan_token.cancel()
+        self.status_var.set("Cancelling scan...")
+
+    def close_window(self, window):
+        """Destroy a Toplevel that may already be gone"""
+        try:
+            window.destroy()
+        except tk.TclError:
+            pass
+
+    def enable_buttons(self):
+        """Re-enable all buttons"""
+        try:
+            for widget in self.root.winfo_children():
+                if isinstance(widget, tk.Button):
+                    widget.configure(state='normal')
+        except tk.TclError:
+            pass
+
+    def filter_files(self, file_type):
+        self.current_filter = file_type
+        self.show_rows(self.results.rows(file_type))
+
+    def search_files(self):
+        search_term = self.search_entry.get().lower()
+
+        if not len(self.results) and self.index is not None and not self.scanning:
+            # Nothing scanned this session: search what earlier scans indexed
+            self.load_index(search_term)
+            return
+
+        self.show_rows(self.results.rows(term=search_term))
+
+    def load_index(self, search_term):
+        """Fill the results from the scan index on a job, showing matches batch by batch"""
+        generation = self.stop_classify()
+        self.scanning = True
+        self.scan_token.cancel()
+        self.files_listbox.set_rows([])
+        self.status_var.set("Loading indexed files...")
+
+        def show(rows, text):
+            if generation == self.scan_generation:
+                self.files_listbox.append_rows(rows)
+                self.status_var.set(text)
+
+        def run_load(control):
+            loaded = 0
+            try:
+                entries = self.index.query()
+                for start in range(0, len(entries), 1000):
+                    if not control.checkpoint():
+                        return
+                    added = self.results.extend(entry.to_scan_result() for entry in entries[start:start + 1000])
+                    loaded += len(added)
+                    rows = [row for row in added if search_term in self.results.get(row).name.lower()]
+                    self.pump.post(show, rows, f"Loading indexed files... {loaded} of {len(entries)}")
+                self.pump.post(show, [], f"Searched {loaded} indexed files.")
+            except Exception as e:
+                self.pump.post(self.status_var.set, f"Index error: {str(e)}")
+            finally:
+                self.scanning = False
+
+        job = Job('scan', run_load, name="load index", priority=PRIORITY_HIGH)
+        self.scan_token = job.control
+        self.jobs.submit(job)
+
+    def row_text(self, row):
+        record = self.results.get(row)
+        if record.source not in TRASH_KINDS:
+            return record.name
+        # Trashed files are listed under the name and place they were deleted from
+        deleted = datetime.fromtimestamp(record.deleted).strftime('%Y-%m-%d %H:%M') if record.deleted else "?"
+        return f"{record.name}  —  {record.origin or 'original location unknown'} (deleted {deleted})"
+
+    def show_rows(self, rows):
+        """Replace the list contents with the given result rows"""
+        self.files_listbox.set_rows(rows)
+
+    def restore_files(self):
+        selections = self.files_listbox.curselection()
+        if not selections:
+            messagebox.showwarning("Warning", "Please select files to restore")
+            return
+        if self.restoring:
+            return
+        if self.restore_location is None and not self.choose_restore_location():
+            self.status_var.set("Choose a folder on another drive to restore to.")
+            return
+
+        results = [self.results.get(self.files_listbox.row(index)) for index in selections]
+        dedup = self.dedup_restore.get()
+        self.restoring = True
+        self.status_var.set(f"Restoring {len(results)} files...")
+
+        last_progress = []
+
+        def show_progress(event):
+            last_progress[:] = [event]
+            self.pump.post_latest('restore', self.status_var.set,
+                                  f"Restoring {event.files_done}/{event.files_total} files "
+                                  f"({event.mb_per_second:,.1f} MB/s, {event.failures} failed)")
+
+        def run_restore(restore_token):
+            self.pump.post(self.status_var.set, f"Restoring {len(results)} files...")
+            started, clock = time.time(), time.monotonic()
+            failures = []
+            restored = 0
+            restored_bytes = 0
+            status = 'failed'
+            try:
+                for outcome in self.scanner.restore(results, self.restore_location, cancel_token=restore_token,
+                                                    on_progress=show_progress, dedup=dedup):
+                    restore_token.charge(outcome.size, 1)
+                    if outcome.status == 'failed':
+                        failures.append(f"{outcome.record.name}: {outcome.error}")
+                    else:
+                        restored += 1
+                        restored_bytes += outcome.size
+                summary = f"Restored {restored} of {len(results)} files to {self.restore_location}."
+                if restore_token.cancelled:
+                    summary = f"Restore cancelled after {restored} files. Run it again to resume."
+                status = last_progress[0].stage if last_progress else 'done'
+                self.pump.post(self.status_var.set, summary)
+                if failures:
+                    # One report at the end instead of a dialog per file
+                    shown = "\n".join(failures[:20])
+                    if len(failures) > 20:
+                        shown += f"\n... and {len(failures) - 20} more"
+                    self.pump.post(messagebox.showerror, "Restore Errors",
+                                   f"{len(failures)} files could not be restored:\n{shown}")
+            except Exception as e:
+                self.pump.post(self.status_var.set, "Restore failed.")
+                self.pump.post(messagebox.showerror, "Error", f"Failed to restore: {str(e)}")
+            finally:
+                self.restoring = False
+                self.record_history('restore', None, started, time.monotonic() - clock,
+                                    restored, restored_bytes, len(failures), status,
+                                    {'destination': self.restore_location})
+
+        # Sources are only read, so claim just the destination disk: a deep
+        # scan of the same source must not hold the restore back
+        job = Job('restore', run_restore, name=f"restore {len(results)} files",
+                  devices=[self.restore_location], priority=PRIORITY_HIGH)
+        busy = [other.name for other in self.jobs.jobs()
+                if other.state in ('queued', 'running', 'paused') and set(other.devices) & set(job.devices)]
+        if busy:
+            self.status_var.set(f"Waiting for {busy[0]} to finish on {self.restore_location}...")
+        self.restore_token = job.control
+        self.jobs.submit(job)
+
+    def put_back_files(self):
+        selections = self.files_listbox.curselection()
+        results = [self.results.get(self.files_listbox.row(index)) for index in selections]
+        results = [result for result in results if result.source in TRASH_KINDS and result.image is None]
+        unknown = [result for result in results if result.origin is None]
+        if unknown:
+            # The trash kept no record of where these came from; don't guess
+            messagebox.showwarning("Warning", f"{len(unknown)} of the selected files have no recorded original "
+                                              f"location. Use Restore to copy them to a folder instead.")
+            results = [result for result in results if result.origin is not None]
+        if not results:
+            messagebox.showwarning("Warning", "Please select trashed files from a quick scan to put back")
+            return
+        if self.restoring:
+            return
+        self.restoring = True
+        self.status_var.set(f"Putting back {len(results)} files...")
+
+        def run_put_back(control):
+            started, clock = time.time(), time.monotonic()
+            failures = []
+            restored = restored_bytes = 0
+            status = 'failed'
+            try:
+                for outcome in self.scanner.put_back(results, cancel_token=control):
+                    if outcome.status == 'failed':
+                        failures.append(f"{outcome.record.origin}: {outcome.error}")
+                    else:
+                        restored += 1
+                        restored_bytes += outcome.size
+                if control.cancelled:
+                    status = 'cancelled'
+                elif restored or not failures:
+                    status = 'done'
+                self.pump.post(self.status_var.set, f"Put back {restored} of {len(results)} files.")
+                if failures:
+                    shown = "\n".join(failures[:20])
+                    if len(failures) > 20:
+                        shown += f"\n... and {len(failures) - 20} more"
+                    self.pump.post(messagebox.showerror, "Put Back Errors",
+                                   f"{len(failures)} files could not be put back:\n{shown}")
+            finally:
+                self.restoring = False
+                self.record_history('restore', 'put_back', started, time.monotonic() - clock,
+                                    restored, restored_bytes, len(failures), status,
+                                    {'destination': 'origin'})
+
+        self.jobs.submit(Job('restore', run_put_back, name=f"put back {len(results)} files",
+                             priority=PRIORITY_HIGH))
+
+    def choose_restore_location(self):
+        """Ask for the restore folder; returns whether one was chosen"""
+        directory = filedialog.askdirectory(
+            title="Choose Restore Location (on a different drive)",
+            initialdir=self.restore_location or os.path.expanduser("~")
+        )
+        if directory:
+            self.restore_location = directory
+            self.status_var.set(f"Restore location: {directory}")
+        return bool(directory)
+
+    def preview_file(self):
+        selection = self.files_listbox.curselection()
+        if not selection:
+            self.status_var.set("Select a file to preview.")
+            return
+        self.open_preview_window()
+        self.preview_row(selection[0])
+
+    def on_row_selected(self, index):
+        """Follow the selection while the preview window is open"""
+        if self.preview_window is not None and self.preview_window.winfo_exists():
+            self.preview_row(index)
+
+    def open_preview_window(self):
+        if self.preview_window is not None and self.preview_window.winfo_exists():
+            self.preview_window.lift()
+            return
+        window = self.preview_window = tk.Toplevel(self.root)
+        window.title("Preview")
+        window.geometry("560x480")
+        window.configure(bg=self.dark_bg)
+
+        self.preview_title = tk.Label(window, bg=self.dark_bg, fg=self.emerald, font=("Helvetica", 11, "bold"))
+        self.preview_title.pack(pady=5)
+        self.preview_image = tk.Label(window, bg=self.dark_bg)
+        self.preview_text = tk.Text(window, bg="#2D2D2D", fg="white", wrap=tk.NONE, font=("Courier", 9))
+
+    def preview_row(self, index):
+        record = self.results.get(self.files_listbox.row(index))
+        self.status_var.set(f"Previewing: {record.name}")
+        # Only the newest preview is drawn; older ones still land in the cache
+        self.previews.request(record, lambda record, preview: self.pump.post_latest(
+            'preview', self.show_preview, record, preview))
+        # Warm the next few rows so stepping down the list stays instant
+        following = range(index + 1, min(index + 6, len(self.files_listbox)))
+        self.previews.prefetch([self.results.get(self.files_listbox.row(i)) for i in following])
+
+    def show_preview(self, record, preview):
+        """Draw a Preview, or the error that stopped one, in the preview window"""
+        if self.preview_window is None or not self.preview_window.winfo_exists():
+            return
+        self.preview_title.config(text=record.name)
+        if not isinstance(preview, Exception) and preview.kind == 'image':
+            # Tk reads PNG data directly; no PIL.ImageTk needed
+            photo = tk.PhotoImage(data=base64.b64encode(preview.data))
+            self.preview_image.config(image=photo)
+            self.preview_image.image = photo
+            self.preview_text.pack_forget()
+            self.preview_image.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+            return
+
+        text = f"No preview available: {preview}" if isinstance(preview, Exception) else preview.data
+        self.preview_text.config(state=tk.NORMAL)
+        self.preview_text.delete("1.0", tk.END)
+        self.preview_text.insert("1.0", text)
+        self.preview_text.config(state=tk.DISABLED)
+        self.preview_image.pack_forget()
+        self.preview_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+    def record_history(self, kind, mode, started, elapsed, files, total_bytes, failures, status,
+                       details=None):
+        """Append a finished run to the recovery history; safe from any thread"""
+        if self.history is None:
+            return
+        try:
+            self.history.record(kind, started, elapsed, files, total_bytes, failures, status,
+                                mode=mode, details=details)
+        except Exception:
+            # History is a convenience; never let it break a scan or restore
+            pass
+
+    def show_history(self):
+        history_window = tk.Toplevel(self.root)
+        history_window.title("Recovery History")
+        history_window.geometry("700x400")
+        history_window.configure(bg=self.dark_bg)
+        
+        history_list = tk.Listbox(
+            history_window,
+            bg="#2D2D2D",
+            fg="white",
+            font=("Courier", 9)
+        )
+        history_list.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        scrollbar = tk.Scrollbar(history_window, command=history_list.yview)
+        scrollbar.pack(side=tk.LEFT, fill=tk.Y, pady=10)
+
+        if self.history is None:
+            history_list.insert(tk.END, "No previous recovery history")
+            return
+
+        # Records are fetched a page at a time as the list scrolls down
+        last_record = []
+
+        def load_page():
+            records = self.history.page(after=last_record[0] if last_record else None, limit=200)
+            if not records:
+                return False
+            last_record[:] = records[-1:]
+            for record in records:
+                when = datetime.fromtimestamp(record.started).strftime("%Y-%m-%d %H:%M")
+                label = record.kind if record.mode is None else f"{record.kind} ({record.mode})"
+                runs = f" x{record.runs}" if record.runs > 1 else ""
+                history_list.insert(
+                    tk.END,
+                    f"{when}  {label:<14} {record.files:>9,} files {record.bytes / (1024 * 1024):>10,.1f} MB "
+                    f"{record.elapsed:>8.1f}s {record.files_per_second:>9,.0f} files/s "
+                    f"{record.mb_per_second:>7,.1f} MB/s  {record.status}{runs}")
+            return True
+
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            if float(last) >= 0.95 and last_record:
+                if not load_page():
+                    # Everything is loaded; stop asking
+                    last_record.clear()
+
+        history_list.config(yscrollcommand=on_scroll)
+        if not load_page():
+            history_list.insert(tk.END, "No previous recovery history")
+
+    def show_readme(self):
+        """Display README information in a new window"""
+        readme_window = tk.Toplevel(self.root)
+        readme_window.title("File Recovery Tool - README")
+        readme_window.geometry("800x600")
+        readme_window.configure(bg="#1a1a1a")
+
+        # Create text widget with white text on dark background
+        text = tk.Text(
+            readme_window,
+            bg="#1a1a1a",  # Dark background
+            fg="#50C878",  # Emerald green text
+            font=("Courier", 12),
+            wrap=tk.WORD,
+            padx=20,
+            pady=20
+        )
+        
+        # Create and attach scrollbar
+        scrollbar = tk.Scrollbar(readme_window, command=text.yview)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        text.config(yscrollcommand=scrollbar.set)
+
+        readme_text = """FILE RECOVERY TOOL - USER GUIDE
+
+QUICK SCAN
+----------
+• Lists files sitting in the Trash or Recycle Bin
+• Reads the trash's own records on every drive:
+  - Linux desktop Trash
+  - macOS Trash
+  - Windows $Recycle.Bin
+• Shows where each file was deleted from, and when
+• Takes under a second
+• 'Put Back' returns selected files to where they were
+
+DEEP SCAN
+---------
+• Thorough system-wide search
+• Checks all accessible locations:
+  - All user folders
+  - System directories
+  - Connected drives
+• Takes 10-30 minutes
+• Finds older deleted files
+• Higher system resource usage
+
+HOW TO USE
+----------
+1. Choose scan type:
+   • Quick Scan for recent files
+   • Deep Scan for thorough search
+
+2. Wait for scan completion
+
+3. Use filters to find files:
+   • Documents
+   • Videos
+   • Images
+   • Emails
+   • Audio
+   • Other
+
+4. Select files to recover
+
+5. Choose restore location
+
+6. Click 'Restore Selected', or 'Put Back' for
+   files found by Quick Scan
+
+TIPS
+----
+• Start with Quick Scan
+• Use Deep Scan if needed
+• Filter results by type
+• Preview before recovery
+• Choose new location for recovery
+
+WARNING
+-------
+• Don't save to original location
+• Keep app running during scan
+• Avoid disk writing during scan
+• Success rate varies by file age"""
+
+        # Insert the content
+        text.insert("1.0", readme_text)
+        
+        # Make text read-only
+        text.config(state='disabled')
+
+        # Add close button
+        close_button = tk.Button(
+            readme_window,
+            text="Close",
+            bg="#2E8B57",
+            fg="white",
+            command=readme_window.destroy,
+            font=("Helvetica", 10, "bold")
+        )
+        close_button.pack(side=tk.BOTTOM, pady=10)
+
+    def show_scan_info(self):
+        """Display detailed scan information"""
+        scan_info_window = tk.Toplevel(self.root)
+        scan_info_window.title("Scan Types Information")
+        scan_info_window.geometry("700x800")
+        scan_info_window.configure(bg=self.dark_bg)
+
+        # Create frame with scrollbar
+        frame = tk.Frame(scan_info_window, bg=self.dark_bg)
+        frame.pack(fill=tk.BOTH, expand=True, padx=20, pady=20)
+
+        # Add scrollbar
+        scrollbar = tk.Scrollbar(frame)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        # Create text widget
+        text = tk.Text(
+            frame,
+            bg="#2D2D2D",
+            fg=self.emerald,
+            font=("Helvetica", 11),
+            wrap=tk.WORD,
+            padx=15,
+            pady=15,
+            selectbackground="#4A4A4A",
+            selectforeground="#FFFFFF"
+        )
+        text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.config(command=text.yview)
+        text.config(yscrollcommand=scrollbar.set)
+
+        # Insert the scan content
+        text.insert(tk.END, scan_content)
+        text.config(state=tk.DISABLED)
+
+        # Add close button
+        close_button = tk.Button(
+            scan_info_window,
+            text="Close",
+            bg=self.button_bg,
+            fg=self.button_text,
+            command=scan_info_window.destroy,
+            width=15
+        )
+        close_button.pack(pady=10)
+
+class RecoveryEngine:
+    def __init__(self):
+        self.encryption_support = list(ENCRYPTION_FORMATS)
+        self.raid_support = list(RAID_LEVELS)
+        
+    def handle_encrypted_data(self, file_path, encryption_type, key=None, keyfile=None):
+        """Decrypted view of an encrypted image the readers and carver can open
+
+        key is the volume key as bytes or hex, or keyfile a file holding it.
+        """
+        return open_encrypted(file_path, encryption_type, key=key, keyfile=keyfile)
+
+    def recover_raid_data(self, raid_config):
+        """Assemble member images into a RaidVolume the readers and carver can open
+
+        raid_config holds 'members' (paths, None for a missing member) and
+        'level'; 'stripe_size', 'order', 'parity_layout' and 'data_offset'
+        are detected from the members when left out.
+        """
+        members = raid_config['members']
+        level = raid_config['level']
+        if raid_config.get('stripe_size') and raid_config.get('order') is not None:
+            layout = RaidLayout(level, raid_config['stripe_size'], raid_config['order'],
+                                raid_config.get('parity_layout', 'left-symmetric'),
+                                raid_config.get('data_offset', 0))
+        else:
+            stripe_sizes = (raid_config['stripe_size'],) if raid_config.get('stripe_size') else None
+            layout = detect_layout(members, level, stripe_sizes or STRIPE_SIZES,
+                                   data_offset=raid_config.get('data_offset', 0))
+        return RaidVolume(members, layout)
+
+if __name__ == "__main__":
+    # Hide console on startup
+    if sys.executable.endswith("pythonw.exe"):
+        sys.stdout = open(os.devnull, "w")
+        sys.stderr = open(os.devnull, "w")
+    
+    root = tk.Tk()
+    app = FileRecoveryApp(root)
+    root.mainloop()
@@ -0,0 +1,400 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    # Windows: peak RSS is reported as None
+    resource = None
+
+from . import workloads
+
+
+MB = 1024 * 1024
+
+# Results documents say which harness wrote them; bump on incompatible changes
+HARNESS_VERSION = 1
+
+EXIT_OK = 0
+EXIT_REGRESSION = 1
+EXIT_ERROR = 3
+
+SCALES = {
+    'small': {'tree_files': 20000, 'hash_mb': 128, 'carve_mb': 128, 'carve_files': 64, 'image_files': 400},
+    'medium': {'tree_files': 250000, 'hash_mb': 1024, 'carve_mb': 1024, 'carve_files': 512,
+               'image_files': 4000},
+    'large': {'tree_files': 2000000, 'hash_mb': 4096, 'carve_mb': 4096, 'carve_files': 2048,
+              'image_files': 20000},
+}
+
+# Benchmark name -> (workload, its primary metric); every primary metric is
+# higher-is-better
+BENCHMARKS = {
+    'walk': ('tree', 'files_per_second'),
+    'hash': ('files', 'mb_per_second'),
+    'carve': ('carve', 'mb_per_second'),
+    'scan_fat': ('fat', 'files_per_second'),
+    'scan_ext4': ('ext4', 'files_per_second'),
+    'restore_image': ('fat', 'mb_per_second'),
+    'restore_files': ('files', 'mb_per_second'),
+}
+
+EPILOG = """\
+Workloads are generated once per set of parameters under --workdir and
+reused by later runs. The results document goes to --output (default
+stdout); with --baseline every benchmark's primary rate and peak RSS are
+compared to an earlier document and the exit code is 1 if any got worse
+by more than --tolerance. Timings are warm page cache numbers: the data
+was just written or read.
+"""
+
+
+def _workload_params(options):
+    seed = options['seed']
+    return {
+        'tree': ({'files': options['tree_files'], 'seed': seed}, workloads.build_tree),
+        'files': ({'total_mb': options['hash_mb'], 'seed': seed}, workloads.build_hash_files),
+        'carve': ({'size_mb': options['carve_mb'], 'files': options['carve_files'], 'seed': seed},
+                  workloads.build_carve_image),
+        'fat': ({'files': options['image_files'], 'seed': seed}, workloads.build_fat_image),
+        'ext4': ({'files': options['image_files'], 'seed': seed}, workloads.build_ext4_image),
+    }
+
+
+def _peak_rss():
+    """Peak resident set size of this process in bytes, or None where unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes everywhere but macOS, which reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(MB), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _rate(amount, elapsed):
+    return amount / elapsed if elapsed > 0 else 0.0
+
+
+def _recovered_runs(results):
+    """Image runs of each scan result, merged, as hashable tuples"""
+    runs = set()
+    for result in results:
+        pieces = [(offset, length) for offset, length, _ in sorted(result.extents, key=lambda e: e[2])]
+        runs.add(tuple(tuple(run) for run in workloads._runs(pieces)))
+    return runs
+
+
+def _bench_walk(manifest, workers=None, restore_dir=None):
+    from src.core.walker import ParallelWalker
+
+    walker = ParallelWalker(workers=workers)
+    started = time.perf_counter()
+    files = sum(len(listing) for _, listing in walker.walk([manifest['root']]))
+    elapsed = time.perf_counter() - started
+    return {'files': files, 'expected': manifest['files'], 'dirs': walker.stats.dirs,
+            'elapsed': elapsed, 'files_per_second': _rate(files, elapsed)}
+
+
+def _bench_hash(manifest, workers=None, restore_dir=None):
+    from src.core.hashing import HashCache, HashService
+
+    # A fresh cache, so every file is read and digested
+    hasher = HashService(workers=workers, cache=HashCache())
+    started = time.perf_counter()
+    errors = sum(1 for _, _, error in hasher.hash_files(manifest['paths']) if error is not None)
+    elapsed = time.perf_counter() - started
+    return {'bytes': manifest['bytes'], 'errors': errors, 'algorithm': hasher.algorithm,
+            'elapsed': elapsed, 'mb_per_second': _rate(manifest['bytes'] / MB, elapsed)}
+
+
+def _bench_carve(manifest, workers=None, restore_dir=None):
+    from src.core.carver import Carver
+
+    started = time.perf_counter()
+    carved = list(Carver().carve(manifest['path']))
+    elapsed = time.perf_counter() - started
+    found = {(carved_file.signature, carved_file.offset, carved_file.length) for carved_file in carved}
+    matched = sum(1 for placed in manifest['files']
+                  if (placed['signature'], placed['offset'], placed['length']) in found)
+    return {'bytes': manifest['bytes'], 'carved': len(carved), 'matched': matched,
+            'expected': len(manifest['files']), 'elapsed': elapsed,
+            'mb_per_second': _rate(manifest['bytes'] / MB, elapsed)}
+
+
+def _bench_scan(manifest, workers=None, restore_dir=None):
+    from src.core.scanner import Scanner
+
+    started = time.perf_counter()
+    results = list(Scanner().scan_image(manifest['path']))
+    elapsed = time.perf_counter() - started
+    recovered = _recovered_runs(results)
+    matched = sum(1 for deleted in manifest['deleted']
+                  if tuple(tuple(run) for run in deleted['runs']) in recovered)
+    return {'files': len(results), 'matched': matched, 'expected': len(manifest['deleted']),
+            'elapsed': elapsed, 'files_per_second': _rate(len(results), elapsed)}
+
+
+def _restore(records, expected, workers, restore_dir):
+    from src.core.restore import RestorePipeline
+
+    destination = tempfile.mkdtemp(prefix='phoenix-bench-restore-', dir=restore_dir)
+    try:
+        pipeline = RestorePipeline(destination, workers=workers or 4)
+        started = time.perf_counter()
+        outcomes = list(pipeline.restore(records))
+        elapsed = time.perf_counter() - started
+        restored = [outcome for outcome in outcomes if outcome.status == 'restored']
+        restored_bytes = sum(outcome.size for outcome in restored)
+
+        # Checked outside the timing: do the copies hold the original data?
+        digests = {_sha256(outcome.destination) for outcome in restored}
+        verified = sum(1 for digest in expected if digest in digests)
+    finally:
+        shutil.rmtree(destination, ignore_errors=True)
+    return {'files': len(restored), 'failed': len(outcomes) - len(restored), 'bytes': restored_bytes,
+            'verified': verified, 'expected': len(expected), 'elapsed': elapsed,
+            'mb_per_second': _rate(restored_bytes / MB, elapsed)}
+
+
+def _bench_restore_image(manifest, workers=None, restore_dir=None):
+    from src.core.scanner import Scanner
+
+    records = list(Scanner().scan_image(manifest['path']))
+    return _restore(records, [deleted['sha256'] for deleted in manifest['deleted']], workers, restore_dir)
+
+
+def _bench_restore_files(manifest, workers=None, restore_dir=None):
+    from src.core.scanner import ScanResult
+
+    records = [ScanResult(path, os.path.getsize(path)) for path in manifest['paths']]
+    return _restore(records, [_sha256(path) for path in manifest['paths']], workers, restore_dir)
+
+
+_RUNNERS = {
+    'walk': _bench_walk,
+    'hash': _bench_hash,
+    'carve': _bench_carve,
+    'scan_fat': _bench_scan,
+    'scan_ext4': _bench_scan,
+    'restore_image': _bench_restore_image,
+    'restore_files': _bench_restore_files,
+}
+
+
+def _child(name, manifest, workers, restore_dir):
+    from src.core.restore import RestoreError
+
+    try:
+        result = _RUNNERS[name](manifest, workers, restore_dir)
+    except RestoreError as e:
+        # Plain files are only restored onto another volume
+        return {'skipped': f"{e} (pass --restore-dir)"}
+    result['peak_rss'] = _peak_rss()
+    return result
+
+
+def run_benchmark(name, manifest, workers=None, restore_dir=None):
+    """Run one benchmark in a fresh process, so its peak RSS is its own"""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(_child, name, manifest, workers, restore_dir).result()
+
+
+def _summarise(name, runs):
+    """The median run by primary metric, with every run's rate kept beside it"""
+    metric = BENCHMARKS[name][1]
+    ordered = sorted(runs, key=lambda run: run[metric])
+    summary = dict(ordered[(len(ordered) - 1) // 2])
+    summary['runs'] = [run[metric] for run in runs]
+    if len(runs) > 1:
+        summary['stdev'] = statistics.stdev(summary['runs'])
+    return summary
+
+
+def compare(results, baseline, tolerance):
+    """Per-benchmark comparison against a baseline document; flags regressions"""
+    comparison = {}
+    for name, current in results['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if 'skipped' in current or previous is None or 'skipped' in previous:
+            continue
+        workload = BENCHMARKS[name][0]
+        metric = BENCHMARKS[name][1]
+        entry = {
+            'metric': metric,
+            'baseline': previous[metric],
+            'current': current[metric],
+            'ratio': current[metric] / previous[metric] if previous[metric] else None,
+            'comparable': results['workloads'].get(workload) == baseline.get('workloads', {}).get(workload),
+            'regressions': [],
+        }
+        comparison[name] = entry
+        if not entry['comparable']:
+            # Numbers from another workload are shown but never judged
+            continue
+        if entry['ratio'] is not None and entry['ratio'] < 1 - tolerance:
+            entry['regressions'].append(metric)
+        if current.get('peak_rss') and previous.get('peak_rss') and \
+                current['peak_rss'] > previous['peak_rss'] * (1 + tolerance):
+            entry['regressions'].append('peak_rss')
+        # Correctness counts are exact; any drop is a regression
+        for count in ('matched', 'verified', 'files'):
+            if count in current and count in previous and current[count] < previous[count]:
+                entry['regressions'].append(count)
+    return comparison
+
+
+def _git_commit():
+    try:
+        done = subprocess.run(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              universal_newlines=True)
+    except OSError:
+        return None
+    return done.stdout.strip() or None
+
+
+def _report(document, stream):
+    for name, result in document['results'].items():
+        if 'skipped' in result:
+            stream.write(f"{name:<14} skipped: {result['skipped']}\n")
+            continue
+        metric = BENCHMARKS[name][1]
+        rss = f"{result['peak_rss'] / MB:8.1f} MB" if result.get('peak_rss') else "       n/a"
+        line = f"{name:<14} {result[metric]:12.1f} {metric:<16} peak RSS {rss}"
+        check = next((key for key in ('matched', 'verified') if key in result), None)
+        if check is not None:
+            line += f"  {check} {result[check]}/{result['expected']}"
+        entry = document.get('comparison', {}).get(name)
+        if entry is not None and entry['ratio'] is not None:
+            line += f"  x{entry['ratio']:.2f} vs baseline"
+            if entry['regressions']:
+                line += f"  REGRESSION ({', '.join(entry['regressions'])})"
+            elif not entry['comparable']:
+                line += "  (different workload)"
+        stream.write(line + "\n")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description="Benchmark walking, hashing, carving, image scanning and restoring on synthetic workloads.",
+        epilog=EPILOG, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--only', help="comma-separated benchmarks to run (default: all)")
+    parser.add_argument('--skip', help="comma-separated benchmarks to leave out")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per benchmark; the median is reported")
+    parser.add_argument('--workers', type=int, help="thread count for walk, hash and restore")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'phoenix-bench'),
+                        help="where generated workloads are kept between runs")
+    parser.add_argument('--restore-dir', help="restore into this directory; plain files need one on "
+                                              "another volume (default: the temp directory)")
+    parser.add_argument('--output', help="write the results document here instead of stdout")
+    parser.add_argument('--baseline', help="earlier results document to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="fraction a rate may drop, or peak RSS grow, before it counts as a regression")
+    parser.add_argument('--quiet', action='store_true', help="no summary table on stderr")
+    for key in SCALES['small']:
+        parser.add_argument(f"--{key.replace('_', '-')}", type=int, dest=key,
+                            help="override the scale's value")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    options = dict(SCALES[args.scale], seed=args.seed)
+    for key in SCALES['small']:
+        if getattr(args, key) is not None:
+            options[key] = getattr(args, key)
+
+    names = list(BENCHMARKS)
+    if args.only:
+        names = [name.strip() for name in args.only.split(',')]
+    if args.skip:
+        names = [name for name in names if name not in args.skip.split(',')]
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        sys.stderr.write(f"benchmarks: unknown benchmark {', '.join(unknown)}\n")
+        return EXIT_ERROR
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    from src import __version__
+
+    document = {
+        'harness_version': HARNESS_VERSION,
+        'created': time.time(),
+        'phoenix_version': __version__,
+        'git_commit': _git_commit(),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'scale': args.scale,
+        'repeat': args.repeat,
+        'workloads': {},
+        'results': {},
+    }
+    params = _workload_params(options)
+    manifests = {}
+    for name in names:
+        workload = BENCHMARKS[name][0]
+        if workload not in manifests:
+            workload_params, build = params[workload]
+            key = hashlib.sha1(json.dumps(workload_params, sort_keys=True).encode()).hexdigest()[:12]
+            if not args.quiet:
+                sys.stderr.write(f"preparing {workload} workload...\n")
+            try:
+                manifests[workload] = workloads.ensure(os.path.join(args.workdir, f"{workload}-{key}"),
+                                                       workload, workload_params, build)
+            except workloads.WorkloadError as e:
+                manifests[workload] = e
+            document['workloads'][workload] = workload_params
+        manifest = manifests[workload]
+        if isinstance(manifest, workloads.WorkloadError):
+            document['results'][name] = {'skipped': str(manifest)}
+            continue
+        runs = []
+        for _ in range(max(1, args.repeat)):
+            runs.append(run_benchmark(name, manifest, args.workers, args.restore_dir))
+            if 'skipped' in runs[-1]:
+                break
+        document['results'][name] = runs[-1] if 'skipped' in runs[-1] else _summarise(name, runs)
+
+    status = EXIT_OK
+    if baseline is not None:
+        document['comparison'] = compare(document, baseline, args.tolerance)
+        if any(entry['regressions'] for entry in document['comparison'].values()):
+            status = EXIT_REGRESSION
+
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
+    if not args.quiet:
+        _report(document, sys.stderr)
+    return status
@@ -0,0 +1,433 @@
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import zipfile
+import zlib
+
+
+MB = 1024 * 1024
+
+MANIFEST_NAME = "manifest.json"
+
+# Bumped whenever a generator changes what it writes, so cached workloads
+# from an older harness are rebuilt instead of silently compared
+WORKLOAD_VERSION = 1
+
+
+class WorkloadError(Exception):
+    """Raised when a workload cannot be generated here, e.g. a tool is missing"""
+
+
+def _random_bytes(rng, count):
+    return rng.getrandbits(count * 8).to_bytes(count, 'little') if count else b''
+
+
+def _runs(pieces):
+    """Merge (offset, length) pieces into maximal contiguous runs"""
+    runs = []
+    for offset, length in pieces:
+        if runs and runs[-1][0] + runs[-1][1] == offset:
+            runs[-1] = [runs[-1][0], runs[-1][1] + length]
+        else:
+            runs.append([offset, length])
+    return runs
+
+
+def ensure(directory, kind, params, build):
+    """Manifest of the workload in directory, generating it first unless already there
+
+    Workloads are seeded, so the same params always give the same bytes;
+    a cached one is reused only if its manifest records the same kind,
+    params and WORKLOAD_VERSION.
+    """
+    path = os.path.join(directory, MANIFEST_NAME)
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('kind') == kind and manifest.get('params') == params and \
+                manifest.get('version') == WORKLOAD_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    manifest = build(directory, **params)
+    manifest.update(kind=kind, params=params, version=WORKLOAD_VERSION)
+    # Written last: a half-built workload has no manifest and is rebuilt
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def build_tree(directory, files, files_per_dir=256, fanout=16, max_size=4096, seed=0):
+    """Directory tree of small files for walking: files_per_dir per leaf, fanout per level"""
+    rng = random.Random(seed)
+    pool = _random_bytes(rng, 64 * 1024 + max_size)
+    root = os.path.join(directory, 'tree')
+    leaves = max(1, -(-files // files_per_dir))
+    depth = 1
+    while fanout ** depth < leaves:
+        depth += 1
+
+    total_bytes = 0
+    made = 0
+    for leaf in range(leaves):
+        parts = []
+        index = leaf
+        for _ in range(depth):
+            index, digit = divmod(index, fanout)
+            parts.append(f"d{digit:02x}")
+        path = os.path.join(root, *reversed(parts))
+        os.makedirs(path, exist_ok=True)
+        for number in range(min(files_per_dir, files - made)):
+            size = rng.randrange(max_size + 1)
+            start = rng.randrange(64 * 1024)
+            with open(os.path.join(path, f"f{number:04d}.dat"), 'wb') as f:
+                f.write(pool[start:start + size])
+            total_bytes += size
+        made += min(files_per_dir, files - made)
+    return {'root': root, 'files': made, 'bytes': total_bytes}
+
+
+def build_hash_files(directory, total_mb, file_mb=16, seed=0):
+    """Files of random data totalling total_mb, for hashing and plain-file restores"""
+    rng = random.Random(seed)
+    root = os.path.join(directory, 'files')
+    os.makedirs(root)
+    paths = []
+    remaining = total_mb
+    while remaining > 0:
+        size = min(file_mb, remaining)
+        path = os.path.join(root, f"data{len(paths):04d}.bin")
+        with open(path, 'wb') as f:
+            for _ in range(size):
+                f.write(_random_bytes(rng, MB))
+        paths.append(path)
+        remaining -= size
+    return {'root': root, 'paths': paths, 'bytes': total_mb * MB}
+
+
+def _synthetic_jpeg(rng, size):
+    body = _random_bytes(rng, size).replace(b'\xff', b'\xff\x00')
+    return b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00' + body + b'\xff\xd9'
+
+
+def _synthetic_png(rng, size):
+    data = _random_bytes(rng, size)
+    header = struct.pack('>IIBBBBB', 64, 64, 8, 2, 0, 0, 0)
+
+    def chunk(kind, payload):
+        return struct.pack('>I', len(payload)) + kind + payload + \
+            struct.pack('>I', zlib.crc32(kind + payload) & 0xFFFFFFFF)
+
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', data) + chunk(b'IEND', b'')
+
+
+def _synthetic_pdf(rng, size):
+    stream = _random_bytes(rng, size)
+    return (b'%PDF-1.4\n1 0 obj\n<< /Length ' + str(len(stream)).encode() + b' >>\nstream\n' +
+            stream + b'\nendstream\nendobj\ntrailer\n<< /Root 1 0 R >>\n%%EOF\n')
+
+
+def _synthetic_zip(rng, size):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for number in range(1 + size // (256 * 1024)):
+            archive.writestr(f"part{number}.bin", _random_bytes(rng, min(size, 256 * 1024)))
+    return buffer.getvalue()
+
+
+_SYNTHETIC = {
+    'jpeg': _synthetic_jpeg,
+    'png': _synthetic_png,
+    'pdf': _synthetic_pdf,
+    'zip': _synthetic_zip,
+}
+
+
+def build_carve_image(directory, size_mb, files, zero_fraction=0.5, cluster_size=4096, seed=0):
+    """Raw image of random and zeroed clusters with files of known signatures embedded
+
+    Files start on cluster boundaries, as they would on a filesystem; the
+    manifest lists (signature, offset, length) for each so a carve run can
+    be scored, not only timed.
+    """
+    rng = random.Random(seed)
+    path = os.path.join(directory, 'carve.img')
+    size = size_mb * MB
+    slots = size // cluster_size
+    placed = []
+    with open(path, 'wb') as f:
+        f.truncate(size)
+        # Filler first: runs of random or zeroed clusters (zeroes are already there)
+        position = 0
+        while position < slots:
+            run = rng.randint(1, 256)
+            if rng.random() >= zero_fraction:
+                f.seek(position * cluster_size)
+                f.write(_random_bytes(rng, min(run, slots - position) * cluster_size))
+            position += run
+
+        spacing = slots // max(1, files)
+        for number in range(files):
+            signature = rng.choice(sorted(_SYNTHETIC))
+            data = _SYNTHETIC[signature](rng, rng.randint(16 * 1024, 1 * MB))
+            slot = number * spacing + rng.randrange(max(1, spacing // 4))
+            offset = slot * cluster_size
+            if offset + len(data) > size or placed and offset < placed[-1]['offset'] + placed[-1]['length']:
+                continue
+            f.seek(offset)
+            f.write(data)
+            placed.append({'signature': signature, 'offset': offset, 'length': len(data)})
+    return {'path': path, 'bytes': size, 'files': placed}
+
+
+class _FatBuilder:
+    """Writes a FAT32 volume cluster by cluster; only what the recovery reader needs"""
+
+    def __init__(self, path, cluster_count, cluster_size):
+        self.path = path
+        self.cluster_size = cluster_size
+        self.cluster_count = cluster_count
+        self.sector_size = 512
+        self.reserved = 32
+        self.fat_sectors = -(-(cluster_count + 2) * 4 // self.sector_size)
+        self.heap_offset = (self.reserved + 2 * self.fat_sectors) * self.sector_size
+        self.size = self.heap_offset + cluster_count * cluster_size
+        self.fat = [0] * (cluster_count + 2)
+        self.fat[0], self.fat[1] = 0x0FFFFFF8, 0x0FFFFFFF
+        self.next_cluster = 2
+        self.file = open(path, 'wb')
+        self.file.truncate(self.size)
+
+    def allocate(self, count):
+        """Next count clusters, as a list"""
+        if self.next_cluster + count > self.cluster_count + 2:
+            raise WorkloadError("FAT image too small for the workload")
+        clusters = list(range(self.next_cluster, self.next_cluster + count))
+        self.next_cluster += count
+        return clusters
+
+    def offset(self, cluster):
+        return self.heap_offset + (cluster - 2) * self.cluster_size
+
+    def chain(self, clusters):
+        for current, following in zip(clusters, clusters[1:] + [0x0FFFFFFF]):
+            self.fat[current] = following
+
+    def write(self, clusters, data):
+        for index, cluster in enumerate(clusters):
+            self.file.seek(self.offset(cluster))
+            self.file.write(data[index * self.cluster_size:(index + 1) * self.cluster_size])
+
+    @staticmethod
+    def entry(name, attributes, cluster, size, deleted=False):
+        raw = bytearray(name.ljust(11).encode('ascii'))
+        if deleted:
+            raw[0] = 0xE5
+        # 2020-01-01 12:00:00
+        date, time_ = (40 << 9) | (1 << 5) | 1, 12 << 11
+        return bytes(raw) + struct.pack('<BBBHHHHHHHI', attributes, 0, 0, time_, date, date,
+                                        cluster >> 16, time_, date, cluster & 0xFFFF, size)
+
+    def finish(self, root_clusters):
+        boot = bytearray(512)
+        boot[0:3] = b'\xeb\x58\x90'
+        boot[3:11] = b'MSWIN4.1'
+        total = self.size // self.sector_size
+        struct.pack_into('<HBHBHHBHHHII', boot, 11, self.sector_size, self.cluster_size // self.sector_size,
+                         self.reserved, 2, 0, 0, 0xF8, 0, 63, 255, 0, total)
+        struct.pack_into('<IHHIHH', boot, 36, self.fat_sectors, 0, 0, root_clusters[0], 1, 6)
+        struct.pack_into('<BBBI', boot, 64, 0x80, 0, 0x29, 0x50484E58)
+        boot[71:82] = b'PHOENIXBNCH'
+        boot[82:90] = b'FAT32   '
+        boot[510:512] = b'\x55\xaa'
+
+        info = bytearray(512)
+        free = self.cluster_count - sum(1 for value in self.fat[2:] if value)
+        struct.pack_into('<I', info, 0, 0x41615252)
+        struct.pack_into('<III', info, 484, 0x61417272, free, self.next_cluster)
+        struct.pack_into('<I', info, 508, 0xAA550000)
+
+        fat = struct.pack(f'<{len(self.fat)}I', *self.fat)
+        for sector, data in ((0, boot), (1, info), (6, boot), (7, info)):
+            self.file.seek(sector * self.sector_size)
+            self.file.write(data)
+        for copy in range(2):
+            self.file.seek((self.reserved + copy * self.fat_sectors) * self.sector_size)
+            self.file.write(fat)
+        self.file.close()
+
+
+def build_fat_image(directory, files, files_per_dir=64, min_size=4096, max_size=256 * 1024,
+                    deleted_fraction=0.3, fragmented_fraction=0.1, cluster_size=4096, seed=0):
+    """FAT32 image with live, deleted and deleted-but-fragmented files
+
+    A fragmented file's pieces are separated by the clusters of a live
+    file, which is the layout a FAT reader can still rebuild after the
+    chain is gone; the manifest lists every deleted file's byte runs.
+    """
+    rng = random.Random(seed)
+    sizes = [rng.randint(min_size, max_size) for _ in range(files)]
+    per_cluster = lambda size: max(1, -(-size // cluster_size))
+    # Data, a spacer of up to 4 clusters per piece, directories and slack
+    needed = sum(per_cluster(size) for size in sizes) + 8 * files + files // files_per_dir + 64
+    fat = _FatBuilder(os.path.join(directory, 'fat32.img'), needed, cluster_size)
+
+    dirs = -(-files // files_per_dir)
+    root_entries = [_FatBuilder.entry('PHOENIXBNCH', 0x08, 0, 0)]
+    root = fat.allocate(per_cluster((dirs + 1) * 32))
+    deleted = []
+    live = 0
+    for number in range(dirs):
+        dir_name = f"D{number:04d}"
+        dir_clusters = fat.allocate(per_cluster((2 + 3 * files_per_dir) * 32))
+        entries = [_FatBuilder.entry('.', 0x10, dir_clusters[0], 0),
+                   _FatBuilder.entry('..', 0x10, 0, 0)]
+        for index in range(number * files_per_dir, min(files, (number + 1) * files_per_dir)):
+            size = sizes[index]
+            data = _random_bytes(rng, size)
+            name = f"F{index:07d}BIN"
+            kind = rng.random()
+            if kind < fragmented_fraction:
+                pieces = rng.randint(2, 3)
+                count = per_cluster(size)
+                cuts = sorted(rng.sample(range(1, count), min(pieces - 1, count - 1))) if count > 1 else []
+                clusters = []
+                for first, last in zip([0] + cuts, cuts + [count]):
+                    if clusters:
+                        spacer = fat.allocate(rng.randint(1, 4))
+                        fat.chain(spacer)
+                        fat.write(spacer, _random_bytes(rng, len(spacer) * cluster_size))
+                        entries.append(_FatBuilder.entry(f"S{index:07d}{len(entries) % 1000:03d}", 0x20,
+                                                         spacer[0], len(spacer) * cluster_size))
+                        live += 1
+                    clusters.extend(fat.allocate(last - first))
+                removed = True
+            else:
+                clusters = fat.allocate(per_cluster(size))
+                removed = kind < fragmented_fraction + deleted_fraction
+            fat.write(clusters, data)
+            if removed:
+                pieces = [(fat.offset(cluster), cluster_size) for cluster in clusters]
+                runs = _runs(pieces)
+                runs[-1][1] -= len(clusters) * cluster_size - size
+                deleted.append({'path': f"/{dir_name}/_{name[1:8]}.{name[8:]}", 'size': size,
+                                'sha256': hashlib.sha256(data).hexdigest(), 'runs': runs})
+            else:
+                fat.chain(clusters)
+                live += 1
+            entries.append(_FatBuilder.entry(name, 0x20, clusters[0], size, deleted=removed))
+        fat.chain(dir_clusters)
+        fat.write(dir_clusters, b''.join(entries))
+        root_entries.append(_FatBuilder.entry(dir_name, 0x10, dir_clusters[0], 0))
+    fat.chain(root)
+    fat.write(root, b''.join(root_entries))
+    fat.finish(root)
+    return {'path': fat.path, 'bytes': fat.size, 'live': live, 'deleted': deleted}
+
+
+# "(logical[-logical]):physical[-physical]" in debugfs stat output
+_EXTENT = re.compile(r'\((\d+)(?:-(\d+))?\):(\d+)(?:-(\d+))?')
+
+
+def _debugfs(image, commands):
+    with tempfile.NamedTemporaryFile('w', suffix='.debugfs', delete=False) as script:
+        script.write("\n".join(commands) + "\n")
+    try:
+        done = subprocess.run(['debugfs', '-w', '-f', script.name, image], stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, universal_newlines=True)
+    finally:
+        os.remove(script.name)
+    if done.returncode:
+        raise WorkloadError(f"debugfs failed: {done.stderr.strip()}")
+    return done.stdout
+
+
+def build_ext4_image(directory, files, min_size=4096, max_size=256 * 1024, deleted_fraction=0.3,
+                     fragmented=None, block_size=4096, seed=0):
+    """ext4 image from mke2fs -d with files removed through debugfs
+
+    Every third file is removed first to leave holes; the fragmented
+    files, written afterwards with debugfs, fill those holes in pieces
+    and are then removed too, along with deleted_fraction of the rest.
+    Needs e2fsprogs (mke2fs and debugfs); raises WorkloadError without.
+    """
+    for tool in ('mke2fs', 'debugfs'):
+        if shutil.which(tool) is None:
+            raise WorkloadError(f"{tool} not found; install e2fsprogs to build ext4 workloads")
+    rng = random.Random(seed)
+    staging = os.path.join(directory, 'staging')
+    later = os.path.join(directory, 'later')
+    os.makedirs(staging)
+    os.makedirs(later)
+    if fragmented is None:
+        fragmented = max(1, files // 30)
+
+    contents = {}
+    for number in range(files):
+        data = _random_bytes(rng, rng.randint(min_size, max_size))
+        name = f"f{number:07d}.bin"
+        with open(os.path.join(staging, name), 'wb') as f:
+            f.write(data)
+        contents[name] = data
+    holes = [name for number, name in enumerate(sorted(contents)) if number % 3 == 1]
+    hole_bytes = sum(-(-len(contents[name]) // block_size) * block_size for name in holes)
+    # Each fragmented file spans about two holes, and together they fit in them
+    for number in range(fragmented):
+        size = min(2 * max_size, hole_bytes // fragmented - block_size)
+        if size < block_size:
+            break
+        data = _random_bytes(rng, rng.randint(size // 2, size))
+        name = f"g{number:07d}.bin"
+        with open(os.path.join(later, name), 'wb') as f:
+            f.write(data)
+        contents[name] = data
+    fragments = sorted(name for name in contents if name.startswith('g'))
+
+    total = sum(len(data) for data in contents.values())
+    size_mb = max(16, 2 * total // MB + 16)
+    path = os.path.join(directory, 'ext4.img')
+    done = subprocess.run(['mke2fs', '-q', '-t', 'ext4', '-b', str(block_size), '-d', staging, '-F',
+                           path, f"{size_mb}M"], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    if done.returncode:
+        raise WorkloadError(f"mke2fs failed: {done.stderr.strip()}")
+
+    _debugfs(path, [f"rm /{name}" for name in holes] +
+             [f"write {os.path.join(later, name)} {name}" for name in fragments])
+    survivors = [name for number, name in enumerate(sorted(contents)) if name.startswith('f') and
+                 number % 3 != 1]
+    removed = fragments + [name for name in survivors if rng.random() < deleted_fraction]
+
+    # Where each file landed, read back before it is removed; the EXTENTS
+    # part of stat lists data runs, skipping extent tree blocks (ETB)
+    output = _debugfs(path, [f"stat /{name}" for name in removed])
+    reports = output.split("debugfs: stat")[1:]
+    if len(reports) != len(removed):
+        raise WorkloadError("debugfs did not report on every removed file")
+    _debugfs(path, [f"rm /{name}" for name in removed])
+
+    deleted = []
+    for name, report in zip(removed, reports):
+        extents = report.split("EXTENTS:", 1)[-1]
+        pieces = []
+        for first, last, start, end in _EXTENT.findall(extents):
+            count = int(last or first) - int(first) + 1
+            pieces.append((int(start) * block_size, count * block_size))
+        runs = _runs(pieces)
+        runs[-1][1] -= sum(length for _, length in pieces) - len(contents[name])
+        deleted.append({'path': f"/{name}", 'size': len(contents[name]),
+                        'sha256': hashlib.sha256(contents[name]).hexdigest(), 'runs': runs})
+    shutil.rmtree(staging)
+    shutil.rmtree(later)
+    return {'path': path, 'bytes': os.path.getsize(path), 'live': len(survivors) + len(fragments) - len(removed),
+            'deleted': deleted}
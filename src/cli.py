@@ -0,0 +1,405 @@
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+
+
+# Exit codes, stable for cron and fleet tooling
+EXIT_OK = 0
+EXIT_PARTIAL = 1  # finished, but some files failed
+EXIT_USAGE = 2  # bad arguments (argparse's own code)
+EXIT_ERROR = 3  # nothing done: unreadable source, refused destination, ...
+EXIT_INTERRUPTED = 130
+
+EPILOG = """\
+Results are written to stdout as one JSON object per line; a one-line JSON
+summary goes to stderr unless --quiet is given. Exit codes: 0 success,
+1 finished with failed files, 2 usage error, 3 fatal error, 130 interrupted.
+"""
+
+
+class _Output:
+    """NDJSON writer for stdout plus the summary line on stderr"""
+
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+        self.count = 0
+        self._write = sys.stdout.write
+
+    def emit(self, record):
+        self._write(json.dumps(record, separators=(',', ':')) + "\n")
+        self.count += 1
+
+    def summary(self, **fields):
+        if not self.quiet:
+            sys.stderr.write(json.dumps(fields) + "\n")
+
+
+def _cancel_on_sigint(token):
+    """Turn the first Ctrl-C or SIGTERM into a graceful cancel, the second into a hard stop"""
+    def handler(signum, frame):
+        if token.cancelled:
+            raise KeyboardInterrupt
+        token.cancel()
+
+    signal.signal(signal.SIGINT, handler)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, handler)
+
+
+def _record_history(args, kind, mode, started, elapsed, files, total_bytes, failures, status, details=None):
+    if args.no_history:
+        return
+    from .database.operations import RecoveryHistory
+    try:
+        with RecoveryHistory(args.history) as history:
+            history.record(kind, started, elapsed, files, total_bytes, failures, status,
+                           mode=mode, details=details)
+    except Exception:
+        # A read-only home directory must not fail an otherwise good run
+        pass
+
+
+def _scan(args, out):
+    from .core.scanner import CancelToken, Scanner
+
+    scanner = Scanner(metrics=args.metrics)
+    token = CancelToken()
+    _cancel_on_sigint(token)
+    started, clock = time.time(), time.monotonic()
+    total_bytes = 0
+
+    index = None
+    if args.image and args.mode == 'quick':
+        mode = 'image-trash'
+        results = scanner.scan_image_trash(args.image, cancel_token=token)
+    elif args.image:
+        mode = 'image'
+        results = scanner.scan_image(args.image, cancel_token=token)
+    elif args.mode == 'quick':
+        mode = 'quick'
+        volumes = [os.path.abspath(path) for path in args.paths] or None
+        results = scanner.quick_scan(volumes, cancel_token=token)
+    else:
+        mode = args.mode
+        if not args.no_index:
+            from .database.operations import ScanIndex
+            index = ScanIndex(args.index)
+        locations = [os.path.abspath(path) for path in args.paths] or None
+        results = scanner.scan(locations, mode=args.mode, cancel_token=token, index=index, full=args.full)
+
+    def emit(batch):
+        if args.classify:
+            scanner.classify(batch, index=index)
+        for result in batch:
+            out.emit(result.to_dict())
+
+    try:
+        batch = []
+        for result in results:
+            # One lstat per file found
+            args.limiter.consume(0, 1, token)
+            total_bytes += result.size
+            batch.append(result)
+            # Classified a batch at a time, so output still streams
+            if not args.classify or len(batch) >= scanner.classifier.batch_size:
+                emit(batch)
+                batch = []
+        emit(batch)
+    finally:
+        results.close()
+        if index is not None:
+            index.close()
+
+    elapsed = time.monotonic() - clock
+    status = 'cancelled' if token.cancelled else 'done'
+    _record_history(args, 'scan', mode, started, elapsed, out.count, total_bytes, 0, status)
+    out.summary(command='scan', mode=mode, status=status, files=out.count, bytes=total_bytes,
+                elapsed=elapsed, files_per_second=out.count / elapsed if elapsed > 0 else 0.0)
+    return EXIT_INTERRUPTED if token.cancelled else EXIT_OK
+
+
+def _carve(args, out):
+    from .core.carver import Carver
+    from .core.scanner import CancelToken, ScanResult
+
+    token = CancelToken()
+    _cancel_on_sigint(token)
+    started, clock = time.time(), time.monotonic()
+    carver = Carver(chunk_size=args.chunk_size * 1024 * 1024)
+    total_bytes = 0
+    read = [0]
+
+    def throttle(event):
+        # Called from the carving loop, so waiting here slows the reads themselves
+        args.limiter.consume(event.bytes_done - read[0], 1, token)
+        read[0] = event.bytes_done
+
+    regions = None
+    details = {'source': args.source}
+    if args.unallocated:
+        from .core.scanner import Scanner
+
+        scanner = Scanner(metrics=args.metrics)
+        if args.no_map_cache:
+            scanner.allocation_dir = None
+        regions = scanner.allocation_map(args.source, cancel_token=token, on_progress=throttle,
+                                         skip_zeros=not args.keep_zeros)
+        details.update(regions.to_dict())
+        # The carve counts the bytes it reads from zero again
+        read[0] = 0
+
+    if args.reassemble:
+        from .core.reassemble import Reassembler
+
+        carved_files = list(carver.carve(args.source, cancel_token=token, on_progress=throttle, regions=regions))
+        for result in Reassembler().reassemble(args.source, carved_files, cancel_token=token):
+            carved = result.carved
+            record = ScanResult(f"/{carved.name}", result.length, source='carve', image=args.source,
+                                extents=result.extents).to_dict()
+            record.update(carved.to_dict())
+            record['reassembly'] = result.to_dict()
+            out.emit(record)
+            total_bytes += result.length
+    else:
+        for carved in carver.carve(args.source, cancel_token=token, on_progress=throttle, regions=regions):
+            # Emitted as a scan result too, so the line can be fed to `restore`
+            record = ScanResult(f"/{carved.name}", carved.length, source='carve', image=args.source,
+                                extents=[(carved.offset, carved.length, 0)]).to_dict()
+            record.update(carved.to_dict())
+            out.emit(record)
+            total_bytes += carved.length
+
+    elapsed = time.monotonic() - clock
+    status = 'cancelled' if token.cancelled else 'done'
+    _record_history(args, 'carve', 'unallocated' if args.unallocated else None, started, elapsed,
+                    out.count, total_bytes, 0, status, details)
+    out.summary(command='carve', status=status, files=out.count, bytes=total_bytes, elapsed=elapsed,
+                read_bytes=regions.free_bytes if regions is not None else None)
+    return EXIT_INTERRUPTED if token.cancelled else EXIT_OK
+
+
+def _read_results(stream):
+    from .core.scanner import ScanResult
+
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            extents = record.get('extents')
+            yield ScanResult(record['path'], record.get('size', 0), record.get('mtime', 0.0),
+                             record.get('inode', 0), record.get('device', 0),
+                             record.get('source', 'walk'), record.get('image'),
+                             [tuple(extent) for extent in extents] if extents is not None else None,
+                             record.get('category'), record.get('origin'), record.get('deleted'))
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"line {number}: not a scan result ({e})")
+
+
+def _restore(args, out):
+    from .core.restore import RestorePipeline
+    from .core.scanner import CancelToken, Scanner
+
+    if args.destination is None and not args.to_origin:
+        sys.stderr.write("phoenix: restore needs a destination or --to-origin\n")
+        return EXIT_USAGE
+    if args.input == '-':
+        results = list(_read_results(sys.stdin))
+    else:
+        with open(args.input, encoding='utf-8') as f:
+            results = list(_read_results(f))
+
+    token = CancelToken()
+    _cancel_on_sigint(token)
+    started, clock = time.time(), time.monotonic()
+    if args.to_origin:
+        destination = 'origin'
+        outcomes = Scanner(metrics=args.metrics).put_back(results, cancel_token=token)
+    else:
+        destination = os.path.abspath(args.destination)
+        pipeline = RestorePipeline(args.destination, workers=args.workers, verify=not args.no_verify,
+                                   metrics=args.metrics, dedup=args.dedup, link=args.link)
+        outcomes = pipeline.restore(results, cancel_token=token)
+    failures = restored_bytes = shared_bytes = 0
+
+    for outcome in outcomes:
+        args.limiter.consume(outcome.size, 1, token)
+        out.emit(outcome.to_dict())
+        if outcome.status == 'failed':
+            failures += 1
+        else:
+            restored_bytes += outcome.size
+        if outcome.shared:
+            shared_bytes += outcome.size
+
+    elapsed = time.monotonic() - clock
+    status = 'cancelled' if token.cancelled else 'done'
+    _record_history(args, 'restore', None, started, elapsed, out.count - failures, restored_bytes,
+                    failures, status, {'destination': destination})
+    out.summary(command='restore', status=status, files=out.count - failures, failed=failures,
+                bytes=restored_bytes, shared_bytes=shared_bytes, elapsed=elapsed,
+                mb_per_second=restored_bytes / (1024 * 1024) / elapsed if elapsed > 0 else 0.0)
+    if token.cancelled:
+        return EXIT_INTERRUPTED
+    return EXIT_PARTIAL if failures else EXIT_OK
+
+
+def _index(args, out):
+    from .database.operations import ScanIndex
+
+    with ScanIndex(args.index) as index:
+        if args.index_command == 'stats':
+            out.emit(index.stats())
+        else:
+            for entry in index.query(args.name, args.file_type, args.under,
+                                     args.min_size, args.max_size, args.limit):
+                out.emit(entry.to_dict())
+    return EXIT_OK
+
+
+def _history(args, out):
+    from .database.operations import RecoveryHistory
+
+    with RecoveryHistory(args.history) as history:
+        if args.compact is not None:
+            removed = history.compact(args.compact)
+            out.summary(command='history', compacted=removed)
+        elif args.throughput:
+            for row in history.throughput(args.kind or 'scan', by=args.throughput):
+                out.emit(row)
+        else:
+            for record in history.page(limit=args.limit, kind=args.kind, host=args.host):
+                out.emit(record.to_dict())
+    return EXIT_OK
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='phoenix', description="PhoenixRestore file recovery, headless",
+                                     epilog=EPILOG, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quiet', action='store_true', help="no summary line on stderr")
+    parser.add_argument('--index', help="scan index file (default: ~/.phoenix_restore/scan_index.db)")
+    parser.add_argument('--history', help="history file (default: ~/.phoenix_restore/history.db)")
+    parser.add_argument('--no-history', action='store_true', help="do not record this run in the history")
+    parser.add_argument('--metrics', dest='metrics_file', metavar='FILE',
+                        help="write stage timings and counters here at the end (.prom: Prometheus text)")
+    parser.add_argument('--metrics-format', choices=('json', 'prometheus'),
+                        help="format for --metrics (default: from the file extension)")
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help="serve live metrics on localhost:PORT/metrics while running")
+    parser.add_argument('--profile', metavar='DIR',
+                        help="capture cProfile and tracemalloc reports into DIR")
+    parser.add_argument('--max-mbps', type=float, metavar='MB',
+                        help="hold scan, carve and restore I/O to MB megabytes per second")
+    parser.add_argument('--max-iops', type=float, metavar='N',
+                        help="hold scan, carve and restore to N file or read operations per second")
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    scan = commands.add_parser('scan', help="walk directories, or list deleted files on an image")
+    scan.add_argument('paths', nargs='*',
+                      help="directories to walk, or for --mode quick volume roots whose trashes to read "
+                           "(default: the mode's locations)")
+    scan.add_argument('--mode', choices=('quick', 'deep'), default='deep',
+                      help="quick lists trashed files with their original paths from the trash metadata")
+    scan.add_argument('--image', help="list deleted files on an ext4, NTFS, FAT32 or exFAT image or device; "
+                                      "with --mode quick, its $Recycle.Bin instead")
+    scan.add_argument('--no-index', action='store_true', help="walk everything without the scan index")
+    scan.add_argument('--full', action='store_true', help="re-list every directory, still updating the index")
+    scan.add_argument('--classify', action='store_true',
+                      help="add each file's category, judged by its contents")
+    scan.set_defaults(handler=_scan)
+
+    carve = commands.add_parser('carve', help="carve files by signature out of an image or device")
+    carve.add_argument('source')
+    carve.add_argument('--chunk-size', type=int, default=16, metavar='MB')
+    carve.add_argument('--reassemble', action='store_true',
+                       help="check carved JPEG and zip files and rejoin fragmented ones")
+    carve.add_argument('--unallocated', action='store_true',
+                       help="read only space no file owns on an ext4, NTFS, FAT32 or exFAT volume, "
+                            "skipping all-zero blocks; the map is cached per image")
+    carve.add_argument('--keep-zeros', action='store_true', help="with --unallocated, read all-zero blocks too")
+    carve.add_argument('--no-map-cache', action='store_true',
+                       help="with --unallocated, neither use nor keep a cached map")
+    carve.set_defaults(handler=_carve)
+
+    restore = commands.add_parser('restore', help="restore files listed as scan or carve output")
+    restore.add_argument('destination', nargs='?', help="directory on a different volume")
+    restore.add_argument('--to-origin', action='store_true',
+                         help="move trashed files from a quick scan back to where they were deleted from")
+    restore.add_argument('--input', default='-', help="NDJSON scan or carve output (default: stdin)")
+    restore.add_argument('--workers', type=int, default=4)
+    restore.add_argument('--no-verify', action='store_true', help="skip checking copies by digest")
+    restore.add_argument('--dedup', action='store_true',
+                         help="store each distinct content once and lay files out under their original paths")
+    restore.add_argument('--link', choices=('auto', 'reflink', 'hardlink', 'copy'), default='auto',
+                         help="how --dedup outputs share stored content (default: reflink, else hard link)")
+    restore.set_defaults(handler=_restore)
+
+    index = commands.add_parser('index', help="query the scan index")
+    index_commands = index.add_subparsers(dest='index_command', metavar='index_command')
+    index_commands.required = True
+    index_commands.add_parser('stats', help="totals for the whole index")
+    query = index_commands.add_parser('query', help="indexed files matching the filters")
+    query.add_argument('--name', help="substring of the file name")
+    query.add_argument('--type', dest='file_type', help="category such as images or documents")
+    query.add_argument('--under', help="only files below this directory")
+    query.add_argument('--min-size', type=int)
+    query.add_argument('--max-size', type=int)
+    query.add_argument('--limit', type=int)
+    index.set_defaults(handler=_index)
+
+    history = commands.add_parser('history', help="past scans and restores, newest first")
+    history.add_argument('--kind', help="scan, carve or restore")
+    history.add_argument('--host')
+    history.add_argument('--limit', type=int, default=100)
+    history.add_argument('--throughput', choices=('version', 'host', 'mode'),
+                         help="average speed grouped by this column instead of single runs")
+    history.add_argument('--compact', type=int, metavar='DAYS',
+                         help="fold runs older than DAYS into daily totals")
+    history.set_defaults(handler=_history)
+    return parser
+
+
+def main(argv=None):
+    from .core.throttle import RateLimiter
+    from .core.metrics import Metrics
+
+    args = build_parser().parse_args(argv)
+    out = _Output(quiet=args.quiet)
+    args.metrics = Metrics()
+    args.limiter = RateLimiter(args.max_mbps * 1024 * 1024 if args.max_mbps else None, args.max_iops)
+    server = capture = None
+    try:
+        if args.metrics_port is not None:
+            from .core.metrics_server import MetricsServer
+
+            server = MetricsServer(args.metrics, port=args.metrics_port).start()
+            if not args.quiet:
+                sys.stderr.write(f"phoenix: metrics at {server.url}\n")
+        if args.profile:
+            from .core.profiling import ProfileCapture
+
+            capture = ProfileCapture(args.profile).start()
+        return args.handler(args, out)
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    except BrokenPipeError:
+        # The reader went away (e.g. `| head`); point stdout at devnull so
+        # the interpreter's final flush does not raise again
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return EXIT_OK
+    except Exception as e:
+        # OSError, RestoreError, Ext4Error, DatabaseError, ...: the run could not go ahead
+        sys.stderr.write(f"phoenix: {e}\n")
+        return EXIT_ERROR
+    finally:
+        if capture is not None:
+            args.metrics.capture = capture.stop()
+        if args.metrics_file:
+            args.metrics.write(args.metrics_file, args.metrics_format)
+        if server is not None:
+            server.close()
@@ -0,0 +1,379 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from array import array
+from itertools import groupby
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .carver import CarveProgress
+from .ext4 import Ext4Error, Ext4Reader
+from .fat import FAT32_MASK, FatError, FatReader
+from .ntfs import NtfsError, NtfsReader
+
+
+MB = 1024 * 1024
+
+DEFAULT_ALLOCATION_DIR = os.path.join(os.path.expanduser("~"), ".phoenix_restore", "allocation")
+
+# Start of the image digested into a cached map's key along with the
+# allocation itself: boot sectors and superblocks, whose counters and
+# timestamps move whenever the filesystem is written
+HEADER_BYTES = 64 * 1024
+
+MAP_FORMAT = 1
+
+# A run of wholly free bytes, or one byte with some bits free
+_FREE_BYTES = re.compile(rb'\x00+|[^\xff]')
+
+
+class AllocationError(Exception):
+    """Raised when a filesystem's allocation records cannot be read"""
+
+
+def _append(extents, start, end):
+    """Add [start, end) to a flat, sorted extent array, merging it with the last one if they touch"""
+    if end <= start:
+        return
+    if extents and extents[-1] == start:
+        extents[-1] = end
+    else:
+        extents.extend((start, end))
+
+
+def _numpy_runs(used, first):
+    """(first, length) runs of zeros in an array of 0/1 flags"""
+    one = numpy.int8(1)
+    edges = numpy.diff(used.astype(numpy.int8), prepend=one, append=one)
+    starts = numpy.flatnonzero(edges == -1).tolist()
+    ends = numpy.flatnonzero(edges == 1).tolist()
+    return [(first + start, end - start) for start, end in zip(starts, ends)]
+
+
+def clear_runs(bitmap, count, slice_bytes=MB):
+    """Yield (first, length) runs of clear bits among the first count bits of bitmap
+
+    Bit 0 is the lowest bit of byte 0, as in ext4, NTFS and exFAT
+    bitmaps. Runs crossing a slice boundary come out in two pieces.
+    """
+    count = min(count, len(bitmap) * 8)
+    view = memoryview(bitmap)
+    for base in range(0, (count + 7) // 8, slice_bytes):
+        piece = view[base:base + slice_bytes]
+        first = base * 8
+        bits = min(len(piece) * 8, count - first)
+        if numpy is not None:
+            used = numpy.unpackbits(numpy.frombuffer(piece, dtype=numpy.uint8), count=bits, bitorder='little')
+            yield from _numpy_runs(used, first)
+            continue
+        # Whole free bytes are skipped over by the regex engine; only mixed bytes are split bit by bit
+        for match in _FREE_BYTES.finditer(piece):
+            start, end = match.span()
+            byte = piece[start]
+            if not byte:
+                length = min(end * 8, bits) - start * 8
+                if length > 0:
+                    yield first + start * 8, length
+                continue
+            for bit in range(8):
+                if not byte & (1 << bit) and start * 8 + bit < bits:
+                    yield first + start * 8 + bit, 1
+
+
+def free_entries(fat, first, count, slice_entries=8 * MB):
+    """Yield (index, length) runs of free FAT32 entries in fat[first:first + count], indexed from first"""
+    end = min(first + count, len(fat))
+    if numpy is not None:
+        table = numpy.frombuffer(fat, dtype=numpy.uint32)
+        for base in range(first, end, slice_entries):
+            entries = table[base:min(base + slice_entries, end)]
+            used = ((entries & FAT32_MASK) != 0).view(numpy.uint8)
+            yield from _numpy_runs(used, base - first)
+        return
+    position = 0
+    for used, entries in groupby(fat[first:end], key=lambda entry: entry & FAT32_MASK != 0):
+        length = sum(1 for _ in entries)
+        if not used:
+            yield position, length
+        position += length
+
+
+def nonzero_spans(data, block_size):
+    """(start, end) byte spans of data covering every block that holds a nonzero byte"""
+    data = memoryview(data)
+    whole = len(data) // block_size
+    spans = []
+    if numpy is not None and block_size % 8 == 0:
+        if whole:
+            blocks = numpy.frombuffer(data, dtype=numpy.uint64, count=whole * block_size // 8)
+            used = blocks.reshape(whole, -1).any(axis=1)
+            del blocks
+            zero = numpy.int8(0)
+            edges = numpy.diff(used.astype(numpy.int8), prepend=zero, append=zero)
+            starts = numpy.flatnonzero(edges == 1).tolist()
+            ends = numpy.flatnonzero(edges == -1).tolist()
+            spans = [(start * block_size, end * block_size) for start, end in zip(starts, ends)]
+    else:
+        # A block-sized copy compared with memcmp still runs at several GB/s
+        zeros = bytes(block_size)
+        for start in range(0, whole * block_size, block_size):
+            if data[start:start + block_size].tobytes() != zeros:
+                if spans and spans[-1][1] == start:
+                    spans[-1] = (spans[-1][0], start + block_size)
+                else:
+                    spans.append((start, start + block_size))
+    tail = whole * block_size
+    if tail < len(data) and data[tail:].tobytes().strip(b'\x00'):
+        if spans and spans[-1][1] == tail:
+            spans[-1] = (spans[-1][0], len(data))
+        else:
+            spans.append((tail, len(data)))
+    return spans
+
+
+class AllocationMap:
+    """Byte ranges of an image worth carving, kept as a flat array('Q') of start, end pairs
+
+    Built from the filesystem's own allocation records, so live files and
+    metadata are left out, while slack past the end of the filesystem is
+    kept. without_zeros() also drops blocks holding nothing but zeros.
+    At 16 bytes per free extent the map stays small however large the
+    disk is, and it is saved as that array behind a one-line JSON header.
+    Iterating a map yields (offset, length) ranges, as Carver.carve()
+    takes them.
+    """
+
+    def __init__(self, size, extents=None, block_size=4096, filesystem=None, zeros_skipped=False):
+        self.size = size
+        self.extents = extents if extents is not None else array('Q')
+        self.block_size = block_size
+        self.filesystem = filesystem  # None when the whole image was taken as free
+        self.zeros_skipped = zeros_skipped
+
+    @classmethod
+    def whole(cls, size, block_size=4096):
+        """Map taking every byte of an image as worth carving"""
+        extents = array('Q')
+        _append(extents, 0, size)
+        return cls(size, extents, block_size)
+
+    def __len__(self):
+        return len(self.extents) // 2
+
+    def __iter__(self):
+        return self.regions()
+
+    def regions(self, start=0, end=None):
+        """Yield (offset, length) for each range, clipped to [start, end)"""
+        if end is None:
+            end = self.size
+        extents = self.extents
+        for i in range(0, len(extents), 2):
+            low = max(extents[i], start)
+            high = min(extents[i + 1], end)
+            if low < high:
+                yield low, high - low
+
+    @property
+    def free_bytes(self):
+        extents = self.extents
+        return sum(extents[1::2]) - sum(extents[0::2])
+
+    def without_zeros(self, image, cancel_token=None, on_progress=None, chunk_size=16 * MB):
+        """Copy of the map without blocks that are all zeros, found by reading every range once
+
+        Blocks are block_size bytes counted from the start of each range and
+        checked a chunk at a time, as 64-bit words with NumPy when it is
+        installed. If cancelled, ranges not read yet are kept whole.
+        """
+        block_size = self.block_size
+        chunk_size = max(block_size, chunk_size - chunk_size % block_size)
+        kept = array('Q')
+        total = self.free_bytes
+        done = 0
+        started = last_report = time.monotonic()
+        cancelled = False
+
+        for offset, length in self.regions():
+            if cancelled:
+                _append(kept, offset, offset + length)
+                continue
+            for base, view, limit in image.chunks(offset, offset + length, chunk_size=chunk_size):
+                if cancel_token is not None and cancel_token.cancelled:
+                    cancelled = True
+                    view.release()
+                    _append(kept, base, offset + length)
+                    break
+                for start, end in nonzero_spans(view, block_size):
+                    _append(kept, base + start, base + end)
+                view.release()
+                done += limit
+
+                now = time.monotonic()
+                if on_progress is not None and now - last_report >= 0.25:
+                    last_report = now
+                    on_progress(CarveProgress('mapping', done, total, 0, now - started))
+
+        if on_progress is not None:
+            on_progress(CarveProgress('cancelled' if cancelled else 'mapped', done, total, 0,
+                                      time.monotonic() - started))
+        return AllocationMap(self.size, kept, block_size, self.filesystem, zeros_skipped=not cancelled)
+
+    def to_dict(self):
+        return {
+            'filesystem': self.filesystem,
+            'size': self.size,
+            'block_size': self.block_size,
+            'extents': len(self),
+            'free_bytes': self.free_bytes,
+            'zeros_skipped': self.zeros_skipped
+        }
+
+    def save(self, path):
+        header = dict(self.to_dict(), format=MAP_FORMAT)
+        extents = array('Q', self.extents)
+        if sys.byteorder != 'little':
+            extents.byteswap()
+        temp = path + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            extents.tofile(f)
+        os.replace(temp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Map saved by save(); ValueError if the file is not one"""
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline())
+            data = f.read()
+        if header.get('format') != MAP_FORMAT or len(data) != header['extents'] * 16:
+            raise ValueError(f"{path}: not an allocation map")
+        extents = array('Q')
+        extents.frombytes(data)
+        if sys.byteorder != 'little':
+            extents.byteswap()
+        return cls(header['size'], extents, header['block_size'], header['filesystem'], header['zeros_skipped'])
+
+    def __repr__(self):
+        return f"AllocationMap({self.filesystem!r}, {len(self)} extents, {self.free_bytes} of {self.size} bytes)"
+
+
+def _ext4_free(image, extents):
+    reader = Ext4Reader(image)
+    block_size = reader.block_size
+    for group in range(reader.group_count):
+        first = reader.first_data_block + group * reader.blocks_per_group
+        blocks = min(reader.blocks_per_group, reader.blocks_count - first)
+        for start, length in clear_runs(reader.block_bitmap(group), blocks):
+            _append(extents, (first + start) * block_size, (first + start + length) * block_size)
+    return block_size, reader.blocks_count * block_size
+
+
+def _fat_free(image, extents):
+    reader = FatReader(image)
+    bitmap = reader.allocation_bitmap()
+    if bitmap is not None:
+        runs = clear_runs(bitmap, reader.cluster_count)
+    else:
+        runs = free_entries(reader.fat, 2, reader.cluster_count)
+    for start, length in runs:
+        offset = reader.heap_offset + start * reader.cluster_size
+        _append(extents, offset, offset + length * reader.cluster_size)
+    return reader.cluster_size, reader.heap_offset + reader.cluster_count * reader.cluster_size
+
+
+def _ntfs_free(image, extents):
+    reader = NtfsReader(image)
+    bitmap = reader.cluster_bitmap()
+    count = min(reader.cluster_count or len(bitmap) * 8, len(bitmap) * 8)
+    for start, length in clear_runs(bitmap, count):
+        _append(extents, start * reader.cluster_size, (start + length) * reader.cluster_size)
+    return reader.cluster_size, count * reader.cluster_size
+
+
+_BUILDERS = {
+    'EXT4': _ext4_free,
+    'EXT2/3': _ext4_free,
+    'FAT32': _fat_free,
+    'exFAT': _fat_free,
+    'NTFS': _ntfs_free,
+}
+
+
+def build_allocation_map(image, filesystem):
+    """AllocationMap of the space on an open DiskImage that filesystem's records show as free
+
+    filesystem is a name as Scanner.verify_filesystem() returns it. Raises
+    AllocationError for other filesystems or unreadable records.
+    """
+    builder = _BUILDERS.get(filesystem)
+    if builder is None:
+        raise AllocationError(f"{image.path}: no allocation records for filesystem {filesystem}")
+    extents = array('Q')
+    try:
+        block_size, filesystem_end = builder(image, extents)
+    except (Ext4Error, FatError, NtfsError) as e:
+        raise AllocationError(str(e))
+    # Slack between the end of the filesystem and the end of the image is nobody's
+    _append(extents, filesystem_end, image.size)
+    while extents and extents[-1] > image.size:
+        if extents[-2] >= image.size:
+            del extents[-2:]
+        else:
+            extents[-1] = image.size
+    return AllocationMap(image.size, extents, block_size, filesystem)
+
+
+def _cache_key(image, free):
+    digest = hashlib.sha256()
+    try:
+        mtime = os.stat(image.path).st_mtime_ns
+        path = os.path.realpath(image.path)
+    except (OSError, TypeError, ValueError):
+        mtime = 0
+        path = repr(image.path)
+    digest.update(json.dumps([path, image.size, mtime, free.filesystem, free.block_size]).encode())
+    digest.update(image.read_at(0, HEADER_BYTES))
+    digest.update(free.extents.tobytes())
+    return digest.hexdigest()
+
+
+def allocation_map(image, filesystem, skip_zeros=True, cache_dir=None, cancel_token=None, on_progress=None):
+    """Map of the unallocated and, with skip_zeros, nonzero space on an open DiskImage
+
+    Unknown filesystems and ones whose records cannot be read are taken
+    as wholly free. The zero check reads every free byte, so with a
+    cache_dir its result is kept per image, keyed by the image's path,
+    size and mtime, its first HEADER_BYTES and the free space itself, and
+    reused for as long as none of those change.
+    """
+    try:
+        free = build_allocation_map(image, filesystem)
+    except AllocationError:
+        free = AllocationMap.whole(image.size)
+    if not skip_zeros:
+        return free
+
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, _cache_key(image, free) + '.map')
+        try:
+            return AllocationMap.load(path)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    nonzero = free.without_zeros(image, cancel_token=cancel_token, on_progress=on_progress)
+    if path is not None and nonzero.zeros_skipped:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            nonzero.save(path)
+        except OSError:
+            # A read-only cache must not fail the carve
+            pass
+    return nonzero
@@ -0,0 +1,265 @@
+import os
+import struct
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .file_types import OTHER, category_for
+from .image import DiskImage
+
+
+# Magic numbers at offset 0, by length. Values are a category, or the name
+# of a container that needs a closer look at the head.
+MAGIC = {
+    b'\xff\xd8\xff': 'images',
+    b'\x89PNG': 'images',
+    b'GIF8': 'images',
+    b'II*\x00': 'images',
+    b'MM\x00*': 'images',
+    b'BM': 'bmp',
+    b'%PDF': 'documents',
+    b'{\\rt': 'documents',
+    b'\xd0\xcf\x11\xe0': 'ole',
+    b'PK\x03\x04': 'zip',
+    b'RIFF': 'riff',
+    b'\x1aE\xdf\xa3': 'videos',  # Matroska / WebM
+    b'0&\xb2u': 'asf',
+    b'FLV\x01': 'videos',
+    b'\x00\x00\x01\xba': 'videos',  # MPEG program stream
+    b'\x00\x00\x01\xb3': 'videos',
+    b'ID3': 'audio',
+    b'\xff\xfb': 'audio',
+    b'\xff\xf3': 'audio',
+    b'\xff\xf2': 'audio',
+    b'OggS': 'ogg',
+    b'fLaC': 'audio',
+    b'From': 'email',
+    b'Retu': 'email',
+    b'Rece': 'email',
+    b'Deli': 'email',
+    b'Mess': 'email',
+    b'MIME': 'email',
+    b'X-Ma': 'email',
+    b'\x7fELF': OTHER,
+    b'MZ': OTHER,
+    b'7z\xbc\xaf': OTHER,
+    b'Rar!': OTHER,
+    b'\x1f\x8b': OTHER,
+    b'SQLi': OTHER,
+}
+
+FTYP_BRANDS = {
+    b'M4A ': 'audio',
+    b'M4B ': 'audio',
+    b'heic': 'images',
+    b'heix': 'images',
+    b'mif1': 'images',
+    b'avif': 'images',
+}
+
+RIFF_TYPES = {
+    b'WAVE': 'audio',
+    b'AVI ': 'videos',
+    b'WEBP': 'images',
+}
+
+EMAIL_HEADERS = (b'From:', b'Return-Path:', b'Received:', b'Delivered-To:',
+                 b'Message-ID:', b'MIME-Version:', b'X-Mailer:')
+
+# Zip-based office formats name their first entry one of these
+OFFICE_ENTRIES = (b'[Content_Types].xml', b'mimetype', b'_rels/', b'docProps/', b'word/', b'xl/', b'ppt/',
+                  b'META-INF/')
+
+_FTYP = struct.unpack('<I', b'ftyp')[0]
+
+
+def _build_tables():
+    """MAGIC split into {prefix_as_int: value} per prefix length"""
+    tables = {}
+    for magic, value in MAGIC.items():
+        tables.setdefault(len(magic), {})[int.from_bytes(magic, 'little')] = value
+    return [(length, (1 << (8 * length)) - 1, tables[length]) for length in sorted(tables, reverse=True)]
+
+
+_TABLES = _build_tables()
+
+
+class Classifier:
+    """Sorts files into categories from their first bytes, a batch at a time
+
+    The heads of a batch of files are read into one buffer at a fixed
+    stride. The first and second 32-bit words of every head are pulled out
+    with strided memoryview casts and matched against the magic table as
+    integers, so most files are classified by a few dictionary lookups;
+    only containers and short magics (zip, RIFF, ISO media, OLE, BMP, mail
+    headers) look further into their head. Files with no recognised
+    signature keep the category their extension suggests.
+    """
+
+    def __init__(self, head_size=4096, batch_size=1024, workers=None):
+        self.head_size = max(64, head_size - head_size % 4)
+        self.batch_size = batch_size
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self._images = {}
+        self._images_lock = threading.Lock()
+
+    def classify_batch(self, buffer, lengths, names):
+        """Category for each head in buffer, head i at i * head_size holding lengths[i] bytes"""
+        count = len(lengths)
+        stride = self.head_size
+        view = memoryview(buffer)
+        if sys.byteorder == 'little':
+            words = view.cast('I')
+            firsts = words[0::stride // 4].tolist()[:count]
+            seconds = words[1::stride // 4].tolist()[:count]
+            words.release()
+        else:
+            firsts = [int.from_bytes(view[i * stride:i * stride + 4], 'little') for i in range(count)]
+            seconds = [int.from_bytes(view[i * stride + 4:i * stride + 8], 'little') for i in range(count)]
+
+        categories = []
+        for i in range(count):
+            length = lengths[i]
+            value = None
+            if length >= 12 and seconds[i] == _FTYP:
+                value = 'ftyp'
+            elif length >= 2:
+                first = firsts[i]
+                for size, mask, table in _TABLES:
+                    if size <= length:
+                        value = table.get(first & mask)
+                        if value is not None:
+                            break
+
+            if value is None:
+                categories.append(self._fallback(view, i, names[i]))
+            elif value in CONTAINERS:
+                head = view[i * stride:i * stride + length]
+                categories.append(CONTAINERS[value](head, names[i]) or self._fallback(view, i, names[i]))
+            else:
+                categories.append(value)
+        view.release()
+        return categories
+
+    def _fallback(self, view, index, name):
+        category = category_for(name)
+        if category != OTHER or os.path.splitext(name)[1]:
+            return category
+        # No extension at all: plain text is most likely a document
+        head = view[index * self.head_size:(index + 1) * self.head_size].tobytes().rstrip(b'\x00')
+        if head and b'\x00' not in head:
+            try:
+                head.decode('utf-8')
+                return 'documents'
+            except UnicodeDecodeError:
+                pass
+        return OTHER
+
+    def classify(self, results):
+        """Category for each of a list of ScanResults, reading heads on a thread pool"""
+        categories = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for start in range(0, len(results), self.batch_size):
+                    batch = results[start:start + self.batch_size]
+                    buffer = bytearray(len(batch) * self.head_size)
+                    lengths = list(pool.map(self._read_head, batch, [buffer] * len(batch),
+                                            range(len(batch))))
+                    categories.extend(self.classify_batch(buffer, lengths, [result.path for result in batch]))
+        finally:
+            for image in self._images.values():
+                image.close()
+            self._images.clear()
+        return categories
+
+    def _read_head(self, result, buffer, index):
+        """Read up to head_size bytes of a result into its slot; returns the count read"""
+        start = index * self.head_size
+        slot = memoryview(buffer)[start:start + self.head_size]
+        try:
+            if result.image is None:
+                with open(result.path, 'rb', buffering=0) as f:
+                    return f.readinto(slot) or 0
+            if not result.extents:
+                return 0
+            offset, length, file_offset = min(result.extents, key=lambda extent: extent[2])
+            if file_offset:
+                # The head of the file is a hole
+                return 0
+            image = self._image(result.image)
+            data = image.view(offset, min(length, self.head_size))
+            slot[:len(data)] = data
+            count = len(data)
+            data.release()
+            return count
+        except OSError:
+            return 0
+        finally:
+            slot.release()
+
+    def _image(self, path):
+        with self._images_lock:
+            image = self._images.get(path)
+            if image is None:
+                image = self._images[path] = DiskImage(path)
+            return image
+
+
+def _zip(head, name):
+    # Local file header: name length at 26, name from 30
+    if len(head) < 30:
+        return None
+    name_length = struct.unpack_from('<H', head, 26)[0]
+    entry = bytes(head[30:30 + name_length])
+    if entry.startswith(OFFICE_ENTRIES):
+        return 'documents'
+    # Any other zip: leave it to the extension (.jar, .apk, .cbz, ...)
+    return None
+
+
+def _riff(head, name):
+    return RIFF_TYPES.get(bytes(head[8:12]))
+
+
+def _ftyp(head, name):
+    return FTYP_BRANDS.get(bytes(head[8:12]), 'videos')
+
+
+def _ole(head, name):
+    # Outlook messages and Office 97 documents share the compound file format
+    return 'emails' if name.lower().endswith('.msg') else 'documents'
+
+
+def _asf(head, name):
+    return 'audio' if name.lower().endswith('.wma') else 'videos'
+
+
+def _ogg(head, name):
+    return 'videos' if name.lower().endswith(('.ogv', '.ogm')) else 'audio'
+
+
+def _email(head, name):
+    if bytes(head[:16]).startswith(EMAIL_HEADERS):
+        return 'emails'
+    # An mbox "From sender date" separator, not prose starting with "From"
+    line = bytes(head[:256]).split(b'\n', 1)[0]
+    if line.startswith(b'From ') and (b'@' in line or b'MAILER-DAEMON' in line):
+        return 'emails'
+    return None
+
+
+def _bmp(head, name):
+    # Two reserved zero words follow the file size
+    return 'images' if len(head) >= 26 and bytes(head[6:10]) == b'\0\0\0\0' else None
+
+
+CONTAINERS = {
+    'zip': _zip,
+    'riff': _riff,
+    'ftyp': _ftyp,
+    'ole': _ole,
+    'asf': _asf,
+    'ogg': _ogg,
+    'email': _email,
+    'bmp': _bmp,
+}
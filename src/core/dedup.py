@@ -0,0 +1,147 @@
+import errno
+import json
+import os
+import shutil
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+STORE_NAME = ".phoenix-store"
+
+LINK_MODES = ('auto', 'reflink', 'hardlink', 'copy')
+
+# _IOW(0x94, 9, int): share the source's extents copy-on-write (btrfs, XFS, bcachefs)
+FICLONE = 0x40049409
+
+# errno values meaning "this filesystem cannot do that", as opposed to a real failure
+_UNSUPPORTED = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.EPERM,
+                getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP)}
+
+
+class StoreError(Exception):
+    """Raised when an output file cannot be linked to the content store"""
+
+
+def reflink(source, target):
+    """Create target as a copy-on-write clone of source; OSError if the filesystem cannot"""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform")
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(target)
+            raise
+
+
+def link_file(source, target, mode='auto'):
+    """Make target show source's content without copying it if possible; returns the method used
+
+    'auto' tries a reflink, then a hard link, then a plain copy. A reflink
+    is an independent file sharing blocks copy-on-write; a hard link is the
+    same file, so editing one output changes every duplicate of it.
+    """
+    if mode not in LINK_MODES:
+        raise ValueError(f"Unsupported link mode: {mode}")
+    if mode in ('auto', 'reflink'):
+        try:
+            reflink(source, target)
+            return 'reflink'
+        except OSError as e:
+            if mode == 'reflink' or e.errno not in _UNSUPPORTED:
+                raise StoreError(f"{target}: cannot reflink ({e})")
+    if mode in ('auto', 'hardlink'):
+        try:
+            os.link(source, target)
+            return 'hardlink'
+        except OSError as e:
+            if mode == 'hardlink' or e.errno not in _UNSUPPORTED | {errno.EMLINK}:
+                raise StoreError(f"{target}: cannot hard link ({e})")
+    shutil.copyfile(source, target)
+    shutil.copystat(source, target)
+    return 'copy'
+
+
+class ContentStore:
+    """Content-addressed store that keeps each distinct restored file once
+
+    Objects live at objects/<first two hex digits>/<digest> under root.
+    An append-only index.jsonl maps each object's (size, partial hash) to
+    its digest, so a file whose size and partial hash match nothing stored
+    is known to be new without a full hash, and one that does match only
+    needs a full hash to be linked instead of copied. Entries for objects
+    deleted by hand are ignored.
+    """
+
+    def __init__(self, root, algorithm):
+        self.root = root
+        self.algorithm = algorithm
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._index = {}
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+        self._index_path = os.path.join(root, 'index.jsonl')
+        self._load()
+        self._file = open(self._index_path, 'a', encoding='utf-8')
+
+    def _load(self):
+        try:
+            with open(self._index_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get('algorithm') == self.algorithm:
+                        self._index.setdefault((entry['size'], entry['partial']), set()).add(entry['digest'])
+        except FileNotFoundError:
+            pass
+
+    def path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def temp_path(self):
+        """Fresh name in the store's own directory, so a finished object is moved in by rename"""
+        return os.path.join(self.root, 'tmp', uuid.uuid4().hex)
+
+    def lock(self, size, partial):
+        """Lock serialising writers of one (size, partial hash), so equal files are stored once"""
+        with self._lock:
+            lock = self._key_locks.get((size, partial))
+            if lock is None:
+                lock = self._key_locks[(size, partial)] = threading.Lock()
+            return lock
+
+    def candidates(self, size, partial):
+        """Digests stored under a (size, partial hash); empty means the content is new"""
+        with self._lock:
+            return set(self._index.get((size, partial), ()))
+
+    def has(self, digest):
+        return os.path.isfile(self.path(digest))
+
+    def add(self, temp, size, partial, digest):
+        """Move a finished, verified temp file in as the object for digest"""
+        target = self.path(digest)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(temp, target)
+        with self._lock:
+            self._index.setdefault((size, partial), set()).add(digest)
+            self._file.write(json.dumps({'size': size, 'partial': partial, 'digest': digest,
+                                         'algorithm': self.algorithm}) + "\n")
+            self._file.flush()
+        return target
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                os.fsync(self._file.fileno())
+                self._file.close()
+        shutil.rmtree(os.path.join(self.root, 'tmp'), ignore_errors=True)
@@ -0,0 +1,344 @@
+import base64
+import binascii
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .image import DiskImage
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+    Cipher = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+MB = 1024 * 1024
+
+ENCRYPTION_FORMATS = ('LUKS', 'VeraCrypt', 'XTS')
+
+LUKS_MAGIC = b'LUKS\xba\xbe'
+
+# VeraCrypt (and TrueCrypt) keep a 128 KB header area before the data and
+# a backup header area of the same size after it
+VERACRYPT_HEADER_SIZE = 128 * 1024
+
+_KEY_SEPARATORS = re.compile(rb'[\s:]')
+_HEX = re.compile(rb'[0-9a-fA-F]+')
+
+class EncryptionError(Exception):
+    """Raised when an encrypted volume cannot be opened with the given key"""
+
+
+def read_key(keyfile):
+    """Volume key from a file: raw key bytes, or hex as printed by cryptsetup"""
+    with open(keyfile, 'rb') as f:
+        data = f.read()
+    return parse_key(data)
+
+
+def parse_key(key):
+    """Key bytes from raw bytes, or from hex with optional spaces or colons"""
+    if isinstance(key, str):
+        key = key.encode('ascii', 'replace')
+    digits = _KEY_SEPARATORS.sub(b'', bytes(key))
+    if len(digits) >= 32 and len(digits) % 2 == 0 and _HEX.fullmatch(digits):
+        return binascii.unhexlify(digits)
+    return bytes(key)
+
+
+class EncryptedVolume(DiskImage):
+    """Read-only plaintext view of an AES-XTS encrypted volume
+
+    Behaves like a DiskImage, so the ext4, NTFS and FAT readers, hashing
+    and the carver read the decrypted volume directly. Sectors are
+    decrypted a batch of batch_size bytes at a time: with NumPy, the XTS
+    tweaks of a whole batch are derived with one AES call and vectorised
+    doubling, and the batch is decrypted with one more, instead of one
+    cipher context per sector. Reads spanning several batches decrypt
+    them on a thread pool, and the most recently used batches are cached,
+    since readers return to the same metadata many times.
+
+    sector_size is the encryption data unit; the tweak of the n-th sector
+    is tweak_base + n * tweak_step, which covers LUKS (sectors counted in
+    512-byte units from the data segment) and VeraCrypt (counted from the
+    start of the container).
+    """
+
+    def __init__(self, source, key, sector_size=512, data_offset=0, size=None, tweak_base=0,
+                 tweak_step=1, batch_size=1 * MB, cache_batches=32, workers=None):
+        if Cipher is None:
+            raise EncryptionError("Decrypting volumes needs the 'cryptography' package")
+        if len(key) not in (32, 64):
+            raise EncryptionError(f"AES-XTS needs a 32 or 64 byte key, not {len(key)} bytes")
+        if sector_size < 16 or sector_size % 16:
+            raise EncryptionError(f"Invalid encryption sector size: {sector_size}")
+
+        if isinstance(source, DiskImage):
+            self._source = source
+            self._owned = None
+        else:
+            self._source = self._owned = DiskImage(source)
+        if size is None:
+            size = self._source.size - data_offset
+        self.size = max(0, min(size, self._source.size - data_offset))
+        self.size -= self.size % sector_size
+
+        self.path = f"xts:{self._source.path}"
+        self.key = bytes(key)
+        self.sector_size = sector_size
+        self.data_offset = data_offset
+        self.tweak_base = tweak_base
+        self.tweak_step = tweak_step
+        self.batch_size = max(sector_size, batch_size - batch_size % sector_size)
+        self._cache_batches = cache_batches
+        self._batches = OrderedDict()
+        self._pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+
+        self.window_size = self.batch_size
+        self.max_windows = 0
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+        self.mapped = False
+        self.decrypted_batches = 0
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        with self._lock:
+            self._batches.clear()
+        if self._owned is not None:
+            self._owned.close()
+            self._owned = None
+
+    def _readahead(self, offset, length):
+        self._source._readahead(self.data_offset + offset, length)
+
+    def _pread(self, offset, length):
+        length = max(0, min(length, self.size - offset))
+        if not length:
+            return b''
+        first = offset // self.batch_size
+        last = (offset + length - 1) // self.batch_size
+        # Long sequential reads (carving, hashing) would flush the cache of
+        # metadata batches, so only short reads go through it
+        cached = last - first < max(1, self._cache_batches // 4)
+        batches = self._batches_for(range(first, last + 1), cached)
+        start = offset - first * self.batch_size
+        if len(batches) == 1:
+            return batches[0][start:start + length]
+        return b''.join(batches)[start:start + length]
+
+    def _batches_for(self, numbers, cached):
+        found = {}
+        if cached:
+            with self._lock:
+                for number in numbers:
+                    batch = self._batches.get(number)
+                    if batch is not None:
+                        self._batches.move_to_end(number)
+                        found[number] = batch
+        missing = [number for number in numbers if number not in found]
+        if len(missing) == 1:
+            found[missing[0]] = self._decrypt_batch(missing[0])
+        elif missing:
+            found.update(zip(missing, self._pool.map(self._decrypt_batch, missing)))
+        if cached and missing:
+            with self._lock:
+                for number in missing:
+                    self._batches[number] = found[number]
+                while len(self._batches) > self._cache_batches:
+                    self._batches.popitem(last=False)
+        return [found[number] for number in numbers]
+
+    def _decrypt_batch(self, number):
+        start = number * self.batch_size
+        length = min(self.batch_size, self.size - start)
+        view = self._source.view(self.data_offset + start, length)
+        try:
+            data = decrypt_sectors(self.key, view, self.sector_size,
+                                   self.tweak_base + start // self.sector_size * self.tweak_step,
+                                   self.tweak_step)
+        finally:
+            view.release()
+        with self._lock:
+            self.decrypted_batches += 1
+        return data
+
+
+def decrypt_sectors(key, data, sector_size, first_tweak, tweak_step=1):
+    """AES-XTS decryption of consecutive sectors, the first one with tweak first_tweak"""
+    count = len(data) // sector_size
+    if numpy is None or count < 2:
+        return _decrypt_each(key, data, sector_size, count, first_tweak, tweak_step)
+
+    half = len(key) // 2
+    blocks = sector_size // 16
+    tweaks = numpy.zeros((count, 2), dtype='<u8')
+    tweaks[:, 0] = first_tweak + numpy.arange(count, dtype='<u8') * tweak_step
+    encrypted = _ecb(key[half:]).encryptor().update(tweaks.tobytes())
+
+    # Tweak of block j in a sector is E(sector tweak) * x^j in GF(2^128);
+    # blocks are filled in doubling slabs, each the previous one times x^k
+    masks = numpy.empty((count, blocks, 2), dtype='<u8')
+    masks[:, 0] = numpy.frombuffer(encrypted, dtype='<u8').reshape(count, 2)
+    filled = 1
+    while filled < blocks:
+        shift = min(filled, 32, blocks - filled)
+        masks[:, filled:filled + shift] = _times_x(masks[:, filled - shift:filled], shift)
+        filled += shift
+
+    masks = masks.reshape(-1)
+    # XEX: mask, decrypt every block of the batch with one ECB call, mask again
+    buffer = numpy.frombuffer(data, dtype='<u8', count=count * sector_size // 8) ^ masks
+    plaintext = _ecb(key[:half]).decryptor().update(memoryview(buffer).cast('B'))
+    numpy.bitwise_xor(numpy.frombuffer(plaintext, dtype='<u8'), masks, out=buffer)
+    return buffer.tobytes()
+
+
+def _times_x(tweaks, shift):
+    """Tweaks (..., 2 little-endian words) multiplied by x^shift in GF(2^128), shift <= 32"""
+    low, high = tweaks[..., 0], tweaks[..., 1]
+    left, right = numpy.uint64(shift), numpy.uint64(64 - shift)
+    overflow = high >> right
+    result = numpy.empty_like(tweaks)
+    result[..., 1] = (high << left) | (low >> right)
+    # The bits shifted out fold back in as overflow * (x^7 + x^2 + x + 1)
+    result[..., 0] = (low << left) ^ overflow ^ (overflow << numpy.uint64(1)) \
+        ^ (overflow << numpy.uint64(2)) ^ (overflow << numpy.uint64(7))
+    return result
+
+
+def _decrypt_each(key, data, sector_size, count, first_tweak, tweak_step):
+    """One XTS context per sector, without NumPy"""
+    pieces = []
+    view = memoryview(data)
+    for index in range(count):
+        tweak = (first_tweak + index * tweak_step).to_bytes(16, 'little')
+        decryptor = Cipher(algorithms.AES(key), modes.XTS(tweak), default_backend()).decryptor()
+        pieces.append(decryptor.update(view[index * sector_size:(index + 1) * sector_size]))
+    return b''.join(pieces)
+
+
+def _ecb(key):
+    return Cipher(algorithms.AES(key), modes.ECB(), default_backend())
+
+
+def luks_header(image):
+    """Geometry of a LUKS1 or LUKS2 volume's data segment, read from its header"""
+    header = image.read_at(0, 4096)
+    if header[:6] != LUKS_MAGIC:
+        raise EncryptionError("Not a LUKS volume")
+    version = struct.unpack_from('>H', header, 6)[0]
+
+    if version == 1:
+        cipher = header[8:40].rstrip(b'\0').decode('ascii', 'replace')
+        mode = header[40:72].rstrip(b'\0').decode('ascii', 'replace')
+        hash_name = header[72:104].rstrip(b'\0').decode('ascii', 'replace')
+        payload, key_bytes = struct.unpack_from('>II', header, 104)
+        iterations = struct.unpack_from('>I', header, 164)[0]
+        return {
+            'version': 1,
+            'encryption': f"{cipher}-{mode}",
+            'key_bytes': key_bytes,
+            'data_offset': payload * 512,
+            'size': None,
+            'sector_size': 512,
+            'iv_tweak': 0,
+            'digests': [(hash_name, header[132:164], iterations, header[112:132])]
+        }
+
+    if version != 2:
+        raise EncryptionError(f"Unsupported LUKS version: {version}")
+    header_size = struct.unpack_from('>Q', header, 8)[0]
+    area = image.read_at(4096, header_size - 4096).rstrip(b'\0')
+    try:
+        metadata = json.loads(area.decode('utf-8'))
+        segment = metadata['segments'][min(metadata['segments'], key=int)]
+        key_bytes = next(iter(metadata['keyslots'].values()))['key_size']
+        digests = [(digest['hash'], base64.b64decode(digest['salt']), digest['iterations'],
+                    base64.b64decode(digest['digest']))
+                   for digest in metadata.get('digests', {}).values() if digest.get('type') == 'pbkdf2']
+        return {
+            'version': 2,
+            'encryption': segment['encryption'],
+            'key_bytes': key_bytes,
+            'data_offset': int(segment['offset']),
+            'size': None if segment['size'] == 'dynamic' else int(segment['size']),
+            'sector_size': segment.get('sector_size', 512),
+            'iv_tweak': int(segment.get('iv_tweak', 0)),
+            'digests': digests
+        }
+    except (ValueError, KeyError, TypeError, StopIteration) as e:
+        raise EncryptionError(f"Unreadable LUKS2 metadata: {e}")
+
+
+def open_encrypted(source, encryption_type, key=None, keyfile=None, **options):
+    """EncryptedVolume for a LUKS, VeraCrypt or raw AES-XTS container, given its volume key
+
+    The key is the volume (master) key itself, as bytes, hex, or a keyfile
+    holding either: what `cryptsetup luksDump --dump-volume-key` prints,
+    for instance. Unlocking a key slot from a passphrase is not done here.
+    LUKS keys are checked against the header's digest before any data is
+    read; options override the geometry found for the format.
+    """
+    if key is None and keyfile is None:
+        raise EncryptionError("A volume key or keyfile is needed")
+    key = read_key(keyfile) if key is None else parse_key(key)
+
+    owned = None
+    if not isinstance(source, DiskImage):
+        source = owned = DiskImage(source)
+    try:
+        if encryption_type == 'LUKS':
+            geometry = luks_header(source)
+            if geometry['encryption'] != 'aes-xts-plain64':
+                raise EncryptionError(f"Unsupported LUKS cipher: {geometry['encryption']}")
+            if len(key) != geometry['key_bytes']:
+                raise EncryptionError(f"The volume key must be {geometry['key_bytes']} bytes, "
+                                      f"not {len(key)}")
+            if geometry['digests'] and not any(_digest_matches(key, *digest) for digest in geometry['digests']):
+                raise EncryptionError("The key does not unlock this volume")
+            # plain64 counts 512-byte sectors whatever the encryption sector size
+            settings = {
+                'sector_size': geometry['sector_size'],
+                'data_offset': geometry['data_offset'],
+                'size': geometry['size'],
+                'tweak_base': geometry['iv_tweak'],
+                'tweak_step': geometry['sector_size'] // 512
+            }
+        elif encryption_type == 'VeraCrypt':
+            settings = {
+                'data_offset': VERACRYPT_HEADER_SIZE,
+                'size': source.size - 2 * VERACRYPT_HEADER_SIZE,
+                'tweak_base': VERACRYPT_HEADER_SIZE // 512
+            }
+        elif encryption_type == 'XTS':
+            settings = {}
+        else:
+            raise EncryptionError(f"Unsupported encryption type: {encryption_type}")
+        settings.update(options)
+        volume = EncryptedVolume(source, key, **settings)
+    except Exception:
+        if owned is not None:
+            owned.close()
+        raise
+    volume._owned = owned
+    return volume
+
+
+def _digest_matches(key, hash_name, salt, iterations, expected):
+    try:
+        return hashlib.pbkdf2_hmac(hash_name, key, salt, iterations, len(expected)) == expected
+    except ValueError:
+        # A hash hashlib does not know; the key cannot be checked
+        return True
@@ -0,0 +1,325 @@
+import struct
+import sys
+
+from .image import DiskImage
+
+
+SUPERBLOCK_OFFSET = 1024
+EXT4_MAGIC = 0xEF53
+EXTENT_MAGIC = 0xF30A
+
+COMPAT_SPARSE_SUPER2 = 0x0200
+INCOMPAT_META_BG = 0x0010
+INCOMPAT_EXTENTS = 0x0040
+INCOMPAT_64BIT = 0x0080
+
+BG_INODE_UNINIT = 0x0001
+BG_BLOCK_UNINIT = 0x0002
+RO_COMPAT_SPARSE_SUPER = 0x0001
+RO_COMPAT_GDT_CSUM = 0x0010
+RO_COMPAT_METADATA_CSUM = 0x0400
+
+INODE_EXTENTS_FL = 0x80000
+INODE_INLINE_DATA_FL = 0x10000000
+
+S_IFMT = 0xF000
+S_IFREG = 0x8000
+
+# Uninitialized extents store their length biased by this value
+EXT_INIT_MAX_LEN = 32768
+
+
+class Ext4Error(Exception):
+    """Raised when an image does not hold a readable ext4 filesystem"""
+
+
+class DeletedInode:
+    """An unlinked ext4 inode whose extent tree still describes its data"""
+
+    __slots__ = ('inode', 'mode', 'size', 'mtime', 'dtime', 'extents', 'intact')
+
+    def __init__(self, inode, mode, size, mtime, dtime, extents, intact):
+        self.inode = inode
+        self.mode = mode
+        self.size = size
+        self.mtime = mtime
+        self.dtime = dtime
+        self.extents = extents  # [(logical_block, physical_block, block_count), ...]
+        self.intact = intact  # True when none of its blocks have been reused
+
+    @property
+    def is_regular(self):
+        return self.mode & S_IFMT == S_IFREG
+
+    def to_dict(self):
+        return {
+            'inode': self.inode,
+            'mode': self.mode,
+            'size': self.size,
+            'mtime': self.mtime,
+            'dtime': self.dtime,
+            'extents': self.extents,
+            'intact': self.intact
+        }
+
+    def __repr__(self):
+        return f"DeletedInode({self.inode}, size={self.size}, extents={len(self.extents)})"
+
+
+class Ext4Reader:
+    """Pure-Python reader for deleted inodes on an ext4 image or device
+
+    Each block group's inode table is taken as a single mapped slice and
+    the link count, mode and dtime columns are pulled out of it with
+    strided memoryview casts, so inodes are filtered a table at a time
+    instead of being parsed one by one. Only the few unlinked inodes left
+    over get their extent trees decoded.
+    """
+
+    def __init__(self, source):
+        if isinstance(source, DiskImage):
+            self.image = source
+            self._owns_image = False
+        else:
+            self.image = DiskImage(source)
+            self._owns_image = True
+        self._parse_superblock()
+        self._parse_group_descriptors()
+        self._bitmap_cache = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._owns_image:
+            self.image.close()
+
+    def _parse_superblock(self):
+        sb = self.image.read_at(SUPERBLOCK_OFFSET, 1024)
+        if len(sb) < 1024 or struct.unpack_from('<H', sb, 0x38)[0] != EXT4_MAGIC:
+            raise Ext4Error(f"{self.image.path}: no ext2/3/4 superblock found")
+
+        (self.inodes_count, blocks_lo, _, _, _, self.first_data_block,
+         log_block_size, _, self.blocks_per_group, _, self.inodes_per_group) = \
+            struct.unpack_from('<11I', sb, 0)
+        self.block_size = 1024 << log_block_size
+        self.first_inode, self.inode_size = struct.unpack_from('<IH', sb, 0x54)
+        self.feature_compat, self.feature_incompat, self.feature_ro_compat = struct.unpack_from('<III', sb, 0x5C)
+        self.reserved_gdt_blocks = struct.unpack_from('<H', sb, 0xCE)[0]
+        self.backup_groups = None
+        if self.feature_compat & COMPAT_SPARSE_SUPER2:
+            self.backup_groups = set(struct.unpack_from('<II', sb, 0x24C))
+        blocks_hi = struct.unpack_from('<I', sb, 0x150)[0]
+        desc_size = struct.unpack_from('<H', sb, 0xFE)[0]
+
+        if self.feature_incompat & INCOMPAT_META_BG:
+            raise Ext4Error(f"{self.image.path}: meta_bg group descriptor layout is not supported")
+
+        is_64bit = self.feature_incompat & INCOMPAT_64BIT
+        self.blocks_count = blocks_lo | ((blocks_hi << 32) if is_64bit else 0)
+        self.desc_size = desc_size if is_64bit and desc_size >= 64 else 32
+        self.group_count = -(-(self.blocks_count - self.first_data_block) // self.blocks_per_group)
+        self.has_extents = bool(self.feature_incompat & INCOMPAT_EXTENTS)
+        self.has_itable_unused = bool(self.feature_ro_compat & (RO_COMPAT_GDT_CSUM | RO_COMPAT_METADATA_CSUM))
+        self.gdt_blocks = -(-self.group_count * self.desc_size // self.block_size)
+        self.inode_table_blocks = -(-self.inodes_per_group * self.inode_size // self.block_size)
+
+    def _parse_group_descriptors(self):
+        table_offset = (self.first_data_block + 1) * self.block_size
+        table = self.image.read_at(table_offset, self.group_count * self.desc_size)
+        if len(table) < self.group_count * self.desc_size:
+            raise Ext4Error(f"{self.image.path}: group descriptor table is truncated")
+
+        self.groups = []
+        wide = self.desc_size >= 64
+        for group in range(self.group_count):
+            base = group * self.desc_size
+            block_bitmap, inode_bitmap, inode_table = struct.unpack_from('<III', table, base)
+            flags = struct.unpack_from('<H', table, base + 0x12)[0]
+            itable_unused = struct.unpack_from('<H', table, base + 0x1C)[0]
+            if wide:
+                hi = struct.unpack_from('<III', table, base + 0x20)
+                block_bitmap |= hi[0] << 32
+                inode_bitmap |= hi[1] << 32
+                inode_table |= hi[2] << 32
+                itable_unused |= struct.unpack_from('<H', table, base + 0x32)[0] << 16
+            self.groups.append((block_bitmap, inode_bitmap, inode_table, flags, itable_unused))
+
+    def iter_deleted(self, cancel_token=None):
+        """Yield a DeletedInode for every unlinked inode with a readable extent tree"""
+        for group, (_, _, inode_table, flags, itable_unused) in enumerate(self.groups):
+            if cancel_token is not None and cancel_token.cancelled:
+                return
+            if self.has_itable_unused and flags & BG_INODE_UNINIT:
+                continue
+
+            used = self.inodes_per_group
+            if self.has_itable_unused:
+                used -= itable_unused
+            if used <= 0:
+                continue
+
+            table = self.image.view(inode_table * self.block_size, used * self.inode_size)
+            first_inode = group * self.inodes_per_group + 1
+            for index in self._unlinked_slots(table, used):
+                if first_inode + index < self.first_inode:
+                    # Reserved inodes (bad blocks, journal, ...) are never user files
+                    continue
+                deleted = self._decode_inode(table, index, first_inode + index)
+                if deleted is not None:
+                    yield deleted
+            table.release()
+
+    def _unlinked_slots(self, table, count):
+        """Indexes of inodes with a zero link count and a non-empty mode or dtime"""
+        size = self.inode_size
+        if sys.byteorder == 'little' and size % 4 == 0:
+            halves = table.cast('H')
+            words = table.cast('I')
+            modes = halves[0::size // 2].tolist()
+            links = halves[0x1A // 2::size // 2].tolist()
+            dtimes = words[0x14 // 4::size // 4].tolist()
+            halves.release()
+            words.release()
+            return [i for i in range(count) if not links[i] and (dtimes[i] or modes[i])]
+
+        slots = []
+        for i in range(count):
+            mode, = struct.unpack_from('<H', table, i * size)
+            dtime, = struct.unpack_from('<I', table, i * size + 0x14)
+            link_count, = struct.unpack_from('<H', table, i * size + 0x1A)
+            if not link_count and (dtime or mode):
+                slots.append(i)
+        return slots
+
+    def _decode_inode(self, table, index, number):
+        base = index * self.inode_size
+        mode, _, size_lo, _, _, mtime, dtime = struct.unpack_from('<HHIIIII', table, base)
+        flags, = struct.unpack_from('<I', table, base + 0x20)
+        size_hi, = struct.unpack_from('<I', table, base + 0x6C)
+        if not flags & INODE_EXTENTS_FL or flags & INODE_INLINE_DATA_FL:
+            return None
+
+        try:
+            extents = self._read_extents(bytes(table[base + 0x28:base + 0x28 + 60]), depth_limit=5)
+        except Ext4Error:
+            return None
+        if not extents:
+            return None
+
+        intact = not any(self._blocks_in_use(start, count) for _, start, count in extents)
+        return DeletedInode(number, mode, size_lo | (size_hi << 32), mtime, dtime, extents, intact)
+
+    def _read_extents(self, node, depth_limit):
+        magic, entries, max_entries, depth = struct.unpack_from('<HHHH', node, 0)
+        if magic != EXTENT_MAGIC or entries > max_entries or 12 + entries * 12 > len(node):
+            raise Ext4Error("bad extent header")
+
+        extents = []
+        for i in range(entries):
+            entry = 12 + i * 12
+            if depth == 0:
+                logical, length, start_hi, start_lo = struct.unpack_from('<IHHI', node, entry)
+                if length > EXT_INIT_MAX_LEN:
+                    length -= EXT_INIT_MAX_LEN
+                start = start_lo | (start_hi << 32)
+                if not length or start + length > self.blocks_count:
+                    raise Ext4Error("extent outside the filesystem")
+                extents.append((logical, start, length))
+            else:
+                if depth_limit <= 0:
+                    raise Ext4Error("extent tree too deep")
+                _, leaf_lo, leaf_hi = struct.unpack_from('<IIH', node, entry)
+                leaf = leaf_lo | (leaf_hi << 32)
+                if leaf >= self.blocks_count:
+                    raise Ext4Error("extent index outside the filesystem")
+                child = self.image.read_at(leaf * self.block_size, self.block_size)
+                extents.extend(self._read_extents(child, depth_limit - 1))
+        return extents
+
+    def _block_bitmap(self, group):
+        bitmap = self._bitmap_cache.get(group)
+        if bitmap is None:
+            block_bitmap = self.groups[group][0]
+            bitmap = self.image.read_at(block_bitmap * self.block_size, self.blocks_per_group // 8)
+            self._bitmap_cache[group] = bitmap
+        return bitmap
+
+    def has_superblock(self, group):
+        """True if the group starts with a copy of the superblock and group descriptors"""
+        if group == 0:
+            return True
+        if self.backup_groups is not None:
+            return group in self.backup_groups
+        if not self.feature_ro_compat & RO_COMPAT_SPARSE_SUPER or group == 1:
+            return True
+        for base in (3, 5, 7):
+            power = base
+            while power < group:
+                power *= base
+            if power == group:
+                return True
+        return False
+
+    def block_bitmap(self, group):
+        """A group's block bitmap, one bit per block, set while the block is in use
+
+        A group flagged BLOCK_UNINIT has no bitmap on disk; like e2fsck, take
+        only its superblock copy and its own bitmaps and inode table as used.
+        """
+        block_bitmap, inode_bitmap, inode_table, flags, _ = self.groups[group]
+        if not (self.has_itable_unused and flags & BG_BLOCK_UNINIT):
+            # Not cached: building an allocation map reads every group once
+            return self.image.read_at(block_bitmap * self.block_size, self.blocks_per_group // 8)
+
+        bitmap = bytearray(self.blocks_per_group // 8)
+        first = self.first_data_block + group * self.blocks_per_group
+        used = [(block_bitmap, 1), (inode_bitmap, 1), (inode_table, self.inode_table_blocks)]
+        if self.has_superblock(group):
+            used.append((first, 1 + self.gdt_blocks + self.reserved_gdt_blocks))
+        for start, count in used:
+            # Under flex_bg a group's bitmaps and inode table usually sit in another group
+            low = max(start, first) - first
+            high = min(start + count, first + self.blocks_per_group) - first
+            for bit in range(low, high):
+                bitmap[bit >> 3] |= 1 << (bit & 7)
+        return bytes(bitmap)
+
+    def _blocks_in_use(self, start, count):
+        """True if any block in the run is allocated to something else now"""
+        block = start
+        end = start + count
+        while block < end:
+            group, bit = divmod(block - self.first_data_block, self.blocks_per_group)
+            if group >= self.group_count:
+                return True
+            bitmap = self._block_bitmap(group)
+            stop = min(self.blocks_per_group, bit + end - block)
+            block += stop - bit
+
+            # Odd bits at either end one by one, whole bytes in bulk
+            while bit < stop and bit & 7:
+                if bitmap[bit >> 3] & (1 << (bit & 7)):
+                    return True
+                bit += 1
+            while stop > bit and stop & 7:
+                stop -= 1
+                if bitmap[stop >> 3] & (1 << (stop & 7)):
+                    return True
+            if bitmap.count(0, bit >> 3, stop >> 3) != (stop - bit) >> 3:
+                return True
+        return False
+
+    def byte_ranges(self, deleted):
+        """(image_offset, length, file_offset) runs holding the file's data"""
+        ranges = []
+        for logical, start, count in sorted(deleted.extents):
+            file_offset = logical * self.block_size
+            length = min(count * self.block_size, deleted.size - file_offset)
+            if length <= 0:
+                break
+            ranges.append((start * self.block_size, length, file_offset))
+        return ranges
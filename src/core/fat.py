@@ -0,0 +1,445 @@
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+
+from .image import DiskImage
+
+
+DELETED_MARK = 0xE5
+ATTR_DIRECTORY = 0x10
+ATTR_VOLUME_ID = 0x08
+ATTR_LONG_NAME = 0x0F
+
+FAT32_MASK = 0x0FFFFFFF
+FAT32_BAD = 0x0FFFFFF7
+EXFAT_BAD = 0xFFFFFFF7
+
+EXFAT_BITMAP = 0x81
+EXFAT_FILE = 0x85
+EXFAT_STREAM = 0xC0
+EXFAT_NAME = 0xC1
+EXFAT_IN_USE = 0x80
+EXFAT_NO_FAT_CHAIN = 0x02
+
+# Deleted directories are only followed this many levels down
+MAX_DELETED_DEPTH = 8
+
+# A FAT32 directory holds at most this many 32-byte entries
+MAX_DIRECTORY_ENTRIES = 65536
+
+
+class FatError(Exception):
+    """Raised when an image does not hold a readable FAT32 or exFAT volume"""
+
+
+class DeletedEntry:
+    """A deleted FAT32/exFAT directory entry and the clusters it probably used"""
+
+    __slots__ = ('path', 'size', 'mtime', 'first_cluster', 'runs', 'intact', 'contiguous')
+
+    def __init__(self, path, size, mtime, first_cluster, runs, intact, contiguous):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.first_cluster = first_cluster
+        self.runs = runs  # [(first_cluster, cluster_count), ...] in file order
+        self.intact = intact  # True when every cluster needed is still free
+        self.contiguous = contiguous  # False when allocated clusters had to be skipped
+
+    def to_dict(self):
+        return {
+            'path': self.path,
+            'size': self.size,
+            'mtime': self.mtime,
+            'first_cluster': self.first_cluster,
+            'runs': self.runs,
+            'intact': self.intact,
+            'contiguous': self.contiguous
+        }
+
+    def __repr__(self):
+        return f"DeletedEntry({self.path!r}, size={self.size}, runs={self.runs})"
+
+
+def _fat_timestamp(date, time_):
+    if not date:
+        return 0.0
+    try:
+        return datetime(1980 + (date >> 9), (date >> 5) & 0x0F, date & 0x1F,
+                        time_ >> 11, (time_ >> 5) & 0x3F, (time_ & 0x1F) * 2).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def _lfn_checksum(short_name):
+    total = 0
+    for byte in short_name:
+        total = (((total & 1) << 7) + (total >> 1) + byte) & 0xFF
+    return total
+
+
+def _directory_entries(data):
+    """(How many leading 32-byte slots of data look like FAT32 directory entries, whether the end marker follows)"""
+    for offset in range(0, len(data) - 31, 32):
+        marker = data[offset]
+        if marker == 0x00:
+            return offset // 32, True
+        attributes = data[offset + 11]
+        if attributes == ATTR_LONG_NAME:
+            continue
+        # Short names are padded with spaces; 0x05 stands for a leading 0xE5
+        name = data[offset + 1:offset + 11]
+        if attributes & 0xC0 or (marker < 0x20 and marker != 0x05) or min(name) < 0x20:
+            return offset // 32, False
+    return len(data) // 32, False
+
+
+class FatReader:
+    """Deleted-file recovery for FAT32 and exFAT volumes
+
+    The whole FAT is loaded once into a compact array('I'), so following
+    a cluster chain is one array lookup per cluster with no further disk
+    reads. Deleted FAT32 entries (0xE5) and exFAT entries with the in-use
+    bit cleared have lost their chains, so their clusters are rebuilt
+    from the first cluster forward: contiguous if those clusters are
+    still free, otherwise skipping whatever has been allocated since.
+    The free clusters are listed once as runs, so that skip is a bisect
+    rather than a walk over the volume. exFAT files flagged NoFatChain
+    were contiguous to begin with.
+    """
+
+    def __init__(self, source):
+        if isinstance(source, DiskImage):
+            self.image = source
+            self._owns_image = False
+        else:
+            self.image = DiskImage(source)
+            self._owns_image = True
+        self._parse_boot_sector()
+        self._load_fat()
+        self._bitmap = None
+        self._free = None
+        if self.variant == 'exFAT':
+            self._load_allocation_bitmap()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._owns_image:
+            self.image.close()
+
+    def _parse_boot_sector(self):
+        boot = self.image.read_at(0, 512)
+        if len(boot) < 512 or boot[510:512] != b'\x55\xaa':
+            raise FatError(f"{self.image.path}: no boot sector signature")
+
+        if boot[3:11] == b'EXFAT   ':
+            self.variant = 'exFAT'
+            fat_offset, fat_length, heap_offset, self.cluster_count, self.root_cluster = \
+                struct.unpack_from('<IIIII', boot, 80)
+            self.sector_size = 1 << boot[108]
+            self.cluster_size = self.sector_size << boot[109]
+            self.fat_offset = fat_offset * self.sector_size
+            self.fat_bytes = fat_length * self.sector_size
+            self.heap_offset = heap_offset * self.sector_size
+            return
+
+        sector_size, sectors_per_cluster, reserved, fat_count, root_entries, total16, _, fat_size16 = \
+            struct.unpack_from('<HBHBHHBH', boot, 11)
+        total32, fat_size32 = struct.unpack_from('<II', boot, 32)
+        if not sector_size or not sectors_per_cluster or root_entries or fat_size16 or not fat_size32:
+            raise FatError(f"{self.image.path}: not a FAT32 or exFAT volume")
+
+        self.variant = 'FAT32'
+        self.sector_size = sector_size
+        self.cluster_size = sector_size * sectors_per_cluster
+        self.fat_offset = reserved * sector_size
+        self.fat_bytes = fat_size32 * sector_size
+        self.heap_offset = (reserved + fat_count * fat_size32) * sector_size
+        total = total16 or total32
+        self.cluster_count = (total - reserved - fat_count * fat_size32) // sectors_per_cluster
+        self.root_cluster = struct.unpack_from('<I', boot, 44)[0]
+
+    def _load_fat(self):
+        entries = min(self.cluster_count + 2, self.fat_bytes // 4)
+        self.fat = array('I')
+        self.fat.frombytes(self.image.read_at(self.fat_offset, entries * 4))
+        if sys.byteorder != 'little':
+            self.fat.byteswap()
+
+    def _load_allocation_bitmap(self):
+        for entry in self._raw_entries(self.cluster_runs(self.root_cluster)):
+            if entry[0] == EXFAT_BITMAP:
+                first_cluster, length = struct.unpack_from('<IQ', entry, 20)
+                self._bitmap = self.image.read_at(self.cluster_offset(first_cluster), length)
+                return
+        raise FatError(f"{self.image.path}: exFAT allocation bitmap not found")
+
+    def allocation_bitmap(self):
+        """exFAT's allocation bitmap, one bit per cluster from cluster 2; None on FAT32, whose FAT is the record"""
+        return self._bitmap
+
+    def cluster_offset(self, cluster):
+        return self.heap_offset + (cluster - 2) * self.cluster_size
+
+    def _valid_cluster(self, cluster):
+        return 2 <= cluster < self.cluster_count + 2
+
+    def is_allocated(self, cluster):
+        if self._bitmap is not None:
+            bit = cluster - 2
+            return bool(self._bitmap[bit >> 3] & (1 << (bit & 7)))
+        return bool(self.fat[cluster] & FAT32_MASK)
+
+    def cluster_runs(self, first_cluster):
+        """Follow a live FAT chain; returns [(first_cluster, count), ...]"""
+        fat = self.fat
+        mask = FAT32_MASK if self.variant == 'FAT32' else 0xFFFFFFFF
+        bad = FAT32_BAD if self.variant == 'FAT32' else EXFAT_BAD
+        runs = []
+        cluster = first_cluster
+        steps = 0
+        while self._valid_cluster(cluster) and steps <= self.cluster_count:
+            if runs and runs[-1][0] + runs[-1][1] == cluster:
+                runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+            else:
+                runs.append((cluster, 1))
+            steps += 1
+            cluster = fat[cluster] & mask
+            if cluster >= bad:
+                break
+        return runs
+
+    def free_runs(self):
+        """(starts, counts) arrays of the free cluster runs, in cluster order"""
+        if self._free is None:
+            # Imported here: allocation builds its maps from this reader
+            from .allocation import clear_runs, free_entries
+            if self._bitmap is not None:
+                runs = clear_runs(self._bitmap, self.cluster_count)
+            else:
+                runs = free_entries(self.fat, 2, self.cluster_count)
+            starts = array('I')
+            counts = array('I')
+            for start, count in runs:
+                start += 2
+                if starts and starts[-1] + counts[-1] == start:
+                    # Split at a slice boundary; join it back up
+                    counts[-1] += count
+                else:
+                    starts.append(start)
+                    counts.append(count)
+            self._free = starts, counts
+        return self._free
+
+    def rebuild_runs(self, first_cluster, size):
+        """Likely clusters of a deleted file; returns (runs, intact, contiguous)"""
+        needed = -(-size // self.cluster_size)
+        if not needed or not self._valid_cluster(first_cluster):
+            return [], False, True
+        if self.is_allocated(first_cluster):
+            # Reused since deletion; the data is very likely overwritten
+            return [(first_cluster, min(needed, self.cluster_count + 2 - first_cluster))], False, True
+
+        # first_cluster is free, so it lies in the last run starting at or before it
+        starts, counts = self.free_runs()
+        index = bisect_right(starts, first_cluster) - 1
+        runs = []
+        start = first_cluster
+        while needed and index < len(starts):
+            count = min(needed, starts[index] + counts[index] - start)
+            runs.append((start, count))
+            needed -= count
+            index += 1
+            if index < len(starts):
+                start = starts[index]
+        return runs, not needed, len(runs) == 1
+
+    def _rebuild_directory(self, first_cluster):
+        """Likely clusters of a deleted FAT32 directory, whose entry records no size
+
+        Free clusters are followed from the first for as long as they hold
+        directory entries, up to the end-of-directory marker.
+        """
+        limit = -(-MAX_DIRECTORY_ENTRIES * 32 // self.cluster_size)
+        runs, _, _ = self.rebuild_runs(first_cluster, limit * self.cluster_size)
+        if not runs or self.is_allocated(first_cluster):
+            return []
+        kept = []
+        per_cluster = self.cluster_size // 32
+        for start, count in runs:
+            for cluster in range(start, start + count):
+                entries, ended = _directory_entries(self.image.read_at(self.cluster_offset(cluster),
+                                                                       self.cluster_size))
+                if entries:
+                    if kept and kept[-1][0] + kept[-1][1] == cluster:
+                        kept[-1] = (kept[-1][0], kept[-1][1] + 1)
+                    else:
+                        kept.append((cluster, 1))
+                if ended or entries < per_cluster:
+                    return kept
+        return kept
+
+    def byte_ranges(self, entry):
+        """(image_offset, length, file_offset) runs holding the file's data"""
+        ranges = []
+        file_offset = 0
+        for cluster, count in entry.runs:
+            length = min(count * self.cluster_size, entry.size - file_offset)
+            if length <= 0:
+                break
+            ranges.append((self.cluster_offset(cluster), length, file_offset))
+            file_offset += length
+        return ranges
+
+    def _raw_entries(self, runs):
+        for cluster, count in runs:
+            view = self.image.view(self.cluster_offset(cluster), count * self.cluster_size)
+            for offset in range(0, len(view) - 31, 32):
+                yield view[offset:offset + 32].tobytes()
+            view.release()
+
+    def iter_deleted(self, cancel_token=None):
+        """Yield a DeletedEntry for every deleted file reachable from the root"""
+        pending = [('', self.cluster_runs(self.root_cluster), 0)]
+        visited = set()
+        while pending:
+            if cancel_token is not None and cancel_token.cancelled:
+                return
+            path, runs, deleted_depth = pending.pop()
+            if not runs or runs[0][0] in visited:
+                continue
+            visited.add(runs[0][0])
+
+            if self.variant == 'exFAT':
+                entries = self._exfat_directory(runs)
+            else:
+                entries = self._fat32_directory(runs)
+
+            for name, is_dir, deleted, first_cluster, size, mtime, contiguous_chain in entries:
+                child = f"{path}/{name}"
+                # Everything inside a deleted directory is gone too, even
+                # if its own entry was never marked
+                deleted = deleted or deleted_depth > 0
+                if is_dir:
+                    if not deleted:
+                        if contiguous_chain:
+                            child_runs = [(first_cluster, -(-size // self.cluster_size))]
+                        else:
+                            child_runs = self.cluster_runs(first_cluster)
+                        pending.append((child, child_runs, deleted_depth))
+                    elif deleted_depth < MAX_DELETED_DEPTH:
+                        if self.variant == 'FAT32':
+                            # FAT32 directories are sized by their chain, which is gone
+                            child_runs = self._rebuild_directory(first_cluster)
+                            intact = bool(child_runs)
+                        else:
+                            child_runs, intact, _ = self.rebuild_runs(first_cluster, size or self.cluster_size)
+                        if intact and self._looks_like_directory(child_runs):
+                            pending.append((child, child_runs, deleted_depth + 1))
+                    continue
+                if not deleted:
+                    continue
+
+                if contiguous_chain:
+                    count = -(-size // self.cluster_size)
+                    file_runs = [(first_cluster, count)] if count and self._valid_cluster(first_cluster) else []
+                    intact = bool(file_runs) and not any(
+                        self.is_allocated(cluster) for cluster in range(first_cluster, first_cluster + count)
+                    )
+                    contiguous = True
+                else:
+                    file_runs, intact, contiguous = self.rebuild_runs(first_cluster, size)
+                yield DeletedEntry(child, size, mtime, first_cluster, file_runs, intact, contiguous)
+
+    def _looks_like_directory(self, runs):
+        first = self.image.read_at(self.cluster_offset(runs[0][0]), 32)
+        if self.variant == 'exFAT':
+            return first[:1] in (bytes([EXFAT_FILE]), bytes([EXFAT_FILE & 0x7F]), b'\x00')
+        return first[:11] == b'.          '
+
+    def _fat32_directory(self, runs):
+        """(name, is_dir, deleted, first_cluster, size, mtime, contiguous) per entry"""
+        long_parts = []
+        for entry in self._raw_entries(runs):
+            marker = entry[0]
+            if marker == 0x00:
+                break
+            attributes = entry[11]
+            if attributes == ATTR_LONG_NAME:
+                long_parts.append(entry)
+                continue
+
+            parts, long_parts = long_parts, []
+            if attributes & ATTR_VOLUME_ID or entry[:2] == b'. ' or entry[:3] == b'.. ':
+                continue
+
+            deleted = marker == DELETED_MARK
+            name = self._long_name(parts, entry, deleted) or self._short_name(entry, deleted)
+            cluster_hi, time_, date, cluster_lo, size = struct.unpack_from('<HHHHI', entry, 20)
+            yield (name, bool(attributes & ATTR_DIRECTORY), deleted, (cluster_hi << 16) | cluster_lo,
+                   size, _fat_timestamp(date, time_), False)
+
+    def _short_name(self, entry, deleted):
+        base = entry[:8].rstrip(b' ')
+        if deleted:
+            base = b'_' + base[1:]
+        elif base[:1] == b'\x05':
+            # 0xE5 is the deleted mark, so a name starting with it is stored as 0x05
+            base = b'\xe5' + base[1:]
+        extension = entry[8:11].rstrip(b' ')
+        name = base + (b'.' + extension if extension else b'')
+        return name.decode('cp437', 'replace')
+
+    def _long_name(self, parts, entry, deleted):
+        if not parts:
+            return None
+        checksum = parts[-1][13]
+        if not deleted and _lfn_checksum(entry[:11]) != checksum:
+            return None
+        if deleted and all(_lfn_checksum(bytes([c]) + entry[1:11]) != checksum for c in range(0x20, 0x7F)):
+            # Only the first character was lost; if no guess fits, the
+            # long-name entries belong to some other file
+            return None
+
+        # Long-name entries are stored last part first
+        raw = b''.join(part[1:11] + part[14:26] + part[28:32] for part in reversed(parts))
+        name = raw.decode('utf-16-le', 'replace')
+        return name.split('\x00', 1)[0]
+
+    def _exfat_directory(self, runs):
+        """(name, is_dir, deleted, first_cluster, size, mtime, contiguous) per entry set"""
+        entries = list(self._raw_entries(runs))
+        index = 0
+        while index < len(entries):
+            entry = entries[index]
+            entry_type = entry[0]
+            if entry_type == 0x00:
+                break
+            if entry_type & 0x7F != EXFAT_FILE & 0x7F:
+                index += 1
+                continue
+
+            deleted = not entry_type & EXFAT_IN_USE
+            secondary_count = entry[1]
+            attributes, = struct.unpack_from('<H', entry, 4)
+            modified, = struct.unpack_from('<I', entry, 12)
+            entry_set = entries[index + 1:index + 1 + secondary_count]
+            index += 1 + secondary_count
+            if not entry_set or entry_set[0][0] & 0x7F != EXFAT_STREAM & 0x7F:
+                continue
+
+            stream = entry_set[0]
+            flags, name_length = stream[1], stream[3]
+            first_cluster, size = struct.unpack_from('<IQ', stream, 20)
+            name = b''.join(part[2:32] for part in entry_set[1:] if part[0] & 0x7F == EXFAT_NAME & 0x7F)
+            name = name.decode('utf-16-le', 'replace')[:name_length]
+            mtime = _fat_timestamp(modified >> 16, modified & 0xFFFF)
+            yield (name, bool(attributes & ATTR_DIRECTORY), deleted, first_cluster, size,
+                   mtime, bool(flags & EXFAT_NO_FAT_CHAIN))
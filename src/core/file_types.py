@@ -0,0 +1,24 @@
+import os
+
+
+CATEGORY_EXTENSIONS = {
+    'documents': ['.doc', '.docx', '.pdf', '.txt', '.rtf'],
+    'videos': ['.mp4', '.avi', '.mov', '.wmv'],
+    'images': ['.jpg', '.jpeg', '.png', '.gif', '.bmp'],
+    'emails': ['.eml', '.msg'],
+    'audio': ['.mp3', '.wav', '.ogg', '.m4a']
+}
+
+OTHER = 'other'
+
+_CATEGORY_BY_EXTENSION = {
+    extension: category
+    for category, extensions in CATEGORY_EXTENSIONS.items()
+    for extension in extensions
+}
+
+
+def category_for(path):
+    """Category of a file from its extension, or 'other'"""
+    extension = os.path.splitext(path)[1].lower()
+    return _CATEGORY_BY_EXTENSION.get(extension, OTHER)
@@ -0,0 +1,218 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+
+
+MB = 1024 * 1024
+
+SUPPORTED_ALGORITHMS = ('blake2b', 'blake2s', 'sha256', 'sha1', 'md5')
+
+
+class HashCache:
+    """Thread-safe LRU of digests keyed by (device, inode, size, mtime, kind)
+
+    A file whose identity, size and modification time are unchanged keeps
+    its digest, so a repeated scan does not read it again.
+    """
+
+    def __init__(self, max_entries=1000000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(st, kind):
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, kind)
+
+    def get(self, key):
+        with self._lock:
+            digest = self._entries.get(key)
+            if digest is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return digest
+
+    def put(self, key, digest):
+        with self._lock:
+            self._entries[key] = digest
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class HashService:
+    """Chunked file hashing spread over a thread pool
+
+    hashlib releases the GIL while digesting large buffers, so threads
+    hash several files at once without the cost of a process pool. Each
+    file is read through one reused buffer with readinto. partial_hash()
+    digests only the size, head and tail of a file: a cheap prefilter for
+    finding duplicates before paying for a full hash. With a Metrics
+    registry, digests actually computed (not cache hits) are timed under
+    the 'hash' and 'partial_hash' stages.
+    """
+
+    def __init__(self, algorithm='blake2b', workers=None, chunk_size=4 * MB,
+                 partial_size=64 * 1024, cache=None, metrics=None):
+        if algorithm not in SUPPORTED_ALGORITHMS:
+            raise ValueError(f"Unsupported hash algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.chunk_size = chunk_size
+        self.partial_size = partial_size
+        self.cache = cache if cache is not None else HashCache()
+        self.metrics = metrics
+
+    def hash_file(self, path, algorithm=None, use_cache=True):
+        """Hex digest of a whole file, served from the cache when unchanged
+
+        use_cache=False always reads the file, for a file just written: a
+        copied mtime on a reused inode would match a stale entry.
+        """
+        algorithm = algorithm or self.algorithm
+        with open(path, 'rb', buffering=0) as f:
+            st = os.fstat(f.fileno())
+            key = HashCache.key(st, algorithm)
+            if use_cache:
+                digest = self.cache.get(key)
+                if digest is not None:
+                    return digest
+
+            started = time.perf_counter()
+            hasher = hashlib.new(algorithm)
+            buffer = bytearray(min(self.chunk_size, max(st.st_size, 1)))
+            view = memoryview(buffer)
+            while True:
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                hasher.update(view[:read])
+            digest = hasher.hexdigest()
+
+        if self.metrics is not None:
+            self.metrics.add_time('hash', time.perf_counter() - started, 1, st.st_size)
+        self.cache.put(key, digest)
+        return digest
+
+    def partial_hash(self, path):
+        """Hex digest of a file's size, first and last partial_size bytes"""
+        with open(path, 'rb', buffering=0) as f:
+            st = os.fstat(f.fileno())
+            key = HashCache.key(st, f"partial-{self.algorithm}")
+            digest = self.cache.get(key)
+            if digest is not None:
+                return digest
+
+            started = time.perf_counter()
+            hasher = hashlib.new(self.algorithm)
+            hasher.update(st.st_size.to_bytes(8, 'little'))
+            hasher.update(f.read(self.partial_size))
+            if st.st_size > 2 * self.partial_size:
+                f.seek(-self.partial_size, os.SEEK_END)
+                hasher.update(f.read(self.partial_size))
+            elif st.st_size > self.partial_size:
+                hasher.update(f.read())
+            digest = hasher.hexdigest()
+
+        if self.metrics is not None:
+            self.metrics.add_time('partial_hash', time.perf_counter() - started, 1,
+                                  min(st.st_size, 2 * self.partial_size))
+        self.cache.put(key, digest)
+        return digest
+
+    def hash_extents(self, image, extents, algorithm=None):
+        """Hex digest of a recovered file's (image_offset, length, file_offset) runs
+
+        Runs are digested in file order straight from the DiskImage mapping;
+        holes between runs hash as zeros, the way the file would read back.
+        """
+        started = time.perf_counter()
+        hasher = hashlib.new(algorithm or self.algorithm)
+        position = 0
+        for offset, length, file_offset in sorted(extents, key=lambda extent: extent[2]):
+            if file_offset > position:
+                self._update_zeros(hasher, file_offset - position)
+            done = 0
+            while done < length:
+                step = min(self.chunk_size, length - done)
+                view = image.view(offset + done, step)
+                hasher.update(view)
+                view.release()
+                done += step
+            position = file_offset + length
+        if self.metrics is not None:
+            self.metrics.add_time('hash', time.perf_counter() - started, 1, position)
+        return hasher.hexdigest()
+
+    def partial_hash_extents(self, image, extents, size):
+        """partial_hash() of a recovered file, read through its runs"""
+        hasher = hashlib.new(self.algorithm)
+        hasher.update(size.to_bytes(8, 'little'))
+        hasher.update(image.read_extents(extents, 0, min(size, self.partial_size)))
+        if size > self.partial_size:
+            tail = max(self.partial_size, size - self.partial_size)
+            hasher.update(image.read_extents(extents, tail, size - tail))
+        return hasher.hexdigest()
+
+    def _update_zeros(self, hasher, count):
+        zeros = bytes(min(count, self.chunk_size))
+        while count > 0:
+            hasher.update(zeros[:count])
+            count -= len(zeros)
+
+    def hash_files(self, paths, partial=False, cancel_token=None):
+        """Yield (path, digest, error) for each path as its hash completes"""
+        task = self.partial_hash if partial else self.hash_file
+        paths = iter(paths)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # Only a bounded number of files are in flight at once, so a
+            # huge path list never turns into a huge list of futures
+            futures = {pool.submit(task, path): path for path in islice(paths, self.workers * 4)}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = futures.pop(future)
+                    try:
+                        yield path, future.result(), None
+                    except OSError as e:
+                        yield path, None, e
+
+                if cancel_token is not None and cancel_token.cancelled:
+                    for future in futures:
+                        future.cancel()
+                    return
+                for path in islice(paths, len(done)):
+                    futures[pool.submit(task, path)] = path
+
+    def find_duplicates(self, paths, cancel_token=None):
+        """Groups of identical files: size first, then partial hash, then full hash"""
+        by_size = {}
+        for path in paths:
+            try:
+                by_size.setdefault(os.path.getsize(path), []).append(path)
+            except OSError:
+                continue
+        candidates = [path for group in by_size.values() if len(group) > 1 for path in group]
+
+        by_partial = {}
+        for path, digest, error in self.hash_files(candidates, partial=True, cancel_token=cancel_token):
+            if error is None:
+                by_partial.setdefault(digest, []).append(path)
+        candidates = [path for group in by_partial.values() if len(group) > 1 for path in group]
+
+        by_full = {}
+        for path, digest, error in self.hash_files(candidates, cancel_token=cancel_token):
+            if error is None:
+                by_full.setdefault(digest, []).append(path)
+        return [group for group in by_full.values() if len(group) > 1]
@@ -0,0 +1,192 @@
+import hashlib
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+
+MB = 1024 * 1024
+
+
+def _align_down(value, alignment):
+    return value - value % alignment
+
+
+def _advise(mapping, advice_name, start=0, length=None):
+    # madvise is Python 3.8+ and not available on Windows
+    advice = getattr(mmap, advice_name, None)
+    if advice is None or not hasattr(mapping, 'madvise'):
+        return
+    try:
+        if length is None:
+            mapping.madvise(advice)
+        else:
+            mapping.madvise(advice, start, length)
+    except (OSError, ValueError):
+        pass
+
+
+class DiskImage:
+    """Read-only, memory-mapped access to a disk image or block device
+
+    Data is handed out as memoryview slices of page-aligned mmap windows,
+    so the carver, hashing and previews all read the page cache directly
+    without allocating copies. At most max_windows random-access windows
+    stay mapped; sequential chunks are mapped one at a time and released
+    as soon as the caller moves on. Sources that cannot be mapped (pipes,
+    some raw Windows devices) fall back to plain positioned reads.
+    """
+
+    def __init__(self, path, window_size=64 * MB, max_windows=4):
+        self.path = path
+        granularity = mmap.ALLOCATIONGRANULARITY
+        self.window_size = max(granularity, _align_down(window_size, granularity))
+        self.max_windows = max(1, max_windows)
+        self._file = open(path, 'rb', buffering=0)
+        self.size = self._file.seek(0, os.SEEK_END)
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+        self.mapped = self.size > 0 and self._can_map()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Unmap all windows and close the image"""
+        with self._lock:
+            for window in self._windows.values():
+                self._release(window)
+            self._windows.clear()
+        self._file.close()
+
+    def _can_map(self):
+        try:
+            mapping = self._map(0, min(self.size, mmap.ALLOCATIONGRANULARITY))
+        except (OSError, ValueError):
+            return False
+        mapping.close()
+        return True
+
+    def _map(self, base, length):
+        return mmap.mmap(self._file.fileno(), length, access=mmap.ACCESS_READ, offset=base)
+
+    def _release(self, mapping):
+        _advise(mapping, 'MADV_DONTNEED')
+        try:
+            mapping.close()
+        except BufferError:
+            # A caller still holds a view; the mapping goes away with it
+            pass
+
+    def _pread(self, offset, length):
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(length)
+
+    def _window(self, base, length):
+        key = (base, length)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None:
+                self._windows.move_to_end(key)
+                return window
+            window = self._map(base, length)
+            _advise(window, 'MADV_RANDOM')
+            self._windows[key] = window
+            while len(self._windows) > self.max_windows:
+                _, evicted = self._windows.popitem(last=False)
+                self._release(evicted)
+            return window
+
+    def view(self, offset, length):
+        """Zero-copy memoryview of length bytes at offset, clipped to the image"""
+        length = max(0, min(length, self.size - offset))
+        if not length:
+            return memoryview(b'')
+        if not self.mapped:
+            return memoryview(self._pread(offset, length))
+
+        base = _align_down(offset, self.window_size)
+        if offset + length <= base + self.window_size:
+            window = self._window(base, min(self.window_size, self.size - base))
+        else:
+            # The range straddles two windows; map one that covers all of it
+            base = _align_down(offset, mmap.ALLOCATIONGRANULARITY)
+            window = self._window(base, offset + length - base)
+        start = offset - base
+        return memoryview(window)[start:start + length]
+
+    def read_at(self, offset, length):
+        """Copy of a small range as bytes, for parsers that need bytes methods"""
+        return self.view(offset, length).tobytes()
+
+    def read_extents(self, extents, start, length):
+        """Bytes [start, start + length) of a file stored as (image_offset, length, file_offset) runs
+
+        Holes between runs read back as zeros; the result is shorter than
+        length only past the end of the last run.
+        """
+        data = bytearray()
+        end = start + length
+        for offset, run_length, file_offset in sorted(extents, key=lambda extent: extent[2]):
+            low = max(start, file_offset)
+            high = min(end, file_offset + run_length)
+            if low >= high:
+                continue
+            if low > start + len(data):
+                data.extend(bytes(low - start - len(data)))
+            view = self.view(offset + low - file_offset, high - low)
+            data += view
+            view.release()
+        return bytes(data)
+
+    def chunks(self, start=0, end=None, overlap=0, chunk_size=16 * MB):
+        """Yield (offset, view, limit) for sequential chunks of [start, end)
+
+        Consecutive views overlap by overlap bytes so patterns crossing a
+        chunk boundary are seen whole; a match starting at or beyond limit
+        belongs to the next chunk. Each chunk is mapped with a sequential
+        access hint, the kernel is asked to read the next one ahead, and
+        the mapping is dropped once the caller asks for the next chunk.
+        """
+        if end is None or end > self.size:
+            end = self.size
+        position = start
+        while position < end:
+            length = min(chunk_size + overlap, end - position)
+            last = position + length >= end
+            limit = length if last else length - overlap
+
+            if self.mapped:
+                base = _align_down(position, mmap.ALLOCATIONGRANULARITY)
+                mapping = self._map(base, position + length - base)
+                _advise(mapping, 'MADV_SEQUENTIAL')
+                self._readahead(position + length, chunk_size)
+                try:
+                    yield position, memoryview(mapping)[position - base:], limit
+                finally:
+                    self._release(mapping)
+            else:
+                yield position, memoryview(self._pread(position, length)), limit
+
+            position += limit
+
+    def _readahead(self, offset, length):
+        if offset < self.size and hasattr(os, 'posix_fadvise'):
+            try:
+                os.posix_fadvise(self._file.fileno(), offset, length, os.POSIX_FADV_WILLNEED)
+            except OSError:
+                pass
+
+    def hash_range(self, offset=0, length=None, algorithm='sha256', chunk_size=16 * MB):
+        """Hex digest of a byte range, fed to hashlib straight from the mapping"""
+        if length is None:
+            length = self.size - offset
+        digest = hashlib.new(algorithm)
+        for _, view, limit in self.chunks(offset, offset + length, chunk_size=chunk_size):
+            digest.update(view[:limit])
+            view.release()
+        return digest.hexdigest()
@@ -0,0 +1,510 @@
+import asyncio
+import collections
+import itertools
+import os
+import stat
+import threading
+import time
+
+from .carver import Carver
+from .scanner import CancelToken
+from .throttle import RateLimiter
+
+
+# Lower runs first; a foreground restore should not queue behind a deep scan
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+JOB_KINDS = ('scan', 'carve', 'hash', 'restore')
+
+# 'paused' jobs keep their place: queued ones are skipped by the
+# dispatcher, running ones stop at their next checkpoint and hand back
+# their device slots until resumed
+JOB_STATES = ('queued', 'running', 'paused', 'done', 'failed', 'cancelled')
+
+_job_ids = itertools.count(1)
+
+
+class JobError(Exception):
+    """Raised when a job cannot be submitted, e.g. to a closed scheduler"""
+
+
+def device_key(path):
+    """Key for the device holding path, so jobs on one disk can be limited together
+
+    A block device is its own key; anything else is keyed by the device it
+    lives on. Paths that do not exist (yet) key as themselves.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return os.path.abspath(path)
+    return st.st_rdev if stat.S_ISBLK(st.st_mode) else st.st_dev
+
+
+class JobControl(CancelToken):
+    """What a running job's work sees: a CancelToken that can also pause and throttle it
+
+    Pass it wherever a cancel_token is taken. Work calls charge() after
+    each unit of I/O (or checkpoint() with nothing to charge), which is
+    where throttling and pausing happen.
+    """
+
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+        self.limiters = [job.limiter] if job.limiter is not None else []
+        self._gate = threading.Event()
+        self._gate.set()
+
+    def cancel(self):
+        super().cancel()
+        # A paused job has to wake up to notice
+        self._gate.set()
+
+    def checkpoint(self):
+        """Block while the job is paused; returns False once it has been cancelled"""
+        if not self._gate.is_set() and not self.cancelled:
+            self.job._scheduler._call(self.job._scheduler._park, self.job)
+            self._gate.wait()
+        return not self.cancelled
+
+    def charge(self, nbytes=0, ops=0):
+        """Record I/O just done, wait off any throttle debt, then checkpoint"""
+        job = self.job
+        job.bytes_done += nbytes
+        job.ops_done += ops
+        for limiter in self.limiters:
+            limiter.consume(nbytes, ops, self)
+        return self.checkpoint()
+
+
+class Job:
+    """A unit of scan, carve, hash or restore work for a JobScheduler
+
+    work(control) is called on the job's own thread with a JobControl.
+    It may do everything itself, or return an iterable whose items are
+    charged through cost(item) -> (nbytes, ops) and handed to
+    on_item(item), both on the job's thread. devices are device_key()s
+    (or paths) the job reads or writes; the scheduler runs at most its
+    per-device limit of jobs on any one of them at once.
+    """
+
+    def __init__(self, kind, work, name=None, devices=(), priority=PRIORITY_NORMAL,
+                 bytes_per_second=None, iops=None, cost=None, on_item=None):
+        self.id = next(_job_ids)
+        self.kind = kind
+        self.work = work
+        self.name = name or f"{kind} #{self.id}"
+        self.devices = tuple(sorted({device if isinstance(device, int) else device_key(device)
+                                     for device in devices}, key=str))
+        self.priority = priority
+        limiter = RateLimiter(bytes_per_second, iops)
+        self.limiter = limiter if limiter.limited else None
+        self.cost = cost
+        self.on_item = on_item
+        self.state = 'new'
+        self.items = 0
+        self.bytes_done = 0
+        self.ops_done = 0
+        self.error = None
+        self.submitted = self.started = self.finished = None
+        self.control = JobControl(self)
+        self._scheduler = None
+        self._sequence = 0
+        self._parked = False
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        if self._scheduler is not None:
+            self._scheduler.cancel(self)
+        else:
+            self.control.cancel()
+
+    def pause(self):
+        if self._scheduler is not None:
+            self._scheduler.pause(self)
+
+    def resume(self):
+        if self._scheduler is not None:
+            self._scheduler.resume(self)
+
+    def wait(self, timeout=None):
+        """Block until the job has finished; returns False on timeout"""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'name': self.name,
+            'state': self.state,
+            'priority': self.priority,
+            'items': self.items,
+            'bytes': self.bytes_done,
+            'ops': self.ops_done,
+            'error': str(self.error) if self.error is not None else None
+        }
+
+    def __repr__(self):
+        return f"Job({self.id}, {self.name!r}, {self.state!r})"
+
+
+class JobScheduler:
+    """Runs Jobs by priority with global and per-device concurrency limits
+
+    An asyncio event loop on a daemon thread owns all scheduling state;
+    the public methods hand their request to it, so they are safe to call
+    from any thread, the Tk one included. Each started job gets a thread
+    of its own and the loop awaits its completion. The waiting job with
+    the best (lowest) priority whose devices all have a free slot starts
+    first; ties go to the earlier submission.
+
+    on_change(job) is called from the loop thread whenever a job changes
+    state. Per-device limits on concurrency, bandwidth and IOPS are set
+    with limit_device(); a job's own rate limits apply on top. Finished
+    jobs are forgotten once more than keep_finished have piled up.
+    """
+
+    def __init__(self, max_jobs=2, per_device=1, on_change=None, keep_finished=100):
+        self.max_jobs = max(1, max_jobs)
+        self.per_device = max(1, per_device)
+        self.on_change = on_change
+        self.keep_finished = max(0, keep_finished)
+        self._device_jobs = {}
+        self._device_limits = {}
+        self._limiters = {}
+        self._queued = []
+        self._running = set()
+        self._jobs = []
+        self._finished = collections.deque()
+        self._sequence = itertools.count()
+        self._closed = False
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name='phoenix-jobs', daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _call(self, callback, *args):
+        self._loop.call_soon_threadsafe(callback, *args)
+
+    def submit(self, job):
+        """Queue a job and return it"""
+        if self._closed:
+            raise JobError("the scheduler has been closed")
+        if job._scheduler is not None:
+            raise JobError(f"{job.name} was already submitted")
+        job._scheduler = self
+        job.submitted = time.time()
+        job.state = 'queued'
+        self._call(self._enqueue, job)
+        return job
+
+    def cancel(self, job):
+        # Set the token at once so running work stops at its next check
+        job.control.cancel()
+        self._call(self._cancel, job)
+
+    def pause(self, job):
+        self._call(self._pause, job)
+
+    def resume(self, job):
+        self._call(self._resume, job)
+
+    def limit_device(self, device, max_jobs=None, bytes_per_second=None, iops=None):
+        """Set a device's job limit and the I/O rate shared by every job on it
+
+        device is a path on it or a device_key(). None leaves the default
+        job limit or removes a rate limit.
+        """
+        key = device if isinstance(device, int) else device_key(device)
+        limiter = RateLimiter(bytes_per_second, iops)
+        self._call(self._limit_device, key, max_jobs, limiter if limiter.limited else None)
+
+    def jobs(self):
+        """Every unfinished job and the keep_finished last to finish, oldest first"""
+        return list(self._jobs)
+
+    def close(self, cancel=True, timeout=None):
+        """Stop accepting jobs; cancel the unfinished ones (or wait for them) and stop the loop"""
+        self._closed = True
+        for job in self.jobs():
+            if cancel:
+                job.cancel()
+            job.wait(timeout)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            self._loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Everything below runs on the loop thread
+
+    def _changed(self, job):
+        if self.on_change is not None:
+            try:
+                self.on_change(job)
+            except Exception:
+                # A broken listener must not stall every other job
+                pass
+
+    def _enqueue(self, job):
+        self._jobs.append(job)
+        if job.control.cancelled:
+            self._end(job, 'cancelled')
+            return
+        job._sequence = next(self._sequence)
+        self._queued.append(job)
+        self._changed(job)
+        self._dispatch()
+
+    def _limit_device(self, key, max_jobs, limiter):
+        if max_jobs is not None:
+            self._device_limits[key] = max(1, max_jobs)
+        if limiter is None:
+            self._limiters.pop(key, None)
+        else:
+            self._limiters[key] = limiter
+        for job in self._jobs:
+            if key in job.devices:
+                self._attach_limiters(job)
+        self._dispatch()
+
+    def _attach_limiters(self, job):
+        limiters = [job.limiter] if job.limiter is not None else []
+        limiters.extend(self._limiters[key] for key in job.devices if key in self._limiters)
+        # Replaced whole, so the job's thread never sees a half-built list
+        job.control.limiters = limiters
+
+    def _can_start(self, job):
+        return all(self._device_jobs.get(key, 0) < self._device_limits.get(key, self.per_device)
+                   for key in job.devices)
+
+    def _dispatch(self):
+        self._queued.sort(key=lambda job: (job.priority, job._sequence))
+        for job in list(self._queued):
+            if len(self._running) >= self.max_jobs:
+                break
+            if job.state != 'queued' or not self._can_start(job):
+                continue
+            self._queued.remove(job)
+            self._running.add(job)
+            for key in job.devices:
+                self._device_jobs[key] = self._device_jobs.get(key, 0) + 1
+            job.state = 'running'
+            if job._parked:
+                # Paused mid-run: its thread is waiting at a checkpoint
+                job._parked = False
+                job.control._gate.set()
+            else:
+                job.started = time.time()
+                self._attach_limiters(job)
+                self._loop.create_task(self._execute(job))
+            self._changed(job)
+
+    def _release(self, job):
+        self._running.discard(job)
+        for key in job.devices:
+            self._device_jobs[key] -= 1
+
+    async def _execute(self, job):
+        finished = self._loop.create_future()
+
+        def run():
+            try:
+                self._run_work(job)
+            finally:
+                self._call(finished.set_result, None)
+
+        threading.Thread(target=run, name=f"phoenix-job-{job.id}", daemon=True).start()
+        await finished
+        if job in self._running:
+            self._release(job)
+        if job.error is not None:
+            state = 'failed'
+        else:
+            state = 'cancelled' if job.control.cancelled else 'done'
+        self._end(job, state)
+        self._dispatch()
+
+    def _end(self, job, state):
+        if job in self._queued:
+            self._queued.remove(job)
+        job._parked = False
+        job.state = state
+        job.finished = time.time()
+        self._finished.append(job)
+        if len(self._finished) > self.keep_finished:
+            forgotten = self._finished.popleft()
+            # Replaced whole, so jobs() on another thread never sees a half-edited list
+            self._jobs = [other for other in self._jobs if other is not forgotten]
+        job._done.set()
+        self._changed(job)
+
+    def _cancel(self, job):
+        # A running job ends through _execute once its work returns
+        if job.done:
+            return
+        if job._parked:
+            # Its thread wakes from the cancelled gate and finishes
+            job._parked = False
+            if job in self._queued:
+                self._queued.remove(job)
+        elif job in self._queued:
+            self._end(job, 'cancelled')
+
+    def _pause(self, job):
+        if job.state == 'queued' and not job._parked:
+            job.state = 'paused'
+            self._changed(job)
+        elif job.state == 'running':
+            job.state = 'paused'
+            job.control._gate.clear()
+            self._changed(job)
+
+    def _park(self, job):
+        """A paused job's thread reached a checkpoint: give its device slots to others"""
+        if job.state == 'paused' and job in self._running and not job.control._gate.is_set():
+            self._release(job)
+            job._parked = True
+            self._dispatch()
+
+    def _resume(self, job):
+        if job.state != 'paused':
+            return
+        if job._parked:
+            # Has to win its device slots back like any queued job
+            job.state = 'queued'
+            self._queued.append(job)
+        elif job in self._running:
+            job.state = 'running'
+            job.control._gate.set()
+        else:
+            job.state = 'queued'
+        self._changed(job)
+        self._dispatch()
+
+    # Runs on the job's thread
+
+    @staticmethod
+    def _run_work(job):
+        control = job.control
+        items = None
+        try:
+            items = job.work(control)
+            if items is None:
+                return
+            cost, on_item = job.cost, job.on_item
+            for item in items:
+                job.items += 1
+                if on_item is not None:
+                    on_item(item)
+                if cost is not None:
+                    nbytes, ops = cost(item)
+                    control.charge(nbytes, ops)
+                else:
+                    control.checkpoint()
+                if control.cancelled:
+                    break
+        except Exception as e:
+            job.error = e
+        finally:
+            # Lets a generator stopped early run its own cleanup now
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
+
+
+def scan_job(scanner, locations=None, mode='deep', index=None, on_progress=None, **options):
+    """Job walking locations with Scanner.scan(), charged one operation per file"""
+    if locations is None:
+        locations = scanner.default_locations(mode)
+    options.setdefault('devices', [location for location in locations if os.path.isdir(location)])
+    options.setdefault('name', f"{mode} scan")
+    return Job('scan', lambda control: scanner.scan(locations, mode=mode, cancel_token=control,
+                                                    on_progress=on_progress, index=index),
+               cost=lambda result: (0, 1), **options)
+
+
+def quick_scan_job(scanner, volumes=None, on_progress=None, **options):
+    """Job reading trash metadata with Scanner.quick_scan()"""
+    options.setdefault('name', "quick scan")
+    return Job('scan', lambda control: scanner.quick_scan(volumes, cancel_token=control,
+                                                          on_progress=on_progress),
+               cost=lambda result: (0, 1), **options)
+
+
+def carve_job(source, carver=None, on_progress=None, regions=None, **options):
+    """Job carving source, or only regions of it, charged by the bytes the carver reports having read"""
+    carver = carver if carver is not None else Carver()
+    options.setdefault('devices', [source])
+    options.setdefault('name', f"carve {os.path.basename(source)}")
+
+    def work(control):
+        read = [0]
+
+        def progress(event):
+            # Called from the carving loop, so a throttle wait here slows the reads themselves
+            control.charge(event.bytes_done - read[0], 1)
+            read[0] = event.bytes_done
+            if on_progress is not None:
+                on_progress(event)
+
+        return carver.carve(source, cancel_token=control, on_progress=progress, regions=regions)
+
+    return Job('carve', work, **options)
+
+
+def hash_job(hasher, paths, algorithm=None, **options):
+    """Job yielding (path, digest) per file, charged by file size"""
+    paths = list(paths)
+    options.setdefault('devices', {os.path.dirname(os.path.abspath(path)) for path in paths})
+    options.setdefault('name', f"hash {len(paths)} files")
+
+    def work(control):
+        for path in paths:
+            if control.cancelled:
+                return
+            try:
+                size = os.path.getsize(path)
+                digest = hasher.hash_file(path, algorithm)
+            except OSError:
+                continue
+            yield path, digest
+            control.charge(size, 1)
+
+    return Job('hash', work, **options)
+
+
+def restore_job(scanner, results, destination, on_progress=None, **options):
+    """Job restoring results with Scanner.restore(), charged by bytes copied
+
+    It holds a slot on the destination's device and on every source's.
+    """
+    results = list(results)
+    if 'devices' not in options:
+        devices = {device_key(destination)}
+        for result in results:
+            if result.image is not None:
+                devices.add(result.image)
+            elif result.device:
+                devices.add(result.device)
+        options['devices'] = devices
+    options.setdefault('name', f"restore {len(results)} files")
+    options.setdefault('priority', PRIORITY_HIGH)
+    return Job('restore', lambda control: scanner.restore(results, destination, cancel_token=control,
+                                                          on_progress=on_progress),
+               cost=lambda outcome: (outcome.size, 1), **options)
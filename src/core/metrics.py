@@ -0,0 +1,108 @@
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Stages the scan and restore paths time; others may be added freely
+STAGES = ('walk', 'stat', 'classify', 'hash', 'partial_hash', 'copy', 'verify')
+
+_METRIC_NAME = re.compile(r'[^a-zA-Z0-9_]')
+
+
+class Metrics:
+    """Thread-safe stage timers and counters for a scan or restore
+
+    A stage accumulates calls, seconds, items and bytes; callers on hot
+    paths add their time once per directory or per file rather than per
+    entry, so keeping metrics costs a lock round trip at most that often.
+    Stages can nest (verify includes the hashing it does), so their
+    seconds need not add up to the wall clock time.
+    """
+
+    def __init__(self, prefix='phoenix'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+        self.started = time.monotonic()
+        self.capture = None  # summary of the last ProfileCapture, if any
+
+    def add_time(self, stage, seconds, items=0, nbytes=0):
+        """Add one call's seconds, items and bytes to a stage"""
+        with self._lock:
+            totals = self._stages.get(stage)
+            if totals is None:
+                totals = self._stages[stage] = [0, 0.0, 0, 0]
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += items
+            totals[3] += nbytes
+
+    @contextmanager
+    def stage(self, name, items=0, nbytes=0):
+        """Time the body of a with block as one call of a stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started, items, nbytes)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+            self.started = time.monotonic()
+
+    def snapshot(self):
+        """Plain dict of everything recorded so far"""
+        with self._lock:
+            stages = {
+                name: {'calls': calls, 'seconds': seconds, 'items': items, 'bytes': nbytes}
+                for name, (calls, seconds, items, nbytes) in self._stages.items()
+            }
+            counters = dict(self._counters)
+        snapshot = {'uptime': time.monotonic() - self.started, 'stages': stages, 'counters': counters}
+        if self.capture is not None:
+            snapshot['capture'] = self.capture
+        return snapshot
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+    def to_prometheus(self):
+        """Snapshot in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        prefix = self.prefix
+        lines = [
+            f"# HELP {prefix}_uptime_seconds Seconds since the metrics were created or reset",
+            f"# TYPE {prefix}_uptime_seconds gauge",
+            f"{prefix}_uptime_seconds {snapshot['uptime']:.6f}",
+        ]
+        for field, help_text in (('seconds', "Time spent in each stage"),
+                                 ('calls', "Calls timed in each stage"),
+                                 ('items', "Files or entries handled in each stage"),
+                                 ('bytes', "Bytes handled in each stage")):
+            name = f"{prefix}_stage_{field}_total"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for stage, totals in sorted(snapshot['stages'].items()):
+                lines.append(f'{name}{{stage="{stage}"}} {totals[field]}')
+        for counter, value in sorted(snapshot['counters'].items()):
+            name = f"{prefix}_{_METRIC_NAME.sub('_', counter)}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, fmt=None):
+        """Write a snapshot to path, as Prometheus text for .prom/.txt or fmt='prometheus', else JSON"""
+        if fmt is None:
+            fmt = 'prometheus' if path.endswith(('.prom', '.txt')) else 'json'
+        text = self.to_prometheus() if fmt == 'prometheus' else self.to_json() + "\n"
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
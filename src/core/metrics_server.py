@@ -0,0 +1,66 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        metrics = self.server.metrics
+        if self.path in ('/metrics', '/'):
+            body = metrics.to_prometheus().encode()
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/metrics.json':
+            body = metrics.to_json().encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would otherwise flood stderr
+        pass
+
+
+class MetricsServer:
+    """Serves live Metrics over HTTP from a daemon thread
+
+    GET /metrics returns Prometheus text and /metrics.json the JSON
+    snapshot. It binds to localhost unless told otherwise; port 0 picks a
+    free port, available as .port once started.
+    """
+
+    def __init__(self, metrics, host='127.0.0.1', port=0):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), _MetricsHandler)
+        self._server.daemon_threads = True
+        self._server.metrics = self.metrics
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/metrics"
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,381 @@
+import struct
+import sys
+
+from .image import DiskImage
+
+
+FILE_SIGNATURE = 0x454C4946  # b'FILE' read as a little-endian word
+RECORD_IN_USE = 0x0001
+RECORD_IS_DIRECTORY = 0x0002
+
+ATTR_FILE_NAME = 0x30
+ATTR_DATA = 0x80
+ATTR_END = 0xFFFFFFFF
+
+ROOT_RECORD = 5
+BITMAP_RECORD = 6
+REFERENCE_MASK = 0xFFFFFFFFFFFF
+
+NAMESPACE_DOS = 2
+
+# Seconds between 1601-01-01 (FILETIME epoch) and 1970-01-01
+FILETIME_EPOCH = 11644473600
+
+MB = 1024 * 1024
+
+
+class NtfsError(Exception):
+    """Raised when an image does not hold a readable NTFS volume"""
+
+
+class DeletedFile:
+    """A deleted file described by an MFT record that is no longer in use"""
+
+    __slots__ = ('record', 'path', 'size', 'mtime', 'runs', 'resident', 'is_directory')
+
+    def __init__(self, record, path, size, mtime, runs, resident, is_directory=False):
+        self.record = record
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        # Non-resident data: [(lcn, cluster_count), ...] with lcn None for sparse runs.
+        # Resident data: (image_offset, length, file_offset) pieces inside the record.
+        self.runs = runs
+        self.resident = resident
+        self.is_directory = is_directory
+
+    def to_dict(self):
+        return {
+            'record': self.record,
+            'path': self.path,
+            'size': self.size,
+            'mtime': self.mtime,
+            'runs': self.runs,
+            'resident': self.resident
+        }
+
+    def __repr__(self):
+        return f"DeletedFile({self.record}, {self.path!r}, size={self.size})"
+
+
+def _filetime(value):
+    return value / 10000000 - FILETIME_EPOCH if value else 0.0
+
+
+def decode_runlist(data, offset=0):
+    """Decode an NTFS mapping-pairs array into [(lcn, cluster_count), ...]"""
+    runs = []
+    lcn = 0
+    while offset < len(data):
+        header = data[offset]
+        if not header:
+            break
+        length_size = header & 0x0F
+        offset_size = header >> 4
+        offset += 1
+        if not length_size or offset + length_size + offset_size > len(data):
+            break
+        count = int.from_bytes(data[offset:offset + length_size], 'little')
+        offset += length_size
+        if offset_size:
+            lcn += int.from_bytes(data[offset:offset + offset_size], 'little', signed=True)
+            runs.append((lcn, count))
+        else:
+            runs.append((None, count))
+        offset += offset_size
+    return runs
+
+
+class NtfsReader:
+    """Streams deleted files out of an NTFS volume's $MFT
+
+    The $MFT is read in large sequential slices of its own runlist. Each
+    slice is screened as a whole: the signature and flags columns are
+    pulled out with strided memoryview casts, so only directories and
+    records no longer in use are copied and fixed up. Directory names and
+    parents go into an in-memory index, and full paths are resolved from
+    it once the whole table has been read. iter_allocated() makes the same
+    pass for files still in use, such as the recycle bin's own records.
+    """
+
+    def __init__(self, source, chunk_size=16 * MB):
+        if isinstance(source, DiskImage):
+            self.image = source
+            self._owns_image = False
+        else:
+            self.image = DiskImage(source)
+            self._owns_image = True
+        self.chunk_size = chunk_size
+        self._parse_boot_sector()
+        self._mft_runs = self._read_mft_runs()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._owns_image:
+            self.image.close()
+
+    def _parse_boot_sector(self):
+        boot = self.image.read_at(0, 512)
+        if len(boot) < 512 or boot[3:11] != b'NTFS    ':
+            raise NtfsError(f"{self.image.path}: no NTFS boot sector found")
+
+        sector_size, sectors_per_cluster = struct.unpack_from('<HB', boot, 11)
+        if sectors_per_cluster > 0x80:
+            sectors_per_cluster = 1 << (256 - sectors_per_cluster)
+        self.cluster_size = sector_size * sectors_per_cluster
+        self.sector_size = sector_size
+        self.cluster_count = struct.unpack_from('<Q', boot, 40)[0] // sectors_per_cluster
+        self.mft_cluster = struct.unpack_from('<Q', boot, 48)[0]
+        record_clusters = struct.unpack_from('<b', boot, 64)[0]
+        if record_clusters < 0:
+            self.record_size = 1 << -record_clusters
+        else:
+            self.record_size = record_clusters * self.cluster_size
+        if not self.cluster_size or self.record_size < 512:
+            raise NtfsError(f"{self.image.path}: invalid NTFS geometry")
+
+    def _read_mft_runs(self):
+        offset = self.mft_cluster * self.cluster_size
+        record = self._fixed_record(self.image.read_at(offset, self.record_size))
+        if record is None:
+            raise NtfsError(f"{self.image.path}: $MFT record is damaged")
+        for attr_type, _, attr in self._attributes(record):
+            if attr_type == ATTR_DATA and attr[8] and not attr[9]:
+                runlist_offset = struct.unpack_from('<H', attr, 32)[0]
+                return decode_runlist(attr, runlist_offset)
+        raise NtfsError(f"{self.image.path}: $MFT has no data runs")
+
+    def _fixed_record(self, raw):
+        """Copy of a record with its update-sequence fixups applied, or None if torn"""
+        record = bytearray(raw)
+        usa_offset, usa_count = struct.unpack_from('<HH', record, 4)
+        if usa_offset + usa_count * 2 > len(record):
+            return None
+        usn = record[usa_offset:usa_offset + 2]
+        for i in range(1, usa_count):
+            end = i * self.sector_size
+            if end > len(record):
+                break
+            if record[end - 2:end] != usn:
+                return None
+            record[end - 2:end] = record[usa_offset + i * 2:usa_offset + i * 2 + 2]
+        return record
+
+    def _attributes(self, record):
+        """Yield (type, offset, view) for each attribute of a fixed-up record"""
+        offset = struct.unpack_from('<H', record, 20)[0]
+        while offset + 16 <= len(record):
+            attr_type, length = struct.unpack_from('<II', record, offset)
+            if attr_type == ATTR_END or length < 16 or offset + length > len(record):
+                break
+            yield attr_type, offset, memoryview(record)[offset:offset + length]
+            offset += length
+
+    def _record_offset(self, number):
+        """Image offset of an MFT record, found through the $MFT runlist"""
+        position = number * self.record_size
+        for lcn, count in self._mft_runs:
+            run_bytes = count * self.cluster_size
+            if position < run_bytes:
+                if lcn is None:
+                    break
+                return lcn * self.cluster_size + position
+            position -= run_bytes
+        raise NtfsError(f"{self.image.path}: MFT record {number} is not mapped")
+
+    def cluster_bitmap(self):
+        """Contents of $Bitmap: one bit per cluster, set while the cluster is in use"""
+        record_offset = self._record_offset(BITMAP_RECORD)
+        record = self._fixed_record(self.image.read_at(record_offset, self.record_size))
+        if record is None or struct.unpack_from('<I', record, 0)[0] != FILE_SIGNATURE:
+            raise NtfsError(f"{self.image.path}: $Bitmap record is damaged")
+        for attr_type, attr_offset, attr in self._attributes(record):
+            if attr_type != ATTR_DATA or attr[9]:
+                continue
+            if not attr[8]:
+                size, value_offset = struct.unpack_from('<IH', attr, 16)
+                pieces = self._resident_pieces(record_offset, attr_offset + value_offset, size,
+                                               struct.unpack_from('<H', record, 4)[0])
+                return self.image.read_extents(pieces, 0, size)
+            size = struct.unpack_from('<Q', attr, 48)[0]
+            runs = decode_runlist(attr, struct.unpack_from('<H', attr, 32)[0])
+            entry = DeletedFile(BITMAP_RECORD, '/$Bitmap', size, 0.0, runs, None)
+            return self.image.read_extents(self.byte_ranges(entry), 0, size)
+        raise NtfsError(f"{self.image.path}: $Bitmap has no data")
+
+    def _mft_slices(self):
+        """Yield (first_record_number, image_offset, view) over the whole $MFT"""
+        number = 0
+        records_per_chunk = max(1, self.chunk_size // self.record_size)
+        for lcn, count in self._mft_runs:
+            run_bytes = count * self.cluster_size
+            if lcn is None:
+                number += run_bytes // self.record_size
+                continue
+            run_offset = lcn * self.cluster_size
+            done = 0
+            while done < run_bytes:
+                length = min(records_per_chunk * self.record_size, run_bytes - done)
+                length -= length % self.record_size
+                if not length:
+                    break
+                view = self.image.view(run_offset + done, length)
+                yield number, run_offset + done, view
+                view.release()
+                number += length // self.record_size
+                done += length
+
+    def _screen(self, view):
+        """Indexes of FILE records in a slice, with their flags"""
+        size = self.record_size
+        count = len(view) // size
+        if sys.byteorder == 'little':
+            words = view.cast('I')
+            halves = view.cast('H')
+            signatures = words[0::size // 4].tolist()
+            flags = halves[22 // 2::size // 2].tolist()
+            words.release()
+            halves.release()
+        else:
+            signatures = [struct.unpack_from('<I', view, i * size)[0] for i in range(count)]
+            flags = [struct.unpack_from('<H', view, i * size + 22)[0] for i in range(count)]
+        return [(i, flags[i]) for i in range(count) if signatures[i] == FILE_SIGNATURE]
+
+    def _parse_record(self, record, record_offset):
+        """(parent, name, mtime, size, runs, resident, sequence) from a fixed-up record"""
+        sequence = struct.unpack_from('<H', record, 16)[0]
+        parent = name = None
+        mtime = 0.0
+        best_namespace = None
+        size = 0
+        runs = None
+        resident = None
+        usa_offset = struct.unpack_from('<H', record, 4)[0]
+
+        for attr_type, attr_offset, attr in self._attributes(record):
+            if attr_type == ATTR_FILE_NAME and not attr[8]:
+                value_offset = struct.unpack_from('<H', attr, 20)[0]
+                value = attr[value_offset:]
+                if len(value) < 66:
+                    continue
+                namespace = value[65]
+                if name is not None and (namespace == NAMESPACE_DOS or best_namespace != NAMESPACE_DOS):
+                    continue
+                parent_ref, = struct.unpack_from('<Q', value, 0)
+                parent = parent_ref & REFERENCE_MASK
+                mtime = _filetime(struct.unpack_from('<Q', value, 16)[0])
+                name_length = value[64]
+                name = bytes(value[66:66 + name_length * 2]).decode('utf-16-le', 'replace')
+                best_namespace = namespace
+            elif attr_type == ATTR_DATA and not attr[9] and runs is None and resident is None:
+                if attr[8]:
+                    runlist_offset = struct.unpack_from('<H', attr, 32)[0]
+                    size = struct.unpack_from('<Q', attr, 48)[0]
+                    runs = decode_runlist(attr, runlist_offset)
+                else:
+                    size, value_offset = struct.unpack_from('<IH', attr, 16)
+                    resident = self._resident_pieces(record_offset, attr_offset + value_offset, size, usa_offset)
+        return parent, name, mtime, size, runs, resident, sequence
+
+    def _resident_pieces(self, record_offset, value_start, size, usa_offset):
+        """Image ranges for resident data, routing each sector's last two
+        bytes to their saved copy in the update sequence array"""
+        pieces = []
+        position = value_start
+        end = value_start + size
+        while position < end:
+            sector_end = (position // self.sector_size + 1) * self.sector_size
+            fixup_start = sector_end - 2
+            if position < fixup_start:
+                length = min(end, fixup_start) - position
+                pieces.append((record_offset + position, length, position - value_start))
+                position += length
+                continue
+            sector = sector_end // self.sector_size
+            saved = record_offset + usa_offset + sector * 2 + (position - fixup_start)
+            length = min(end, sector_end) - position
+            pieces.append((saved, length, position - value_start))
+            position += length
+        return pieces
+
+    def iter_deleted(self, cancel_token=None):
+        """Yield a DeletedFile for every record whose in-use flag is cleared"""
+        return self._iter_files(cancel_token, allocated=False)
+
+    def iter_allocated(self, cancel_token=None):
+        """Yield a DeletedFile for every file still in use, e.g. to read the recycle bin's records"""
+        return self._iter_files(cancel_token, allocated=True)
+
+    def _iter_files(self, cancel_token, allocated):
+        directories = {ROOT_RECORD: (ROOT_RECORD, '')}
+        found = []
+
+        for first_number, slice_offset, view in self._mft_slices():
+            if cancel_token is not None and cancel_token.cancelled:
+                return
+            for index, flags in self._screen(view):
+                in_use = bool(flags & RECORD_IN_USE)
+                is_directory = flags & RECORD_IS_DIRECTORY
+                if in_use != allocated and not is_directory:
+                    continue
+
+                start = index * self.record_size
+                record_offset = slice_offset + start
+                record = self._fixed_record(view[start:start + self.record_size])
+                if record is None:
+                    continue
+                # Skip extension records; their base record carries the names
+                if struct.unpack_from('<Q', record, 32)[0] & REFERENCE_MASK:
+                    continue
+
+                number = first_number + index
+                parent, name, mtime, size, runs, resident, _ = self._parse_record(record, record_offset)
+                if name is None:
+                    continue
+                if is_directory and number != ROOT_RECORD:
+                    directories[number] = (parent, name)
+                if in_use == allocated:
+                    found.append(DeletedFile(number, (parent, name), size, mtime, runs,
+                                             resident, bool(is_directory)))
+
+        paths = {ROOT_RECORD: ''}
+        for entry in found:
+            parent, name = entry.path
+            entry.path = f"{self._resolve(parent, directories, paths)}/{name}"
+            if not entry.is_directory:
+                yield entry
+
+    def _resolve(self, number, directories, paths):
+        """Full path of a directory record, memoised; unknown parents land in $Orphan"""
+        chain = []
+        while number not in paths:
+            if number not in directories or len(chain) > 255:
+                paths[number] = '/$Orphan'
+                break
+            chain.append(number)
+            number = directories[number][0]
+        path = paths[number]
+        for child in reversed(chain):
+            path = f"{path}/{directories[child][1]}"
+            paths[child] = path
+        return path
+
+    def byte_ranges(self, entry):
+        """(image_offset, length, file_offset) runs holding the file's data"""
+        if entry.resident is not None:
+            return list(entry.resident)
+        ranges = []
+        file_offset = 0
+        for lcn, count in entry.runs or ():
+            length = min(count * self.cluster_size, entry.size - file_offset)
+            if length <= 0:
+                break
+            if lcn is not None:
+                ranges.append((lcn * self.cluster_size, length, file_offset))
+            file_offset += length
+        return ranges
@@ -0,0 +1,362 @@
+import io
+import os
+import re
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .file_types import category_for
+from .hashing import HashService
+from .image import DiskImage
+
+
+MB = 1024 * 1024
+
+DEFAULT_PREVIEW_DIR = os.path.join(os.path.expanduser("~"), ".phoenix_restore", "previews")
+
+# Stored previews by kind; thumbnails are PNG, snippets and hex dumps UTF-8
+_SUFFIXES = {'image': '.png', 'text': '.txt', 'hex': '.hex'}
+_KINDS = {suffix: kind for kind, suffix in _SUFFIXES.items()}
+
+_PDF_STREAM = re.compile(rb'stream\r?\n(.*?)\r?\nendstream', re.S)
+_PDF_TEXT = re.compile(rb'\[(.*?)\]\s*TJ|\((.*?)(?<!\\)\)\s*(?:Tj|\'|")', re.S)
+_PDF_STRING = re.compile(rb'\((.*?)(?<!\\)\)', re.S)
+
+
+class Preview:
+    """A thumbnail, text snippet or hex dump of one file"""
+
+    __slots__ = ('kind', 'key', 'data', 'width', 'height')
+
+    def __init__(self, kind, key, data, width=0, height=0):
+        self.kind = kind  # 'image' (PNG bytes), 'text' or 'hex' (str)
+        self.key = key
+        self.data = data
+        self.width = width
+        self.height = height
+
+    @property
+    def weight(self):
+        """Approximate bytes held, for the cache bound"""
+        return len(self.data)
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'key': self.key,
+            'width': self.width,
+            'height': self.height
+        }
+
+    def __repr__(self):
+        return f"Preview({self.kind!r}, {self.key!r}, {self.weight} bytes)"
+
+
+class PreviewCache:
+    """Byte-bounded LRU of previews in memory, backed by files on disk
+
+    Previews are keyed by a digest of the file's contents, so a file seen
+    under another name, by another scan or in another session is served
+    without being read again. The disk cache is trimmed, oldest first,
+    once it grows past max_disk_bytes.
+    """
+
+    def __init__(self, directory=None, max_bytes=64 * MB, max_disk_bytes=512 * MB):
+        self.directory = directory or DEFAULT_PREVIEW_DIR
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._disk_bytes = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key, kind):
+        return os.path.join(self.directory, key[:2], key + _SUFFIXES[kind])
+
+    def get(self, key):
+        """The cached Preview for a content key, or None"""
+        with self._lock:
+            preview = self._entries.get(key)
+            if preview is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return preview
+
+        preview = self._load(key)
+        with self._lock:
+            if preview is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(preview)
+        return preview
+
+    def put(self, preview):
+        with self._lock:
+            self._remember(preview)
+        self._store(preview)
+
+    def _remember(self, preview):
+        old = self._entries.pop(preview.key, None)
+        if old is not None:
+            self._bytes -= old.weight
+        self._entries[preview.key] = preview
+        self._bytes += preview.weight
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.weight
+
+    def _load(self, key):
+        folder = os.path.join(self.directory, key[:2])
+        for suffix, kind in _KINDS.items():
+            path = os.path.join(folder, key + suffix)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            if kind == 'image':
+                width, height = _png_size(data)
+                return Preview(kind, key, data, width, height)
+            return Preview(kind, key, data.decode('utf-8', 'replace'))
+        return None
+
+    def _store(self, preview):
+        path = self._path(preview.key, preview.kind)
+        data = preview.data if preview.kind == 'image' else preview.data.encode('utf-8')
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written aside and renamed, so a reader never sees half a file
+            partial = f"{path}.{threading.get_ident()}.tmp"
+            with open(partial, 'wb') as f:
+                f.write(data)
+            os.replace(partial, path)
+        except OSError:
+            # Previews still work from memory on a read-only home directory
+            return
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._measure()
+            else:
+                self._disk_bytes += len(data)
+            over = self._disk_bytes > self.max_disk_bytes
+        if over:
+            self._trim()
+
+    def _files(self):
+        for folder in os.scandir(self.directory):
+            if folder.is_dir():
+                for entry in os.scandir(folder.path):
+                    if entry.name.endswith(tuple(_KINDS)):
+                        yield entry
+
+    def _measure(self):
+        try:
+            return sum(entry.stat().st_size for entry in self._files())
+        except OSError:
+            return 0
+
+    def _trim(self):
+        """Delete the least recently written previews down to 3/4 of the disk bound"""
+        try:
+            entries = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                              for entry in self._files()))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        target = self.max_disk_bytes * 3 // 4
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+
+
+def _png_size(data):
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+    return 0, 0
+
+
+class PreviewGenerator:
+    """Builds previews off the UI thread and caches them by content
+
+    Images are decoded at reduced size (JPEG draft mode, then Pillow's
+    reducing thumbnail) into a small PNG; text and the first page of a PDF
+    become a snippet; anything else, or any file Pillow cannot read, a hex
+    dump of its head. request() runs on a small pool and drops queued work
+    that a newer request has superseded, so holding down an arrow key
+    over thousands of rows only renders the rows the user stops on.
+    """
+
+    def __init__(self, cache=None, hasher=None, thumbnail_size=(256, 256), text_bytes=8192,
+                 hex_bytes=512, max_image_bytes=64 * MB, workers=2):
+        self.cache = cache if cache is not None else PreviewCache()
+        self.hasher = hasher if hasher is not None else HashService()
+        self.thumbnail_size = thumbnail_size
+        self.text_bytes = text_bytes
+        self.hex_bytes = hex_bytes
+        self.max_image_bytes = max_image_bytes
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._pending = None
+        self._prefetching = []
+        self._lock = threading.Lock()
+        self._images = {}
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        with self._lock:
+            for image in self._images.values():
+                image.close()
+            self._images.clear()
+
+    def request(self, record, callback):
+        """Build record's preview in the background and call callback(record, preview_or_error)
+
+        An earlier request that has not started yet is cancelled. callback
+        runs on a worker thread; hand it to the UI thread from there.
+        """
+        with self._lock:
+            if self._pending is not None:
+                self._pending.cancel()
+            for future in self._prefetching:
+                future.cancel()
+            self._prefetching = []
+            self._pending = self._pool.submit(self._run, record, callback)
+            return self._pending
+
+    def prefetch(self, records):
+        """Warm the cache for rows the user is likely to look at next"""
+        with self._lock:
+            self._prefetching.extend(self._pool.submit(self._quietly, record) for record in records)
+
+    def _run(self, record, callback):
+        try:
+            callback(record, self.preview(record))
+        except Exception as e:
+            callback(record, e)
+
+    def _quietly(self, record):
+        try:
+            self.preview(record)
+        except Exception:
+            pass
+
+    def key(self, record):
+        """Content key of a record: a digest of its size, head and tail"""
+        if record.image is None:
+            return self.hasher.partial_hash(record.path)
+        return self.hasher.partial_hash_extents(self._image(record.image), record.extents or [], record.size)
+
+    def preview(self, record):
+        """Preview of a ScanResult, from the cache when its contents were seen before"""
+        key = self.key(record)
+        preview = self.cache.get(key)
+        if preview is None:
+            preview = self._build(record, key)
+            self.cache.put(preview)
+        return preview
+
+    def _read(self, record, length):
+        if record.image is None:
+            with open(record.path, 'rb') as f:
+                return f.read(length)
+        return self._image(record.image).read_extents(record.extents or [], 0, min(length, record.size))
+
+    def _image(self, path):
+        with self._lock:
+            image = self._images.get(path)
+            if image is None:
+                image = self._images[path] = DiskImage(path)
+            return image
+
+    def _build(self, record, key):
+        category = record.category or category_for(record.path)
+        head = self._read(record, max(self.text_bytes, self.hex_bytes))
+        if category == 'images' and record.size <= self.max_image_bytes:
+            preview = self._thumbnail(record, key)
+            if preview is not None:
+                return preview
+        if head.startswith(b'%PDF'):
+            text = self._pdf_text(record)
+            if text:
+                return Preview('text', key, text)
+        text = _as_text(head)
+        if text is not None:
+            return Preview('text', key, text)
+        return Preview('hex', key, _hex_dump(head[:self.hex_bytes]))
+
+    def _thumbnail(self, record, key):
+        try:
+            from PIL import Image
+        except ImportError:
+            return None
+        source = record.path if record.image is None else io.BytesIO(self._read(record, record.size))
+        try:
+            with Image.open(source) as picture:
+                # JPEG decodes straight to 1/2, 1/4 or 1/8 scale in draft mode
+                picture.draft('RGB', self.thumbnail_size)
+                picture.thumbnail(self.thumbnail_size, reducing_gap=2.0)
+                if picture.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+                    picture = picture.convert('RGB')
+                output = io.BytesIO()
+                picture.save(output, 'PNG', optimize=False, compress_level=1)
+                return Preview('image', key, output.getvalue(), picture.width, picture.height)
+        except Exception:
+            # Truncated or partly overwritten images are common in recovery
+            return None
+
+    def _pdf_text(self, record):
+        """Text shown by the first content streams of a PDF, best effort"""
+        data = self._read(record, min(record.size, 4 * MB))
+        pieces = []
+        for match in _PDF_STREAM.finditer(data):
+            stream = match.group(1)
+            try:
+                stream = zlib.decompress(stream)
+            except zlib.error:
+                pass
+            for array, string in _PDF_TEXT.findall(stream):
+                if array:
+                    pieces.append(b''.join(_PDF_STRING.findall(array)))
+                else:
+                    pieces.append(string)
+            if sum(len(piece) for piece in pieces) >= self.text_bytes:
+                break
+        text = b' '.join(pieces).replace(b'\\(', b'(').replace(b'\\)', b')')
+        return text.decode('latin-1')[:self.text_bytes].strip()
+
+
+def _as_text(data):
+    """data decoded as text, or None when it looks binary"""
+    if not data or b'\x00' in data:
+        return None
+    control = sum(1 for byte in data[:1024] if byte < 32 and byte not in (9, 10, 12, 13, 27))
+    if control * 20 >= min(len(data), 1024):
+        return None
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # A character cut in half at the end of the head is still UTF-8
+        if e.start >= len(data) - 3:
+            return data[:e.start].decode('utf-8')
+        return data.decode('latin-1')
+
+
+def _hex_dump(data):
+    lines = []
+    for offset in range(0, len(data), 16):
+        row = data[offset:offset + 16]
+        text = ''.join(chr(byte) if 32 <= byte < 127 else '.' for byte in row)
+        hex_bytes = ' '.join(f"{byte:02x}" for byte in row)
+        lines.append(f"{offset:08x}  {hex_bytes:<47}  {text}")
+    return "\n".join(lines)
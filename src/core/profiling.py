@@ -0,0 +1,99 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+
+
+class ProfileCapture:
+    """cProfile and tracemalloc over a stretch of work, written to a directory
+
+    Before Python 3.12 cProfile only sees the thread that enables it, so
+    every thread started while the capture runs gets its own profiler and
+    the results are merged; from 3.12 one profiler sees every thread.
+    Writes profile.pstats (for pstats or snakeviz), profile.txt with the
+    top functions by cumulative time and memory.txt with the lines holding
+    the most memory at the end.
+    """
+
+    def __init__(self, directory, cpu=True, memory=True, top=30, frames=8):
+        self.directory = directory
+        self.cpu = cpu
+        self.memory = memory
+        self.top = top
+        self.frames = frames
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._running = False
+
+    def _thread_hook(self, frame, event, arg):
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        # Replaces this hook for the rest of the thread
+        profile.enable()
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._running = True
+        if self.memory:
+            tracemalloc.start(self.frames)
+        if self.cpu:
+            if sys.version_info < (3, 12):
+                threading.setprofile(self._thread_hook)
+            profile = cProfile.Profile()
+            self._profiles.append(profile)
+            profile.enable()
+        return self
+
+    def stop(self):
+        """Stop capturing and write the reports; returns a summary dict, or None if not running"""
+        if not self._running:
+            return None
+        self._running = False
+        summary = {'directory': self.directory}
+        if self.cpu:
+            threading.setprofile(None)
+            self._profiles[0].disable()
+            stats = None
+            with self._lock:
+                profiles, self._profiles = self._profiles, []
+            for profile in profiles:
+                try:
+                    if stats is None:
+                        stats = pstats.Stats(profile)
+                    else:
+                        stats.add(profile)
+                except TypeError:
+                    # A thread that never ran a profiled call has no stats
+                    continue
+            if stats is not None:
+                path = os.path.join(self.directory, 'profile.pstats')
+                stats.dump_stats(path)
+                text = io.StringIO()
+                pstats.Stats(path, stream=text).sort_stats('cumulative').print_stats(self.top)
+                with open(os.path.join(self.directory, 'profile.txt'), 'w', encoding='utf-8') as f:
+                    f.write(text.getvalue())
+                summary['profile'] = path
+            summary['threads'] = len(profiles)
+
+        if self.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            top = snapshot.statistics('lineno')[:self.top]
+            with open(os.path.join(self.directory, 'memory.txt'), 'w', encoding='utf-8') as f:
+                f.write(f"traced now {current} bytes, peak {peak} bytes\n\n")
+                for statistic in top:
+                    f.write(f"{statistic}\n")
+            summary.update(traced_bytes=current, traced_peak=peak,
+                           memory=os.path.join(self.directory, 'memory.txt'))
+        return summary
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
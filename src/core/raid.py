@@ -0,0 +1,444 @@
+import itertools
+import threading
+from collections import OrderedDict
+
+from .image import DiskImage
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+KB = 1024
+
+RAID_LEVELS = ('RAID0', 'RAID1', 'RAID5', 'RAID6', 'RAID10')
+
+# Where parity sits in each stripe row and where the data after it resumes,
+# named as Linux md names them
+PARITY_LAYOUTS = ('left-symmetric', 'left-asymmetric', 'right-symmetric', 'right-asymmetric')
+
+STRIPE_SIZES = tuple(KB << shift for shift in range(2, 11))  # 4 KB .. 1 MB
+
+_PARITY_COUNT = {'RAID5': 1, 'RAID6': 2}
+
+
+class RaidError(Exception):
+    """Raised when members cannot be assembled into the requested array"""
+
+
+class RaidLayout:
+    """Geometry of a RAID array: what detect_layout() finds and RaidVolume needs"""
+
+    __slots__ = ('level', 'stripe_size', 'order', 'parity_layout', 'data_offset', 'score')
+
+    def __init__(self, level, stripe_size, order, parity_layout='left-symmetric', data_offset=0, score=None):
+        self.level = level
+        self.stripe_size = stripe_size
+        self.order = tuple(order)  # order[slot] is the index of the member in that slot
+        self.parity_layout = parity_layout
+        self.data_offset = data_offset  # bytes before the first stripe on every member
+        self.score = score  # lower is better; None unless detected
+
+    def to_dict(self):
+        return {
+            'level': self.level,
+            'stripe_size': self.stripe_size,
+            'order': list(self.order),
+            'parity_layout': self.parity_layout,
+            'data_offset': self.data_offset,
+            'score': self.score
+        }
+
+    def __repr__(self):
+        return (f"RaidLayout({self.level!r}, stripe_size={self.stripe_size}, order={self.order}, "
+                f"parity_layout={self.parity_layout!r})")
+
+
+def xor_blocks(blocks):
+    """Bytewise XOR of equal-length buffers, vectorised with NumPy when available"""
+    if numpy is not None:
+        length = len(blocks[0])
+        dtype = numpy.uint64 if length % 8 == 0 else numpy.uint8
+        stacked = numpy.frombuffer(b''.join(blocks), dtype=dtype).reshape(len(blocks), -1)
+        return numpy.bitwise_xor.reduce(stacked, axis=0).tobytes()
+    # Python integers XOR a whole buffer in one C loop too
+    result = 0
+    for block in blocks:
+        result ^= int.from_bytes(block, 'little')
+    return result.to_bytes(len(blocks[0]), 'little')
+
+
+def parity_slots(level, parity_layout, row, count):
+    """Slots holding P (and Q for RAID6) in a stripe row of count members"""
+    parities = _PARITY_COUNT.get(level, 0)
+    if not parities:
+        return ()
+    if parity_layout.startswith('left'):
+        p = count - 1 - row % count
+    else:
+        p = row % count
+    return tuple((p + i) % count for i in range(parities))
+
+
+def data_slots(level, parity_layout, row, count):
+    """Slots holding a stripe row's data chunks, in logical order"""
+    parity = parity_slots(level, parity_layout, row, count)
+    if not parity:
+        return tuple(range(count))
+    if parity_layout.endswith('asymmetric'):
+        return tuple(slot for slot in range(count) if slot not in parity)
+    # Symmetric layouts resume right after the last parity chunk and wrap
+    start = parity[-1] + 1
+    return tuple((start + i) % count for i in range(count - len(parity)))
+
+
+class RaidVolume(DiskImage):
+    """Read-only linear view of a RAID array assembled from member images
+
+    Behaves like a DiskImage, so the ext4, NTFS and FAT readers and the
+    carver read the assembled volume directly; nothing is written out.
+    Members are paths, open DiskImages or None for a missing disk. A
+    RAID5 array, or a RAID6 array missing one disk, rebuilds the missing
+    member's chunks by XOR-ing the rest of their stripe row; rebuilt
+    chunks are kept in a small LRU, since readers come back to the same
+    metadata blocks many times. Mirrors (RAID1, RAID10) read whichever
+    copy is present.
+    """
+
+    def __init__(self, members, layout, cache_chunks=64):
+        if layout.level not in RAID_LEVELS:
+            raise RaidError(f"Unsupported RAID level: {layout.level}")
+        if layout.level != 'RAID1' and layout.stripe_size <= 0:
+            raise RaidError("Stripe size must be positive")
+        if sorted(layout.order) != list(range(len(members))):
+            raise RaidError("Member order must name every member once")
+        if layout.level == 'RAID10' and len(members) % 2:
+            raise RaidError("RAID10 needs an even number of members")
+
+        self.layout = layout
+        self._owned = []
+        self._members = []
+        for member in members:
+            if member is not None and not isinstance(member, DiskImage):
+                member = DiskImage(member)
+                self._owned.append(member)
+            self._members.append(member)
+        self._slots = [self._members[index] for index in layout.order]
+
+        present = [member for member in self._members if member is not None]
+        if not present:
+            raise RaidError("No member images given")
+        self.path = f"{layout.level.lower()}:" + ",".join(member.path for member in present)
+        self._check_missing()
+
+        member_size = min(member.size for member in present) - layout.data_offset
+        count = len(self._slots)
+        if layout.level == 'RAID1':
+            self.size = max(0, member_size)
+            self._data_per_row = 1
+        else:
+            rows = max(0, member_size) // layout.stripe_size
+            if layout.level == 'RAID10':
+                self._data_per_row = count // 2
+            else:
+                self._data_per_row = count - _PARITY_COUNT.get(layout.level, 0)
+            self.size = rows * self._data_per_row * layout.stripe_size
+
+        self.window_size = layout.stripe_size or 1
+        self.max_windows = 0
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+        self.mapped = False
+        self._rebuilt = OrderedDict()
+        self._cache_chunks = cache_chunks
+        self.rebuilt_chunks = 0
+
+    def _check_missing(self):
+        missing = [slot for slot, member in enumerate(self._slots) if member is None]
+        level = self.layout.level
+        if not missing:
+            return
+        if level == 'RAID0':
+            raise RaidError("RAID0 keeps no redundancy; every member is needed")
+        if level == 'RAID1' and len(missing) == len(self._slots):
+            raise RaidError("Every RAID1 member is missing")
+        if level == 'RAID10':
+            for pair in range(0, len(self._slots), 2):
+                if pair in missing and pair + 1 in missing:
+                    raise RaidError(f"Both members of RAID10 mirror {pair // 2} are missing")
+        if level in _PARITY_COUNT and len(missing) > 1:
+            # Two lost disks need RAID6's Reed-Solomon Q syndrome, not plain XOR
+            raise RaidError(f"{level} can be rebuilt from XOR parity with one missing member, "
+                            f"not {len(missing)}")
+
+    def close(self):
+        for member in self._owned:
+            member.close()
+        self._owned = []
+
+    def _readahead(self, offset, length):
+        pass
+
+    def _pread(self, offset, length):
+        length = max(0, min(length, self.size - offset))
+        if self.layout.level == 'RAID1':
+            return self._read_member(self._first_present(range(len(self._slots))),
+                                     self.layout.data_offset + offset, length)
+
+        stripe = self.layout.stripe_size
+        pieces = []
+        end = offset + length
+        while offset < end:
+            chunk, within = divmod(offset, stripe)
+            step = min(stripe - within, end - offset)
+            pieces.append(self._read_chunk(chunk, within, step))
+            offset += step
+        return b''.join(pieces)
+
+    def _first_present(self, slots):
+        for slot in slots:
+            if self._slots[slot] is not None:
+                return slot
+        return None
+
+    def _read_member(self, slot, offset, length):
+        view = self._slots[slot].view(offset, length)
+        data = view.tobytes()
+        view.release()
+        return data
+
+    def _read_chunk(self, chunk, within, length):
+        """length bytes at within of the chunk-th data chunk of the volume"""
+        layout = self.layout
+        row, index = divmod(chunk, self._data_per_row)
+        member_offset = layout.data_offset + row * layout.stripe_size
+
+        if layout.level == 'RAID0':
+            return self._read_member(index, member_offset + within, length)
+        if layout.level == 'RAID10':
+            # Near layout: chunk i lives on both members of mirror pair i
+            slot = self._first_present((2 * index, 2 * index + 1))
+            return self._read_member(slot, member_offset + within, length)
+
+        count = len(self._slots)
+        slot = data_slots(layout.level, layout.parity_layout, row, count)[index]
+        if self._slots[slot] is not None:
+            return self._read_member(slot, member_offset + within, length)
+        return self._rebuild(slot, row, member_offset)[within:within + length]
+
+    def _rebuild(self, slot, row, member_offset):
+        """A missing member's whole chunk in a stripe row, from the row's P parity"""
+        key = (slot, row)
+        with self._lock:
+            data = self._rebuilt.get(key)
+            if data is not None:
+                self._rebuilt.move_to_end(key)
+                return data
+
+        layout = self.layout
+        count = len(self._slots)
+        parity = parity_slots(layout.level, layout.parity_layout, row, count)
+        # P is the XOR of the data chunks, so any one of them is the XOR of
+        # P and the others; RAID6's Q chunk plays no part
+        others = [other for other in range(count)
+                  if other != slot and other not in parity[1:]]
+        data = xor_blocks([self._read_member(other, member_offset, layout.stripe_size)
+                           for other in others])
+        with self._lock:
+            self._rebuilt[key] = data
+            self.rebuilt_chunks += 1
+            while len(self._rebuilt) > self._cache_chunks:
+                self._rebuilt.popitem(last=False)
+        return data
+
+
+# Byte classes for the continuity score: zero, text, other
+_CLASSES = bytes(0 if byte == 0 else 1 if 9 <= byte < 127 else 2 for byte in range(256))
+
+
+def _edge_profile(data):
+    """(zeros, text, other) counts of an edge of a chunk"""
+    classes = data.translate(_CLASSES)
+    return classes.count(0), classes.count(1), classes.count(2)
+
+
+def detect_layout(members, level, stripe_sizes=STRIPE_SIZES, parity_layouts=None, data_offset=0,
+                  windows=16, window_rows=32, edge=512, max_orders=5040):
+    """Best-scoring RaidLayout for members, found by scoring candidate geometries
+
+    Files are mostly stored contiguously, so in the right geometry the end
+    of each chunk looks like the start of the chunk placed after it (text
+    runs into text, zeros into zeros) while a wrong stripe size, member
+    order or parity layout puts unrelated data side by side. Each chunk
+    edge is profiled by its mix of zero, text and other bytes, and every
+    candidate is scored by the mean mismatch across its chunk boundaries
+    relative to arbitrarily paired edges, so stripe sizes compare.
+
+    Only the edges of windows runs of window_rows stripe rows, spread over
+    the members, are read. Parity rotates with a period of one row per
+    member, so edge mismatches are summed per member pair and row phase
+    once per stripe size, and scoring a candidate is a few lookups.
+    """
+    if level not in RAID_LEVELS:
+        raise RaidError(f"Unsupported RAID level: {level}")
+    if level == 'RAID1':
+        return RaidLayout(level, 0, range(len(members)), data_offset=data_offset, score=0.0)
+    if any(member is None for member in members):
+        raise RaidError("Layout detection needs every member")
+    if parity_layouts is None:
+        parity_layouts = PARITY_LAYOUTS if level in _PARITY_COUNT else ('left-symmetric',)
+
+    owned = []
+    images = []
+    for member in members:
+        if not isinstance(member, DiskImage):
+            member = DiskImage(member)
+            owned.append(member)
+        images.append(member)
+
+    try:
+        count = len(images)
+        if level == 'RAID10':
+            # Mirror pairs hold identical data; only the order of pairs matters
+            pairs = _mirror_pairs(images, data_offset)
+            images = [images[pair[0]] for pair in pairs]
+        else:
+            pairs = None
+        period = count if level in _PARITY_COUNT else 1
+        orders = list(itertools.islice(itertools.permutations(range(len(images))), max_orders))
+        member_size = min(image.size for image in images) - data_offset
+
+        candidates = []
+        for stripe_size in sorted(stripe_sizes):
+            rows = member_size // stripe_size
+            if rows < 2:
+                break
+            length = min(window_rows, rows)
+            # Window starts keep the row phase, so sums line up with parity
+            starts = sorted({(rows - length) * i // max(1, windows - 1) // period * period
+                             for i in range(windows)})
+            heads, tails = _profiles(images, data_offset, stripe_size, starts, length,
+                                     min(edge, stripe_size // 2))
+            within, across, baseline = _boundary_sums(heads, tails, starts, length, period)
+            if not baseline:
+                continue
+            best = None
+            for parity_layout in parity_layouts:
+                for order in orders:
+                    score = _score(level, parity_layout, order, within, across, count)
+                    if score is not None and (best is None or score / baseline < best[0]):
+                        best = (score / baseline, stripe_size, order, parity_layout)
+            if best is not None:
+                candidates.append(best)
+        if not candidates:
+            raise RaidError("The members hold too little data to detect a layout")
+
+        score, stripe_size, order, parity_layout = min(candidates, key=lambda candidate: candidate[0])
+        if pairs is not None:
+            order = [member for unit in order for member in pairs[unit]]
+        return RaidLayout(level, stripe_size, order, parity_layout, data_offset, score)
+    finally:
+        for image in owned:
+            image.close()
+
+
+def _mirror_pairs(images, data_offset, probe=64 * KB):
+    """Members grouped into identical pairs, by comparing a sample of each"""
+    samples = [image.read_at(data_offset, probe) + image.read_at(image.size // 2, probe) for image in images]
+    pairs = []
+    unpaired = list(range(len(images)))
+    while unpaired:
+        first = unpaired.pop(0)
+        twin = next((other for other in unpaired if samples[other] == samples[first]), None)
+        if twin is None:
+            raise RaidError(f"Member {first} of a RAID10 array has no identical mirror")
+        unpaired.remove(twin)
+        pairs.append((first, twin))
+    return pairs
+
+
+def _profiles(images, data_offset, stripe_size, starts, length, edge):
+    """Head and tail edge profiles of the sampled chunks: heads[member][row]"""
+    heads = []
+    tails = []
+    for image in images:
+        member_heads = {}
+        member_tails = {}
+        for first in starts:
+            for row in range(first, first + length):
+                start = data_offset + row * stripe_size
+                member_heads[row] = _edge_profile(image.read_at(start, edge))
+                member_tails[row] = _edge_profile(image.read_at(start + stripe_size - edge, edge))
+        heads.append(member_heads)
+        tails.append(member_tails)
+    return heads, tails
+
+
+def _mismatch(tail, head):
+    """Difference between two edge profiles, or None when both are all zeros"""
+    if tail[1] == tail[2] == 0 and head[1] == head[2] == 0:
+        # Zeros meeting zeros say nothing about the layout
+        return None
+    return abs(tail[0] - head[0]) + abs(tail[1] - head[1]) + abs(tail[2] - head[2])
+
+
+def _boundary_sums(heads, tails, starts, length, period):
+    """Edge mismatches summed by row phase and member pair, plus a baseline
+
+    within[phase][a][b] holds (total, count) for the tail of member a's
+    chunk meeting the head of member b's chunk in the same row, across
+    the same for b's chunk in the next row. The baseline is the mean
+    mismatch of edges paired with no regard to any layout.
+    """
+    count = len(heads)
+    within = [[[[0, 0] for _ in range(count)] for _ in range(count)] for _ in range(period)]
+    across = [[[[0, 0] for _ in range(count)] for _ in range(count)] for _ in range(period)]
+    total = pairs = 0
+    sampled = [row for first in starts for row in range(first, first + length)]
+    for first in starts:
+        for row in range(first, first + length):
+            phase = row % period
+            for a in range(count):
+                tail = tails[a][row]
+                for b in range(count):
+                    if b != a:
+                        mismatch = _mismatch(tail, heads[b][row])
+                        if mismatch is not None:
+                            within[phase][a][b][0] += mismatch
+                            within[phase][a][b][1] += 1
+                    if row + 1 < first + length:
+                        mismatch = _mismatch(tail, heads[b][row + 1])
+                        if mismatch is not None:
+                            across[phase][a][b][0] += mismatch
+                            across[phase][a][b][1] += 1
+                # A fixed scatter of other members and rows
+                other = sampled[(row * 7 + a * 13 + 3) % len(sampled)]
+                mismatch = _mismatch(tail, heads[(a + 1 + row) % count][other])
+                if mismatch is not None:
+                    total += mismatch
+                    pairs += 1
+    return within, across, total / pairs if pairs else 0.0
+
+
+def _score(level, parity_layout, order, within, across, count):
+    """Mean edge mismatch over the informative chunk boundaries of a candidate, or None"""
+    total = boundaries = 0
+    period = len(within)
+    for phase in range(period):
+        if level in _PARITY_COUNT:
+            members = [order[slot] for slot in data_slots(level, parity_layout, phase, count)]
+            following = order[data_slots(level, parity_layout, phase + 1, count)[0]]
+        else:
+            members = order
+            following = order[0]
+        sums = within[phase]
+        for a, b in zip(members, members[1:]):
+            total += sums[a][b][0]
+            boundaries += sums[a][b][1]
+        last = across[phase][members[-1]][following]
+        total += last[0]
+        boundaries += last[1]
+    if not boundaries:
+        return None
+    return total / boundaries
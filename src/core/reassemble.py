@@ -0,0 +1,889 @@
+import re
+import struct
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import deque
+from functools import lru_cache
+
+from .image import DiskImage
+
+
+MB = 1024 * 1024
+
+# Enough for the APP segments (EXIF and its thumbnail, ICC profiles) that
+# come before a JPEG's scan
+JPEG_HEADER_LIMIT = 1 * MB
+
+# A marker other than stuffing, a restart or the end of image cannot occur
+# in the entropy-coded data of a baseline scan
+_JPEG_FOREIGN_MARKER = re.compile(rb'\xff[^\x00\xd0-\xd7\xd9\xff]')
+
+# Bits kept in the decoder's accumulator; refills stop at 32 or more live bits
+_ACC_MASK = (1 << 64) - 1
+
+# Decompressor snapshots kept while looking for the cluster where a zip
+# entry's data breaks off; each holds a 32 KB window
+_ZIP_CHECKPOINTS = 64
+
+
+class ReassembledFile:
+    """Outcome of checking, and if needed reassembling, one carved file"""
+
+    __slots__ = ('carved', 'fragments', 'status', 'confidence', 'reason')
+
+    def __init__(self, carved, fragments, status, confidence=None, reason=None):
+        self.carved = carved
+        self.fragments = fragments  # [(image_offset, length)] in file order
+        self.status = status  # 'intact', 'reassembled', 'unresolved' or 'unchecked'
+        self.confidence = confidence  # 0 to 1; None when the format is not checked
+        self.reason = reason
+
+    @property
+    def length(self):
+        return sum(length for _, length in self.fragments)
+
+    @property
+    def extents(self):
+        """Fragments as (image_offset, length, file_offset) runs, as ScanResult keeps them"""
+        runs = []
+        position = 0
+        for offset, length in self.fragments:
+            runs.append((offset, length, position))
+            position += length
+        return runs
+
+    def to_dict(self):
+        return {
+            'status': self.status,
+            'confidence': self.confidence,
+            'reason': self.reason,
+            'fragments': [list(fragment) for fragment in self.fragments]
+        }
+
+    def __repr__(self):
+        return (f"ReassembledFile({self.carved.name!r}, {self.status!r}, "
+                f"fragments={len(self.fragments)}, confidence={self.confidence})")
+
+
+class _Corrupt(Exception):
+    """A file's structure stops making sense at offset"""
+
+    def __init__(self, offset, reason):
+        super().__init__(reason)
+        self.offset = offset
+        self.reason = reason
+
+
+class _Claims:
+    """Sorted, non-overlapping byte ranges of the image already owned by a file"""
+
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+
+    def add(self, start, end):
+        first = bisect_left(self._ends, start)
+        last = bisect_right(self._starts, end)
+        if first < last:
+            start = min(start, self._starts[first])
+            end = max(end, self._ends[last - 1])
+        self._starts[first:last] = [start]
+        self._ends[first:last] = [end]
+
+    def covers(self, start, end):
+        """Whether any byte of [start, end) is claimed"""
+        index = bisect_right(self._starts, start)
+        if index and self._ends[index - 1] > start:
+            return True
+        return index < len(self._starts) and self._starts[index] < end
+
+
+class _JpegScan:
+    """Huffman tables and MCU layout of a baseline JPEG's scan"""
+
+    __slots__ = ('blocks', 'mcus', 'restart_interval', 'data_start', 'dc_limits', 'baseline')
+
+    def __init__(self, blocks, mcus, restart_interval, data_start, dc_limits, baseline):
+        self.blocks = blocks  # (dc_table, ac_table, component) for each block of an MCU
+        self.mcus = mcus
+        self.restart_interval = restart_interval
+        self.data_start = data_start
+        self.dc_limits = dc_limits  # largest quantised DC value each component can hold
+        self.baseline = baseline  # False for progressive, lossless and arithmetic coding
+
+    def initial_state(self):
+        return (self.data_start, 0, 0, 0, 0, -1, 0, (0,) * len(self.dc_limits))
+
+
+@lru_cache(maxsize=64)
+def _huffman_lookup(counts, symbols, ac):
+    """Table of 2^16 entries indexed by the next 16 bits, 0 where no valid code starts
+
+    DC entries are code length << 8 | size of the difference that follows.
+    AC entries are (code length + coefficient bits) << 8 | positions the
+    symbol advances through the block, 0 for end of block; symbols
+    baseline decoding cannot produce are left out.
+    """
+    table = [0] * 65536
+    code = 0
+    index = 0
+    for length in range(1, 17):
+        for _ in range(counts[length - 1]):
+            if code >= 1 << length:
+                raise ValueError("over-subscribed Huffman table")
+            symbol = symbols[index]
+            size = symbol & 15
+            if not ac:
+                entry = length << 8 | symbol if symbol <= 11 else 0
+            elif size:
+                entry = (length + size) << 8 | (symbol >> 4) + 1 if size <= 10 else 0
+            elif symbol == 0xF0:
+                entry = length << 8 | 16
+            else:
+                entry = length << 8 if symbol == 0 else 0
+            span = 1 << (16 - length)
+            table[code * span:(code + 1) * span] = [entry] * span
+            code += 1
+            index += 1
+        code <<= 1
+    return table
+
+
+def _parse_jpeg(data):
+    """_JpegScan for the JPEG whose head is data; raises _Corrupt"""
+    if data[:2] != b'\xff\xd8':
+        raise _Corrupt(0, "no start of image marker")
+    tables = {}
+    quantisers = {}
+    frame = None
+    baseline = True
+    restart_interval = 0
+    pos = 2
+    while True:
+        if pos + 4 > len(data):
+            raise _Corrupt(pos, "header runs past what was read")
+        if data[pos] != 0xFF:
+            raise _Corrupt(pos, "expected a marker in the header")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            pos += 2
+            continue
+        if marker == 0xD9:
+            raise _Corrupt(pos, "image ends before its scan")
+        length = struct.unpack_from('>H', data, pos + 2)[0]
+        segment = data[pos + 4:pos + 2 + length]
+        if length < 2 or len(segment) != length - 2:
+            raise _Corrupt(pos, "header segment runs past what was read")
+
+        try:
+            if marker == 0xDB:
+                index = 0
+                while index < len(segment):
+                    precision, table = segment[index] >> 4, segment[index] & 15
+                    if precision:
+                        quantisers[table] = struct.unpack_from('>H', segment, index + 1)[0]
+                        index += 129
+                    else:
+                        quantisers[table] = segment[index + 1]
+                        index += 65
+            elif marker == 0xC4:
+                index = 0
+                while index < len(segment):
+                    counts = bytes(segment[index + 1:index + 17])
+                    total = sum(counts)
+                    symbols = bytes(segment[index + 17:index + 17 + total])
+                    if len(counts) != 16 or len(symbols) != total:
+                        raise _Corrupt(pos, "damaged Huffman table")
+                    tables[segment[index]] = _huffman_lookup(counts, symbols, segment[index] >> 4 == 1)
+                    index += 17 + total
+            elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                baseline = baseline and marker in (0xC0, 0xC1)
+                precision, height, width, count = struct.unpack_from('>BHHB', segment)
+                components = {}
+                for index in range(count):
+                    ident, sampling, table = segment[6 + 3 * index:9 + 3 * index]
+                    components[ident] = (sampling >> 4, sampling & 15, table)
+                if not (width and height and components):
+                    raise _Corrupt(pos, "image has no size")
+                frame = (precision, width, height, components)
+            elif marker == 0xDD:
+                restart_interval = struct.unpack_from('>H', segment)[0]
+            elif marker == 0xDA:
+                pos += 2 + length
+                break
+        except (struct.error, ValueError, IndexError):
+            raise _Corrupt(pos, "damaged header segment")
+        pos += 2 + length
+
+    if frame is None:
+        raise _Corrupt(pos, "scan before the frame header")
+    precision, width, height, components = frame
+    count = segment[0]
+    scanned = [(segment[1 + 2 * index], segment[2 + 2 * index]) for index in range(count)]
+    spectral = bytes(segment[1 + 2 * count:4 + 2 * count])
+    if len(scanned) < len(components) or spectral != b'\x00\x3f\x00':
+        # Later scans of a multi-scan image are not checked
+        baseline = False
+    if not baseline:
+        return _JpegScan([], 0, restart_interval, pos, (), False)
+
+    h_max = max(h for h, _, _ in components.values())
+    v_max = max(v for _, v, _ in components.values())
+    blocks = []
+    limits = []
+    for index, (ident, selectors) in enumerate(scanned):
+        if ident not in components:
+            raise _Corrupt(pos, "scan names an unknown component")
+        h, v, table = components[ident]
+        dc, ac = tables.get(selectors >> 4), tables.get(0x10 | selectors & 15)
+        if dc is None or ac is None:
+            raise _Corrupt(pos, "scan uses an undefined Huffman table")
+        blocks.extend([(dc, ac, index)] * (h * v if count > 1 else 1))
+        # The DC coefficient of 8-bit samples lies within +-1024 before quantisation
+        limits.append((8 << (precision - 1)) // max(1, quantisers.get(table, 1)) + 1)
+    if count > 1:
+        mcus = -(-width // (8 * h_max)) * -(-height // (8 * v_max))
+    else:
+        # A lone component is coded block by block at its own resolution
+        h, v, _ = components[scanned[0][0]]
+        columns = -(-width * h // h_max)
+        rows = -(-height * v // v_max)
+        mcus = -(-columns // 8) * -(-rows // 8)
+    return _JpegScan(blocks, mcus, restart_interval, pos, tuple(limits), True)
+
+
+def _decode_scan(data, scan, state, checkpoints=None, cluster_size=4096):
+    """Huffman-decode MCUs of a baseline scan from state, without computing pixels
+
+    Returns (outcome, offset, state): 'done' with the offset just past the
+    scan, 'error' with the offset where the data stopped decoding, or
+    'more' when data ran out first, with the state at the last MCU start.
+    Checks that every code exists, no block holds more than 64
+    coefficients, DC values stay in range and restart markers come in
+    sequence where they belong. The state at the start of the last MCU in
+    each cluster is kept in checkpoints, keyed by cluster number.
+    """
+    pos, acc, nbits, mcu, restarts, marker, padded, preds = state
+    preds = list(preds)
+    blocks = scan.blocks
+    limits = scan.dc_limits
+    total = scan.mcus
+    interval = scan.restart_interval
+    saved = state
+    find = data.find
+    from_bytes = int.from_bytes
+    # find() gives -1 past the last 0xFF, which % end turns into end
+    end = len(data) + 1
+    next_ff = find(b'\xff', pos) % end
+    try:
+        while mcu < total:
+            if interval and mcu and not mcu % interval and restarts < mcu // interval:
+                # The last byte's padding, then RSTn with n counting modulo 8
+                if nbits - padded >= 8:
+                    return 'error', pos, saved
+                if marker < 0:
+                    while data[pos] == 0xFF and data[pos + 1] == 0xFF:
+                        pos += 1
+                    marker = pos
+                if data[marker] != 0xFF or data[marker + 1] != 0xD0 + restarts % 8:
+                    return 'error', marker, saved
+                pos = marker + 2
+                next_ff = find(b'\xff', pos) % end
+                acc = nbits = padded = 0
+                marker = -1
+                restarts += 1
+                preds = [0] * len(preds)
+
+            saved = (pos, acc, nbits, mcu, restarts, marker, padded, tuple(preds))
+            if checkpoints is not None:
+                checkpoints[pos // cluster_size] = saved
+
+            for dc, ac, component in blocks:
+                # Refill to at least 32 bits, four bytes at a time up to the
+                # next 0xFF; kept inline, as this loop is the hot path
+                while nbits < 32:
+                    if pos + 4 <= next_ff:
+                        acc = ((acc << 32) | from_bytes(data[pos:pos + 4], 'big')) & _ACC_MASK
+                        pos += 4
+                        nbits += 32
+                        break
+                    byte = 0
+                    if marker < 0:
+                        byte = data[pos]
+                        if byte != 0xFF:
+                            pos += 1
+                        elif data[pos + 1] == 0:
+                            pos += 2
+                            next_ff = find(b'\xff', pos) % end
+                        elif data[pos + 1] == 0xFF:
+                            pos += 1
+                            continue
+                        else:
+                            # Past a marker the decoder sees zero bits
+                            marker = pos
+                            byte = 0
+                            padded += 8
+                    else:
+                        padded += 8
+                    acc = ((acc << 8) | byte) & _ACC_MASK
+                    nbits += 8
+
+                entry = dc[(acc >> (nbits - 16)) & 0xFFFF]
+                if not entry:
+                    return 'error', pos, saved
+                nbits -= entry >> 8
+                size = entry & 0xFF
+                if size:
+                    nbits -= size
+                    value = (acc >> nbits) & ((1 << size) - 1)
+                    if value < 1 << (size - 1):
+                        value -= (1 << size) - 1
+                    value += preds[component]
+                    if value > limits[component] or -value > limits[component]:
+                        return 'error', pos, saved
+                    preds[component] = value
+
+                k = 1
+                while k < 64:
+                    while nbits < 32:
+                        if pos + 4 <= next_ff:
+                            acc = ((acc << 32) | from_bytes(data[pos:pos + 4], 'big')) & _ACC_MASK
+                            pos += 4
+                            nbits += 32
+                            break
+                        byte = 0
+                        if marker < 0:
+                            byte = data[pos]
+                            if byte != 0xFF:
+                                pos += 1
+                            elif data[pos + 1] == 0:
+                                pos += 2
+                                next_ff = find(b'\xff', pos) % end
+                            elif data[pos + 1] == 0xFF:
+                                pos += 1
+                                continue
+                            else:
+                                marker = pos
+                                byte = 0
+                                padded += 8
+                        else:
+                            padded += 8
+                        acc = ((acc << 8) | byte) & _ACC_MASK
+                        nbits += 8
+
+                    entry = ac[(acc >> (nbits - 16)) & 0xFFFF]
+                    if not entry:
+                        return 'error', pos, saved
+                    nbits -= entry >> 8
+                    if not entry & 0xFF:
+                        break
+                    k += entry & 0xFF
+                if k > 64:
+                    return 'error', pos, saved
+
+            if marker >= 0 and nbits < padded:
+                # Decoding ran on into a marker
+                return 'error', marker, saved
+            mcu += 1
+
+        if nbits - padded >= 8:
+            return 'error', pos, saved
+        if marker < 0:
+            while data[pos] == 0xFF and data[pos + 1] == 0xFF:
+                pos += 1
+            marker = pos
+        state = (pos, acc, nbits, mcu, restarts, marker, padded, tuple(preds))
+        if data[marker] == 0xFF and data[marker + 1] == 0xD9:
+            return 'done', marker + 2, state
+        return 'done', marker, state
+    except IndexError:
+        return 'more', pos, saved
+
+
+def _rebase(state, delta):
+    """A decoder state for data that starts delta bytes later"""
+    pos, acc, nbits, mcu, restarts, marker, padded, preds = state
+    return (pos - delta, acc, nbits, mcu, restarts, marker - delta if marker >= 0 else -1, padded, preds)
+
+
+def _plausible_jpeg_cluster(cluster):
+    """Whether a cluster could hold the entropy-coded data of a baseline JPEG"""
+    end = cluster.find(b'\xff\xd9')
+    body = cluster if end < 0 else cluster[:end]
+    if _JPEG_FOREIGN_MARKER.search(body):
+        return False
+    # Long runs of zeros are free space or another format, not Huffman codes
+    return body.count(0) * 8 < len(body)
+
+
+class _ZipEntry:
+    """One central directory record of a zip archive"""
+
+    __slots__ = ('name', 'flags', 'method', 'crc', 'compressed_size', 'size', 'offset')
+
+    def __init__(self, name, flags, method, crc, compressed_size, size, offset):
+        self.name = name
+        self.flags = flags
+        self.method = method
+        self.crc = crc
+        self.compressed_size = compressed_size
+        self.size = size
+        self.offset = offset  # of the local header, from the start of the archive
+
+
+def _zip_end_record(image, carved):
+    """(offset, entry count, directory size, directory offset) of a carved zip's end record"""
+    tail_start = max(carved.offset, carved.end - 65557)
+    tail = image.read_at(tail_start, carved.end - tail_start)
+    at = tail.rfind(b'PK\x05\x06')
+    if at < 0 or len(tail) - at < 22:
+        raise _Corrupt(carved.end, "no end of central directory record")
+    _, disk, directory_disk, _, count, size, offset, _ = struct.unpack_from('<4sHHHHIIH', tail, at)
+    if disk or directory_disk:
+        raise _Corrupt(tail_start + at, "multi-disk archive")
+    if count == 0xFFFF or 0xFFFFFFFF in (size, offset):
+        raise _Corrupt(tail_start + at, "ZIP64 archives are not checked")
+    end_record = tail_start + at
+    if end_record - size < carved.offset:
+        raise _Corrupt(end_record, "central directory starts before the archive")
+    return end_record, count, size, offset
+
+
+def _zip_entries(directory, count, base):
+    """Entries of a central directory read from image offset base, sorted by offset"""
+    entries = []
+    pos = 0
+    for _ in range(count):
+        if directory[pos:pos + 4] != b'PK\x01\x02' or pos + 46 > len(directory):
+            raise _Corrupt(base + pos, "damaged central directory")
+        fields = struct.unpack_from('<4sHHHHHHIIIHHHHHII', directory, pos)
+        name_length, extra_length, comment_length = fields[10:13]
+        name = directory[pos + 46:pos + 46 + name_length]
+        entries.append(_ZipEntry(name, fields[3], fields[4], fields[7], fields[8], fields[9], fields[16]))
+        pos += 46 + name_length + extra_length + comment_length
+    entries.sort(key=lambda entry: entry.offset)
+    return entries
+
+
+def _local_header(image, offset, entry):
+    """Length of entry's local header if it is at offset, else None"""
+    header = image.read_at(offset, 30 + len(entry.name))
+    if len(header) < 30 + len(entry.name) or header[:4] != b'PK\x03\x04':
+        return None
+    name_length, extra_length = struct.unpack_from('<HH', header, 26)
+    if header[30:30 + name_length] != entry.name:
+        return None
+    return 30 + name_length + extra_length
+
+
+class Reassembler:
+    """Checks carved JPEG and zip files and reassembles fragmented ones
+
+    Header-to-footer carving assumes a file is contiguous. Here each
+    carved JPEG is Huffman-decoded (codes, coefficient counts, DC range,
+    restart marker sequence) and each zip's local headers are matched
+    against its central directory, so a file that breaks off is caught
+    at the cluster where it does. Files that check out claim their
+    clusters first; then for a broken file the search tries, nearest
+    first, the free clusters after the break that could continue it:
+    a JPEG decoder resumes from a checkpoint just before the break over
+    each candidate and keeps the one that decodes furthest, and a zip's
+    gap, known from where its central directory sits, is placed where
+    the entry's data inflates to its recorded CRC or where the directory
+    itself parses. The search is bounded by max_gap, max_tests candidates
+    per break, backtrack clusters before a detected break, and
+    max_fragments pieces per file.
+    """
+
+    def __init__(self, cluster_size=4096, max_gap=16 * MB, max_fragments=4, max_tests=128,
+                 backtrack=4, decode_limit=16 * MB):
+        self.cluster_size = cluster_size
+        self.max_gap = max_gap
+        self.max_fragments = max_fragments
+        self.max_tests = max_tests
+        self.backtrack = backtrack
+        self.decode_limit = decode_limit
+        self.lookahead = 2  # clusters a JPEG candidate must decode through
+        self.confirm_clusters = 64  # decoded to rank candidates that pass
+
+    def reassemble(self, source, carved_files, cancel_token=None):
+        """Yield a ReassembledFile for each carved file, in the order given
+
+        source is a path or an open DiskImage; a DiskImage is shared with
+        the caller and left open. Formats other than JPEG and zip come
+        back 'unchecked' as the single fragment they were carved as.
+        """
+        if isinstance(source, DiskImage):
+            yield from self._reassemble(source, list(carved_files), cancel_token)
+            return
+        with DiskImage(source) as image:
+            yield from self._reassemble(image, list(carved_files), cancel_token)
+
+    def _reassemble(self, image, carved_files, cancel_token):
+        claims = _Claims()
+        results = []
+        broken = []
+        for index, carved in enumerate(carved_files):
+            if cancel_token is not None and cancel_token.cancelled:
+                return
+            if carved.signature == 'jpeg':
+                result = self._check_jpeg(image, carved)
+            elif carved.signature == 'zip':
+                result = self._check_zip(image, carved)
+            else:
+                result = ReassembledFile(carved, [(carved.offset, carved.length)], 'unchecked')
+                if not carved.complete:
+                    results.append(result)
+                    continue
+            if result is None:
+                broken.append(index)
+            elif result.status != 'unresolved':
+                for offset, length in result.fragments:
+                    claims.add(offset, offset + length)
+            results.append(result)
+
+        # Clusters of files that check out are no candidates for broken ones
+        for index in broken:
+            if cancel_token is not None and cancel_token.cancelled:
+                return
+            carved = carved_files[index]
+            if carved.signature == 'jpeg':
+                result = self._reassemble_jpeg(image, carved, claims)
+            else:
+                result = self._reassemble_zip(image, carved)
+            if result.status == 'reassembled':
+                for offset, length in result.fragments:
+                    claims.add(offset, offset + length)
+            results[index] = result
+        yield from results
+
+    def _jpeg_scan(self, image, carved):
+        return _parse_jpeg(image.read_at(carved.offset, min(JPEG_HEADER_LIMIT, image.size - carved.offset)))
+
+    def _check_jpeg(self, image, carved):
+        """ReassembledFile for a JPEG that decodes as carved, or None when it breaks off"""
+        try:
+            scan = self._jpeg_scan(image, carved)
+        except _Corrupt as e:
+            return ReassembledFile(carved, [(carved.offset, carved.length)], 'unresolved', 0.0,
+                                   f"{e.reason} at offset {carved.offset + e.offset}")
+        if not scan.baseline:
+            return self._check_jpeg_markers(image, carved, scan)
+
+        outcome, position, _, data = self._decode_file(image, scan, carved.offset, scan.initial_state(),
+                                                       self.decode_limit)
+        if outcome == 'done':
+            return ReassembledFile(carved, [(carved.offset, position)], 'intact', 1.0)
+        if outcome == 'more' and len(data) == self.decode_limit:
+            return ReassembledFile(carved, [(carved.offset, carved.length)], 'intact', 0.5,
+                                   f"only the first {len(data)} bytes were decoded")
+        return None
+
+    def _decode_file(self, image, scan, start, state, budget, checkpoints=None):
+        """_decode_scan over the image from start, reading further as needed up to budget bytes
+
+        Returns the outcome, offset and state of _decode_scan and the data read.
+        """
+        limit = min(budget, image.size - start)
+        length = min(limit, 4 * MB)
+        while True:
+            data = image.read_at(start, length)
+            outcome, position, state = _decode_scan(data, scan, state, checkpoints, self.cluster_size)
+            if outcome != 'more' or length >= limit:
+                return outcome, position, state, data
+            length = min(limit, 4 * length)
+
+    def _check_jpeg_markers(self, image, carved, scan):
+        # Progressive and arithmetic-coded scans cannot be decoded here;
+        # only the markers between them are checked
+        data = image.read_at(carved.offset, carved.length)
+        pos = scan.data_start
+        for match in _JPEG_FOREIGN_MARKER.finditer(data, pos):
+            if match.start() < pos:
+                continue
+            marker = data[match.start() + 1]
+            if marker in (0xC4, 0xDA, 0xDB, 0xDD, 0xFE) and match.start() + 4 <= len(data):
+                pos = match.start() + 2 + struct.unpack_from('>H', data, match.start() + 2)[0]
+                continue
+            return ReassembledFile(carved, [(carved.offset, carved.length)], 'unresolved', 0.0,
+                                   f"unexpected marker at offset {carved.offset + match.start()}; "
+                                   "progressive JPEGs are not reassembled")
+        if not data.endswith(b'\xff\xd9'):
+            return ReassembledFile(carved, [(carved.offset, carved.length)], 'unresolved', 0.0,
+                                   "no end of image; progressive JPEGs are not reassembled")
+        return ReassembledFile(carved, [(carved.offset, carved.length)], 'intact', 0.5,
+                               "progressive or arithmetic-coded: markers checked only")
+
+    def _reassemble_jpeg(self, image, carved, claims):
+        scan = self._jpeg_scan(image, carved)
+        fragments = []
+        confidence = 1.0
+        start = carved.offset
+        state = scan.initial_state()
+        budget = self.decode_limit
+
+        while True:
+            checkpoints = {}
+            outcome, position, state, data = self._decode_file(image, scan, start, state, budget, checkpoints)
+            if outcome == 'done':
+                fragments.append((start, position))
+                status = 'reassembled' if len(fragments) > 1 else 'intact'
+                return ReassembledFile(carved, fragments, status, round(confidence, 3))
+            if outcome == 'more' and len(data) < budget:
+                fragments.append((start, len(data)))
+                return ReassembledFile(carved, fragments, 'unresolved', 0.0,
+                                       "the image ends before the last block of the JPEG")
+            if outcome == 'more':
+                fragments.append((start, len(data)))
+                return ReassembledFile(carved, fragments, 'unresolved', 0.0,
+                                       f"only the first {self.decode_limit} bytes were decoded")
+            if len(fragments) + 1 >= self.max_fragments:
+                fragments.append((start, position))
+                return ReassembledFile(carved, fragments, 'unresolved', 0.0,
+                                       f"more than {self.max_fragments} fragments")
+
+            found = self._jpeg_continuation(image, scan, data, start, position, checkpoints, claims)
+            if found is None:
+                fragments.append((start, position))
+                return ReassembledFile(carved, fragments, 'unresolved', 0.0,
+                                       f"no continuation found for the data breaking off at "
+                                       f"offset {start + position}")
+            split, continuation, state, certainty = found
+            fragments.append((start, split - start))
+            budget -= split - start
+            confidence *= certainty
+            start = continuation
+
+    def _jpeg_continuation(self, image, scan, data, start, position, checkpoints, claims):
+        """(split, continuation, state, confidence) for a JPEG that breaks off at position, or None"""
+        cluster = self.cluster_size
+        for back in range(self.backtrack):
+            boundary = position // cluster - back
+            if boundary <= 0:
+                break
+            checkpoint = next((checkpoints[key] for key in range(boundary - 1, max(-1, boundary - 4), -1)
+                               if key in checkpoints), None)
+            if checkpoint is None:
+                continue
+            split = start + boundary * cluster
+            prefix = data[checkpoint[0]:boundary * cluster]
+            resumed = _rebase(checkpoint, checkpoint[0])
+
+            passing = []
+            for tests, candidate in enumerate(self._jpeg_candidates(image, split, claims)):
+                if tests >= self.max_tests or len(passing) >= 4:
+                    break
+                tried = self._try_continuation(image, scan, prefix, resumed, candidate, self.lookahead)
+                if tried and (tried[0] or tried[1] > (self.lookahead - 1) * cluster):
+                    passing.append((candidate, tried[2]))
+            if not passing:
+                continue
+
+            # Misaligned data coded with the same tables can decode for a
+            # while; the true continuation decodes furthest, often to the end
+            ranked = sorted(((self._try_continuation(image, scan, prefix, resumed, candidate,
+                                                     self.confirm_clusters)[:2], candidate, state)
+                             for candidate, state in passing), reverse=True)
+            (finished, reach), candidate, state = ranked[0]
+            if len(ranked) == 1 or finished and not ranked[1][0][0]:
+                confidence = 1.0
+            else:
+                confidence = 1.0 - ranked[1][0][1] / max(1, reach)
+            return split, candidate, state, confidence
+        return None
+
+    def _try_continuation(self, image, scan, prefix, state, candidate, clusters):
+        """(finished, bytes decoded into candidate, rebased state) for prefix followed by the
+        first clusters of candidate, or None if decoding fails before reaching candidate"""
+        data = prefix + image.read_at(candidate, clusters * self.cluster_size)
+        outcome, position, state = _decode_scan(data, scan, state)
+        if state[0] < len(prefix):
+            return None
+        reach = len(data) - len(prefix) if outcome == 'more' else position - len(prefix)
+        return outcome == 'done', reach, _rebase(state, len(prefix))
+
+    def _jpeg_candidates(self, image, split, claims):
+        """Offsets of free clusters after split that could continue a JPEG, nearest first"""
+        cluster = self.cluster_size
+        end = min(image.size, split + self.max_gap)
+        position = split + cluster
+        while position + cluster <= end:
+            window_end = min(end, position + 256 * cluster)
+            view = image.view(position, window_end - position)
+            try:
+                for at in range(0, len(view) - cluster + 1, cluster):
+                    offset = position + at
+                    if not claims.covers(offset, offset + cluster) and \
+                            _plausible_jpeg_cluster(view[at:at + cluster].tobytes()):
+                        yield offset
+            finally:
+                view.release()
+            position = window_end
+
+    def _check_zip(self, image, carved):
+        """ReassembledFile for a zip whose local headers sit where its directory says, else None"""
+        try:
+            end_record, count, directory_size, directory_offset = _zip_end_record(image, carved)
+        except _Corrupt as e:
+            return ReassembledFile(carved, [(carved.offset, carved.length)], 'unresolved', 0.0,
+                                   f"{e.reason} at offset {e.offset}")
+        directory_start = end_record - directory_size
+        try:
+            entries = _zip_entries(image.read_at(directory_start, directory_size), count, directory_start)
+        except _Corrupt as e:
+            if directory_start > carved.offset + directory_offset:
+                return None  # a gap may lie inside the directory
+            return ReassembledFile(carved, [(carved.offset, carved.length)], 'unresolved', 0.0,
+                                   f"{e.reason} at offset {e.offset}")
+        if directory_start != carved.offset + directory_offset:
+            return None
+        for entry in entries:
+            if _local_header(image, carved.offset + entry.offset, entry) is None:
+                return None
+        return ReassembledFile(carved, [(carved.offset, carved.length)], 'intact', 0.9,
+                               "local headers match the central directory")
+
+    def _reassemble_zip(self, image, carved):
+        cluster = self.cluster_size
+        end_record, count, directory_size, directory_offset = _zip_end_record(image, carved)
+
+        def unresolved(reason):
+            return ReassembledFile(carved, [(carved.offset, carved.length)], 'unresolved', 0.0, reason)
+
+        # Everything between where the directory should be and where it is
+        # came from other files
+        total = end_record - directory_size - (carved.offset + directory_offset)
+        if total <= 0 or total % cluster:
+            return unresolved("the central directory is not a whole number of clusters away "
+                              "from where it belongs")
+        try:
+            entries = _zip_entries(image.read_at(end_record - directory_size, directory_size),
+                                   count, end_record - directory_size)
+        except _Corrupt:
+            return self._zip_directory_gap(image, carved, end_record, count, directory_offset, total)
+        fragments = []
+        start = carved.offset
+        shift = 0
+        previous = None
+        for entry in entries:
+            expected = carved.offset + entry.offset + shift
+            header = _local_header(image, expected, entry)
+            if header is None:
+                if previous is None:
+                    return unresolved(f"no local header for {entry.name!r}")
+                gap = next((gap for gap in range(cluster, total - shift + 1, cluster)
+                            if _local_header(image, expected + gap, entry) is not None), None)
+                if gap is None:
+                    return unresolved(f"local header of {entry.name!r} not found")
+                split = self._zip_split(image, *previous, gap, expected)
+                if split is None:
+                    return unresolved(f"no place for the gap in {previous[0].name!r} matches its CRC")
+                fragments.append((start, split - start))
+                start = split + gap
+                shift += gap
+                expected += gap
+                header = _local_header(image, expected, entry)
+            previous = (entry, expected + header)
+
+        if shift < total:
+            # The last gap lies before the central directory
+            gap = total - shift
+            split = self._zip_split(image, *previous, gap, carved.offset + directory_offset + shift)
+            if split is None:
+                return unresolved(f"no place for the gap in {previous[0].name!r} matches its CRC")
+            fragments.append((start, split - start))
+            start = split + gap
+        fragments.append((start, carved.end - start))
+        return ReassembledFile(carved, fragments, 'reassembled', 1.0,
+                               "every gap placed where an entry's data matches its CRC")
+
+    def _zip_directory_gap(self, image, carved, end_record, count, directory_offset, total):
+        """ReassembledFile for a zip whose only gap lies inside its central directory"""
+        cluster = self.cluster_size
+        directory_start = carved.offset + directory_offset
+        data = image.read_at(directory_start, end_record - directory_start)
+        for split in range(-(-directory_offset // cluster) * cluster, end_record - carved.offset - total,
+                           cluster):
+            split += carved.offset
+            try:
+                entries = _zip_entries(data[:split - directory_start] + data[split + total - directory_start:],
+                                       count, directory_start)
+            except _Corrupt:
+                continue
+            if all(_local_header(image, carved.offset + entry.offset, entry) is not None
+                   for entry in entries):
+                return ReassembledFile(carved, [(carved.offset, split - carved.offset),
+                                                (split + total, carved.end - split - total)],
+                                       'reassembled', 0.9, "gap placed where the central directory parses")
+        return ReassembledFile(carved, [(carved.offset, carved.length)], 'unresolved', 0.0,
+                               "damaged central directory")
+
+    def _zip_split(self, image, entry, data_start, gap, limit):
+        """Cluster boundary where gap bytes of foreign data interrupt entry, or None
+
+        data_start is where entry's data begins; limit is the latest the
+        gap can start, where the next structure should have been.
+        """
+        if entry.method not in (0, 8):
+            return None
+        cluster = self.cluster_size
+        end = data_start + entry.compressed_size
+        inflate = zlib.decompressobj(-15) if entry.method == 8 else None
+        checkpoints = deque(maxlen=_ZIP_CHECKPOINTS) if inflate is not None else []
+        crc = size = 0
+        position = data_start
+        broken = None
+        while position < end:
+            piece_end = min(end, (position // cluster + 1) * cluster)
+            if not position % cluster:
+                checkpoints.append((position, inflate.copy() if inflate is not None else None, crc, size))
+            piece = image.read_at(position, piece_end - position)
+            if inflate is not None:
+                try:
+                    piece = inflate.decompress(piece)
+                except zlib.error:
+                    broken = piece_end
+                    break
+            crc = zlib.crc32(piece, crc)
+            size += len(piece)
+            position = piece_end
+            if inflate is not None and inflate.eof and position < end:
+                broken = position
+                break
+
+        if broken is None and crc == entry.crc and size == entry.size:
+            # The data is whole; the gap starts after it
+            split = -(-end // cluster) * cluster
+            return split if split <= limit else None
+
+        broken = end if broken is None else broken
+        candidates = [checkpoint for checkpoint in checkpoints if checkpoint[0] <= broken]
+        for split, snapshot, crc, size in reversed(candidates[-self.max_tests:]):
+            if self._zip_resumes(image, entry, snapshot, crc, size, split + gap, end - split):
+                return split
+        return None
+
+    def _zip_resumes(self, image, entry, inflate, crc, size, position, remaining):
+        """Whether entry's data, resumed at position with remaining bytes, matches its CRC"""
+        inflate = inflate.copy() if inflate is not None else None
+        while remaining > 0:
+            piece = image.read_at(position, min(remaining, 1 * MB))
+            if not piece:
+                return False
+            position += len(piece)
+            remaining -= len(piece)
+            if inflate is not None:
+                try:
+                    piece = inflate.decompress(piece)
+                except zlib.error:
+                    return False
+                if inflate.eof and remaining:
+                    return False
+            crc = zlib.crc32(piece, crc)
+            size += len(piece)
+        if inflate is not None and not inflate.eof:
+            return False
+        return crc == entry.crc and size == entry.size
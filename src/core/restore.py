@@ -0,0 +1,496 @@
+import json
+import os
+import shutil
+import stat
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .dedup import STORE_NAME, ContentStore, StoreError, link_file
+from .hashing import HashService
+from .image import DiskImage
+
+
+MB = 1024 * 1024
+
+JOURNAL_NAME = ".phoenix-restore-journal.jsonl"
+PARTIAL_SUFFIX = ".phoenix-part"
+
+
+class RestoreError(Exception):
+    """Raised when a restore cannot start, e.g. it would write into the source volume"""
+
+
+class RestoreOutcome:
+    """What happened to one file of a restore"""
+
+    __slots__ = ('record', 'destination', 'status', 'size', 'digest', 'error', 'shared')
+
+    def __init__(self, record, destination, status, size=0, digest=None, error=None, shared=False):
+        self.record = record
+        self.destination = destination
+        self.status = status  # 'restored', 'skipped' (done by an earlier run) or 'failed'
+        self.size = size
+        self.digest = digest
+        self.error = error
+        self.shared = shared  # True when a deduplicated restore found the content already stored
+
+    def to_dict(self):
+        return {
+            'source': self.record.path,
+            'destination': self.destination,
+            'status': self.status,
+            'size': self.size,
+            'digest': self.digest,
+            'error': str(self.error) if self.error is not None else None,
+            'shared': self.shared
+        }
+
+    def __repr__(self):
+        return f"RestoreOutcome({self.record.path!r}, {self.status!r})"
+
+
+class RestoreProgress:
+    """Progress event emitted while a restore runs"""
+
+    __slots__ = ('stage', 'files_done', 'files_total', 'bytes_done', 'bytes_total', 'failures', 'elapsed')
+
+    def __init__(self, stage, files_done, files_total, bytes_done, bytes_total, failures, elapsed):
+        self.stage = stage  # 'restoring', 'done' or 'cancelled'
+        self.files_done = files_done
+        self.files_total = files_total
+        self.bytes_done = bytes_done
+        self.bytes_total = bytes_total
+        self.failures = failures
+        self.elapsed = elapsed
+
+    @property
+    def mb_per_second(self):
+        return self.bytes_done / MB / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class RestoreJournal:
+    """Append-only JSON-lines journal kept in the destination directory
+
+    A 'start' line naming the destination is written before a file is
+    copied and a 'done' line once its copy is verified and in place, so a
+    restore interrupted at any point can be run again: finished files are
+    skipped and half-copied ones redone under the same name.
+    """
+
+    def __init__(self, path, sync_every=256):
+        self.path = path
+        self.sync_every = sync_every
+        self.started = {}
+        self.done = {}
+        self._load()
+        self._file = open(path, 'a', encoding='utf-8')
+        self._unsynced = 0
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line torn by a crash; everything before it still counts
+                        continue
+                    if entry.get('op') == 'start':
+                        self.started[entry['key']] = entry['destination']
+                    elif entry.get('op') == 'done':
+                        self.done[entry['key']] = entry
+        except FileNotFoundError:
+            pass
+
+    def _append(self, entry):
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def start(self, key, destination):
+        self.started[key] = destination
+        self._append({'op': 'start', 'key': key, 'destination': destination})
+
+    def finish(self, key, destination, size, digest):
+        entry = {'op': 'done', 'key': key, 'destination': destination, 'size': size, 'digest': digest}
+        self.done[key] = entry
+        self._append(entry)
+
+    def close(self, remove=False):
+        self.sync()
+        self._file.close()
+        if remove:
+            os.remove(self.path)
+
+
+def _copy_data(source, target, size):
+    """Copy size bytes between two open files, kernel-side when possible"""
+    source_fd, target_fd = source.fileno(), target.fileno()
+    copied = 0
+    # copy_file_range can share extents or copy server-side; sendfile at
+    # least keeps the data out of Python. Either may refuse a pair of files.
+    for name in ('copy_file_range', 'sendfile'):
+        copy = getattr(os, name, None)
+        if copy is None:
+            continue
+        try:
+            while copied < size:
+                count = min(size - copied, 1024 * MB)
+                if name == 'sendfile':
+                    sent = copy(target_fd, source_fd, copied, count)
+                else:
+                    sent = copy(source_fd, target_fd, count, copied, copied)
+                if not sent:
+                    break
+                copied += sent
+            return copied
+        except OSError:
+            if copied:
+                raise
+    shutil.copyfileobj(source, target, 4 * MB)
+    return target.tell()
+
+
+class RestorePipeline:
+    """Copies scan results into a destination directory on a bounded pool
+
+    Files are written under a temporary name, checked against the source
+    by digest, then renamed into place, and every step is recorded in a
+    RestoreJournal so an interrupted restore resumes where it stopped.
+    Nothing is written if any source lives on the destination's volume:
+    restoring onto the volume being recovered overwrites the very blocks
+    deleted files may still occupy.
+
+    With a Metrics registry, each file's copy and verification are timed
+    under the 'copy' and 'verify' stages and outcomes are counted.
+
+    With dedup, each distinct content is copied once into a ContentStore
+    inside the destination and every file is laid out under its original
+    path as a reflink, hard link or copy of it (see link_file). Files are
+    told apart by size and partial hash first; only those matching stored
+    content get a full hash before being linked instead of copied.
+    """
+
+    def __init__(self, destination, workers=4, verify=True, hasher=None, progress_interval=0.25,
+                 metrics=None, dedup=False, link='auto'):
+        self.destination = os.path.abspath(destination)
+        self.workers = max(1, workers)
+        self.verify = verify
+        self.hasher = hasher if hasher is not None else HashService(metrics=metrics)
+        self.progress_interval = progress_interval
+        self.metrics = metrics
+        self.dedup = dedup
+        self.link = link
+        self.store = None
+        self._images = {}
+        self._images_lock = threading.Lock()
+
+    @staticmethod
+    def key(record):
+        """Journal key identifying a record across runs"""
+        if record.image is not None:
+            return f"{record.image}::{record.path}"
+        return record.path
+
+    def check_destination(self, records):
+        """Raise RestoreError unless destination is a directory on another volume"""
+        if not os.path.isdir(self.destination):
+            raise RestoreError(f"{self.destination}: restore location is not a directory")
+        target_device = os.stat(self.destination).st_dev
+        devices = {}
+        for record in records:
+            source = record.image if record.image is not None else record.path
+            if source not in devices:
+                devices[source] = self._source_device(record)
+            if devices[source] == target_device:
+                raise RestoreError(
+                    f"{record.path} is on the same volume as {self.destination}; "
+                    f"restore to a different drive so deleted data is not overwritten")
+
+    @staticmethod
+    def _source_device(record):
+        try:
+            if record.image is None:
+                return os.stat(record.path).st_dev
+            st = os.stat(record.image)
+        except OSError:
+            return None
+        # Data carved from a block device lives on that device; an image
+        # file is only read, so restoring beside it overwrites nothing
+        return st.st_rdev if stat.S_ISBLK(st.st_mode) else None
+
+    def restore(self, records, cancel_token=None, on_progress=None):
+        """Restore records, yielding a RestoreOutcome per file as it finishes"""
+        # A file listed twice would send two workers at one destination
+        unique = {}
+        for record in records:
+            unique.setdefault(self.key(record), record)
+        records = list(unique.values())
+        self.check_destination(records)
+        journal = RestoreJournal(os.path.join(self.destination, JOURNAL_NAME))
+        if self.dedup:
+            self.store = ContentStore(os.path.join(self.destination, STORE_NAME), self.hasher.algorithm)
+        claimed = set(journal.started.values())
+        started = last_report = time.monotonic()
+        files_done = bytes_done = failures = 0
+        bytes_total = sum(record.size for record in records)
+
+        def report(stage):
+            if on_progress is not None:
+                on_progress(RestoreProgress(stage, files_done, len(records), bytes_done, bytes_total,
+                                            failures, time.monotonic() - started))
+
+        def plan():
+            for record in records:
+                key = self.key(record)
+                done = journal.done.get(key)
+                if done is not None and self._still_there(done):
+                    yield None, RestoreOutcome(record, done['destination'], 'skipped',
+                                               done['size'], done['digest'])
+                    continue
+                destination = journal.started.get(key)
+                if destination is None:
+                    destination = self._unique_destination(record, claimed)
+                    claimed.add(destination)
+                    journal.start(key, destination)
+                yield record, destination
+
+        cancelled = False
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = plan()
+            futures = {}
+            ready = []
+
+            def submit(count):
+                while len(futures) < count:
+                    item = next(pending, None)
+                    if item is None:
+                        return
+                    record, destination = item
+                    if record is None:
+                        # Already restored by an earlier run
+                        ready.append(destination)
+                    else:
+                        restore_one = self._restore_shared if self.store is not None else self._restore_one
+                        futures[pool.submit(restore_one, record, destination)] = record
+
+            try:
+                submit(self.workers * 2)
+                while futures or ready:
+                    if not ready:
+                        finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            futures.pop(future)
+                            ready.append(future.result())
+
+                    for outcome in ready:
+                        if outcome.status == 'restored':
+                            journal.finish(self.key(outcome.record), outcome.destination,
+                                           outcome.size, outcome.digest)
+                        elif outcome.status == 'failed':
+                            failures += 1
+                        if self.metrics is not None:
+                            self.metrics.count(f"restore_{outcome.status}")
+                            self.metrics.count(f"restore_{outcome.status}_bytes", outcome.size)
+                            if outcome.shared:
+                                self.metrics.count('restore_shared')
+                                self.metrics.count('restore_shared_bytes', outcome.size)
+                        files_done += 1
+                        bytes_done += outcome.size
+                        yield outcome
+                    ready = []
+
+                    if cancel_token is not None and cancel_token.cancelled:
+                        cancelled = True
+                        break
+                    submit(self.workers * 2)
+
+                    now = time.monotonic()
+                    if now - last_report >= self.progress_interval:
+                        last_report = now
+                        report('restoring')
+            finally:
+                # Also runs when the caller stops iterating early
+                for future in futures:
+                    future.cancel()
+                complete = files_done == len(records)
+                # Keep the journal while anything is left to retry
+                journal.close(remove=complete and not failures)
+                self._close_images()
+                if self.store is not None:
+                    self.store.close()
+                    self.store = None
+
+        report('done' if complete and not cancelled else 'cancelled')
+
+    def _still_there(self, done):
+        try:
+            return os.path.getsize(done['destination']) == done['size']
+        except OSError:
+            return False
+
+    def _unique_destination(self, record, claimed):
+        # Trashed files sit under a generated name; restore them under the one they had
+        source = getattr(record, 'origin', None) or record.path
+        parts = [part for part in source.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+        name = parts.pop() if parts else 'recovered'
+        folder = self.destination
+        if self.dedup:
+            # Laid out under the original path; a drive letter becomes a folder
+            if parts and len(parts[0]) == 2 and parts[0][1] == ':':
+                parts[0] = parts[0][0]
+            folder = os.path.join(self.destination, *parts)
+        stem, extension = os.path.splitext(name)
+        candidate = os.path.join(folder, name)
+        counter = 1
+        while candidate in claimed or os.path.lexists(candidate):
+            candidate = os.path.join(folder, f"{stem} ({counter}){extension}")
+            counter += 1
+        return candidate
+
+    def _image(self, path):
+        with self._images_lock:
+            image = self._images.get(path)
+            if image is None:
+                image = self._images[path] = DiskImage(path)
+            return image
+
+    def _close_images(self):
+        with self._images_lock:
+            for image in self._images.values():
+                image.close()
+            self._images.clear()
+
+    def _restore_one(self, record, destination):
+        partial = destination + PARTIAL_SUFFIX
+        metrics = self.metrics
+        try:
+            started = time.perf_counter()
+            if record.image is None:
+                size = self._copy_file(record.path, partial)
+            else:
+                image = self._image(record.image)
+                size = self._write_extents(image, record, partial)
+            copied = time.perf_counter()
+            if metrics is not None:
+                metrics.add_time('copy', copied - started, 1, size)
+
+            digest = None
+            if self.verify:
+                if record.image is None:
+                    expected = self.hasher.hash_file(record.path)
+                else:
+                    expected = self.hasher.hash_extents(image, record.extents)
+                # Read back for real: the cache could hold a reused inode's old digest
+                digest = self.hasher.hash_file(partial, use_cache=False)
+                if metrics is not None:
+                    metrics.add_time('verify', time.perf_counter() - copied, 1, size)
+                if digest != expected:
+                    raise RestoreError(f"{record.path}: copy does not match the source")
+            os.replace(partial, destination)
+            return RestoreOutcome(record, destination, 'restored', size, digest)
+        except (OSError, RestoreError) as e:
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+            return RestoreOutcome(record, destination, 'failed', error=e)
+
+    def _restore_shared(self, record, destination):
+        """_restore_one() for a deduplicated restore: copy into the store once, then link"""
+        store = self.store
+        # Named per attempt, so nothing else can remove or replace it between link and rename
+        partial_link = f"{destination}.{uuid.uuid4().hex[:8]}{PARTIAL_SUFFIX}"
+        metrics = self.metrics
+        temp = None
+        try:
+            if record.image is None:
+                image = None
+                size = os.path.getsize(record.path)
+                partial = self.hasher.partial_hash(record.path)
+            else:
+                image = self._image(record.image)
+                size = record.size
+                partial = self.hasher.partial_hash_extents(image, record.extents, size)
+
+            with store.lock(size, partial):
+                expected = None
+                if store.candidates(size, partial):
+                    # Something stored looks the same; only a full hash can tell
+                    expected = self._source_digest(record, image)
+                shared = expected is not None and store.has(expected)
+                if shared:
+                    digest = expected
+                else:
+                    temp = store.temp_path()
+                    started = time.perf_counter()
+                    if image is None:
+                        self._copy_file(record.path, temp)
+                    else:
+                        self._write_extents(image, record, temp)
+                    copied = time.perf_counter()
+                    if metrics is not None:
+                        metrics.add_time('copy', copied - started, 1, size)
+                    # Never from the cache: this digest becomes the blob's address
+                    digest = self.hasher.hash_file(temp, use_cache=False)
+                    if self.verify or expected is not None:
+                        if expected is None:
+                            expected = self._source_digest(record, image)
+                        if metrics is not None:
+                            metrics.add_time('verify', time.perf_counter() - copied, 1, size)
+                        if digest != expected:
+                            raise RestoreError(f"{record.path}: copy does not match the source")
+                    store.add(temp, size, partial, digest)
+                    temp = None
+
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            link_file(store.path(digest), partial_link, self.link)
+            os.replace(partial_link, destination)
+            return RestoreOutcome(record, destination, 'restored', size, digest, shared=shared)
+        except (OSError, RestoreError, StoreError) as e:
+            for path in (temp, partial_link):
+                if path is not None:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            return RestoreOutcome(record, destination, 'failed', error=e)
+
+    def _source_digest(self, record, image):
+        if image is None:
+            return self.hasher.hash_file(record.path)
+        return self.hasher.hash_extents(image, record.extents)
+
+    def _copy_file(self, source, target):
+        with open(source, 'rb', buffering=0) as fsrc, open(target, 'wb', buffering=0) as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            copied = _copy_data(fsrc, fdst, size)
+        if copied != size:
+            raise RestoreError(f"{source}: file changed size while being copied")
+        shutil.copystat(source, target)
+        return size
+
+    def _write_extents(self, image, record, target):
+        with open(target, 'wb', buffering=0) as f:
+            for offset, length, file_offset in record.extents:
+                done = 0
+                while done < length:
+                    step = min(16 * MB, length - done)
+                    view = image.view(offset + done, step)
+                    f.seek(file_offset + done)
+                    f.write(view)
+                    view.release()
+                    done += step
+            # Holes past the last run read back as zeros
+            f.truncate(record.size)
+        if record.mtime:
+            os.utime(target, (record.mtime, record.mtime))
+        return record.size
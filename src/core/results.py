@@ -0,0 +1,179 @@
+import os
+import threading
+from array import array
+from bisect import bisect_right
+
+from .file_types import CATEGORY_EXTENSIONS, OTHER
+
+
+CATEGORIES = (OTHER,) + tuple(CATEGORY_EXTENSIONS)
+_CATEGORY_CODES = {category: code for code, category in enumerate(CATEGORIES)}
+_CODE_BY_EXTENSION = {
+    extension: _CATEGORY_CODES[category]
+    for category, extensions in CATEGORY_EXTENSIONS.items()
+    for extension in extensions
+}
+
+
+class ResultStore:
+    """Append-only store of scan results with category and name indexes
+
+    Every record gets a stable row id, its position in the store, so a view
+    (a list of row ids) always leads back to the exact file even when
+    several share a name. Categories are kept as one byte per row plus a
+    posting array per category; rows start in their extension's category
+    and set_categories() moves them once their contents are classified.
+    Lower-cased names are interned, and the distinct names are kept as
+    one newline-joined string: a substring search is a str.find scan over
+    it, with each hit mapped back to its name by bisecting the name
+    offsets and then to the rows carrying it.
+
+    Records are anything with a path attribute, normally ScanResults.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._records = []
+            self._categories = bytearray()
+            self._by_category = {code: array('I') for code in range(len(CATEGORIES))}
+            self._postings_stale = False
+            self._name_rows = []
+            self._name_lookup = {}
+            self._haystack = ''
+            self._offsets = array('Q', [0])
+            self._unjoined = []
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, record):
+        """Store a record and return its row id"""
+        return self.extend((record,)).start
+
+    def extend(self, records):
+        """Store several records; returns the range of their row ids"""
+        with self._lock:
+            first = row = len(self._records)
+            # Bound locals: this loop runs once per file found
+            append_record = self._records.append
+            append_category = self._categories.append
+            by_category = self._by_category
+            name_lookup = self._name_lookup
+            sep = os.sep
+            altsep = os.altsep
+            for record in records:
+                origin = getattr(record, 'origin', None)
+                if origin is not None:
+                    # Trashed files are found under the name they were deleted as
+                    name = origin.rpartition('/')[2].rpartition('\\')[2]
+                else:
+                    # os.path.basename, minus the call overhead
+                    name = record.path.rpartition(sep)[2]
+                    if altsep:
+                        name = name.rpartition(altsep)[2]
+                name = name.lower()
+                rows = name_lookup.get(name)
+                if rows is None:
+                    rows = name_lookup[name] = array('I')
+                    self._name_rows.append(rows)
+                    self._unjoined.append(name)
+                rows.append(row)
+
+                category = getattr(record, 'category', None)
+                if category is not None:
+                    code = _CATEGORY_CODES[category]
+                else:
+                    dot = name.rfind('.')
+                    code = _CODE_BY_EXTENSION.get(name[dot:], 0) if dot > 0 else 0
+                append_record(record)
+                append_category(code)
+                by_category[code].append(row)
+                row += 1
+            return range(first, row)
+
+    def get(self, row):
+        """The record stored under a row id"""
+        return self._records[row]
+
+    def category(self, row):
+        return CATEGORIES[self._categories[row]]
+
+    def set_categories(self, rows, categories):
+        """Move rows to new categories, e.g. the ones their contents show"""
+        with self._lock:
+            codes = self._categories
+            for row, category in zip(rows, categories):
+                code = _CATEGORY_CODES[category]
+                if codes[row] != code:
+                    codes[row] = code
+                    # Postings are rebuilt once, on the next read
+                    self._postings_stale = True
+
+    def _rebuild_postings(self):
+        by_category = {code: array('I') for code in range(len(CATEGORIES))}
+        appends = [by_category[code].append for code in range(len(CATEGORIES))]
+        for row, code in enumerate(self._categories):
+            appends[code](row)
+        self._by_category = by_category
+        self._postings_stale = False
+
+    def rows(self, category=None, term=None):
+        """Row ids, in insertion order, in category (None or 'all' for any)
+        whose file name contains term, case-insensitively"""
+        with self._lock:
+            code = None
+            if category not in (None, 'all'):
+                code = _CATEGORY_CODES.get(category)
+                if code is None:
+                    return []
+            if not term:
+                if code is None:
+                    return list(range(len(self._records)))
+                if self._postings_stale:
+                    self._rebuild_postings()
+                return list(self._by_category[code])
+
+            rows = self._search(term.lower())
+            if code is not None:
+                categories = self._categories
+                rows = [row for row in rows if categories[row] == code]
+            return rows
+
+    def _join_names(self):
+        if not self._unjoined:
+            return
+        offsets = self._offsets
+        position = offsets[-1]
+        for name in self._unjoined:
+            position += len(name) + 1
+            offsets.append(position)
+        self._haystack += '\n'.join(self._unjoined) + '\n'
+        self._unjoined = []
+
+    def _search(self, term):
+        if '\n' in term:
+            return []
+        self._join_names()
+        haystack = self._haystack
+        offsets = self._offsets
+        name_rows = self._name_rows
+
+        matches = []
+        position = haystack.find(term)
+        while position != -1:
+            name_id = bisect_right(offsets, position) - 1
+            matches.append(name_rows[name_id])
+            # One hit per name is enough; carry on from the next name
+            position = haystack.find(term, offsets[name_id + 1])
+
+        if len(matches) == 1:
+            return list(matches[0])
+        rows = []
+        for name_rows in matches:
+            rows.extend(name_rows)
+        rows.sort()
+        return rows
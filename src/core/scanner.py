@@ -0,0 +1,414 @@
+import os
+import struct
+import threading
+import time
+
+from .allocation import DEFAULT_ALLOCATION_DIR, allocation_map
+from .carver import Carver
+from .classify import Classifier
+from .ext4 import EXT4_MAGIC, INCOMPAT_EXTENTS, SUPERBLOCK_OFFSET, Ext4Reader
+from .fat import FatReader
+from .hashing import HashService
+from .ntfs import NtfsReader
+from .image import DiskImage
+from .metrics import Metrics
+from .restore import RestoreOutcome, RestorePipeline
+from .trash import TRASH_KINDS, TrashError, iter_image_recycle_bin, iter_trash, put_back, trash_locations
+from .walker import ParallelWalker
+
+
+class CancelToken:
+    """Thread-safe cancellation flag shared by a scan and whoever started it"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Ask every scan holding this token to stop"""
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def wait(self, timeout):
+        """Sleep up to timeout seconds; returns True as soon as cancelled"""
+        return self._event.wait(timeout)
+
+
+class ScanResult:
+    """A single file found by a scan
+
+    Files recovered from a filesystem image carry the image path and the
+    (image_offset, length, file_offset) runs holding their data; files
+    found by walking a live tree leave both as None. category is set once
+    the file's contents have been classified. Files found in a trash carry
+    origin, the path they were deleted from, and deleted, the deletion
+    time.
+    """
+
+    __slots__ = ('path', 'size', 'mtime', 'inode', 'device', 'source', 'image', 'extents', 'category',
+                 'origin', 'deleted')
+
+    def __init__(self, path, size=0, mtime=0.0, inode=0, device=0, source='walk',
+                 image=None, extents=None, category=None, origin=None, deleted=None):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.inode = inode
+        self.device = device
+        self.source = source
+        self.image = image
+        self.extents = extents
+        self.category = category
+        self.origin = origin
+        self.deleted = deleted
+
+    @property
+    def name(self):
+        if self.origin is not None:
+            # A recycle bin keeps the data as $R..., the name is in origin
+            return os.path.basename(self.origin.replace('\\', '/'))
+        return os.path.basename(self.path)
+
+    def to_dict(self):
+        result = {
+            'path': self.path,
+            'size': self.size,
+            'mtime': self.mtime,
+            'inode': self.inode,
+            'device': self.device,
+            'source': self.source
+        }
+        if self.image is not None:
+            result['image'] = self.image
+            result['extents'] = self.extents
+        if self.category is not None:
+            result['category'] = self.category
+        if self.origin is not None:
+            result['origin'] = self.origin
+        if self.deleted is not None:
+            result['deleted'] = self.deleted
+        return result
+
+    def __repr__(self):
+        return f"ScanResult({self.path!r}, size={self.size})"
+
+
+class ScanProgress:
+    """Progress event emitted while a scan runs"""
+
+    __slots__ = ('stage', 'current_path', 'files_found', 'elapsed')
+
+    def __init__(self, stage, current_path, files_found, elapsed):
+        self.stage = stage  # 'scanning', 'done' or 'cancelled'
+        self.current_path = current_path
+        self.files_found = files_found
+        self.elapsed = elapsed
+
+    @property
+    def files_per_second(self):
+        return self.files_found / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class Scanner:
+    def __init__(self, metrics=None):
+        self.supported_filesystems = ['NTFS', 'FAT32', 'exFAT', 'HFS+', 'EXT4']
+        self.recovery_modes = ['quick', 'deep', 'forensic']
+        # Quick scans read trash metadata instead; see quick_scan()
+        self.scan_locations = {
+            'deep': [
+                "~/Documents",
+                "~/Downloads",
+                "~/Desktop",
+                "~/Pictures",
+                "~/Videos"
+            ]
+        }
+        # Minimum seconds between two progress events
+        self.progress_interval = 0.25
+        # Directory listing threads; None picks a default from the CPU count
+        self.walk_workers = None
+        self.last_walk_stats = None
+        # Files copied at once by restore()
+        self.restore_workers = 4
+        # Stage timers and counters for every scan, classify and restore run
+        # through this scanner; see Metrics.snapshot()
+        self.metrics = metrics if metrics is not None else Metrics()
+        # Shared so digests stay cached across scans
+        self.hasher = HashService(metrics=self.metrics)
+        self.classifier = Classifier()
+        # Where free-space maps are kept between carves; None keeps none
+        self.allocation_dir = DEFAULT_ALLOCATION_DIR
+
+    def default_locations(self, mode='deep'):
+        """Expanded scan roots for a recovery mode"""
+        locations = self.scan_locations.get(mode, self.scan_locations['deep'])
+        return [os.path.expanduser(location) for location in locations]
+
+    def scan(self, locations=None, mode='deep', cancel_token=None, on_progress=None,
+             index=None, full=False):
+        """Walk the scan locations and yield a ScanResult per file found
+
+        Nothing here touches the GUI: callers stop the scan through
+        cancel_token and receive ScanProgress events through on_progress,
+        which is called from the scanning thread.
+
+        With a ScanIndex, directories whose mtime is unchanged since the
+        last indexed scan are answered from the index instead of being
+        listed again, and everything found is written back to it. full
+        re-lists every directory while still updating the index.
+        """
+        if locations is None:
+            locations = self.default_locations(mode)
+        if cancel_token is None:
+            cancel_token = CancelToken()
+
+        roots = [location for location in locations if os.path.isdir(location)]
+        update = index.begin_update(roots, full) if index is not None else None
+        walker = ParallelWalker(workers=self.walk_workers, cancel_token=cancel_token,
+                                known_dirs=update.known_dirs if update is not None else None,
+                                metrics=self.metrics)
+        started = last_report = time.monotonic()
+        found = 0
+
+        def report(stage, current_path):
+            if on_progress is not None:
+                on_progress(ScanProgress(stage, current_path, found, time.monotonic() - started))
+
+        if update is None:
+            listings = ((dirpath, [ScanResult(path, st.st_size, st.st_mtime, st.st_ino, st.st_dev)
+                                   for path, st in files])
+                        for dirpath, files in walker.walk(roots))
+        else:
+            listings = ((listing.path, update.record(listing))
+                        for listing in walker.walk_listings(roots))
+
+        complete = False
+        try:
+            for dirpath, results in listings:
+                found += len(results)
+                yield from results
+
+                now = time.monotonic()
+                if now - last_report >= self.progress_interval:
+                    last_report = now
+                    report('scanning', dirpath)
+            complete = not cancel_token.cancelled
+        finally:
+            listings.close()
+            if update is not None:
+                update.finish(complete)
+
+        self.last_walk_stats = walker.stats
+        report('done' if complete else 'cancelled', None)
+
+    def quick_scan(self, volumes=None, cancel_token=None, on_progress=None):
+        """Yield a ScanResult per file in the trashes of the home directory and of volumes
+
+        Only the trashes' own metadata is read (.trashinfo files, $I
+        records, the macOS put-back records), so results carry the path each
+        file was deleted from and when, and no file is opened. A trashed
+        folder is listed file by file, each with its place under the
+        folder's origin. volumes defaults to every mounted volume.
+        """
+        if cancel_token is None:
+            cancel_token = CancelToken()
+        started = time.monotonic()
+        found = 0
+
+        for entry in iter_trash(trash_locations(volumes=volumes), cancel_token):
+            if entry.is_directory:
+                results = self._trashed_folder(entry)
+            else:
+                try:
+                    st = os.lstat(entry.path)
+                except OSError:
+                    continue
+                results = [ScanResult(entry.path, entry.size, st.st_mtime, st.st_ino, st.st_dev,
+                                      source=entry.kind, origin=entry.origin, deleted=entry.deleted)]
+            for result in results:
+                found += 1
+                yield result
+
+        self.metrics.count('trash_files', found)
+        if on_progress is not None:
+            stage = 'cancelled' if cancel_token.cancelled else 'done'
+            on_progress(ScanProgress(stage, None, found, time.monotonic() - started))
+
+    @staticmethod
+    def _trashed_folder(entry):
+        for dirpath, _, filenames in os.walk(entry.path):
+            relative = os.path.relpath(dirpath, entry.path)
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    continue
+                origin = None
+                if entry.origin is not None:
+                    origin = os.path.normpath(os.path.join(entry.origin, relative, filename))
+                yield ScanResult(path, st.st_size, st.st_mtime, st.st_ino, st.st_dev, source=entry.kind,
+                                 origin=origin, deleted=entry.deleted)
+
+    def scan_image_trash(self, path, cancel_token=None):
+        """Yield a ScanResult per file in the $Recycle.Bin of an NTFS image, with its original path"""
+        for entry in iter_image_recycle_bin(path, cancel_token):
+            yield ScanResult(entry.path, entry.size, source=entry.kind, image=path, extents=entry.extents,
+                             origin=entry.origin, deleted=entry.deleted)
+
+    def put_back(self, results, cancel_token=None):
+        """Move trashed scan results back to where they were deleted from, yielding a RestoreOutcome each
+
+        Nothing is overwritten: a file whose origin is taken again fails.
+        Results read out of an image have no origin on this machine and
+        are restored with restore() instead.
+        """
+        for result in results:
+            if cancel_token is not None and cancel_token.cancelled:
+                return
+            try:
+                if result.image is not None or result.source not in TRASH_KINDS:
+                    raise TrashError(f"{result.path} is not in a mounted trash")
+                if result.origin is None:
+                    raise TrashError(f"{result.path} has no recorded original location; restore it to a folder")
+                put_back(result.path, result.origin)
+            except (OSError, TrashError) as e:
+                yield RestoreOutcome(result, result.origin, 'failed', error=e)
+                continue
+            self.metrics.count('restore_put_back')
+            yield RestoreOutcome(result, result.origin, 'restored', result.size)
+
+    def classify(self, results, index=None):
+        """Set each ScanResult's category from its contents
+
+        Results that already carry one (files served from the index for an
+        unchanged directory) are left alone. With a ScanIndex, walked files
+        classified before and unchanged since are answered from the index
+        without being opened, and new verdicts are written back to it.
+        """
+        pending = [result for result in results if result.category is None]
+        if index is not None:
+            known = index.classified_types(result.path for result in pending if result.image is None)
+            for result in pending:
+                if result.image is None:
+                    result.category = known.get(result.path)
+            pending = [result for result in pending if result.category is None]
+
+        with self.metrics.stage('classify', items=len(pending)):
+            for result, category in zip(pending, self.classifier.classify(pending)):
+                result.category = category
+        if index is not None:
+            index.set_types([(result.path, result.category) for result in pending if result.image is None])
+
+    def allocation_map(self, source, cancel_token=None, on_progress=None, skip_zeros=True):
+        """AllocationMap of the space on an image or device that no file owns, less all-zero blocks
+
+        Built from the filesystem's allocation records; the zero check reads
+        the free space once, and its result is kept in allocation_dir until
+        the image changes.
+        """
+        if not isinstance(source, DiskImage):
+            with DiskImage(source) as image:
+                return self.allocation_map(image, cancel_token, on_progress, skip_zeros)
+        with self.metrics.stage('allocation_map', nbytes=source.size):
+            return allocation_map(source, self.verify_filesystem(source), skip_zeros=skip_zeros,
+                                  cache_dir=self.allocation_dir, cancel_token=cancel_token,
+                                  on_progress=on_progress)
+
+    def carve(self, source, cancel_token=None, on_progress=None, mode='deep'):
+        """Carve a raw device or disk image, yielding CarvedFile extents
+
+        The deep and forensic modes read only space that no file owns and
+        that is not all zeros (see allocation_map()), so carving time falls
+        with how full the disk is; mode=None reads every byte.
+        """
+        if mode not in ('deep', 'forensic'):
+            yield from Carver().carve(source, cancel_token=cancel_token, on_progress=on_progress)
+            return
+        if not isinstance(source, DiskImage):
+            with DiskImage(source) as image:
+                yield from self.carve(image, cancel_token, on_progress, mode)
+            return
+        regions = self.allocation_map(source, cancel_token=cancel_token, on_progress=on_progress)
+        if cancel_token is not None and cancel_token.cancelled:
+            return
+        self.metrics.count('carve_skipped_bytes', source.size - regions.free_bytes)
+        yield from Carver().carve(source, cancel_token=cancel_token, on_progress=on_progress, regions=regions)
+
+    def restore(self, results, destination, cancel_token=None, on_progress=None, dedup=False, link='auto'):
+        """Copy scan results into destination, yielding a RestoreOutcome per file
+
+        Copies run on restore_workers threads, are checked against their
+        source by digest and are journalled, so running the same restore
+        again resumes it. With dedup, duplicates are stored once and laid
+        out under their original paths as links (see RestorePipeline).
+        Raises RestoreError when destination is on the volume being
+        recovered.
+        """
+        pipeline = RestorePipeline(destination, workers=self.restore_workers, hasher=self.hasher,
+                                   metrics=self.metrics, dedup=dedup, link=link)
+        return pipeline.restore(results, cancel_token=cancel_token, on_progress=on_progress)
+
+    def scan_image(self, path, cancel_token=None, on_progress=None):
+        """Yield a ScanResult per deleted file recoverable from a filesystem image"""
+        filesystem = self.verify_filesystem(path)
+        started = time.monotonic()
+        found = 0
+
+        with DiskImage(path) as image:
+            if filesystem == 'EXT4':
+                reader = Ext4Reader(image)
+                for deleted in reader.iter_deleted(cancel_token):
+                    if not deleted.is_regular:
+                        continue
+                    found += 1
+                    yield ScanResult(f"/$inode_{deleted.inode}", deleted.size, deleted.mtime,
+                                     deleted.inode, source='ext4', image=path,
+                                     extents=reader.byte_ranges(deleted))
+            elif filesystem == 'NTFS':
+                reader = NtfsReader(image)
+                for deleted in reader.iter_deleted(cancel_token):
+                    found += 1
+                    yield ScanResult(deleted.path, deleted.size, deleted.mtime, deleted.record,
+                                     source='ntfs', image=path, extents=reader.byte_ranges(deleted))
+            elif filesystem in ('FAT32', 'exFAT'):
+                reader = FatReader(image)
+                for entry in reader.iter_deleted(cancel_token):
+                    found += 1
+                    yield ScanResult(entry.path, entry.size, entry.mtime, entry.first_cluster,
+                                     source=filesystem.lower(), image=path,
+                                     extents=reader.byte_ranges(entry))
+            else:
+                raise ValueError(f"{path}: unsupported or unrecognised filesystem")
+
+        if on_progress is not None:
+            stage = 'cancelled' if cancel_token is not None and cancel_token.cancelled else 'done'
+            on_progress(ScanProgress(stage, None, found, time.monotonic() - started))
+
+    def verify_filesystem(self, path):
+        """Name of the filesystem on an image or device (a path or open DiskImage), or None if unrecognised"""
+        if isinstance(path, DiskImage):
+            boot = path.read_at(0, 512)
+            superblock = path.read_at(SUPERBLOCK_OFFSET, 1024)
+        else:
+            with DiskImage(path) as image:
+                boot = image.read_at(0, 512)
+                superblock = image.read_at(SUPERBLOCK_OFFSET, 1024)
+
+        if len(superblock) == 1024 and struct.unpack_from('<H', superblock, 0x38)[0] == EXT4_MAGIC:
+            incompat = struct.unpack_from('<I', superblock, 0x60)[0]
+            return 'EXT4' if incompat & INCOMPAT_EXTENTS else 'EXT2/3'
+        if len(boot) == 512 and boot[510:512] == b'\x55\xaa':
+            if boot[3:11] == b'NTFS    ':
+                return 'NTFS'
+            if boot[3:11] == b'EXFAT   ':
+                return 'exFAT'
+            if boot[82:90] == b'FAT32   ':
+                return 'FAT32'
+        return None
+
+    def calculate_checksum(self, file_path, algorithm='sha256'):
+        """Hex digest of a file; unchanged files are answered from the cache"""
+        return self.hasher.hash_file(file_path, algorithm)
@@ -0,0 +1,53 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """Token buckets for bytes and I/O operations per second
+
+    Callers charge what they have just done and are told to wait off any
+    debt, so the average rate stays at the limit however large a single
+    charge is. Up to burst seconds of allowance builds up while idle.
+    Limits may be changed while in use; None means unlimited.
+    """
+
+    def __init__(self, bytes_per_second=None, iops=None, burst=0.25):
+        self.bytes_per_second = bytes_per_second
+        self.iops = iops
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._bytes = 0.0
+        self._ops = 0.0
+        self._stamp = time.monotonic()
+
+    @property
+    def limited(self):
+        return bool(self.bytes_per_second or self.iops)
+
+    def reserve(self, nbytes=0, ops=0):
+        """Charge nbytes and ops; returns the seconds the caller should now wait"""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._stamp
+            self._stamp = now
+            wait = 0.0
+            if self.bytes_per_second:
+                rate = self.bytes_per_second
+                self._bytes = min(self._bytes + elapsed * rate, rate * self.burst) - nbytes
+                if self._bytes < 0:
+                    wait = -self._bytes / rate
+            if self.iops:
+                rate = self.iops
+                self._ops = min(self._ops + elapsed * rate, rate * self.burst) - ops
+                if self._ops < 0:
+                    wait = max(wait, -self._ops / rate)
+            return wait
+
+    def consume(self, nbytes=0, ops=0, cancel_token=None):
+        """Charge nbytes and ops and sleep off any debt, waking early if cancel_token is cancelled"""
+        wait = self.reserve(nbytes, ops)
+        if wait > 0:
+            if cancel_token is not None:
+                cancel_token.wait(wait)
+            else:
+                time.sleep(wait)
@@ -0,0 +1,514 @@
+import glob
+import os
+import shutil
+import stat
+import string
+import struct
+import sys
+from datetime import datetime
+from urllib.parse import unquote
+
+from .image import DiskImage
+from .ntfs import FILETIME_EPOCH, NtfsReader
+
+
+TRASHINFO_SUFFIX = '.trashinfo'
+RECYCLE_BIN = '$Recycle.Bin'
+
+# freedesktop.org trash, macOS Trash and Windows $Recycle.Bin
+TRASH_KINDS = ('freedesktop', 'macos', 'recycle_bin')
+
+_DS_STORE_MAGIC = b'\x00\x00\x00\x01Bud1'
+
+
+class TrashError(Exception):
+    """Raised when trash metadata is malformed or an item cannot be put back"""
+
+
+class TrashEntry:
+    """One item found in a trash, described by the trash's own metadata
+
+    path is where the item sits now; for an entry read out of an image it
+    is the path inside the image and extents holds the runs of its data.
+    origin is the full path it was deleted from (None when the trash kept
+    no record of it), deleted the deletion time as a Unix timestamp, and
+    info the metadata file that describes it (None for the macOS Trash,
+    which keeps that in .DS_Store).
+    """
+
+    __slots__ = ('path', 'origin', 'deleted', 'size', 'kind', 'info', 'is_directory', 'extents')
+
+    def __init__(self, path, origin, deleted, size, kind, info=None, is_directory=False, extents=None):
+        self.path = path
+        self.origin = origin
+        self.deleted = deleted
+        self.size = size
+        self.kind = kind
+        self.info = info
+        self.is_directory = is_directory
+        self.extents = extents
+
+    @property
+    def name(self):
+        return os.path.basename((self.origin or self.path).replace('\\', '/'))
+
+    def to_dict(self):
+        result = {
+            'path': self.path,
+            'origin': self.origin,
+            'deleted': self.deleted,
+            'size': self.size,
+            'kind': self.kind,
+            'info': self.info,
+            'is_directory': self.is_directory
+        }
+        if self.extents is not None:
+            result['extents'] = self.extents
+        return result
+
+    def __repr__(self):
+        return f"TrashEntry({self.path!r}, origin={self.origin!r})"
+
+
+def parse_trashinfo(text):
+    """(Path, deletion timestamp or None) from a freedesktop .trashinfo file
+
+    Path is percent-decoded but otherwise as written: absolute for the home
+    trash, relative to the volume's top directory for a .Trash-$uid one.
+    """
+    lines = [line.strip() for line in text.splitlines()]
+    if '[Trash Info]' not in lines:
+        raise TrashError("no [Trash Info] group")
+    values = {}
+    for line in lines[lines.index('[Trash Info]') + 1:]:
+        if line.startswith('['):
+            break
+        key, sep, value = line.partition('=')
+        if sep:
+            values.setdefault(key.strip(), value.strip())
+    if not values.get('Path'):
+        raise TrashError("no Path key")
+    deleted = None
+    try:
+        # Local time with no zone, as the spec has it; some writers add a fraction
+        deleted = datetime.strptime(values.get('DeletionDate', '')[:19], '%Y-%m-%dT%H:%M:%S').timestamp()
+    except ValueError:
+        pass
+    return unquote(values['Path']), deleted
+
+
+def parse_recycle_record(data):
+    """(original path, size, deletion timestamp) from a Windows $I record
+
+    Version 1 (Vista to 8.1) stores the path in a fixed 520-byte field;
+    version 2 (Windows 10 on) stores its length in characters first.
+    """
+    if len(data) < 28:
+        raise TrashError("$I record is truncated")
+    version, size, filetime = struct.unpack_from('<QQQ', data, 0)
+    if version == 1:
+        raw = data[24:24 + 520]
+    elif version == 2:
+        length, = struct.unpack_from('<I', data, 24)
+        raw = data[28:28 + length * 2]
+    else:
+        raise TrashError(f"unknown $I record version {version}")
+    path = bytes(raw).decode('utf-16-le', 'replace').split('\x00', 1)[0]
+    if not path:
+        raise TrashError("$I record has no path")
+    return path, size, filetime / 10000000 - FILETIME_EPOCH if filetime else None
+
+
+def _ds_records(data):
+    """Yield (filename, code, value) for every record of a .DS_Store file"""
+    if len(data) < 36 or data[:8] != _DS_STORE_MAGIC:
+        raise TrashError("not a .DS_Store file")
+    view = memoryview(data)[4:]
+    root_offset, root_size = struct.unpack_from('>II', view, 4)
+
+    def block(address):
+        offset = address & ~0x1F
+        size = 1 << (address & 0x1F)
+        if offset + size > len(view):
+            raise TrashError(".DS_Store block runs past the end of the file")
+        return view[offset:offset + size]
+
+    root = view[root_offset:root_offset + root_size]
+    count, = struct.unpack_from('>I', root, 0)
+    addresses = struct.unpack_from(f'>{count}I', root, 8)
+    position = 8 + (count + 255) // 256 * 256 * 4
+    toc_count, = struct.unpack_from('>I', root, position)
+    position += 4
+    directory = {}
+    for _ in range(toc_count):
+        length = root[position]
+        name = bytes(root[position + 1:position + 1 + length])
+        directory[name], = struct.unpack_from('>I', root, position + 1 + length)
+        position += 5 + length
+    if b'DSDB' not in directory:
+        raise TrashError(".DS_Store has no DSDB tree")
+    top, = struct.unpack_from('>I', block(addresses[directory[b'DSDB']]), 0)
+
+    pending = [top]
+    seen = set()
+    while pending:
+        number = pending.pop()
+        if number in seen or number >= len(addresses):
+            continue
+        seen.add(number)
+        node = block(addresses[number])
+        pointer, count = struct.unpack_from('>II', node, 0)
+        position = 8
+        for _ in range(count):
+            if pointer:
+                pending.append(struct.unpack_from('>I', node, position)[0])
+                position += 4
+            length, = struct.unpack_from('>I', node, position)
+            name = bytes(node[position + 4:position + 4 + length * 2]).decode('utf-16-be', 'replace')
+            position += 4 + length * 2
+            code = bytes(node[position:position + 4])
+            kind = bytes(node[position + 4:position + 8])
+            position += 8
+            if kind == b'bool':
+                value = bool(node[position])
+                position += 1
+            elif kind in (b'long', b'shor', b'type'):
+                value = bytes(node[position:position + 4])
+                position += 4
+            elif kind in (b'comp', b'dutc'):
+                value = bytes(node[position:position + 8])
+                position += 8
+            elif kind == b'blob':
+                length, = struct.unpack_from('>I', node, position)
+                value = bytes(node[position + 4:position + 4 + length])
+                position += 4 + length
+            elif kind == b'ustr':
+                length, = struct.unpack_from('>I', node, position)
+                value = bytes(node[position + 4:position + 4 + length * 2]).decode('utf-16-be', 'replace')
+                position += 4 + length * 2
+            else:
+                raise TrashError(f".DS_Store record of unknown type {kind!r}")
+            yield name, code, value
+        if pointer:
+            pending.append(pointer)
+
+
+def read_put_back(data):
+    """{name in the Trash: original path relative to the volume root} from a Trash's .DS_Store
+
+    Finder records the folder an item came from (ptbL) and, when it had to
+    be renamed on the way into the Trash, its original name (ptbN).
+    """
+    folders = {}
+    names = {}
+    try:
+        for name, code, value in _ds_records(data):
+            if code == b'ptbL':
+                folders[name] = value
+            elif code == b'ptbN':
+                names[name] = value
+    except (struct.error, IndexError) as e:
+        raise TrashError(f".DS_Store is damaged ({e})")
+    return {name: folder.rstrip('/') + '/' + names.get(name, name) for name, folder in folders.items()}
+
+
+def _stat_entry(path, origin, deleted, kind, info=None, size=None):
+    """TrashEntry for an item on a mounted volume, sized from its metadata alone"""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    is_directory = stat.S_ISDIR(st.st_mode)
+    if size is None:
+        size = 0 if is_directory else st.st_size
+    return TrashEntry(path, origin, deleted, size, kind, info, is_directory)
+
+
+def iter_freedesktop(directory, topdir=None):
+    """Yield a TrashEntry per .trashinfo file of a freedesktop.org trash
+
+    topdir is the volume root that relative Paths hang off, for the
+    .Trash/$uid and .Trash-$uid trashes kept at the top of a volume.
+    Trashed directories are sized from the trash's directorysizes cache.
+    """
+    info_dir = os.path.join(directory, 'info')
+    files_dir = os.path.join(directory, 'files')
+    sizes = {}
+    try:
+        with open(os.path.join(directory, 'directorysizes'), encoding='utf-8', errors='replace') as f:
+            for line in f:
+                fields = line.split(None, 2)
+                if len(fields) == 3 and fields[0].isdigit():
+                    sizes[unquote(fields[2].strip())] = int(fields[0])
+    except OSError:
+        pass
+    try:
+        entries = list(os.scandir(info_dir))
+    except OSError:
+        return
+    for entry in entries:
+        if not entry.name.endswith(TRASHINFO_SUFFIX):
+            continue
+        name = entry.name[:-len(TRASHINFO_SUFFIX)]
+        try:
+            with open(entry.path, encoding='utf-8', errors='replace') as f:
+                origin, deleted = parse_trashinfo(f.read())
+        except (OSError, TrashError):
+            continue
+        if not os.path.isabs(origin) and topdir is not None:
+            origin = os.path.join(topdir, origin)
+        result = _stat_entry(os.path.join(files_dir, name), origin, deleted, 'freedesktop',
+                             entry.path, sizes.get(name))
+        if result is not None:
+            yield result
+
+
+def iter_macos(directory, topdir='/'):
+    """Yield a TrashEntry per item in a macOS Trash
+
+    Original locations come from the put-back records in the Trash's
+    .DS_Store and are relative to topdir, the volume the Trash is on;
+    items without one get no origin rather than a guessed one. The
+    Trash keeps no deletion time, so the item's ctime, set when it was
+    moved in, stands in for it.
+    """
+    try:
+        with open(os.path.join(directory, '.DS_Store'), 'rb') as f:
+            put_back = read_put_back(f.read())
+    except (OSError, TrashError):
+        put_back = {}
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return
+    for entry in entries:
+        if entry.name in ('.DS_Store', '.localized'):
+            continue
+        origin = put_back.get(entry.name)
+        if origin is not None:
+            origin = os.path.join(topdir, origin.lstrip('/'))
+        try:
+            deleted = entry.stat(follow_symlinks=False).st_ctime
+        except OSError:
+            continue
+        result = _stat_entry(entry.path, origin, deleted, 'macos')
+        if result is not None:
+            yield result
+
+
+def _local_origin(origin, topdir):
+    """Where a recorded Windows path lives on this machine
+
+    On Windows it is used as is. Elsewhere the volume is mounted at topdir
+    and the drive letter it had under Windows means nothing, so the path
+    is taken from the root of that mount.
+    """
+    if os.name == 'nt' or topdir is None:
+        return origin
+    parts = [part for part in origin.replace('\\', '/').split('/') if part]
+    if parts and len(parts[0]) == 2 and parts[0][1] == ':':
+        parts = parts[1:]
+    return os.path.join(topdir, *parts)
+
+
+def iter_recycle_bin(directory, topdir=None):
+    """Yield a TrashEntry per $I record in one user's $Recycle.Bin\\<SID> folder
+
+    The record names the original path, size and deletion time; the data
+    sits beside it under the same name with $R in place of $I.
+    """
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return
+    for entry in entries:
+        if not entry.name.startswith('$I'):
+            continue
+        try:
+            with open(entry.path, 'rb') as f:
+                origin, size, deleted = parse_recycle_record(f.read(4096))
+        except (OSError, TrashError):
+            continue
+        data = os.path.join(directory, '$R' + entry.name[2:])
+        result = _stat_entry(data, _local_origin(origin, topdir), deleted, 'recycle_bin', entry.path,
+                             size)
+        if result is not None:
+            yield result
+
+
+def default_volumes():
+    """Roots of the mounted volumes worth checking for a trash"""
+    if os.name == 'nt':
+        return [f"{letter}:\\" for letter in string.ascii_uppercase if os.path.isdir(f"{letter}:\\")]
+    if sys.platform == 'darwin':
+        return ['/'] + sorted(glob.glob('/Volumes/*'))
+    volumes = ['/']
+    try:
+        with open('/proc/self/mounts', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                # Disks and partitions only; proc, tmpfs and friends have no trash
+                if len(fields) >= 2 and fields[0].startswith('/dev/'):
+                    mount_point = fields[1].replace('\\040', ' ')
+                    if mount_point not in volumes:
+                        volumes.append(mount_point)
+    except OSError:
+        pass
+    return volumes
+
+
+def trash_locations(home=None, volumes=None):
+    """(kind, directory, topdir) for every trash found in a home directory and on volumes
+
+    Trashes of every user on a volume are included, so a mounted disk from
+    another machine is covered too. volumes defaults to default_volumes().
+    """
+    home = home if home is not None else os.path.expanduser('~')
+    if volumes is None:
+        volumes = default_volumes()
+    data_home = os.environ.get('XDG_DATA_HOME') or os.path.join(home, '.local', 'share')
+    candidates = [
+        ('freedesktop', os.path.join(data_home, 'Trash'), None),
+        ('macos', os.path.join(home, '.Trash'), '/'),
+    ]
+    for volume in volumes:
+        candidates.extend(('freedesktop', path, volume)
+                          for path in sorted(glob.glob(os.path.join(volume, '.Trash-*'))))
+        candidates.extend(('freedesktop', path, volume)
+                          for path in sorted(glob.glob(os.path.join(volume, '.Trash', '*'))))
+        candidates.extend(('macos', path, volume)
+                          for path in sorted(glob.glob(os.path.join(volume, '.Trashes', '*'))))
+        # Matched without regard to case: FAT and some mounts lower-case it
+        for name in _listdir(volume):
+            if name.lower() == RECYCLE_BIN.lower():
+                candidates.extend(('recycle_bin', path, volume)
+                                  for path in sorted(glob.glob(os.path.join(volume, glob.escape(name), '*'))))
+
+    locations = []
+    seen = set()
+    for kind, path, topdir in candidates:
+        real = os.path.realpath(path)
+        if real not in seen and os.path.isdir(path):
+            seen.add(real)
+            locations.append((kind, path, topdir))
+    return locations
+
+
+def _listdir(path):
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+
+_READERS = {'freedesktop': iter_freedesktop, 'macos': iter_macos, 'recycle_bin': iter_recycle_bin}
+
+
+def iter_trash(locations=None, cancel_token=None):
+    """Yield a TrashEntry for every item in the given trash locations
+
+    locations are (kind, directory, topdir) tuples as trash_locations()
+    returns them, which is the default. Only metadata is read, never the
+    trashed files' contents.
+    """
+    if locations is None:
+        locations = trash_locations()
+    for kind, directory, topdir in locations:
+        if cancel_token is not None and cancel_token.cancelled:
+            return
+        yield from _READERS[kind](directory, topdir)
+
+
+def iter_image_recycle_bin(source, cancel_token=None):
+    """Yield a TrashEntry per $I record in an NTFS image's $Recycle.Bin
+
+    Entries carry the image path of their $R data and its extents, so
+    they restore like any other image result. Deleted folders, whose $R
+    is a directory, are not listed.
+    """
+    owns_image = not isinstance(source, DiskImage)
+    image = DiskImage(source) if owns_image else source
+    try:
+        with NtfsReader(image) as reader:
+            records = {}
+            data = {}
+            for entry in reader.iter_allocated(cancel_token):
+                parts = entry.path.split('/')
+                if len(parts) != 4 or parts[1].lower() != RECYCLE_BIN.lower():
+                    continue
+                folder, name = '/'.join(parts[:3]), parts[3]
+                if name.startswith('$I'):
+                    records[(folder, name[2:])] = entry
+                elif name.startswith('$R'):
+                    data[(folder, name[2:])] = entry
+
+            for key, record in sorted(records.items()):
+                entry = data.get(key)
+                if entry is None:
+                    continue
+                raw = bytearray(record.size)
+                for offset, length, file_offset in reader.byte_ranges(record):
+                    raw[file_offset:file_offset + length] = image.read_at(offset, length)
+                try:
+                    origin, size, deleted = parse_recycle_record(raw)
+                except TrashError:
+                    continue
+                yield TrashEntry(entry.path, origin, deleted, entry.size, 'recycle_bin', record.path,
+                                 extents=reader.byte_ranges(entry))
+    finally:
+        if owns_image:
+            image.close()
+
+
+def _trashed_item(path):
+    """(top-level trashed item holding path, its metadata file or None), or (None, None)"""
+    child = os.path.abspath(path)
+    parent = os.path.dirname(child)
+    while parent != child:
+        name = os.path.basename(parent)
+        above = os.path.dirname(parent)
+        if name == 'files' and os.path.isdir(os.path.join(above, 'info')):
+            return child, os.path.join(above, 'info', os.path.basename(child) + TRASHINFO_SUFFIX)
+        if os.path.basename(above).lower() == RECYCLE_BIN.lower() and os.path.basename(child).startswith('$R'):
+            return child, os.path.join(parent, '$I' + os.path.basename(child)[2:])
+        if name == '.Trash' or os.path.basename(above) == '.Trashes':
+            return child, None
+        child, parent = parent, above
+    return None, None
+
+
+def put_back(path, origin):
+    """Move a trashed file or directory at path back to origin
+
+    Missing parent folders are recreated. Raises TrashError rather than
+    overwrite anything already at origin. When path was a whole trashed
+    item, or the last file left in a trashed folder, the folder and the
+    item's metadata are removed as the system's own restore would.
+    """
+    if origin is None:
+        raise TrashError(f"{path} has no recorded original location")
+    if os.path.lexists(origin):
+        raise TrashError(f"{origin} already exists")
+    if not os.path.lexists(path):
+        raise TrashError(f"{path} is no longer in the trash")
+    item, info = _trashed_item(path)
+    os.makedirs(os.path.dirname(origin) or '.', exist_ok=True)
+    shutil.move(path, origin)
+    if item is None:
+        return
+
+    folder = os.path.dirname(os.path.abspath(path))
+    while os.path.abspath(path) != item and folder.startswith(item):
+        try:
+            os.rmdir(folder)
+        except OSError:
+            # Other files of the folder are still in the trash
+            return
+        if folder == item:
+            break
+        folder = os.path.dirname(folder)
+    if info is not None:
+        try:
+            os.remove(info)
+        except OSError:
+            pass
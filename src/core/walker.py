@@ -0,0 +1,280 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+
+_DONE = object()
+
+
+class WalkStats:
+    """Counters collected by a ParallelWalker run"""
+
+    def __init__(self):
+        self.files = 0
+        self.dirs = 0
+        self.errors = 0
+        self.denied = 0  # of the errors, directories skipped for lack of permission
+        self.bytes = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        end = self.finished if self.finished is not None else time.monotonic()
+        return end - self.started
+
+    @property
+    def files_per_second(self):
+        elapsed = self.elapsed
+        return self.files / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self):
+        return {
+            'files': self.files,
+            'dirs': self.dirs,
+            'errors': self.errors,
+            'denied': self.denied,
+            'bytes': self.bytes,
+            'elapsed': self.elapsed,
+            'files_per_second': self.files_per_second
+        }
+
+
+class DirListing:
+    """One directory as seen by ParallelWalker.walk_listings()
+
+    unchanged is True when the directory's mtime matched known_dirs, in
+    which case it was not listed: files is None and subdirs comes from
+    known_dirs.
+    """
+
+    __slots__ = ('path', 'mtime_ns', 'files', 'subdirs', 'unchanged')
+
+    def __init__(self, path, mtime_ns, files, subdirs, unchanged=False):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.files = files
+        self.subdirs = subdirs
+        self.unchanged = unchanged
+
+    def __repr__(self):
+        return f"DirListing({self.path!r}, unchanged={self.unchanged})"
+
+
+class ParallelWalker:
+    """Walk several roots at once with os.scandir on a bounded set of threads
+
+    Every worker owns a deque of directories still to list. It pushes the
+    subdirectories it finds onto its own deque and pops from the same end,
+    so a subtree stays on one thread while it is hot; a worker that runs
+    dry steals from the opposite end of another worker's deque. Stat data
+    comes from the DirEntry, so each file costs at most one lstat (none on
+    Windows, where scandir already returns it).
+
+    known_dirs maps directory paths to (mtime_ns, subdirs) from an earlier
+    walk. A directory whose mtime still matches is not listed again (no
+    entry can have been added, removed or renamed in it) and only its
+    known subdirectories are visited.
+
+    With a Metrics registry, each directory adds its listing time to the
+    'walk' stage and its lstat time to 'stat', and the found, error and
+    permission-denied counts go to its counters as the walk runs.
+    """
+
+    def __init__(self, workers=None, cancel_token=None, follow_symlinks=False, queue_size=1024,
+                 known_dirs=None, metrics=None):
+        if workers is None:
+            workers = min(32, (os.cpu_count() or 1) + 4)
+        self.workers = max(1, workers)
+        self.cancel_token = cancel_token
+        self.follow_symlinks = follow_symlinks
+        self.queue_size = queue_size
+        self.known_dirs = known_dirs
+        self.metrics = metrics
+        # How long an idle worker or the consumer sleeps before re-checking
+        # for work and cancellation
+        self.poll_interval = 0.005
+        self.stats = WalkStats()
+
+    def walk(self, roots):
+        """Yield (dirpath, [(path, stat_result), ...]) for every directory listed
+
+        Directories arrive in no particular order. Leaving the generator
+        early, or cancelling the token, stops all workers.
+        """
+        for listing in self._run(roots, listings=False):
+            yield listing.path, listing.files
+
+    def walk_listings(self, roots):
+        """Yield a DirListing for every directory visited, files or not"""
+        return self._run(roots, listings=True)
+
+    def _run(self, roots, listings):
+        self.stats = WalkStats()
+        self._listings = listings
+        self._stop = threading.Event()
+        self._out = queue.Queue(self.queue_size)
+        self._cond = threading.Condition()
+        self._idle = 0
+        self._deques = [deque() for _ in range(self.workers)]
+        self._errors = [0] * self.workers
+        self._denied = [0] * self.workers
+        self._pending = 0
+
+        for index, root in enumerate(roots):
+            self._deques[index % self.workers].append(root)
+            self._pending += 1
+
+        threads = [
+            threading.Thread(target=self._run_worker, args=(index,), daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        finished = 0
+        try:
+            while finished < len(threads):
+                if self._cancelled():
+                    break
+                try:
+                    item = self._out.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    continue
+
+                if item is _DONE:
+                    finished += 1
+                    continue
+
+                self.stats.dirs += 1
+                if item.files:
+                    self.stats.files += len(item.files)
+                    size = 0
+                    for _, st in item.files:
+                        size += st.st_size
+                    self.stats.bytes += size
+                    if self.metrics is not None:
+                        self.metrics.count('files', len(item.files))
+                        self.metrics.count('bytes', size)
+                yield item
+        finally:
+            self._stop.set()
+            with self._cond:
+                self._cond.notify_all()
+            self.stats.errors = sum(self._errors)
+            self.stats.denied = sum(self._denied)
+            self.stats.finished = time.monotonic()
+
+    def _cancelled(self):
+        if self._stop.is_set():
+            return True
+        return self.cancel_token is not None and self.cancel_token.cancelled
+
+    def _run_worker(self, index):
+        own = self._deques[index]
+        try:
+            while not self._cancelled():
+                try:
+                    path = own.pop()
+                except IndexError:
+                    path = self._steal(index)
+
+                if path is None:
+                    with self._cond:
+                        if self._pending == 0:
+                            break
+                        self._idle += 1
+                        self._cond.wait(self.poll_interval)
+                        self._idle -= 1
+                    continue
+
+                subdirs = self._scan_dir(index, path)
+                with self._cond:
+                    self._pending += len(subdirs) - 1
+                    own.extend(subdirs)
+                    if self._pending == 0 or (subdirs and self._idle):
+                        self._cond.notify_all()
+        finally:
+            self._put(_DONE)
+
+    def _steal(self, index):
+        count = len(self._deques)
+        for offset in range(1, count):
+            victim = self._deques[(index + offset) % count]
+            try:
+                return victim.popleft()
+            except IndexError:
+                continue
+        return None
+
+    def _scan_dir(self, index, path):
+        mtime_ns = None
+        if self.known_dirs is not None:
+            # Stat before listing, so a change made during the walk shows
+            # up as a changed directory next time
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                self._errors[index] += 1
+                if self.metrics is not None:
+                    self.metrics.count('errors')
+                return []
+            known = self.known_dirs.get(path)
+            if known is not None and known[0] == mtime_ns:
+                if self.metrics is not None:
+                    self.metrics.count('unchanged_dirs')
+                self._put(DirListing(path, mtime_ns, None, known[1], unchanged=True))
+                return list(known[1])
+
+        metrics = self.metrics
+        started = time.perf_counter()
+        stat_seconds = 0.0
+        errors = self._errors[index]
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=self.follow_symlinks):
+                            subdirs.append(entry.path)
+                        elif entry.is_file():
+                            # Links to files are listed, as os.walk does;
+                            # links to directories are never descended
+                            if metrics is None:
+                                files.append((entry.path, entry.stat()))
+                            else:
+                                before = time.perf_counter()
+                                files.append((entry.path, entry.stat()))
+                                stat_seconds += time.perf_counter() - before
+                    except OSError:
+                        self._errors[index] += 1
+        except PermissionError:
+            # Protected directories are skipped, and counted apart
+            self._errors[index] += 1
+            self._denied[index] += 1
+            if metrics is not None:
+                metrics.count('permission_denied')
+        except OSError:
+            self._errors[index] += 1
+
+        if metrics is not None:
+            metrics.add_time('walk', time.perf_counter() - started - stat_seconds, len(files) + len(subdirs))
+            metrics.add_time('stat', stat_seconds, len(files))
+            metrics.count('dirs')
+            if self._errors[index] != errors:
+                metrics.count('errors', self._errors[index] - errors)
+        if files or self._listings:
+            self._put(DirListing(path, mtime_ns, files, subdirs))
+        return subdirs
+
+    def _put(self, item):
+        while not self._cancelled():
+            try:
+                self._out.put(item, timeout=self.poll_interval)
+                return True
+            except queue.Full:
+                continue
+        return False
@@ -0,0 +1,177 @@
+import os
+
+from ..core.scanner import ScanResult
+
+
+SCHEMA_VERSION = 2
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser("~"), ".phoenix_restore", "scan_index.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    subdirs TEXT NOT NULL,
+    generation INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    inode INTEGER NOT NULL,
+    device INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    hash TEXT,
+    hash_algorithm TEXT,
+    generation INTEGER NOT NULL,
+    classified INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+CREATE INDEX IF NOT EXISTS files_type ON files (type);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+"""
+
+# Statements that bring a database at version n up to n + 1
+MIGRATIONS = {
+    1: ["ALTER TABLE files ADD COLUMN classified INTEGER NOT NULL DEFAULT 0"],
+}
+
+FILE_COLUMNS = 'path, size, mtime, inode, device, type, hash, hash_algorithm, classified'
+
+
+class IndexedFile:
+    """A file row read back from the scan index"""
+
+    __slots__ = ('path', 'size', 'mtime', 'inode', 'device', 'type', 'hash', 'hash_algorithm', 'classified')
+
+    def __init__(self, path, size, mtime, inode, device, type, hash=None, hash_algorithm=None,
+                 classified=False):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.inode = inode
+        self.device = device
+        self.type = type  # from the contents once classified, else from the extension
+        self.hash = hash
+        self.hash_algorithm = hash_algorithm
+        self.classified = bool(classified)
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    def to_scan_result(self):
+        return ScanResult(self.path, self.size, self.mtime, self.inode, self.device,
+                          category=self.type if self.classified else None)
+
+    def to_dict(self):
+        return {
+            'path': self.path,
+            'size': self.size,
+            'mtime': self.mtime,
+            'inode': self.inode,
+            'device': self.device,
+            'type': self.type,
+            'hash': self.hash,
+            'hash_algorithm': self.hash_algorithm,
+            'classified': self.classified
+        }
+
+    def __repr__(self):
+        return f"IndexedFile({self.path!r}, size={self.size}, type={self.type!r})"
+
+
+HISTORY_VERSION = 1
+
+DEFAULT_HISTORY_PATH = os.path.join(os.path.expanduser("~"), ".phoenix_restore", "history.db")
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    mode TEXT,
+    started REAL NOT NULL,
+    elapsed REAL NOT NULL,
+    files INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    runs INTEGER NOT NULL,
+    host TEXT NOT NULL,
+    version TEXT NOT NULL,
+    details TEXT
+);
+
+CREATE INDEX IF NOT EXISTS history_started ON history (started, id);
+CREATE INDEX IF NOT EXISTS history_kind ON history (kind, started, id);
+
+CREATE TRIGGER IF NOT EXISTS history_append_only
+BEFORE UPDATE ON history
+BEGIN
+    SELECT RAISE(ABORT, 'recovery history is append-only');
+END;
+"""
+
+HISTORY_COLUMNS = 'id, kind, mode, started, elapsed, files, bytes, failures, status, runs, host, version, details'
+
+
+class HistoryRecord:
+    """One scan, carve or restore run, or a compacted day of them"""
+
+    __slots__ = ('id', 'kind', 'mode', 'started', 'elapsed', 'files', 'bytes', 'failures',
+                 'status', 'runs', 'host', 'version', 'details')
+
+    def __init__(self, id, kind, mode, started, elapsed, files, bytes, failures, status,
+                 runs, host, version, details=None):
+        self.id = id
+        self.kind = kind  # 'scan', 'carve', 'restore', ...
+        self.mode = mode
+        self.started = started
+        self.elapsed = elapsed
+        self.files = files
+        self.bytes = bytes
+        self.failures = failures
+        self.status = status  # 'done', 'cancelled', 'failed' or 'compacted'
+        self.runs = runs  # more than 1 once compacted
+        self.host = host
+        self.version = version
+        self.details = details
+
+    @property
+    def files_per_second(self):
+        return self.files / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def mb_per_second(self):
+        return self.bytes / (1024 * 1024) / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'mode': self.mode,
+            'started': self.started,
+            'elapsed': self.elapsed,
+            'files': self.files,
+            'bytes': self.bytes,
+            'failures': self.failures,
+            'status': self.status,
+            'runs': self.runs,
+            'host': self.host,
+            'version': self.version,
+            'details': self.details,
+            'files_per_second': self.files_per_second,
+            'mb_per_second': self.mb_per_second
+        }
+
+    def __repr__(self):
+        return f"HistoryRecord({self.id}, {self.kind!r}, files={self.files}, status={self.status!r})"
@@ -0,0 +1,421 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from ..core.file_types import category_for
+from ..core.scanner import ScanResult
+from .. import __version__
+from .models import (DEFAULT_HISTORY_PATH, DEFAULT_INDEX_PATH, FILE_COLUMNS, HISTORY_COLUMNS,
+                     HISTORY_SCHEMA, HISTORY_VERSION, MIGRATIONS, SCHEMA, SCHEMA_VERSION,
+                     HistoryRecord, IndexedFile)
+
+
+class DatabaseError(Exception):
+    """Raised when an on-disk database cannot be used"""
+
+
+def _connect(path, schema, schema_version, migrations=None):
+    """Shared WAL-mode connection with schema applied, for use behind a lock
+
+    A database written by an older version is brought up to date with
+    migrations, {version: [statements to reach version + 1]}.
+    """
+    if path != ':memory:':
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version > schema_version or (version and any(
+            step not in (migrations or {}) for step in range(version, schema_version))):
+        conn.close()
+        raise DatabaseError(f"{path}: unsupported database version {version}")
+    with conn:
+        for step in range(version or schema_version, schema_version):
+            for statement in migrations[step]:
+                conn.execute(statement)
+    conn.executescript(schema)
+    conn.execute(f'PRAGMA user_version={schema_version}')
+    return conn
+
+
+def _subtree_bounds(root):
+    """(prefix, upper) such that prefix <= path < upper for paths below root"""
+    prefix = root if root.endswith(os.sep) else root + os.sep
+    return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class ScanIndex:
+    """On-disk SQLite index of every file a walk has seen
+
+    Each directory is stored with its mtime and the names of its
+    subdirectories. A rescan hands these to ParallelWalker as known_dirs,
+    so directories whose mtime has not moved are not listed again and
+    their files are served from the index, each checked against a fresh
+    stat since editing a file in place leaves its directory's mtime
+    alone; only changed directories are re-listed and rewritten. Digests and content-based types survive a
+    rescan as long as the file's size, mtime and inode stay the same.
+
+    One connection is shared between threads behind a lock, so the GUI
+    can query the index while a scan thread writes to it.
+    """
+
+    def __init__(self, path=None, batch_size=2000):
+        self.path = path or DEFAULT_INDEX_PATH
+        self.batch_size = batch_size
+        self._lock = threading.RLock()
+        self._conn = _connect(self.path, SCHEMA, SCHEMA_VERSION, MIGRATIONS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def begin_update(self, roots, full=False):
+        """Start recording a walk of roots; see IndexUpdate"""
+        return IndexUpdate(self, roots, full)
+
+    def _next_generation(self):
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+            generation = int(row[0]) + 1 if row else 1
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('generation', ?)", (str(generation),))
+        return generation
+
+    def known_dirs(self, roots):
+        """{path: (mtime_ns, [subdir paths])} for indexed directories under roots"""
+        known = {}
+        with self._lock:
+            for root in roots:
+                prefix, upper = _subtree_bounds(root)
+                rows = self._conn.execute(
+                    "SELECT path, mtime_ns, subdirs FROM directories "
+                    "WHERE path = ? OR (path >= ? AND path < ?)", (root, prefix, upper))
+                for path, mtime_ns, subdirs in rows:
+                    known[path] = (mtime_ns, [os.path.join(path, name) for name in json.loads(subdirs)])
+        return known
+
+    def files_in(self, directory):
+        """ScanResults for the files indexed directly inside directory"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, size, mtime, inode, device, CASE WHEN classified THEN type END "
+                "FROM files WHERE directory = ?", (directory,)).fetchall()
+        return [ScanResult(path, size, mtime, inode, device, category=category)
+                for path, size, mtime, inode, device, category in rows]
+
+    def query(self, name=None, file_type=None, under=None, min_size=None, max_size=None, limit=None):
+        """IndexedFiles matching every given filter, ordered by path
+
+        name matches case-insensitively anywhere in the file name.
+        """
+        clauses = []
+        params = []
+        if name:
+            clauses.append("name LIKE ? ESCAPE '\\'")
+            params.append(f"%{_escape_like(name)}%")
+        if file_type:
+            clauses.append("type = ?")
+            params.append(file_type)
+        if under:
+            prefix, upper = _subtree_bounds(under)
+            clauses.append("path >= ? AND path < ?")
+            params.extend((prefix, upper))
+        if min_size is not None:
+            clauses.append("size >= ?")
+            params.append(min_size)
+        if max_size is not None:
+            clauses.append("size <= ?")
+            params.append(max_size)
+
+        sql = f"SELECT {FILE_COLUMNS} FROM files"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY path"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [IndexedFile(*row) for row in rows]
+
+    def get(self, path):
+        """The IndexedFile for path, or None"""
+        with self._lock:
+            row = self._conn.execute(f"SELECT {FILE_COLUMNS} FROM files WHERE path = ?", (path,)).fetchone()
+        return IndexedFile(*row) if row else None
+
+    def set_hashes(self, digests, algorithm):
+        """Store (path, digest) pairs computed with algorithm"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE files SET hash = ?, hash_algorithm = ? WHERE path = ?",
+                ((digest, algorithm, path) for path, digest in digests))
+
+    def set_types(self, types):
+        """Store (path, category) pairs found by looking at file contents"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE files SET type = ?, classified = 1 WHERE path = ?",
+                ((category, path) for path, category in types))
+
+    def classified_types(self, paths):
+        """{path: category} for those of paths whose contents were already classified"""
+        wanted = set(paths)
+        sep = os.sep
+        # os.path.dirname, minus the call overhead
+        directories = list({path.rpartition(sep)[0] or sep for path in wanted})
+        types = {}
+        with self._lock:
+            # Looked up by directory, which is indexed, in chunks within
+            # SQLite's default limit on bound parameters
+            for start in range(0, len(directories), 900):
+                chunk = directories[start:start + 900]
+                rows = self._conn.execute(
+                    f"SELECT path, type FROM files WHERE directory IN ({', '.join('?' * len(chunk))}) "
+                    f"AND classified = 1", chunk)
+                types.update(row for row in rows if row[0] in wanted)
+        return types
+
+    def stats(self):
+        """Totals for the whole index"""
+        with self._lock:
+            files, total_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files").fetchone()
+            directories = self._conn.execute("SELECT COUNT(*) FROM directories").fetchone()[0]
+            types = dict(self._conn.execute("SELECT type, COUNT(*) FROM files GROUP BY type"))
+        return {
+            'files': files,
+            'directories': directories,
+            'bytes': total_bytes,
+            'types': types
+        }
+
+
+class IndexUpdate:
+    """A walk being written into a ScanIndex
+
+    Pass known_dirs to the walker, feed every DirListing to record() and
+    call finish() once the walk ends. Writes are batched; directories that
+    a complete walk no longer reached are purged by finish().
+    """
+
+    def __init__(self, index, roots, full=False):
+        self.index = index
+        self.roots = list(roots)
+        self.generation = index._next_generation()
+        self.known_dirs = {} if full else index.known_dirs(self.roots)
+        self._directories = []
+        self._seen = []
+        self._files = []
+        self._changed = []
+
+    def record(self, listing):
+        """Store one DirListing and return its files as ScanResults"""
+        if listing.unchanged:
+            self._seen.append((self.generation, listing.path))
+            results = []
+            for result in self.index.files_in(listing.path):
+                try:
+                    st = os.stat(result.path)
+                except OSError:
+                    continue
+                if (st.st_size, st.st_mtime, st.st_ino) != (result.size, result.mtime, result.inode):
+                    # Rewritten in place: its stored digest and type go with the update
+                    result = ScanResult(result.path, st.st_size, st.st_mtime, st.st_ino, st.st_dev)
+                    self._add_file(result.path, listing.path, st)
+                results.append(result)
+        else:
+            names = [os.path.basename(path) for path in listing.subdirs]
+            self._directories.append((listing.path, listing.mtime_ns, json.dumps(names), self.generation))
+            self._changed.append((listing.path, self.generation))
+            results = []
+            for path, st in listing.files:
+                results.append(ScanResult(path, st.st_size, st.st_mtime, st.st_ino, st.st_dev))
+                self._add_file(path, listing.path, st)
+
+        if len(self._files) + len(self._seen) + len(self._directories) >= self.index.batch_size:
+            self.flush()
+        return results
+
+    def _add_file(self, path, directory, st):
+        self._files.append((path, directory, os.path.basename(path), st.st_size, st.st_mtime, st.st_ino,
+                            st.st_dev, category_for(path), self.generation))
+
+    def flush(self):
+        """Write everything recorded so far in one transaction"""
+        index = self.index
+        with index._lock, index._conn:
+            conn = index._conn
+            conn.executemany(
+                "INSERT INTO directories (path, mtime_ns, subdirs, generation) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET mtime_ns = excluded.mtime_ns, "
+                "subdirs = excluded.subdirs, generation = excluded.generation",
+                self._directories)
+            conn.executemany("UPDATE directories SET generation = ? WHERE path = ?", self._seen)
+            # A digest or a content type stays valid while the file looks the same
+            same = "files.size = excluded.size AND files.mtime = excluded.mtime AND files.inode = excluded.inode"
+            conn.executemany(
+                "INSERT INTO files (path, directory, name, size, mtime, inode, device, type, generation) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET directory = excluded.directory, name = excluded.name, "
+                "generation = excluded.generation, "
+                f"type = CASE WHEN files.classified AND {same} THEN files.type ELSE excluded.type END, "
+                f"classified = CASE WHEN {same} THEN files.classified ELSE 0 END, "
+                f"hash = CASE WHEN {same} THEN files.hash END, "
+                f"hash_algorithm = CASE WHEN {same} THEN files.hash_algorithm END, "
+                "size = excluded.size, mtime = excluded.mtime, inode = excluded.inode, "
+                "device = excluded.device",
+                self._files)
+            # Files that disappeared from a re-listed directory
+            conn.executemany("DELETE FROM files WHERE directory = ? AND generation < ?", self._changed)
+        self._directories = []
+        self._seen = []
+        self._files = []
+        self._changed = []
+
+    def finish(self, complete=True):
+        """Flush, and after a complete walk drop directories that are gone"""
+        self.flush()
+        if not complete:
+            return
+        index = self.index
+        with index._lock, index._conn:
+            for root in self.roots:
+                prefix, upper = _subtree_bounds(root)
+                stale = ("SELECT path FROM directories WHERE generation < ? "
+                         "AND (path = ? OR (path >= ? AND path < ?))")
+                params = (self.generation, root, prefix, upper)
+                index._conn.execute(f"DELETE FROM files WHERE directory IN ({stale})", params)
+                index._conn.execute(
+                    "DELETE FROM directories WHERE generation < ? "
+                    "AND (path = ? OR (path >= ? AND path < ?))", params)
+
+
+class RecoveryHistory:
+    """Append-only SQLite log of scans and restores, with their timings
+
+    Rows are only ever inserted (a trigger rejects updates) and read newest
+    first in keyset-paged slices, so opening years of history costs one
+    index seek. compact() folds old runs into one row per day, status,
+    kind, mode, host and version, keeping the totals that throughput
+    comparisons need.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or DEFAULT_HISTORY_PATH
+        self.host = socket.gethostname()
+        self._lock = threading.RLock()
+        self._conn = _connect(self.path, HISTORY_SCHEMA, HISTORY_VERSION)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def record(self, kind, started, elapsed, files=0, bytes=0, failures=0, status='done',
+               mode=None, details=None):
+        """Append one run; returns its id"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                f"INSERT INTO history ({HISTORY_COLUMNS}) VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?, ?)",
+                (kind, mode, started, elapsed, files, bytes, failures, status, self.host, __version__,
+                 json.dumps(details) if details is not None else None))
+            return cursor.lastrowid
+
+    def page(self, after=None, limit=100, kind=None, host=None):
+        """Up to limit records, newest first, starting below the record after
+
+        Pass the last record of one page as after to get the next; the
+        (started, id) index makes every page a single seek.
+        """
+        clauses = []
+        params = []
+        if after is not None:
+            clauses.append("(started < ? OR (started = ? AND id < ?))")
+            params.extend((after.started, after.started, after.id))
+        if kind:
+            clauses.append("kind = ?")
+            params.append(kind)
+        if host:
+            clauses.append("host = ?")
+            params.append(host)
+        sql = f"SELECT {HISTORY_COLUMNS} FROM history"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY started DESC, id DESC LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._record(row) for row in rows]
+
+    @staticmethod
+    def _record(row):
+        record = HistoryRecord(*row)
+        if record.details is not None:
+            record.details = json.loads(record.details)
+        return record
+
+    def throughput(self, kind='scan', by='version'):
+        """Totals and average speed of kind runs grouped by version, host or mode"""
+        if by not in ('version', 'host', 'mode'):
+            raise ValueError(f"Cannot group history by {by!r}")
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {by}, SUM(runs), SUM(files), SUM(bytes), SUM(elapsed) FROM history "
+                f"WHERE kind = ? AND status IN ('done', 'compacted') GROUP BY {by} ORDER BY {by}",
+                (kind,)).fetchall()
+        return [
+            {
+                by: key,
+                'runs': runs,
+                'files': files,
+                'bytes': total_bytes,
+                'elapsed': elapsed,
+                'files_per_second': files / elapsed if elapsed else 0.0,
+                'mb_per_second': total_bytes / (1024 * 1024) / elapsed if elapsed else 0.0
+            }
+            for key, runs, files, total_bytes, elapsed in rows
+        ]
+
+    def compact(self, older_than_days=90):
+        """Fold runs older than the cutoff into one row per day; returns rows removed"""
+        cutoff = time.time() - older_than_days * 86400
+        # Runs are grouped on the start of their day (UTC). Finished runs
+        # become 'compacted'; failed and cancelled ones keep their status so
+        # throughput() still leaves them out
+        day = "CAST(started / 86400 AS INTEGER) * 86400"
+        status = "CASE status WHEN 'done' THEN 'compacted' ELSE status END"
+        with self._lock:
+            with self._conn:
+                removed = self._conn.execute("SELECT COUNT(*) FROM history WHERE started < ?",
+                                             (cutoff,)).fetchone()[0]
+                days = self._conn.execute(
+                    f"SELECT kind, mode, {day}, SUM(elapsed), SUM(files), SUM(bytes), SUM(failures), "
+                    f"{status}, SUM(runs), host, version FROM history WHERE started < ? "
+                    f"GROUP BY {day}, {status}, kind, mode, host, version", (cutoff,)).fetchall()
+                self._conn.execute("DELETE FROM history WHERE started < ?", (cutoff,))
+                self._conn.executemany(
+                    "INSERT INTO history (kind, mode, started, elapsed, files, bytes, failures, "
+                    "status, runs, host, version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", days)
+            self._conn.execute("VACUUM")
+        return removed - len(days)
@@ -0,0 +1,58 @@
+import queue
+import threading
+import time
+
+
+class UiPump:
+    """Runs callbacks posted from any thread on the Tk thread, a frame at a time
+
+    Background threads never touch Tk: post() queues a call and
+    post_latest() keeps only the newest call per key, which suits status
+    text that is overwritten anyway. A timer on the Tk thread drains the
+    queue every 1/fps seconds, stopping after time_budget seconds so a
+    flood of work spreads over several frames instead of freezing the UI.
+    """
+
+    def __init__(self, widget, fps=30, time_budget=0.008):
+        self.widget = widget
+        self.interval = max(1, int(1000 / fps))
+        self.time_budget = time_budget
+        self._queue = queue.SimpleQueue()
+        self._latest = {}
+        self._latest_lock = threading.Lock()
+        self._after_id = None
+
+    def start(self):
+        if self._after_id is None:
+            self._after_id = self.widget.after(self.interval, self._tick)
+
+    def stop(self):
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+            self._after_id = None
+
+    def post(self, callback, *args):
+        """Queue callback(*args) for the next frame; safe from any thread"""
+        self._queue.put((callback, args))
+
+    def post_latest(self, key, callback, *args):
+        """Like post(), but a later call with the same key replaces this one"""
+        with self._latest_lock:
+            self._latest[key] = (callback, args)
+
+    def _tick(self):
+        deadline = time.monotonic() + self.time_budget
+        try:
+            while time.monotonic() < deadline:
+                try:
+                    callback, args = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                callback(*args)
+
+            with self._latest_lock:
+                latest, self._latest = self._latest, {}
+            for callback, args in latest.values():
+                callback(*args)
+        finally:
+            self._after_id = self.widget.after(self.interval, self._tick)
@@ -0,0 +1,173 @@
+import tkinter as tk
+import tkinter.font as tkfont
+
+
+class VirtualList(tk.Frame):
+    """Scrollable list that only draws the rows currently on screen
+
+    The list holds row ids, not text: text_for(row) is asked for a label
+    only when that row scrolls into view, so a million results cost one
+    Python list and a screenful of canvas items. Clicking toggles a row's
+    selection and shift-click selects a range, like a MULTIPLE Listbox;
+    curselection() and get() keep the Listbox names so callers read
+    selections the same way. on_select(index), if given, is called with
+    the position of each row a click selects.
+    """
+
+    def __init__(self, master, text_for, bg="#2D2D2D", fg="white", select_bg="#2E8B57",
+                 width=70, height=20, on_select=None, **kwargs):
+        super().__init__(master, bg=bg, **kwargs)
+        self.text_for = text_for
+        self.on_select = on_select
+        self.fg = fg
+        self.select_bg = select_bg
+        self.font = tkfont.nametofont('TkDefaultFont')
+        self.row_height = self.font.metrics('linespace') + 2
+
+        self.canvas = tk.Canvas(
+            self,
+            bg=bg,
+            highlightthickness=0,
+            width=width * self.font.measure('0'),
+            height=height * self.row_height
+        )
+        self.scrollbar = tk.Scrollbar(self, command=self._on_scrollbar)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.LEFT, fill=tk.Y)
+
+        self._rows = []
+        self._selected = set()
+        self._anchor = None
+        self._top = 0
+        # Canvas items reused from frame to frame: (background, text) per screen line
+        self._items = []
+        self._redraw_pending = False
+
+        self.canvas.bind('<Configure>', lambda event: self.refresh())
+        self.canvas.bind('<Button-1>', self._on_click)
+        self.canvas.bind('<Shift-Button-1>', self._on_shift_click)
+        self.canvas.bind('<MouseWheel>', self._on_wheel)
+        self.canvas.bind('<Button-4>', lambda event: self.scroll(-3))
+        self.canvas.bind('<Button-5>', lambda event: self.scroll(3))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def set_rows(self, rows):
+        """Show a new list of row ids, scrolled to the top with nothing selected"""
+        self._rows = list(rows)
+        self._selected.clear()
+        self._anchor = None
+        self._top = 0
+        self.refresh()
+
+    def append_rows(self, rows):
+        """Add row ids at the end; only redraws if they land on screen"""
+        start = len(self._rows)
+        self._rows.extend(rows)
+        if start < self._top + self._visible_count():
+            self.refresh()
+        else:
+            self._update_scrollbar()
+
+    def row(self, index):
+        """Row id shown at a list position"""
+        return self._rows[index]
+
+    def get(self, index):
+        """Text shown at a list position"""
+        return self.text_for(self._rows[index])
+
+    def curselection(self):
+        """Selected list positions, in order"""
+        return tuple(sorted(self._selected))
+
+    def refresh(self):
+        """Redraw on the next idle pass; repeated calls collapse into one"""
+        if not self._redraw_pending:
+            self._redraw_pending = True
+            self.after_idle(self._redraw)
+
+    def scroll(self, lines):
+        self._scroll_to(self._top + lines)
+
+    def _visible_count(self):
+        return max(1, self.canvas.winfo_height() // self.row_height + 1)
+
+    def _scroll_to(self, top):
+        top = max(0, min(top, len(self._rows) - self._visible_count() + 1))
+        if top != self._top:
+            self._top = top
+            self.refresh()
+
+    def _update_scrollbar(self):
+        total = len(self._rows)
+        if not total:
+            self.scrollbar.set(0.0, 1.0)
+            return
+        visible = self._visible_count()
+        self.scrollbar.set(self._top / total, min(1.0, (self._top + visible) / total))
+
+    def _redraw(self):
+        self._redraw_pending = False
+        if not self.winfo_exists():
+            return
+        width = self.canvas.winfo_width()
+        visible = self._visible_count()
+        while len(self._items) < visible:
+            y = len(self._items) * self.row_height
+            background = self.canvas.create_rectangle(0, y, width, y + self.row_height,
+                                                      width=0, fill='')
+            text = self.canvas.create_text(4, y + 1, anchor=tk.NW, fill=self.fg, font=self.font)
+            self._items.append((background, text))
+
+        for line, (background, text) in enumerate(self._items):
+            index = self._top + line
+            y = line * self.row_height
+            self.canvas.coords(background, 0, y, width, y + self.row_height)
+            if line < visible and index < len(self._rows):
+                selected = index in self._selected
+                self.canvas.itemconfigure(background, fill=self.select_bg if selected else '')
+                self.canvas.itemconfigure(text, text=self.text_for(self._rows[index]))
+            else:
+                self.canvas.itemconfigure(background, fill='')
+                self.canvas.itemconfigure(text, text='')
+        self._update_scrollbar()
+
+    def _index_at(self, y):
+        index = self._top + int(self.canvas.canvasy(y)) // self.row_height
+        return index if index < len(self._rows) else None
+
+    def _on_click(self, event):
+        index = self._index_at(event.y)
+        if index is None:
+            return
+        if index in self._selected:
+            self._selected.discard(index)
+        else:
+            self._selected.add(index)
+            if self.on_select is not None:
+                self.on_select(index)
+        self._anchor = index
+        self.refresh()
+
+    def _on_shift_click(self, event):
+        index = self._index_at(event.y)
+        if index is None:
+            return
+        anchor = index if self._anchor is None else self._anchor
+        self._selected.update(range(min(anchor, index), max(anchor, index) + 1))
+        self.refresh()
+
+    def _on_wheel(self, event):
+        # Windows reports multiples of 120 per notch; macOS reports small deltas
+        delta = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        self.scroll(-delta * 3)
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == tk.MOVETO:
+            self._scroll_to(int(float(amount) * len(self._rows)))
+        elif unit == tk.PAGES:
+            self.scroll(int(amount) * max(1, self._visible_count() - 1))
+        else:
+            self.scroll(int(amount))
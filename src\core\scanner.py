@@ -1,12 +0,0 @@
-class Scanner:
-    def __init__(self):
-        self.supported_filesystems = ['NTFS', 'FAT32', 'exFAT', 'HFS+', 'EXT4']
-        self.recovery_modes = ['quick', 'deep', 'forensic']
-        
-    def verify_filesystem(self, path):
-        # Add filesystem detection logic
-        pass
-
-    def calculate_checksum(self, file_path):
-        # Add checksum calculation
-        pass 
\ No newline at end of file
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from src.core.encryption import _decrypt_each, _times_x, decrypt_sectors
+
+ciphers = pytest.importorskip('cryptography.hazmat.primitives.ciphers')
+numpy = pytest.importorskip('numpy')
+
+# IEEE 1619-2007 XTS-AES-128 vectors 1 to 3: (key1 + key2, data unit number, plaintext, ciphertext)
+IEEE_1619 = [
+    (bytes(32), 0, bytes(32),
+     '917cf69ebd68b2ec9b9fe9a3eadda692cd43d2f59598ed858c02c2652fbf922e'),
+    (b'\x11' * 16 + b'\x22' * 16, 0x3333333333, b'\x44' * 32,
+     'c454185e6a16936e39334038acef838bfb186fff7480adc4289382ecd6d394f0'),
+    (bytes.fromhex('fffefdfcfbfaf9f8f7f6f5f4f3f2f1f0') + b'\x22' * 16, 0x3333333333, b'\x44' * 32,
+     'af85336b597afc1a900b2eb21ec949d292df4c047e0b21532186a5971a227a89'),
+]
+
+# Vector 4: a 512-byte data unit, so the tweak is doubled 31 times
+VECTOR_4_KEY = bytes.fromhex('27182818284590452353602874713526' '31415926535897932384626433832795')
+VECTOR_4_START = '27a7479befa1d476489f308cd4cfa6e2a96e4bbe3208ff25287dd3819616e89c'
+
+
+def _encrypt(key, tweak, data):
+    tweak = tweak.to_bytes(16, 'little')
+    return ciphers.Cipher(ciphers.algorithms.AES(key), ciphers.modes.XTS(tweak)).encryptor().update(data)
+
+
+@pytest.mark.parametrize('key, tweak, plaintext, ciphertext', IEEE_1619)
+def test_ieee_1619_vectors(key, tweak, plaintext, ciphertext):
+    # Two copies of the data unit under the same tweak take the batched path
+    data = bytes.fromhex(ciphertext) * 2
+    assert decrypt_sectors(key, data, 32, tweak, tweak_step=0) == plaintext * 2
+
+
+def test_ieee_1619_vector_4():
+    plaintext = bytes(range(256)) * 2
+    ciphertext = _encrypt(VECTOR_4_KEY, 0, plaintext)
+    assert ciphertext.hex().startswith(VECTOR_4_START)
+    assert decrypt_sectors(VECTOR_4_KEY, ciphertext * 2, 512, 0, tweak_step=0) == plaintext * 2
+
+
+@pytest.mark.parametrize('key_size', [32, 64])
+def test_batched_path_matches_per_sector_path(key_size):
+    key = os.urandom(key_size)
+    sector_size = 4096
+    data = os.urandom(sector_size * 3)
+    # 4 KB sectors numbered in 512-byte units, as dm-crypt can do
+    expected = _decrypt_each(key, data, sector_size, 3, 1000, 8)
+    assert decrypt_sectors(key, data, sector_size, 1000, tweak_step=8) == expected
+
+
+def _as_int(tweak):
+    return int(tweak[0]) | int(tweak[1]) << 64
+
+
+def _double(value):
+    value <<= 1
+    if value >> 128:
+        value ^= (1 << 128) | 0x87
+    return value
+
+
+def test_times_x_carries_into_the_reduction_polynomial():
+    tweak = numpy.array([0, 1 << 63], dtype='<u8')
+    assert _as_int(_times_x(tweak, 1)) == 0x87
+
+
+@pytest.mark.parametrize('shift', [1, 2, 7, 31, 32])
+def test_times_x_is_repeated_doubling(shift):
+    tweak = numpy.frombuffer(os.urandom(16), dtype='<u8')
+    expected = _as_int(tweak)
+    for _ in range(shift):
+        expected = _double(expected)
+    assert _as_int(_times_x(tweak, shift)) == expected
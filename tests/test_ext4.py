@@ -0,0 +1,72 @@
+import os
+import shutil
+import struct
+import subprocess
+
+import pytest
+
+from src.core.ext4 import Ext4Reader
+
+pytestmark = pytest.mark.skipif(not (shutil.which('mke2fs') and shutil.which('debugfs')),
+                                reason="needs mke2fs and debugfs from e2fsprogs")
+
+
+def _mkfs(path, size, block_size):
+    subprocess.run(['mke2fs', '-q', '-F', '-t', 'ext4', '-b', str(block_size), str(path), size],
+                   check=True, capture_output=True)
+
+
+def _debugfs(image, *commands):
+    for command in commands:
+        subprocess.run(['debugfs', '-w', '-R', command, str(image)], check=True, capture_output=True)
+
+
+@pytest.fixture(scope='module')
+def volume(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('ext4')
+    image = folder / 'fs.img'
+    _mkfs(image, '8M', 4096)
+    contents = {name: os.urandom(size) for name, size in
+                (('first.bin', 40000), ('reused.bin', 30000), ('deleted.bin', 200000), ('new.bin', 60000))}
+    for name, data in contents.items():
+        (folder / name).write_bytes(data)
+    # new.bin takes first.bin's inode and blocks, and runs on into reused.bin's
+    _debugfs(image, *(f"write {folder / name} {name}" for name in ('first.bin', 'reused.bin', 'deleted.bin')),
+             "rm first.bin", "rm reused.bin", "rm deleted.bin", f"write {folder / 'new.bin'} new.bin")
+    return str(image), contents
+
+
+def test_deleted_file_reads_back(volume):
+    image, contents = volume
+    with Ext4Reader(image) as reader:
+        deleted = {entry.size: entry for entry in reader.iter_deleted() if entry.is_regular}
+        entry = deleted[len(contents['deleted.bin'])]
+        assert entry.intact
+        data = reader.image.read_extents(reader.byte_ranges(entry), 0, entry.size)
+    assert data == contents['deleted.bin']
+
+
+def test_reused_blocks_are_not_intact(volume):
+    image, contents = volume
+    with Ext4Reader(image) as reader:
+        deleted = {entry.size: entry for entry in reader.iter_deleted() if entry.is_regular}
+    assert set(deleted) == {len(contents['deleted.bin']), len(contents['reused.bin'])}
+    assert not deleted[len(contents['reused.bin'])].intact
+
+
+def test_block_bitmaps_match_free_count(tmp_path):
+    # 1 KB blocks give eight groups, most of them BLOCK_UNINIT
+    image = tmp_path / 'groups.img'
+    _mkfs(image, '64M', 1024)
+    with open(image, 'rb') as f:
+        f.seek(1024 + 0x0C)
+        free_blocks, = struct.unpack('<I', f.read(4))
+    with Ext4Reader(str(image)) as reader:
+        assert reader.group_count == 8
+        used = 0
+        for group in range(reader.group_count):
+            first = reader.first_data_block + group * reader.blocks_per_group
+            blocks = min(reader.blocks_per_group, reader.blocks_count - first)
+            bitmap = reader.block_bitmap(group)
+            used += sum(bin(byte).count('1') for byte in bitmap[:blocks // 8])
+        assert reader.blocks_count - reader.first_data_block - used == free_blocks
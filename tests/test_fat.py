@@ -0,0 +1,279 @@
+import struct
+
+import pytest
+
+from src.core.fat import FatReader, _lfn_checksum
+
+SECTOR = 512
+CLUSTER = SECTOR  # one sector per cluster keeps the images small
+FAT32_END = 0x0FFFFFFF
+EXFAT_END = 0xFFFFFFFF
+
+
+class Volume:
+    """A FAT32 or exFAT volume laid out in memory, cluster by cluster"""
+
+    def __init__(self, heap_offset, cluster_count, end_mark):
+        self.heap_offset = heap_offset
+        self.cluster_count = cluster_count
+        self.end_mark = end_mark
+        self.fat = [0] * (cluster_count + 2)
+        self.fat[0] = self.fat[1] = end_mark
+        self.clusters = {}
+
+    def chain(self, first, count):
+        """Allocate count clusters from first as one FAT chain"""
+        for cluster in range(first, first + count):
+            self.fat[cluster] = cluster + 1 if cluster + 1 < first + count else self.end_mark
+
+    def write(self, cluster, data):
+        """Put data in cluster and the ones after it"""
+        for index in range(0, len(data), CLUSTER):
+            self.clusters[cluster + index // CLUSTER] = data[index:index + CLUSTER].ljust(CLUSTER, b'\x00')
+
+    def bytes(self, boot, fat_offset):
+        image = bytearray(self.heap_offset + self.cluster_count * CLUSTER)
+        image[:SECTOR] = boot
+        fat = struct.pack(f'<{len(self.fat)}I', *self.fat)
+        image[fat_offset:fat_offset + len(fat)] = fat
+        for cluster, data in self.clusters.items():
+            offset = self.heap_offset + (cluster - 2) * CLUSTER
+            image[offset:offset + CLUSTER] = data
+        return bytes(image)
+
+
+# FAT32
+
+RESERVED = 32
+FAT_SECTORS = 8
+FAT32_CLUSTERS = 1000
+
+
+def _fat32_volume():
+    return Volume((RESERVED + FAT_SECTORS) * SECTOR, FAT32_CLUSTERS, FAT32_END)
+
+
+def _fat32_image(volume, path):
+    boot = bytearray(SECTOR)
+    boot[3:11] = b'MSWIN4.1'
+    struct.pack_into('<HBHBHHBH', boot, 11, SECTOR, 1, RESERVED, 1, 0, 0, 0xF8, 0)
+    struct.pack_into('<II', boot, 32, RESERVED + FAT_SECTORS + FAT32_CLUSTERS, FAT_SECTORS)
+    struct.pack_into('<I', boot, 44, 2)
+    boot[510:512] = b'\x55\xaa'
+    path.write_bytes(volume.bytes(boot, RESERVED * SECTOR))
+    return str(path)
+
+
+def _entry(short_name, cluster=0, size=0, attributes=0x20):
+    entry = bytearray(32)
+    entry[:11] = short_name
+    entry[11] = attributes
+    struct.pack_into('<HHHHI', entry, 20, cluster >> 16, 0, 0x5021, cluster & 0xFFFF, size)
+    return bytes(entry)
+
+
+def _with_long_name(name, short_name, deleted=False, **fields):
+    """Long-name entries, last part first, then the short entry"""
+    checksum = _lfn_checksum(short_name)
+    chars = name.encode('utf-16-le') + b'\x00\x00'
+    chars = chars.ljust(-(-len(chars) // 26) * 26, b'\xff')
+    parts = [chars[index:index + 26] for index in range(0, len(chars), 26)]
+    entries = []
+    for number, part in enumerate(parts, 1):
+        entry = bytearray(32)
+        entry[0] = number | (0x40 if number == len(parts) else 0)
+        entry[1:11], entry[14:26], entry[28:32] = part[:10], part[10:22], part[22:26]
+        entry[11] = 0x0F
+        entry[13] = checksum
+        entries.append(bytes(entry))
+    short = _entry(short_name, **fields)
+    entries = list(reversed(entries)) + [short]
+    if deleted:
+        entries = [b'\xe5' + entry[1:] for entry in entries]
+    return b''.join(entries)
+
+
+def _dot_entries(cluster, parent=0):
+    return _entry(b'.          ', cluster, attributes=0x10) + _entry(b'..         ', parent, attributes=0x10)
+
+
+@pytest.fixture
+def fat32(tmp_path):
+    volume = _fat32_volume()
+    volume.chain(2, 1)
+    root = b''.join([
+        _entry(b'KEEP    TXT', 3, 100),
+        _entry(b'\xe5ONE    BIN', 10, 3 * CLUSTER - 100),
+        _with_long_name('Holiday photo.jpeg', b'HOLIDA~1JPE', deleted=True, cluster=40, size=CLUSTER),
+        _entry(b'\x05DIR       ', 5, attributes=0x10),
+        _entry(b'\xe5OLD       ', 20, attributes=0x10),
+    ])
+    volume.write(2, root)
+
+    volume.chain(3, 1)
+    volume.write(3, b'k' * 100)
+    # ONE.BIN lost its chain; cluster 12 was reused since
+    volume.write(10, b'1' * 2 * CLUSTER + b'x' * CLUSTER + b'2' * CLUSTER)
+    volume.chain(12, 1)
+    volume.write(40, b'h' * CLUSTER)
+
+    # A live directory whose name starts with 0xE5, holding one deleted file
+    volume.chain(5, 1)
+    volume.write(5, _dot_entries(5) + _entry(b'\xe5NNER   DAT', 50, 10))
+    volume.write(50, b'i' * 10)
+
+    # A deleted directory of two clusters, 2 dot entries and 30 files,
+    # followed by a cluster of unrelated data
+    files = b''.join(_entry(f'FILE{index:02}  TXT'.encode(), 100 + index, 10) for index in range(30))
+    volume.write(20, _dot_entries(20) + files)
+    volume.write(22, bytes(range(1, 256)) * 3)
+    for index in range(30):
+        volume.write(100 + index, f'file {index}'.encode().ljust(10, b'.'))
+    return _fat32_image(volume, tmp_path / 'fat32.img')
+
+
+def _deleted(path):
+    with FatReader(path) as reader:
+        entries = {entry.path: entry for entry in reader.iter_deleted()}
+        data = {name: reader.image.read_extents(reader.byte_ranges(entry), 0, entry.size)
+                for name, entry in entries.items()}
+    return entries, data
+
+
+def test_fat32_geometry(fat32):
+    with FatReader(fat32) as reader:
+        assert reader.variant == 'FAT32'
+        assert reader.cluster_size == CLUSTER
+        assert reader.cluster_count == FAT32_CLUSTERS
+        assert reader.allocation_bitmap() is None
+
+
+def test_fat32_deleted_file_skips_reused_clusters(fat32):
+    entries, data = _deleted(fat32)
+    entry = entries['/_ONE.BIN']
+    assert entry.runs == [(10, 2), (13, 1)]
+    assert entry.intact and not entry.contiguous
+    assert data['/_ONE.BIN'] == b'1' * 2 * CLUSTER + b'2' * (CLUSTER - 100)
+
+
+def test_fat32_deleted_long_name(fat32):
+    entries, data = _deleted(fat32)
+    assert data['/Holiday photo.jpeg'] == b'h' * CLUSTER
+    assert entries['/Holiday photo.jpeg'].contiguous
+
+
+def test_fat32_short_name_starting_with_e5(fat32):
+    entries, data = _deleted(fat32)
+    assert data['/σDIR/_NNER.DAT'] == b'i' * 10
+
+
+def test_fat32_deleted_directory_is_followed_over_its_clusters(fat32):
+    entries, data = _deleted(fat32)
+    inside = sorted(path for path in entries if path.startswith('/_OLD/'))
+    assert inside == [f'/_OLD/FILE{index:02}.TXT' for index in range(30)]
+    assert data['/_OLD/FILE29.TXT'] == b'file 29...'
+    # Nothing from the unrelated cluster after it, and no live files
+    assert set(entries) == set(inside) | {'/_ONE.BIN', '/Holiday photo.jpeg', '/σDIR/_NNER.DAT'}
+
+
+def test_fat32_deleted_directory_stops_at_end_marker(tmp_path):
+    volume = _fat32_volume()
+    volume.chain(2, 1)
+    volume.write(2, _entry(b'\xe5OLD       ', 20, attributes=0x10))
+    # One file, then the end of the directory; the next free cluster
+    # happens to look like directory entries but is not part of it
+    volume.write(20, _dot_entries(20) + _entry(b'ONLY    TXT', 30, 5))
+    volume.write(21, _entry(b'STRAY   TXT', 31, 5))
+    entries, _ = _deleted(_fat32_image(volume, tmp_path / 'fat32.img'))
+    assert set(entries) == {'/_OLD/ONLY.TXT'}
+
+
+# exFAT
+
+EXFAT_FAT_OFFSET = 24
+EXFAT_FAT_SECTORS = 8
+EXFAT_HEAP = 32
+EXFAT_CLUSTERS = 200
+
+
+def _exfat_entry_set(name, first_cluster, size, deleted=False, contiguous=True, attributes=0x20):
+    in_use = 0 if deleted else 0x80
+    names = [name[index:index + 15] for index in range(0, len(name), 15)]
+    file_entry = bytearray(32)
+    file_entry[0] = 0x05 | in_use
+    file_entry[1] = 1 + len(names)
+    struct.pack_into('<H', file_entry, 4, attributes)
+    struct.pack_into('<I', file_entry, 12, (0x5021 << 16) | 0x6000)
+    stream = bytearray(32)
+    stream[0] = 0x40 | in_use
+    stream[1] = 0x01 | (0x02 if contiguous else 0)
+    stream[3] = len(name)
+    struct.pack_into('<IQ', stream, 20, first_cluster, size)
+    entries = [bytes(file_entry), bytes(stream)]
+    for part in names:
+        entry = bytearray(32)
+        entry[0] = 0x41 | in_use
+        entry[2:2 + len(part) * 2] = part.encode('utf-16-le')
+        entries.append(bytes(entry))
+    return b''.join(entries)
+
+
+@pytest.fixture
+def exfat(tmp_path):
+    volume = Volume(EXFAT_HEAP * SECTOR, EXFAT_CLUSTERS, EXFAT_END)
+    used = {2, 3, 21}
+
+    bitmap_entry = bytearray(32)
+    bitmap_entry[0] = 0x81
+    struct.pack_into('<IQ', bitmap_entry, 20, 3, (EXFAT_CLUSTERS + 7) // 8)
+    volume.write(2, bytes(bitmap_entry) + b''.join([
+        _exfat_entry_set('contiguous.bin', 10, 3 * CLUSTER - 12, deleted=True),
+        _exfat_entry_set('chained file name.txt', 20, 2 * CLUSTER, deleted=True, contiguous=False),
+        _exfat_entry_set('Gone', 30, CLUSTER, deleted=True, attributes=0x10),
+        _exfat_entry_set('alive.txt', 21, 5),
+    ]))
+    volume.chain(2, 1)
+    volume.chain(3, 1)
+    volume.chain(21, 1)
+    bitmap = bytearray((EXFAT_CLUSTERS + 7) // 8)
+    for cluster in used:
+        bitmap[(cluster - 2) >> 3] |= 1 << ((cluster - 2) & 7)
+    volume.write(3, bytes(bitmap))
+
+    volume.write(10, b'c' * 3 * CLUSTER)
+    volume.write(20, b'a' * CLUSTER + b'x' * CLUSTER + b'b' * CLUSTER)
+    volume.write(30, _exfat_entry_set('inner.txt', 40, 10))
+    volume.write(40, b'inner data')
+
+    boot = bytearray(SECTOR)
+    boot[3:11] = b'EXFAT   '
+    struct.pack_into('<IIIII', boot, 80, EXFAT_FAT_OFFSET, EXFAT_FAT_SECTORS, EXFAT_HEAP, EXFAT_CLUSTERS, 2)
+    boot[108] = 9
+    boot[109] = 0
+    boot[510:512] = b'\x55\xaa'
+    path = tmp_path / 'exfat.img'
+    path.write_bytes(volume.bytes(boot, EXFAT_FAT_OFFSET * SECTOR))
+    return str(path)
+
+
+def test_exfat_geometry(exfat):
+    with FatReader(exfat) as reader:
+        assert reader.variant == 'exFAT'
+        assert reader.cluster_count == EXFAT_CLUSTERS
+        assert len(reader.allocation_bitmap()) == (EXFAT_CLUSTERS + 7) // 8
+
+
+def test_exfat_deleted_files(exfat):
+    entries, data = _deleted(exfat)
+    assert set(entries) == {'/contiguous.bin', '/chained file name.txt', '/Gone/inner.txt'}
+
+    assert entries['/contiguous.bin'].runs == [(10, 3)]
+    assert data['/contiguous.bin'] == b'c' * (3 * CLUSTER - 12)
+
+    # Its FAT chain is gone; cluster 21 is in use again
+    chained = entries['/chained file name.txt']
+    assert chained.runs == [(20, 1), (22, 1)]
+    assert chained.intact and not chained.contiguous
+    assert data['/chained file name.txt'] == b'a' * CLUSTER + b'b' * CLUSTER
+
+    assert data['/Gone/inner.txt'] == b'inner data'
@@ -0,0 +1,34 @@
+import os
+
+from src.core.scanner import Scanner
+from src.database.operations import ScanIndex
+
+
+def _scan(scanner, root, index):
+    return {result.path: result for result in scanner.scan([str(root)], index=index)}
+
+
+def test_file_rewritten_in_an_unchanged_directory_is_rescanned(tmp_path):
+    root = tmp_path / 'files'
+    root.mkdir()
+    edited, untouched = root / 'edited.txt', root / 'untouched.txt'
+    edited.write_bytes(b'first')
+    untouched.write_bytes(b'same')
+    os.utime(edited, ns=(1_000_000_000, 1_000_000_000))
+    directory_mtime = os.stat(root).st_mtime_ns
+
+    scanner = Scanner()
+    with ScanIndex(str(tmp_path / 'index.db')) as index:
+        _scan(scanner, root, index)
+        index.set_hashes([(str(edited), 'old'), (str(untouched), 'kept')], 'blake2b')
+
+        # Edited in place: the directory's mtime does not move
+        edited.write_bytes(b'second version')
+        os.utime(root, ns=(directory_mtime, directory_mtime))
+        results = _scan(scanner, root, index)
+
+        assert scanner.metrics.snapshot()['counters']['unchanged_dirs'] == 1
+        assert results[str(edited)].size == len(b'second version')
+        assert index.get(str(edited)).size == len(b'second version')
+        assert index.get(str(edited)).hash is None
+        assert index.get(str(untouched)).hash == 'kept'
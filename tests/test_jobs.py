@@ -0,0 +1,20 @@
+import threading
+
+from src.core.jobs import Job, JobScheduler
+
+
+def test_finished_jobs_are_forgotten_past_keep_finished():
+    release = threading.Event()
+    with JobScheduler(max_jobs=1, keep_finished=3) as scheduler:
+        blocked = scheduler.submit(Job('hash', lambda control: release.wait(5), name='blocked'))
+        finished = [scheduler.submit(Job('hash', lambda control: None)) for _ in range(4)]
+        queued = scheduler.submit(Job('hash', lambda control: None, name='queued'))
+        for job in finished:
+            job.cancel()
+            job.wait(5)
+        # Only the three last to finish are kept, and unfinished jobs never go
+        assert [job.state for job in finished] == ['cancelled'] * 4
+        assert scheduler.jobs() == [blocked, *finished[1:], queued]
+        release.set()
+        assert queued.wait(5)
+        assert scheduler.jobs() == [blocked, finished[3], queued]
@@ -0,0 +1,81 @@
+import struct
+
+from src.core.ntfs import NtfsReader, decode_runlist
+
+
+def _reader(sector_size=512):
+    # The record helpers only need the geometry, not an image
+    reader = NtfsReader.__new__(NtfsReader)
+    reader.sector_size = sector_size
+    return reader
+
+
+def _record(sectors, usn=b'\x07\x00', usa_offset=48):
+    """Raw record as on disk: each sector ends in the USN, its real last two bytes saved in the array"""
+    fixed = bytearray(range(256)) * (2 * sectors)
+    struct.pack_into('<HH', fixed, 4, usa_offset, sectors + 1)
+    fixed[usa_offset:usa_offset + 2] = usn
+    raw = bytearray(fixed)
+    for sector in range(1, sectors + 1):
+        end = sector * 512
+        raw[usa_offset + sector * 2:usa_offset + sector * 2 + 2] = fixed[end - 2:end]
+        raw[end - 2:end] = usn
+    # The saved copies are part of the record too
+    fixed[usa_offset + 2:usa_offset + 2 + sectors * 2] = raw[usa_offset + 2:usa_offset + 2 + sectors * 2]
+    return bytes(raw), bytes(fixed)
+
+
+def test_decode_runlist():
+    # Each run's LCN is relative to the one before
+    data = bytes.fromhex('3138732534' '321401e51102' '3142aa0003' '00')
+    assert decode_runlist(data) == [(0x342573, 0x38), (0x363758, 0x114), (0x393802, 0x42)]
+
+
+def test_decode_runlist_negative_offset_and_sparse_run():
+    # 0xF0 is -16 clusters from the previous run; a header with no offset size is sparse
+    data = bytes.fromhex('113060' '1110f0' '0108' '00')
+    assert decode_runlist(data) == [(0x60, 0x30), (0x50, 0x10), (None, 8)]
+
+
+def test_decode_runlist_stops_at_truncated_pair():
+    assert decode_runlist(bytes.fromhex('113060' '3108')) == [(0x60, 0x30)]
+
+
+def test_decode_runlist_from_offset():
+    assert decode_runlist(b'\xff\xff' + bytes.fromhex('1130600000'), 2) == [(0x60, 0x30)]
+
+
+def test_fixups_restore_sector_ends():
+    raw, fixed = _record(2)
+    assert _reader()._fixed_record(raw) == fixed
+
+
+def test_fixups_reject_torn_record():
+    raw, _ = _record(2)
+    torn = bytearray(raw)
+    # The second sector was never written: its end does not hold the USN
+    torn[1022:1024] = b'\x08\x00'
+    assert _reader()._fixed_record(torn) is None
+
+
+def test_fixups_reject_array_past_record():
+    raw, _ = _record(2)
+    damaged = bytearray(raw)
+    struct.pack_into('<H', damaged, 6, 600)
+    assert _reader()._fixed_record(damaged) is None
+
+
+def test_resident_pieces_route_sector_ends_to_saved_copies():
+    raw, fixed = _record(2)
+    record_offset = 4096
+    pieces = _reader()._resident_pieces(record_offset, 500, 20, 48)
+    assert pieces == [(4096 + 500, 10, 0), (4096 + 50, 2, 10), (4096 + 512, 8, 12)]
+
+    value = bytearray(20)
+    for offset, length, value_offset in pieces:
+        value[value_offset:value_offset + length] = raw[offset - record_offset:offset - record_offset + length]
+    assert bytes(value) == fixed[500:520]
+
+
+def test_resident_pieces_inside_one_sector():
+    assert _reader()._resident_pieces(0, 100, 50, 48) == [(100, 50, 0)]
@@ -0,0 +1,42 @@
+import pytest
+
+from src.core.raid import data_slots, parity_slots
+
+# Four-member RAID5 stripe rows as drawn in the Linux md documentation:
+# per row, the parity slot and the slots of the data chunks in order
+MD_RAID5 = {
+    'left-symmetric': [(3, (0, 1, 2)), (2, (3, 0, 1)), (1, (2, 3, 0)), (0, (1, 2, 3))],
+    'left-asymmetric': [(3, (0, 1, 2)), (2, (0, 1, 3)), (1, (0, 2, 3)), (0, (1, 2, 3))],
+    'right-symmetric': [(0, (1, 2, 3)), (1, (2, 3, 0)), (2, (3, 0, 1)), (3, (0, 1, 2))],
+    'right-asymmetric': [(0, (1, 2, 3)), (1, (0, 2, 3)), (2, (0, 1, 3)), (3, (0, 1, 2))],
+}
+
+# Four-member RAID6: Q follows P, and the data either follows Q
+# (symmetric) or fills the remaining slots left to right (asymmetric)
+MD_RAID6 = {
+    'left-symmetric': [((3, 0), (1, 2)), ((2, 3), (0, 1)), ((1, 2), (3, 0)), ((0, 1), (2, 3))],
+    'left-asymmetric': [((3, 0), (1, 2)), ((2, 3), (0, 1)), ((1, 2), (0, 3)), ((0, 1), (2, 3))],
+    'right-symmetric': [((0, 1), (2, 3)), ((1, 2), (3, 0)), ((2, 3), (0, 1)), ((3, 0), (1, 2))],
+}
+
+
+@pytest.mark.parametrize('layout', sorted(MD_RAID5))
+def test_raid5_layouts(layout):
+    # Rows past the first cycle repeat it
+    for row in range(8):
+        parity, data = MD_RAID5[layout][row % 4]
+        assert parity_slots('RAID5', layout, row, 4) == (parity,)
+        assert data_slots('RAID5', layout, row, 4) == data
+
+
+@pytest.mark.parametrize('layout', sorted(MD_RAID6))
+def test_raid6_layouts(layout):
+    for row, (parity, data) in enumerate(MD_RAID6[layout]):
+        assert parity_slots('RAID6', layout, row, 4) == parity
+        assert data_slots('RAID6', layout, row, 4) == data
+
+
+@pytest.mark.parametrize('level', ['RAID0', 'RAID1', 'RAID10'])
+def test_levels_without_parity(level):
+    assert parity_slots(level, 'left-symmetric', 5, 3) == ()
+    assert data_slots(level, 'left-symmetric', 5, 3) == (0, 1, 2)
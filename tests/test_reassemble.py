@@ -0,0 +1,88 @@
+import io
+import random
+import zipfile
+
+import pytest
+
+from src.core.carver import CarvedFile
+from src.core.reassemble import Reassembler
+
+CLUSTER = 4096
+
+
+def _jpeg(rng):
+    Image = pytest.importorskip('PIL.Image')
+    # Noise compresses badly, so the scan runs over a dozen clusters
+    image = Image.frombytes('RGB', (256, 256), rng.randbytes(256 * 256 * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def _zip(rng):
+    words = ['alpha', 'beta', 'gamma', 'delta', 'phoenix', 'restore', 'cluster', 'sector']
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name in ('a.txt', 'b.txt'):
+            archive.writestr(name, ' '.join(f"{rng.choice(words)}{rng.randrange(1000)}" for _ in range(12000)))
+    return buffer.getvalue()
+
+
+def _image(tmp_path, data, rng, split=None, gap=0):
+    """Image with data from cluster 1, and gap clusters of junk after its first split clusters"""
+    if split is None:
+        body = data
+    else:
+        body = data[:split * CLUSTER] + rng.randbytes(gap * CLUSTER) + data[split * CLUSTER:]
+    image = bytes(CLUSTER) + body
+    image += bytes(-len(image) % CLUSTER + CLUSTER)
+    path = tmp_path / 'disk.img'
+    path.write_bytes(image)
+    return str(path)
+
+
+def _reassemble(path, signature, length):
+    # Carving runs header to footer, so the carved length takes in the gap
+    carved = CarvedFile(signature, f".{signature}", CLUSTER, length)
+    return next(Reassembler(cluster_size=CLUSTER).reassemble(path, [carved]))
+
+
+@pytest.mark.parametrize('build, signature', [(_jpeg, 'jpeg'), (_zip, 'zip')])
+def test_contiguous_file_is_intact(tmp_path, build, signature):
+    rng = random.Random(1)
+    data = build(rng)
+    result = _reassemble(_image(tmp_path, data, rng), signature, len(data))
+    assert result.status == 'intact'
+    assert result.fragments == [(CLUSTER, len(data))]
+    assert result.confidence == (1.0 if signature == 'jpeg' else 0.9)
+
+
+@pytest.mark.parametrize('build, signature', [(_jpeg, 'jpeg'), (_zip, 'zip')])
+def test_two_fragments_around_junk(tmp_path, build, signature):
+    rng = random.Random(2)
+    data = build(rng)
+    result = _reassemble(_image(tmp_path, data, rng, split=3, gap=2), signature, len(data) + 2 * CLUSTER)
+    assert result.status == 'reassembled'
+    assert result.confidence == 1.0
+    assert result.fragments == [(CLUSTER, 3 * CLUSTER), (6 * CLUSTER, len(data) - 3 * CLUSTER)]
+    assert result.extents == [(CLUSTER, 3 * CLUSTER, 0), (6 * CLUSTER, len(data) - 3 * CLUSTER, 3 * CLUSTER)]
+
+
+def test_jpeg_with_its_end_missing_is_unresolved(tmp_path):
+    rng = random.Random(3)
+    data = _jpeg(rng)
+    # Only junk follows the first clusters: nothing can continue the scan
+    path = _image(tmp_path, data[:4 * CLUSTER] + rng.randbytes(8 * CLUSTER), rng)
+    result = _reassemble(path, 'jpeg', 12 * CLUSTER)
+    assert result.status == 'unresolved'
+    assert result.confidence == 0.0
+    assert result.fragments[0][0] == CLUSTER
+
+
+def test_other_formats_are_unchecked(tmp_path):
+    rng = random.Random(4)
+    path = _image(tmp_path, rng.randbytes(3 * CLUSTER), rng)
+    result = _reassemble(path, 'pdf', 3 * CLUSTER)
+    assert result.status == 'unchecked'
+    assert result.confidence is None
+    assert result.fragments == [(CLUSTER, 3 * CLUSTER)]
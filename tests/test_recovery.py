@@ -0,0 +1,135 @@
+import json
+import random
+import signal
+from array import array
+
+import pytest
+
+from src import cli
+from src.core import allocation
+from src.core.allocation import clear_runs, free_entries
+from src.core.scanner import ScanResult
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(allocation, 'numpy', None)
+    return request.param
+
+
+def _merged(runs):
+    """Runs with pieces split at slice boundaries joined up again"""
+    merged = []
+    for first, length in runs:
+        assert length > 0
+        if merged and merged[-1][0] + merged[-1][1] == first:
+            merged[-1] = (merged[-1][0], merged[-1][1] + length)
+        else:
+            merged.append((first, length))
+    return merged
+
+
+def _clear_bits(data, count):
+    return [not data[bit // 8] >> (bit % 8) & 1 for bit in range(count)]
+
+
+def _runs_of(flags):
+    runs = []
+    for index, free in enumerate(flags):
+        if free:
+            if runs and sum(runs[-1]) == index:
+                runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+            else:
+                runs.append((index, 1))
+    return runs
+
+
+@pytest.mark.parametrize('count', [0, 1, 333, 2048, 8 * 700 - 5])
+def test_clear_runs(backend, count):
+    rng = random.Random(count)
+    # Long free and used stretches as well as mixed bytes
+    data = bytearray()
+    while len(data) < 700:
+        data += rng.choice([bytes(rng.randrange(1, 40)), b'\xff' * rng.randrange(1, 40),
+                            rng.randbytes(rng.randrange(1, 10))])
+    data = bytes(data[:700])
+    assert _merged(clear_runs(data, count, slice_bytes=64)) == _runs_of(_clear_bits(data, count))
+    # A count beyond the bitmap stops at its end
+    assert _merged(clear_runs(data[:10], count)) == _runs_of(_clear_bits(data, min(count, 80)))
+
+
+def test_free_entries(backend):
+    rng = random.Random(7)
+    fat = array('I')
+    while len(fat) < 5000:
+        # The top four bits are reserved, so 0xF0000000 is still free
+        value = rng.choice([0, 0xF0000000, rng.randrange(2, 0x0FFFFFFF), 0x0FFFFFFF])
+        fat.extend([value] * rng.randrange(1, 30))
+    for first, count in [(2, 4998), (0, len(fat)), (100, 37), (4990, 100)]:
+        end = min(first + count, len(fat))
+        flags = [fat[index] & 0x0FFFFFFF == 0 for index in range(first, end)]
+        assert _merged(free_entries(fat, first, count, slice_entries=256)) == _runs_of(flags)
+
+
+@pytest.fixture
+def run(monkeypatch, tmp_path, capsys):
+    """Call the CLI in-process; returns (exit code, NDJSON records, stderr)"""
+    monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+    handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM)}
+
+    def run(*argv):
+        code = cli.main(['--no-history', *argv])
+        captured = capsys.readouterr()
+        return code, [json.loads(line) for line in captured.out.splitlines()], captured.err
+
+    yield run
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
+
+
+def _listing(tmp_path, *records):
+    path = tmp_path / 'results.ndjson'
+    path.write_text(''.join(json.dumps(record.to_dict()) + '\n' for record in records))
+    return str(path)
+
+
+def test_cli_exit_codes(run, tmp_path):
+    image = tmp_path / 'disk.img'
+    image.write_bytes(bytes(512) + b'\xff\xd8\xff\xe0' + bytes(100) + b'\xff\xd9')
+    present = ScanResult('/photo.jpg', 106, source='carve', image=str(image), extents=[(512, 106, 0)])
+    missing = ScanResult('/gone.jpg', 10, source='carve', image=str(tmp_path / 'gone.img'),
+                         extents=[(0, 10, 0)])
+    first, second = tmp_path / 'first', tmp_path / 'second'
+    first.mkdir()
+    second.mkdir()
+
+    code, records, _ = run('restore', str(first), '--input', _listing(tmp_path, present))
+    assert code == cli.EXIT_OK
+    assert [record['status'] for record in records] == ['restored']
+
+    code, records, err = run('restore', str(second), '--input', _listing(tmp_path, present, missing))
+    assert code == cli.EXIT_PARTIAL
+    assert sorted(record['status'] for record in records) == ['failed', 'restored']
+    assert json.loads(err)['failed'] == 1
+
+    code, _, _ = run('restore', '--input', _listing(tmp_path, present))
+    assert code == cli.EXIT_USAGE
+    with pytest.raises(SystemExit) as exc:
+        run('restore', '--workers', 'many')
+    assert exc.value.code == cli.EXIT_USAGE
+
+    # Refused: a walked file on the same volume as the destination
+    code, records, err = run('restore', str(first), '--input',
+                             _listing(tmp_path, ScanResult(str(image), image.stat().st_size)))
+    assert (code, records) == (cli.EXIT_ERROR, [])
+    assert 'same volume' in err
+    bad = tmp_path / 'bad.ndjson'
+    bad.write_text('{"size": 3}\n')
+    code, _, err = run('restore', str(first), '--input', str(bad))
+    assert code == cli.EXIT_ERROR
+    assert 'line 1' in err
+    code, _, _ = run('carve', str(tmp_path / 'no-such.img'))
+    assert code == cli.EXIT_ERROR
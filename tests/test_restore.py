@@ -0,0 +1,80 @@
+import hashlib
+import os
+
+from src.core.hashing import HashCache, HashService
+from src.core.restore import PARTIAL_SUFFIX, RestorePipeline
+from src.core.scanner import ScanResult
+
+
+class StaleCache(HashCache):
+    """Answers every lookup with one digest, as a reused inode with a copied mtime can"""
+
+    def __init__(self, digest):
+        super().__init__()
+        self.digest = digest
+
+    def get(self, key):
+        return self.digest
+
+
+def _setup(tmp_path, size=10000):
+    data = os.urandom(size)
+    image = tmp_path / 'disk.img'
+    image.write_bytes(b'\x00' * 512 + data)
+    record = ScanResult('/photo.jpg', len(data), source='carve', image=str(image),
+                        extents=[(512, len(data), 0)])
+    destination = tmp_path / 'out'
+    destination.mkdir()
+    return data, record, destination
+
+
+def _pipeline(destination, data, **options):
+    """A pipeline whose hash cache would vouch for the source's digest, and whose copies come out corrupt"""
+    hasher = HashService(cache=StaleCache(hashlib.blake2b(data).hexdigest()))
+    pipeline = RestorePipeline(str(destination), hasher=hasher, **options)
+    write_extents = pipeline._write_extents
+
+    def corrupt(image, record, target):
+        size = write_extents(image, record, target)
+        with open(target, 'r+b') as f:
+            first = f.read(1)
+            f.seek(0)
+            f.write(bytes([first[0] ^ 0xFF]))
+        return size
+
+    pipeline._write_extents = corrupt
+    return pipeline
+
+
+def _leftovers(destination):
+    return [name for _, _, names in os.walk(destination) for name in names if name.endswith(PARTIAL_SUFFIX)]
+
+
+def test_restore_copies_and_verifies(tmp_path):
+    data, record, destination = _setup(tmp_path)
+    outcomes = list(RestorePipeline(str(destination)).restore([record]))
+    assert [outcome.status for outcome in outcomes] == ['restored']
+    assert outcomes[0].digest == hashlib.blake2b(data).hexdigest()
+    assert (destination / 'photo.jpg').read_bytes() == data
+
+
+def test_corrupt_copy_fails_despite_a_stale_cache_entry(tmp_path):
+    data, record, destination = _setup(tmp_path)
+    outcomes = list(_pipeline(destination, data).restore([record]))
+    assert [outcome.status for outcome in outcomes] == ['failed']
+    assert not (destination / 'photo.jpg').exists()
+    assert not _leftovers(destination)
+
+
+def test_dedup_restore_files_copies_under_their_real_digest(tmp_path):
+    data, record, destination = _setup(tmp_path)
+    outcomes = list(_pipeline(destination, data, dedup=True).restore([record]))
+    assert [outcome.status for outcome in outcomes] == ['failed']
+    assert not _leftovers(destination)
+
+    # Unverified, the corrupt copy is kept, but under its own content address
+    outcomes = list(_pipeline(destination, data, dedup=True, verify=False).restore([record]))
+    assert [outcome.status for outcome in outcomes] == ['restored']
+    restored = open(outcomes[0].destination, 'rb').read()
+    assert restored != data
+    assert outcomes[0].digest == hashlib.blake2b(restored).hexdigest()
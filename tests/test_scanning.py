@@ -0,0 +1,118 @@
+import os
+import random
+
+import pytest
+
+from src.core.carver import Carver
+from src.core.results import ResultStore
+from src.core.scanner import ScanResult
+from src.core.walker import ParallelWalker
+
+CHUNK = 4096
+
+
+def _names(rng, count):
+    parts = ['Holiday', 'notes', 'report', 'IMG_', 'scan', 'day', 'a.b', '2021']
+    extensions = ['.jpg', '.JPG', '.txt', '.pdf', '.mp3', '.bin', '']
+    return [''.join(rng.choice(parts) for _ in range(rng.randint(1, 3))) + rng.choice(extensions)
+            for _ in range(count)]
+
+
+def test_result_store_filters_and_searches():
+    store = ResultStore()
+    store.extend([
+        ScanResult('/a/Holiday.JPG', 1),
+        ScanResult('/b/holiday.jpg', 2),
+        ScanResult('/b/notes.txt', 3),
+        ScanResult('/c/report.pdf', 4),
+        # Trashed files are found under the name they were deleted as
+        ScanResult('/t/$R1X2.txt', 5, origin='C:\\Users\\me\\Old Notes.txt', deleted=1.0),
+    ])
+    assert store.rows() == [0, 1, 2, 3, 4]
+    assert store.rows('images') == [0, 1]
+    assert store.rows(term='HOLIDAY') == [0, 1]
+    assert store.rows('documents', 'notes') == [2, 4]
+    assert store.rows(term='$r1') == []
+    assert store.rows('no such category') == []
+    assert store.rows(term='day.jpg\nnotes') == []
+
+    store.set_categories([2], ['other'])
+    assert store.rows('documents') == [3, 4]
+    assert store.rows('other', 'notes') == [2]
+
+    # Names added after a search are found by the next one
+    store.add(ScanResult('/d/holiday2.png', 6))
+    assert store.rows('images', 'holiday') == [0, 1, 5]
+
+
+def test_result_store_search_matches_a_plain_scan():
+    rng = random.Random(5)
+    names = _names(rng, 400)
+    store = ResultStore()
+    for number, name in enumerate(names):
+        store.add(ScanResult(f"/dir{number % 7}/{name}", number))
+        if number % 150 == 0:
+            # Interleave searches with additions
+            store.rows(term='x')
+    for term in ['holiday', 'DAY', 'y.j', '.txt', 'a.b', 'scan2021', 'zzz', 'e']:
+        expected = [row for row, name in enumerate(names) if term.lower() in name.lower()]
+        assert store.rows(term=term) == expected
+        images = [row for row in expected if os.path.splitext(names[row])[1].lower() == '.jpg']
+        assert store.rows('images', term) == images
+
+
+def test_walker_finds_what_os_walk_finds(tmp_path):
+    rng = random.Random(6)
+    root = tmp_path / 'tree'
+    directories = [root]
+    root.mkdir()
+    for number in range(40):
+        parent = rng.choice(directories)
+        child = parent / f"dir{number}"
+        child.mkdir()
+        directories.append(child)
+    for number in range(300):
+        path = rng.choice(directories) / f"file{number}.dat"
+        path.write_bytes(b'x' * rng.randrange(100))
+    (root / 'empty').mkdir()
+    (root / 'target.dat').write_bytes(b'target')
+    # Links to files are listed, links to directories are not descended
+    os.symlink(root / 'target.dat', root / 'file_link')
+    os.symlink(root / 'dir0', root / 'dir_link')
+
+    expected = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            expected[path] = os.stat(path).st_size
+    found = {}
+    for dirpath, files in ParallelWalker(workers=4).walk([str(root)]):
+        for path, st in files:
+            assert os.path.dirname(path) == dirpath
+            assert path not in found
+            found[path] = st.st_size
+    assert found == expected
+
+
+def _carve(path, chunk_size):
+    return [(f.signature, f.offset, f.length, f.complete) for f in Carver(chunk_size=chunk_size).carve(path)]
+
+
+@pytest.mark.parametrize('shift', range(-9, 2))
+def test_carver_matches_across_chunk_boundaries(tmp_path, shift):
+    png = b'\x89PNG\r\n\x1a\n' + bytes(500) + b'IEND\xaeB`\x82'
+    image = bytearray(6 * CHUNK)
+    # The JPEG header straddles the first boundary and its footer the
+    # second; the PNG header straddles the fourth
+    jpeg_at = CHUNK + shift - 1
+    jpeg_end = 2 * CHUNK + shift + 1
+    image[jpeg_at:jpeg_at + 4] = b'\xff\xd8\xff\xe0'
+    image[jpeg_end - 2:jpeg_end] = b'\xff\xd9'
+    png_at = 4 * CHUNK + shift - 3
+    image[png_at:png_at + len(png)] = png
+    path = tmp_path / 'disk.img'
+    path.write_bytes(bytes(image))
+
+    expected = [('jpeg', jpeg_at, jpeg_end - jpeg_at, True), ('png', png_at, len(png), True)]
+    assert _carve(str(path), CHUNK) == expected
+    assert _carve(str(path), 64 * CHUNK) == expected
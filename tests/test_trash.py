@@ -0,0 +1,130 @@
+import struct
+
+import pytest
+
+from src.core.ntfs import FILETIME_EPOCH
+from src.core.trash import (TrashError, _ds_records, iter_macos, parse_recycle_record, parse_trashinfo, put_back,
+                            read_put_back)
+
+# 2021-06-01 00:00:00 UTC as a FILETIME
+DELETED = 1622505600
+FILETIME = (DELETED + FILETIME_EPOCH) * 10000000
+
+
+def _recycle_v1(path, size):
+    field = path.encode('utf-16-le').ljust(520, b'\x00')
+    return struct.pack('<QQQ', 1, size, FILETIME) + field
+
+
+def _recycle_v2(path, size):
+    name = (path + '\x00').encode('utf-16-le')
+    return struct.pack('<QQQI', 2, size, FILETIME, len(name) // 2) + name
+
+
+def _ustr(text):
+    return struct.pack('>I', len(text)) + text.encode('utf-16-be')
+
+
+def _ds_store(records):
+    """A .DS_Store holding records in one leaf node of its DSDB tree"""
+    node = struct.pack('>II', 0, len(records))
+    for name, code, kind, value in records:
+        node += _ustr(name) + code + kind + value
+    # Blocks, addressed from just past the 4-byte prefix: the root block,
+    # the DSDB header and the leaf, each given as offset | log2(size)
+    root_offset, dsdb_offset, node_offset = 0x40, 0x840, 0x860
+    addresses = [root_offset | 11, dsdb_offset | 5, node_offset | 12]
+    root = struct.pack('>II', len(addresses), 0) + struct.pack(f'>{len(addresses)}I', *addresses)
+    root = root.ljust(8 + 256 * 4, b'\x00')
+    root += struct.pack('>I', 1) + b'\x04DSDB' + struct.pack('>I', 1)
+    dsdb = struct.pack('>IIIII', 2, 0, len(records), 1, 0x1000)
+
+    body = bytearray(node_offset + 0x1000)
+    body[:4] = b'Bud1'
+    struct.pack_into('>III', body, 4, root_offset, 0x800, root_offset)
+    body[root_offset:root_offset + len(root)] = root
+    body[dsdb_offset:dsdb_offset + len(dsdb)] = dsdb
+    body[node_offset:node_offset + len(node)] = node
+    return b'\x00\x00\x00\x01' + bytes(body)
+
+
+def test_trashinfo():
+    text = "[Trash Info]\nPath=/home/me/My%20Report.odt\nDeletionDate=2021-06-01T12:30:00\n"
+    path, deleted = parse_trashinfo(text)
+    assert path == '/home/me/My Report.odt'
+    assert deleted is not None
+
+
+def test_trashinfo_relative_path_and_fractional_date():
+    text = "[Trash Info]\r\nPath=photos/a.jpg\r\nDeletionDate=2021-06-01T12:30:00.123\r\n[Other]\r\nPath=x\r\n"
+    path, deleted = parse_trashinfo(text)
+    assert path == 'photos/a.jpg'
+    assert deleted == parse_trashinfo("[Trash Info]\nPath=a\nDeletionDate=2021-06-01T12:30:00")[1]
+
+
+def test_trashinfo_bad_date_keeps_path():
+    assert parse_trashinfo("[Trash Info]\nPath=/a\nDeletionDate=yesterday") == ('/a', None)
+
+
+@pytest.mark.parametrize('text', ["Path=/a\n", "[Trash Info]\nDeletionDate=2021-06-01T12:30:00\n"])
+def test_trashinfo_rejects_incomplete_files(text):
+    with pytest.raises(TrashError):
+        parse_trashinfo(text)
+
+
+@pytest.mark.parametrize('build', [_recycle_v1, _recycle_v2])
+def test_recycle_record(build):
+    path = 'C:\\Users\\me\\Documents\\Report.docx'
+    assert parse_recycle_record(build(path, 12345)) == (path, 12345, DELETED)
+
+
+def test_recycle_record_errors():
+    with pytest.raises(TrashError):
+        parse_recycle_record(b'\x02' + bytes(20))
+    with pytest.raises(TrashError):
+        parse_recycle_record(struct.pack('<QQQI', 3, 0, 0, 0))
+    with pytest.raises(TrashError):
+        parse_recycle_record(_recycle_v2('', 0))
+
+
+def test_ds_records():
+    data = _ds_store([
+        ('report 2.txt', b'ptbL', b'ustr', _ustr('Users/me/Documents/')),
+        ('report 2.txt', b'ptbN', b'ustr', _ustr('report.txt')),
+        ('notes.md', b'ptbL', b'ustr', _ustr('Users/me/')),
+        ('notes.md', b'dilc', b'bool', b'\x01'),
+        ('notes.md', b'lg1S', b'comp', struct.pack('>Q', 4096)),
+    ])
+    assert list(_ds_records(data)) == [
+        ('report 2.txt', b'ptbL', 'Users/me/Documents/'),
+        ('report 2.txt', b'ptbN', 'report.txt'),
+        ('notes.md', b'ptbL', 'Users/me/'),
+        ('notes.md', b'dilc', True),
+        ('notes.md', b'lg1S', struct.pack('>Q', 4096)),
+    ]
+    assert read_put_back(data) == {
+        'report 2.txt': 'Users/me/Documents/report.txt',
+        'notes.md': 'Users/me/notes.md',
+    }
+
+
+def test_ds_records_rejects_other_files():
+    with pytest.raises(TrashError):
+        list(_ds_records(b'\x00' * 64))
+
+
+def test_macos_item_without_put_back_record_has_no_origin(tmp_path):
+    trash = tmp_path / '.Trash'
+    trash.mkdir()
+    (trash / '.DS_Store').write_bytes(_ds_store([
+        ('kept.txt', b'ptbL', b'ustr', _ustr('Users/me/')),
+        ('kept.txt', b'ptbN', b'ustr', _ustr('kept.txt')),
+    ]))
+    (trash / 'kept.txt').write_text('kept')
+    (trash / 'stray.txt').write_text('stray')
+    entries = {entry.name: entry for entry in iter_macos(str(trash), str(tmp_path))}
+    assert entries['kept.txt'].origin == str(tmp_path / 'Users' / 'me' / 'kept.txt')
+    assert entries['stray.txt'].origin is None
+    with pytest.raises(TrashError):
+        put_back(entries['stray.txt'].path, entries['stray.txt'].origin)
+    assert (trash / 'stray.txt').exists()